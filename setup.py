@@ -551,6 +551,7 @@ setup(
             include_dirs=[numpy.get_include()],
             extra_compile_args=['-D_FILE_OFFSET_BITS=64', '-Wextra'] + omp_arg,
             extra_link_args=[] + omp_lib,
+            libraries=['z', 'pthread'],
             sources=[pjoin('src', 'gf', 'ext', 'store_ext.c')]),
 
         Extension(
@@ -560,6 +561,13 @@ setup(
             extra_link_args=[] + omp_lib,
             sources=[pjoin('src', 'parstack_ext.c')]),
 
+        Extension(
+            'spit_ext',
+            include_dirs=[numpy.get_include()],
+            extra_compile_args=['-Wextra'] + omp_arg,
+            extra_link_args=[] + omp_lib,
+            sources=[pjoin('src', 'spit_ext.c')]),
+
         Extension(
             'ahfullgreen_ext',
             include_dirs=[numpy.get_include()],
@@ -756,6 +756,7 @@ in the directory %s'''.lstrip() % (
 
 class QSeis2dGFBuilder(gf.builder.Builder):
     nsteps = 2
+    unsplittable_steps = (0,)
 
     def __init__(self, store_dir, step, shared, block_size=None, tmp=None,
                  force=False):
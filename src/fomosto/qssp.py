@@ -548,6 +548,7 @@ qssp has been invoked as "%s"'''.lstrip() % (
 
 class QSSPGFBuilder(gf.builder.Builder):
     nsteps = 2
+    unsplittable_steps = (0,)
 
     def __init__(self, store_dir, step, shared, block_size=None, tmp=None,
                  force=False):
@@ -1,12 +1,18 @@
 import os
 import signal
 import errno
+import time
+import logging
+import multiprocessing
+from collections import deque, defaultdict
 from os.path import join as pjoin
 import numpy as num
 
 from pyrocko.gf import store
 from pyrocko.parimap import parimap
 
+logger = logging.getLogger('pyrocko.gf.builder')
+
 
 def int_arr(*args):
     return num.array(args, dtype=num.int)
@@ -17,9 +23,98 @@ class Interrupted(store.StoreError):
         return 'Interrupted.'
 
 
+class Task(object):
+    '''
+    Part of a block, covering the index range ``[ilo, ihi)`` along the last
+    (distance) axis of the GF store.
+    '''
+
+    def __init__(self, step, iblock, ilo, ihi, is_part=False):
+        self.step = step
+        self.iblock = iblock
+        self.ilo = ilo
+        self.ihi = ihi
+        self.is_part = is_part
+
+    @property
+    def n(self):
+        return self.ihi - self.ilo
+
+    def split(self, nparts):
+        nparts = max(1, min(nparts, self.n))
+        edges = [self.ilo + (self.n * i) // nparts for i in xrange(nparts+1)]
+        return [Task(self.step, self.iblock, ilo, ihi, is_part=True)
+                for (ilo, ihi) in zip(edges[:-1], edges[1:])]
+
+
+class Scheduler(object):
+    '''
+    Hands out block parts to workers, splitting work near the end of a step.
+
+    As long as more tasks are queued than there are workers, tasks are
+    dispatched as they are. Towards the end of a step, the queue is sorted
+    by estimated cost (largest first) and a dispatched task is split along
+    the distance axis so that its parts are about as expensive as an even
+    share of the remaining work. The remaining parts are put back in front
+    of the queue, where idle workers pick them up. Parts are not split
+    again, to avoid excessive per-run overhead. Costs are estimated from
+    the measured runtime per distance sample of finished tasks, preferably
+    from those of the same block.
+    '''
+
+    def __init__(self, tasks, nworkers, splittable=True):
+        self._queue = deque(tasks)
+        self._nworkers = nworkers
+        self._splittable = splittable
+        self._rate_blocks = defaultdict(list)
+        self._rate_all = []
+        self.timings = []
+
+    def __iter__(self):
+        return self
+
+    def next(self):
+        if not self._queue:
+            raise StopIteration()
+
+        if self._splittable and len(self._queue) < self._nworkers:
+            queue = sorted(self._queue, key=self._cost, reverse=True)
+            share = sum(self._cost(task) for task in queue) / self._nworkers
+            task = queue.pop(0)
+            if task.is_part or not share:
+                parts = [task]
+            else:
+                parts = task.split(int(round(self._cost(task) / share)))
+
+            self._queue = deque(parts[1:] + queue)
+            return parts[0]
+
+        return self._queue.popleft()
+
+    def _rate(self, iblock):
+        rates = self._rate_blocks.get(iblock) or self._rate_all
+        if rates:
+            return num.mean(rates)
+        else:
+            return 1.0
+
+    def _cost(self, task):
+        return task.n * self._rate(task.iblock)
+
+    def done(self, task, duration):
+        rate = duration / max(1, task.n)
+        self._rate_blocks[task.iblock].append(rate)
+        self._rate_all.append(rate)
+        self.timings.append((task, duration))
+
+
 class Builder:
     nsteps = 1
 
+    # steps whose blocks must be computed as a whole, e.g. because they
+    # prepare intermediate results for all distances at once
+    unsplittable_steps = ()
+
     def __init__(self, gf_config, step, block_size=None, force=False):
         if block_size is None:
             if len(gf_config.ns) == 3:
@@ -33,6 +128,7 @@ class Builder:
         self.force = force
         self.gf_config = gf_config
         self._block_size = int_arr(*block_size)
+        self._block_part = None
 
     @property
     def nblocks(self):
@@ -45,25 +141,55 @@ class Builder:
     def all_block_indices(self):
         return num.arange(self.nblocks)
 
-    def get_block(self, index):
+    def get_full_block(self, index):
         dims = self.block_dims
         iblock = num.unravel_index(index, dims)
         ibegins = iblock * self._block_size
         iends = num.minimum(ibegins + self._block_size, self.gf_config.ns)
         return ibegins, iends
 
+    def get_block(self, index):
+        ibegins, iends = self.get_full_block(index)
+        if self._block_part is not None:
+            ilo, ihi = self._block_part
+            ibegins[-1] = ilo
+            iends[-1] = ihi
+
+        return ibegins, iends
+
     def get_block_extents(self, index):
         ibegins, iends = self.get_block(index)
         begins = self.gf_config.mins + ibegins * self.gf_config.deltas
         ends = self.gf_config.mins + (iends-1) * self.gf_config.deltas
         return begins, ends, iends - ibegins
 
+    def get_tasks(self, iblock, done=()):
+        '''
+        Get tasks covering the parts of a block which have not been done yet.
+
+        :param done: list of ``(ilo, ihi)`` index ranges along the last axis
+            which have already been computed
+        '''
+
+        ibegins, iends = self.get_full_block(iblock)
+        tasks = []
+        ilo = ibegins[-1]
+        for (dlo, dhi) in sorted(done) + [(iends[-1], iends[-1])]:
+            if ilo < dlo:
+                tasks.append(Task(self.step, iblock, ilo, min(dlo, iends[-1])))
+
+            ilo = max(ilo, dhi)
+
+        return tasks
+
     @classmethod
     def __work_block(cls, args):
         try:
-            store_dir, step, iblock, shared, force = args
-            builder = cls(store_dir, step, shared, force=force)
-            builder.work_block(iblock)
+            store_dir, task, shared, force = args
+            tstart = time.time()
+            builder = cls(store_dir, task.step, shared, force=force)
+            builder._block_part = task.ilo, task.ihi
+            builder.work_block(task.iblock)
         except KeyboardInterrupt:
             raise Interrupted()
         except IOError, e:
@@ -72,7 +198,7 @@ class Builder:
             else:
                 raise
 
-        return store_dir, step, iblock
+        return task, time.time() - tstart
 
     @classmethod
     def build(cls, store_dir, force=False, nworkers=None, continue_=False,
@@ -85,7 +211,7 @@ class Builder:
         if iblock is not None and step is None and cls.nsteps != 1:
             raise store.StoreError('--step option must be given')
 
-        done = set()
+        done = defaultdict(list)
         status_fn = pjoin(store_dir, '.status')
 
         if not continue_ and iblock in (None, -1) and step in (None, 0):
@@ -100,10 +226,20 @@ class Builder:
                     try:
                         with open(status_fn, 'r') as status:
                             for line in status:
-                                done.add(tuple(int(x) for x in line.split()))
+                                toks = line.split()
+                                k = tuple(int(x) for x in toks[:2])
+                                if len(toks) >= 4:
+                                    done[k].append(
+                                        tuple(int(x) for x in toks[2:4]))
+                                else:
+                                    done[k].append(None)
+
                     except IOError:
                         raise store.StoreError('nothing to continue')
 
+        if nworkers is None:
+            nworkers = multiprocessing.cpu_count()
+
         shared = {}
         for step in steps:
             builder = cls(store_dir, step, shared, force=force)
@@ -111,17 +247,21 @@ class Builder:
                 raise store.StoreError('invalid step: %i' % (step+1))
 
             if iblock in (None, -1):
-                iblocks = [x for x in builder.all_block_indices()
-                           if (step, x) not in done]
+                tasks = []
+                for i in builder.all_block_indices():
+                    done_ranges = done.get((step, i), [])
+                    if None not in done_ranges:
+                        tasks.extend(builder.get_tasks(i, done_ranges))
+
             else:
                 if not (0 <= iblock < builder.nblocks):
                     raise store.StoreError(
                         'invalid block index %i' % (iblock+1))
 
-                iblocks = [iblock]
+                tasks = builder.get_tasks(iblock)
 
             if iblock == -1:
-                for i in iblocks:
+                for i in sorted(set(task.iblock for task in tasks)):
                     c = ['fomosto', 'build']
                     if not os.path.samefile(store_dir, '.'):
                         c.append("'%s'" % store_dir)
@@ -135,25 +275,49 @@ class Builder:
 
                 return
 
+            nblocks = builder.nblocks
+            splittable = iblock is None \
+                and step not in builder.unsplittable_steps
+
             del builder
 
+            scheduler = Scheduler(tasks, nworkers, splittable=splittable)
+
             original = signal.signal(signal.SIGINT, signal.SIG_IGN)
             try:
-                for x in parimap(
+                for task, duration in parimap(
                         cls.__work_block,
-                        [(store_dir, step, i, shared, force)
-                         for i in iblocks],
+                        ((store_dir, task, shared, force)
+                         for task in scheduler),
                         nprocs=nworkers, eprintignore=(
-                            Interrupted, store.StoreError)):
+                            Interrupted, store.StoreError),
+                        ordered=False):
+
+                    scheduler.done(task, duration)
+                    logger.info(
+                        'Step %i / %i, block %i / %i, distance indices '
+                        '%i - %i: %.1f s' % (
+                            step+1, cls.nsteps, task.iblock+1, nblocks,
+                            task.ilo, task.ihi-1, duration))
 
-                    store_dir, step, i = x
                     with open(status_fn, 'a') as status:
-                        status.write('%i %i\n' % (step, i))
+                        status.write('%i %i %i %i %g\n' % (
+                            step, task.iblock, task.ilo, task.ihi, duration))
 
             finally:
                 signal.signal(signal.SIGINT, original)
 
-        os.remove(status_fn)
+            if scheduler.timings:
+                durations = num.array([t for (_, t) in scheduler.timings])
+                logger.info(
+                    'Step %i / %i: %i tasks, %.1f s total, per task: '
+                    'min %.1f s, median %.1f s, max %.1f s' % (
+                        step+1, cls.nsteps, durations.size,
+                        num.sum(durations), num.min(durations),
+                        num.median(durations), num.max(durations)))
+
+        if os.path.exists(status_fn):
+            os.remove(status_fn)
 
 
 __all__ = ['Builder']
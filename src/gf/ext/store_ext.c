@@ -2,6 +2,26 @@
 
 #define GF_STORE_HEADER_SIZE (8+4)
 
+/* optional header at the start of the traces file of compressed stores */
+#define GF_STORE_DATA_HEADER_SIZE 32
+#define GF_STORE_COMPRESSED_MAGIC "GFZC"
+
+/* header preceding each compressed record: nbytes, codec, step */
+#define GF_BLOCK_HEADER_SIZE (4+4+4)
+
+#define CODEC_DEFLATE 1
+#define CODEC_DEFLATE_QUANTIZED 2
+
+/* shared memory record cache */
+#define SHM_MAGIC "GFSHMC03"
+#define SHM_HEADER_SIZE 128
+#define SHM_NOWNERS 64
+#define SHM_NPINS 1024
+#define SHM_ENTRY_HEADER_SIZE 32
+#define SHM_DATA_SIZE_MIN 65536
+#define SHM_FREE_ENTRY UINT64_MAX
+#define pad32(n) (((n) + 31) & ~((uint64_t)31))
+
 /* security limit for length of traces, shifts and offsets (samples) */
 #define SLIMIT 1000000
 
@@ -23,9 +43,15 @@
 #include <sys/types.h>
 #include <sys/stat.h>
 #include <sys/mman.h>
+#include <sys/file.h>
+#include <fcntl.h>
+#include <errno.h>
 #include <unistd.h>
 #include <stdio.h>
 #include <stdlib.h>
+#include <string.h>
+#include <zlib.h>
+#include <pthread.h>
 #if defined(_OPENMP)
     #include <omp.h>
 #endif
@@ -37,6 +63,8 @@
   #include <libkern/OSByteOrder.h>
   #define be32toh(x) OSSwapBigToHostInt32(x)
   #define le32toh(x) OSSwapLittleToHostInt32(x)
+  #define htobe32(x) OSSwapHostToBigInt32(x)
+  #define htole32(x) OSSwapHostToLittleInt32(x)
   #define be64toh(x) OSSwapBigToHostInt64(x)
   #define le64toh(x) OSSwapLittleToHostInt64(x)
 #endif
@@ -54,11 +82,13 @@ typedef npy_float64 float64_t;
 #ifdef GF_STORE_IS_LITTLE_ENDIAN
   #define xe64toh le64toh
   #define xe32toh le32toh
+  #define htoxe32 htole32
 #endif
 
 #ifdef GF_STORE_IS_BIG_ENDIAN
   #define xe64toh be64toh
   #define xe32toh be32toh
+  #define htoxe32 htobe32
 #endif
 
 #define fe32toh(x) \
@@ -95,6 +125,9 @@ typedef enum {
     MMAP_TRACES_FAILED,
     INDEX_OUT_OF_BOUNDS,
     NTARGETS_OUT_OF_BOUNDS,
+    DECOMPRESSION_FAILED,
+    SHM_FAILED,
+    PRELOAD_FAILED,
 } store_error_t;
 
 const char* store_error_names[] = {
@@ -114,6 +147,9 @@ const char* store_error_names[] = {
     "MMAP_TRACES_FAILED",
     "INDEX_OUT_OF_BOUNDS",
     "NTARGETS_OUT_OF_BOUNDS",
+    "DECOMPRESSION_FAILED",
+    "SHM_FAILED",
+    "PRELOAD_FAILED",
 };
 
 #define NDIMS_CONTINUOUS_MAX 4
@@ -186,6 +222,81 @@ typedef struct {
     gf_dtype end_value;
 } record_t;
 
+typedef struct {
+    char magic[8];
+    uint64_t nbytes_total;
+    uint64_t nrecords;
+    uint64_t data_offset;
+    uint64_t data_size;
+    uint64_t head;
+    uint64_t hwm;
+    uint64_t nentries;
+    uint64_t nbytes_used;
+    uint64_t hits;
+    uint64_t misses;
+    uint64_t evictions;
+} shm_header_t;
+
+/* header of an entry in the data area of the shared memory cache, the
+ * record's samples follow */
+typedef struct {
+    uint64_t irecord;
+    uint64_t nbytes;
+    int64_t refcount;
+    uint64_t reserved;
+} shm_entry_t;
+
+typedef struct {
+    char *path;
+    int fd;
+    pid_t pid;
+    pthread_mutex_t mutex;
+    size_t nbytes;
+    char *base;
+    shm_header_t *header;
+    int64_t *owners;
+    uint64_t *pins;
+    uint64_t *slots;
+    char *data;
+    int iowner;
+    uint64_t ipin_next;
+} shm_cache_t;
+
+/* pin handles returned by store_acquire(), other values are indices (plus
+ * one) into the pin table of the shared memory cache */
+#define PIN_NONE 0
+#define PIN_PRIVATE UINT64_MAX
+#define PIN_NEED (UINT64_MAX - 1)
+#define PIN_DECODED (UINT64_MAX - 2)
+
+/* records acquired at once by store_sum() and store_sum_static() */
+#define ACQUIRE_CHUNK 256
+
+typedef struct cache_entry {
+    gf_dtype *data;
+    uint64_t irecord;
+    uint64_t nbytes;
+    int32_t refcount;
+    struct cache_entry *prev;
+    struct cache_entry *next;
+} cache_entry_t;
+
+typedef struct {
+    pthread_mutex_t mutex;
+    cache_entry_t **entries;
+    cache_entry_t *head;
+    cache_entry_t *tail;
+    uint64_t nentries;
+    uint64_t nbytes;
+    uint64_t max_bytes;
+    uint64_t hits;
+    uint64_t misses;
+    uint64_t evictions;
+} record_cache_t;
+
+/* default size limit of the record cache, see store_set_cache_max_bytes() */
+#define RECORD_CACHE_MAX_BYTES_DEFAULT (512*1024*1024ULL)
+
 typedef struct {
     int f_index;
     int f_data;
@@ -194,11 +305,20 @@ typedef struct {
     float32_t deltat;
     record_t *records;
     gf_dtype *data;
-    gf_dtype **memdata;
+    record_cache_t *cache;
     const mapping_scheme_t *mapping_scheme;
     mapping_t *mapping;
+    int compressed;
+    shm_cache_t *shm;
+    int preload;
 } store_t;
 
+/* store_init flags, the effective ones are kept in store_t.preload */
+
+#define PRELOAD 1
+#define PRELOAD_HUGEPAGES 2
+#define PRELOAD_MLOCK 4
+
 typedef struct {
     int is_zero;
     int32_t itmin;
@@ -348,7 +468,7 @@ int good_array(PyObject* o, int typenum_want, npy_intp size_want, int ndim_want,
 }
 
 static const trace_t ZERO_TRACE = { 1, 0, 0, 0.0, 0.0, NULL };
-static const store_t ZERO_STORE = { 0, 0, 0, 0, 0.0, NULL, NULL, NULL, NULL, NULL };
+static const store_t ZERO_STORE = { 0, 0, 0, 0, 0.0, NULL, NULL, NULL, NULL, NULL, 0, NULL, 0 };
 
 static store_error_t store_get_span(const store_t *store, uint64_t irecord,
                              int32_t *itmin, int32_t *nsamples, int *is_zero) {
@@ -390,367 +510,1579 @@ static store_error_t store_read(
     return SUCCESS;
 }
 
-static store_error_t store_get(
-        const store_t *store,
-        uint64_t irecord,
-        trace_t *trace) {
-
-    record_t *record;
-    uint64_t data_offset;
-    store_error_t err;
-    size_t nbytes;
-
-    if (irecord >= store->nrecords) {
-        *trace = ZERO_TRACE;
-        return INVALID_RECORD;
+static store_error_t store_decode(
+        const uint8_t *block,
+        uint64_t nbytes_block,
+        int32_t nsamples,
+        gf_dtype *out) {
+
+    /* Decode a compressed record: byte planes of the differenced sample bit
+     * patterns (or of the differenced quantized samples), packed with
+     * deflate. Output is in store byte order, like uncompressed records. */
+
+    uint32_t nbytes_payload, codec, step_bits;
+    float32_t step;
+    uint8_t *planes, *bytes;
+    uLongf nbytes_raw;
+    int32_t i, delta;
+    int b;
+    int64_t acc;
+    uint32_t uacc;
+    gf_dtype value;
+    uint32_t bits;
+
+    if (nbytes_block < GF_BLOCK_HEADER_SIZE) {
+        return BAD_DATA_OFFSET;
     }
 
-    record = &store->records[irecord];
-    data_offset = xe64toh(record->data_offset);
-    trace->itmin = xe32toh(record->itmin);
-    trace->nsamples = xe32toh(record->nsamples);
-    trace->begin_value = fe32toh(record->begin_value);
-    trace->end_value = fe32toh(record->end_value);
+    memcpy(&nbytes_payload, block, 4);
+    memcpy(&codec, block+4, 4);
+    memcpy(&step_bits, block+8, 4);
+    nbytes_payload = xe32toh(nbytes_payload);
+    codec = xe32toh(codec);
+    step_bits = xe32toh(step_bits);
+    memcpy(&step, &step_bits, 4);
 
-    if (!inlimits(trace->itmin) || !inposlimits(trace->nsamples) ||
-            data_offset >= UINT64_MAX - SLIMIT * sizeof(gf_dtype)) {
-        return BAD_RECORD;
+    if (nbytes_payload > nbytes_block - GF_BLOCK_HEADER_SIZE) {
+        return BAD_DATA_OFFSET;
     }
 
-    if (REC_EMPTY == data_offset) {
-        *trace = ZERO_TRACE;
-        return EMPTY_RECORD;
+    if (CODEC_DEFLATE != codec && CODEC_DEFLATE_QUANTIZED != codec) {
+        return DECOMPRESSION_FAILED;
     }
 
-    if (REC_ZERO == data_offset) {
-        *trace = ZERO_TRACE;
-        trace->itmin = xe32toh(record->itmin);
-        return SUCCESS;
+    planes = (uint8_t*)malloc(nsamples*4);
+    if (NULL == planes) {
+        return ALLOC_FAILED;
     }
 
-    trace->is_zero = 0;
+    nbytes_raw = nsamples*4;
+    if (Z_OK != uncompress(planes, &nbytes_raw, block+GF_BLOCK_HEADER_SIZE,
+                           nbytes_payload) ||
+            nbytes_raw != (uLongf)nsamples*4) {
+        free(planes);
+        return DECOMPRESSION_FAILED;
+    }
 
-    if (data_offset + trace->nsamples*sizeof(gf_dtype) > store->data_size) {
-        *trace = ZERO_TRACE;
-        return BAD_DATA_OFFSET;
+    bytes = (uint8_t*)out;
+    for (i=0; i<nsamples; i++) {
+        for (b=0; b<4; b++) {
+            bytes[i*4+b] = planes[b*nsamples+i];
+        }
     }
+    free(planes);
 
-    if (REC_SHORT == data_offset) {
-        trace->data = &record->begin_value;
+    if (CODEC_DEFLATE == codec) {
+        uacc = 0;
+        for (i=0; i<nsamples; i++) {
+            memcpy(&bits, &out[i], 4);
+            uacc += xe32toh(bits);
+            bits = htoxe32(uacc);
+            memcpy(&out[i], &bits, 4);
+        }
     } else {
-        if (NULL != store->data) {
-            trace->data = &store->data[data_offset/sizeof(gf_dtype)];
-        } else {
-            if (NULL == store->memdata[irecord]) {
-                nbytes = trace->nsamples * sizeof(gf_dtype);
-                store->memdata[irecord] = (gf_dtype*)malloc(nbytes);
-                if (NULL == store->memdata[irecord]) {
-                    *trace = ZERO_TRACE;
-                    return ALLOC_FAILED;
-                }
-                err = store_read(store, data_offset, nbytes, store->memdata[irecord]);
-                if (SUCCESS != err) {
-                    free(store->memdata[irecord]);
-                    store->memdata[irecord] = NULL;
-                    *trace = ZERO_TRACE;
-                    return err;
-                }
-            }
-            trace->data = store->memdata[irecord];
+        acc = 0;
+        for (i=0; i<nsamples; i++) {
+            memcpy(&bits, &out[i], 4);
+            bits = xe32toh(bits);
+            memcpy(&delta, &bits, 4);
+            acc += delta;
+            value = (gf_dtype)((float64_t)acc * (float64_t)step);
+            memcpy(&bits, &value, 4);
+            bits = htoxe32(bits);
+            memcpy(&out[i], &bits, 4);
         }
     }
 
     return SUCCESS;
 }
 
-static int clipint32(int32_t lo, int32_t hi, int32_t n) {
-    return n <= lo ? lo : n >= hi ? hi : n;
+/* Shared memory record cache
+ *
+ * Decoded records are kept in a file-backed shared memory segment, so that
+ * several processes using the same store share them. The segment contains
+ * a header, a table of owners (attachments) with a pin table for each, a
+ * slot table with the position of each cached record and a data area which
+ * is used as a ring buffer: new entries are written at the head, evicting
+ * the oldest entries. Entries which are hit while being close to eviction
+ * are moved to the head again, approximating LRU order.
+ *
+ * Records are used in place. While in use, an entry is pinned: its
+ * reference count is incremented and its position is noted in the pin table
+ * of the owner. Pinned entries are skipped when the ring buffer wraps over
+ * them. Pins of owners whose process does not exist anymore are released
+ * on attach, on clear and when no space can be found otherwise.
+ *
+ * Access is serialized with flock() on a per-process file descriptor, and,
+ * because flock() does not exclude threads sharing that descriptor, with a
+ * mutex between the threads of a process. */
+
+static uint64_t shm_data_offset(uint64_t nrecords) {
+    uint64_t data_offset;
+    data_offset = SHM_HEADER_SIZE + SHM_NOWNERS * sizeof(int64_t) +
+        SHM_NOWNERS * SHM_NPINS * sizeof(uint64_t) +
+        nrecords * sizeof(uint64_t);
+    return (data_offset + 4095) & ~((uint64_t)4095);
 }
 
-static void trace_trim(trace_t *trace, int32_t itmin, int32_t nsamples) {
-    int32_t ilo, ihi;
-    ilo = max(itmin, trace->itmin);
-    ihi = min(itmin + nsamples, trace->itmin + trace->nsamples);
-    trace->data = (trace->nsamples == 0) ? NULL : (trace->data + (ilo - trace->itmin));
-    trace->itmin = ilo;
-    trace->nsamples = max(0, ihi - ilo);
+static shm_entry_t *shm_entry(shm_cache_t *shm, uint64_t pos) {
+    return (shm_entry_t*)(shm->data + pos);
 }
 
-static void trace_trim_sticky(trace_t *trace, int32_t itmin, int32_t nsamples) {
-    int32_t ilo, ihi;
-    ilo = clipint32(0, trace->nsamples-1, itmin-trace->itmin);
-    ihi = clipint32(1, trace->nsamples, itmin+nsamples-trace->itmin);
-    trace->itmin = trace->itmin + ilo;
-    trace->nsamples = max(0, (ihi - ilo));
-    trace->data += ilo;
+static uint64_t shm_entry_size(shm_entry_t *e) {
+    return SHM_ENTRY_HEADER_SIZE + pad32(e->nbytes);
 }
 
+static int shm_owner_dead(int64_t pid) {
+    return 0 != pid && -1 == kill((pid_t)pid, 0) && ESRCH == errno;
+}
 
-static store_error_t store_sum_extent(
-            const store_t *store,
-            const uint64_t *irecords,
-            const float32_t *delays,
-            int n,
-            int32_t *nsamples_,
-            int32_t *itmin_) {
+static void shm_release_owner_locked(shm_cache_t *shm, int iowner) {
+    /* Drop all pins of an owner and free its slot in the owner table. */
 
-    float itmin_d, itmax_d, idelay;
-    int32_t itmax, itmin, ns;
-    int ihave, is_zero, j;
-    store_error_t err;
-    itmin_d = itmax_d = 0.0;
-    itmin = 0;
-    ihave = 0;
+    uint64_t *pins;
+    uint64_t ipin;
+    shm_entry_t *e;
 
-    if (n == 0) {
-        *itmin_ = 0;
-        *nsamples_ = 0;
-        return SUCCESS;
+    pins = shm->pins + (uint64_t)iowner * SHM_NPINS;
+    for (ipin=0; ipin<SHM_NPINS; ipin++) {
+        if (0 != pins[ipin]) {
+            e = shm_entry(shm, pins[ipin] - 1);
+            if (e->refcount > 0) {
+                e->refcount--;
+            }
+            pins[ipin] = 0;
+        }
     }
+    shm->owners[iowner] = 0;
+}
 
-    for (j=0; j<n; j++) {
-        err = store_get_span(store, irecords[j], &itmin, &ns, &is_zero);
-        if (SUCCESS != err) {
-            return err;
+static int shm_reclaim_locked(shm_cache_t *shm) {
+    /* Release pins held by processes which do not exist anymore. */
+
+    int iowner, nreclaimed;
+
+    nreclaimed = 0;
+    for (iowner=0; iowner<SHM_NOWNERS; iowner++) {
+        if (shm_owner_dead(shm->owners[iowner])) {
+            shm_release_owner_locked(shm, iowner);
+            nreclaimed++;
         }
+    }
+    return nreclaimed;
+}
 
-        itmax = itmin + ns - 1;
-        idelay = delays[j]/store->deltat;
+static void shm_claim_owner_locked(shm_cache_t *shm) {
+    int iowner;
+
+    shm->iowner = -1;
+    shm->ipin_next = 0;
+    shm_reclaim_locked(shm);
+    for (iowner=0; iowner<SHM_NOWNERS; iowner++) {
+        if (0 == shm->owners[iowner]) {
+            shm->owners[iowner] = shm->pid;
+            shm->iowner = iowner;
+            return;
+        }
+    }
+}
 
-        if (ihave) {
-            itmin_d = min(itmin_d, itmin + idelay);
-            itmax_d = max(itmax_d, itmax + idelay);
+static int shm_lock(shm_cache_t *shm) {
+    pid_t pid;
+    int fd, forked;
+
+    pthread_mutex_lock(&shm->mutex);
+
+    /* after fork(), the inherited descriptor shares its lock with the
+     * parent's, so a private one must be opened, and pins are held in a
+     * new slot of the owner table */
+    pid = getpid();
+    forked = pid != shm->pid;
+    if (forked) {
+        fd = open(shm->path, O_RDWR);
+        if (-1 == fd) {
+            pthread_mutex_unlock(&shm->mutex);
+            return -1;
         }
-        else {
-            itmin_d = itmin + idelay;
-            itmax_d = itmax + idelay;
-            ihave = 1;
+        close(shm->fd);
+        shm->fd = fd;
+        shm->pid = pid;
+    }
+
+    while (-1 == flock(shm->fd, LOCK_EX)) {
+        if (EINTR != errno) {
+            pthread_mutex_unlock(&shm->mutex);
+            return -1;
         }
     }
 
-    *itmin_ = (int32_t) floor(itmin_d);
-    *nsamples_ = (int32_t) ceil(itmax_d) - *itmin_ + 1;
-    return SUCCESS;
+    if (forked) {
+        shm_claim_owner_locked(shm);
+    }
+
+    return 0;
 }
 
-static store_error_t store_sum(
-        const store_t *store,
-        const uint64_t *irecords,
-        const float32_t *delays,
-        const float32_t *weights,
-        int n,
-        trace_t *result) {
+static void shm_unlock(shm_cache_t *shm) {
+    flock(shm->fd, LOCK_UN);
+    pthread_mutex_unlock(&shm->mutex);
+}
 
-    float32_t weight, delay;
-    trace_t trace;
-    float32_t deltat = store->deltat;
-    gf_dtype begin_value, end_value;
-    int ilo;
-    int i, j;
-    int idelay_floor, idelay_ceil;
-    float w1, w2;
-    store_error_t err;
-    int32_t itmin;
-    int32_t nsamples;
-    gf_dtype *out;
+static void shm_reset(shm_cache_t *shm, uint64_t nrecords, int keep_owners) {
+    /* Remove all entries. Unless keep_owners is set, the owner and pin
+     * tables are cleared too, which is only safe on a fresh segment. */
 
-    out = result->data;
-    itmin = result->itmin;
-    nsamples = result->nsamples;
+    shm_header_t *h;
+    h = shm->header;
+    if (keep_owners) {
+        memset(shm->base, 0, SHM_HEADER_SIZE);
+        memset(shm->slots, 0, nrecords*sizeof(uint64_t));
+    } else {
+        memset(shm->base, 0, shm->data - shm->base);
+    }
+    memcpy(h->magic, SHM_MAGIC, 8);
+    h->nbytes_total = shm->nbytes;
+    h->nrecords = nrecords;
+    h->data_offset = shm->data - shm->base;
+    h->data_size = (shm->nbytes - h->data_offset) & ~((uint64_t)31);
+}
 
-    result->is_zero = 1;
-    result->begin_value = 0.0;
-    result->end_value = 0.0;
+static void shm_evict(shm_cache_t *shm, uint64_t pos) {
+    /* Remove entry at pos from the slot table, if it is the current one. */
 
-    if (!inlimits(itmin) || !inposlimits(nsamples)) {
-        return BAD_REQUEST;
-    }
+    shm_header_t *h;
+    shm_entry_t *e;
 
-    if (0 == n) {
-        return SUCCESS;
+    h = shm->header;
+    e = shm_entry(shm, pos);
+    if (SHM_FREE_ENTRY != e->irecord && e->irecord < h->nrecords &&
+            shm->slots[e->irecord] == pos + 1) {
+        shm->slots[e->irecord] = 0;
+        h->nentries--;
+        h->nbytes_used -= e->nbytes;
+        h->evictions++;
     }
+}
 
-    begin_value = 0.0;
-    end_value = 0.0;
-
-    for (j=0; j<n; j++) {
+static void shm_put_free_entry(shm_cache_t *shm, uint64_t pos, uint64_t end) {
+    shm_entry_t *e;
+    if (end >= pos + SHM_ENTRY_HEADER_SIZE) {
+        e = shm_entry(shm, pos);
+        e->irecord = SHM_FREE_ENTRY;
+        e->nbytes = end - pos - SHM_ENTRY_HEADER_SIZE;
+        e->refcount = 0;
+    }
+}
 
-        delay = delays[j];
-        weight = weights[j];
-        idelay_floor = (int)floor(delay/deltat);
-        idelay_ceil = (int)ceil(delay/deltat);
-        if (!inlimits(idelay_floor) || !inlimits(idelay_ceil))
-            return BAD_REQUEST;
+static uint64_t shm_alloc_locked(shm_cache_t *shm, uint64_t need) {
+    /* Make room for an entry of size need at or after the head, evicting
+     * unpinned entries in the way. Returns position plus one, or 0 if all
+     * space is pinned. */
+
+    shm_header_t *h;
+    shm_entry_t *e;
+    uint64_t pos, end;
+    int nwraps;
+
+    h = shm->header;
+    pos = h->head;
+    end = pos;
+    nwraps = 0;
+    while (end - pos < need) {
+        if (end >= h->hwm) {
+            if (pos + need <= h->data_size) {
+                end = pos + need;
+                break;
+            }
 
-        if (0.0 == weight) {
+            /* wrap around */
+            shm_put_free_entry(shm, pos, h->data_size);
+            h->hwm = h->data_size;
+            nwraps++;
+            if (nwraps > 1) {
+                h->head = 0;
+                return 0;
+            }
+            pos = end = 0;
             continue;
         }
 
-        err = store_get(store, irecords[j], &trace);
-        if (SUCCESS != err)
-            return err;
-
-        if (trace.is_zero)
+        e = shm_entry(shm, end);
+        if (SHM_FREE_ENTRY != e->irecord && e->refcount > 0) {
+            /* pinned, skip over it */
+            shm_put_free_entry(shm, pos, end);
+            pos = end = end + shm_entry_size(e);
             continue;
-
-        trace_trim_sticky(&trace, itmin - idelay_ceil, nsamples + idelay_ceil - idelay_floor);
-
-        if (idelay_floor == idelay_ceil) {
-            ilo = itmin - idelay_floor - trace.itmin;
-            /*for (i=0; i<nsamples; i++) {
-                ifloor = i + ilo;
-                ifloor = max(0, min(ifloor, trace.nsamples-1));
-                out[i] += fe32toh(trace.data[ifloor]) * weight;
-            } // version below is a bit faster */
-            for (i=0; i<min(-ilo,nsamples); i++) {
-                out[i] += fe32toh(trace.data[0]) * weight;
-            }
-            for (i=max(0,-ilo); i<min(nsamples, trace.nsamples-ilo); i++) {
-                out[i] += fe32toh(trace.data[i+ilo]) * weight;
-            }
-            for (i=max(0,trace.nsamples-ilo); i<nsamples; i++) {
-                out[i] += fe32toh(trace.data[trace.nsamples-1]) * weight;
-            }
-        } else {
-            ilo = itmin - idelay_floor - trace.itmin;
-            /*ihi = ilo - 1;*/
-            w1 = (idelay_ceil - delay/deltat);
-            w2 = 1.0 - w1;
-            w1 *= weight;
-            w2 *= weight;
-            /* printf("- w1 %f, w2 %f\n", w1, w2); */
-            /*for (i=0; i<nsamples; i++) {
-                ifloor = i + ilo;
-                iceil = i + ihi;
-                ifloor = max(0, min(ifloor, trace.nsamples-1));
-                iceil = max(0, min(iceil, trace.nsamples-1));
-                out[i] += fe32toh(trace.data[ifloor]) * w1;
-                out[i] += fe32toh(trace.data[iceil]) * w2;
-            } // version below is a bit faster */
-            for (i=0; i<min(-ilo,nsamples); i++) {
-                out[i] += fe32toh(trace.data[0]) * weight;
-            }
-            for (i=max(0,-ilo); i<min(nsamples, -ilo+1); i++) {
-                out[i] += fe32toh(trace.data[i+ilo])*w1
-                          + fe32toh(trace.data[0])*w2;
-            }
-            for (i=max(0,-ilo+1); i<min(nsamples, trace.nsamples-ilo); i++) {
-                out[i] += fe32toh(trace.data[i+ilo])*w1
-                          + fe32toh(trace.data[i+ilo-1])*w2;
-            }
-            for (i=max(0,trace.nsamples-ilo);
-                 i<min(nsamples, trace.nsamples-ilo+1); i++) {
-                out[i] += fe32toh(trace.data[trace.nsamples-1]) * w1
-                          + fe32toh(trace.data[i+ilo-1])*w2;
-            }
-            for (i=max(0,trace.nsamples-ilo+1); i<nsamples; i++) {
-                out[i] += fe32toh(trace.data[trace.nsamples-1]) * weight;
-            }
         }
 
-        begin_value += trace.begin_value * weight;
-        end_value += trace.end_value * weight;
+        shm_evict(shm, end);
+        end += shm_entry_size(e);
     }
 
-    result->is_zero = 0;
-    result->begin_value = begin_value;
-    result->end_value = end_value;
-
-    return SUCCESS;
+    h->head = pos + need;
+    if (end > h->head) {
+        shm_put_free_entry(shm, h->head, end);
+    }
+    h->hwm = max(h->hwm, h->head);
+    return pos + 1;
 }
 
-static store_error_t store_sum_static(
-        const store_t *store,
-        const uint64_t *irecords,
-        const float32_t *delays,
-        const float32_t *weights,
-        int32_t it,
-        int32_t ntargets,
-        size_t nsummands,
-        size_t nsources,
-        int32_t nthreads,
-        gf_dtype *result) {
+static uint64_t shm_put_locked(
+        shm_cache_t *shm, uint64_t irecord, const void *buf, uint64_t nbytes) {
 
-    float32_t weight, delay;
-    trace_t trace;
-    float32_t deltat = store->deltat;
-    int idelay_floor, idelay_ceil;
-    int j, itarget, idx;
-    uint isummand, nsummands_src;
-    float w1, w2;
-    store_error_t err=SUCCESS;
-    (void) nthreads;
+    /* Insert or replace the entry of a record, return position plus one,
+     * or 0 if it cannot be inserted. */
 
-    if (0 == nsummands || 0 == ntargets)
-        return SUCCESS;
+    shm_header_t *h;
+    shm_entry_t *e;
+    uint64_t need, pos;
 
-    if (!inlimits(it))
-        return BAD_REQUEST;
+    h = shm->header;
+    need = SHM_ENTRY_HEADER_SIZE + pad32(nbytes);
+    if (irecord >= h->nrecords || need > h->data_size / 4) {
+        return 0;
+    }
 
-    if (result == NULL)
-        return ALLOC_FAILED;
+    pos = shm_alloc_locked(shm, need);
+    if (0 == pos && 0 != shm_reclaim_locked(shm)) {
+        pos = shm_alloc_locked(shm, need);
+    }
+    if (0 == pos) {
+        return 0;
+    }
+    pos--;
 
-    nsummands_src = nsummands / nsources;
+    if (0 != shm->slots[irecord]) {
+        h->nbytes_used -= shm_entry(shm, shm->slots[irecord] - 1)->nbytes;
+    } else {
+        h->nentries++;
+    }
 
-    #if defined(_OPENMP)
-        if (nthreads == 0)
-            nthreads = omp_get_num_procs();
+    e = shm_entry(shm, pos);
+    e->irecord = irecord;
+    e->nbytes = nbytes;
+    e->refcount = 0;
+    memcpy(shm->data + pos + SHM_ENTRY_HEADER_SIZE, buf, nbytes);
+    shm->slots[irecord] = pos + 1;
+    h->nbytes_used += nbytes;
 
-        #pragma omp parallel \
-            shared (store, irecords, delays, weights, ntargets, nsummands, \
-                    result, it, deltat) \
-            private (j, isummand, delay, weight, idelay_floor, idelay_ceil, idx, trace, w1, w2) \
-            reduction (+: err) \
-            num_threads (nthreads)
-        {
-        #pragma omp for schedule (static)
-    #endif
-        for (itarget=0; itarget<ntargets; itarget++) {
-            for (isummand=0; isummand<nsummands; isummand++) {
-                j = itarget*nsummands + isummand;
+    return pos + 1;
+}
 
-                delay = delays[isummand / nsummands_src];
-                weight = weights[j];
-                idelay_floor = (int) floor(delay/deltat);
-                idelay_ceil = (int) ceil(delay/deltat);
+static uint64_t shm_pin_locked(shm_cache_t *shm, uint64_t pos) {
+    /* Pin entry at position pos (plus one), return the pin handle, or 0 if
+     * the owner's pin table is full. */
 
-                if (weight == 0.)
-                    continue;
+    uint64_t *pins;
+    uint64_t i, ipin;
 
-                if (!inlimits(idelay_floor) || !inlimits(idelay_ceil))
-                    err += BAD_REQUEST;
+    if (shm->iowner < 0) {
+        return 0;
+    }
 
-                err += store_get(store, irecords[j], &trace);
+    pins = shm->pins + (uint64_t)shm->iowner * SHM_NPINS;
+    for (i=0; i<SHM_NPINS; i++) {
+        ipin = (shm->ipin_next + i) % SHM_NPINS;
+        if (0 == pins[ipin]) {
+            pins[ipin] = pos;
+            shm_entry(shm, pos - 1)->refcount++;
+            shm->ipin_next = ipin + 1;
+            return ipin + 1;
+        }
+    }
+    return 0;
+}
 
-                if (trace.is_zero)
-                    continue;
+static void shm_unpin_locked(shm_cache_t *shm, uint64_t pin) {
+    uint64_t *p;
+    shm_entry_t *e;
 
-                idx = it - idelay_floor - trace.itmin;
+    if (shm->iowner < 0) {
+        return;
+    }
 
-                if (idelay_floor == idelay_ceil) {
-                    result[itarget] += fe32toh(trace.data[max(0, min(idx, trace.nsamples-1))]) * weight;
-                } else {
-                    w1 = (idelay_ceil - delay/deltat);
-                    w2 = (1.0-w1);
-                    result[itarget] += (
-                        fe32toh(trace.data[max(0, min(idx, trace.nsamples-1))]) * w1
-                        + fe32toh(trace.data[max(0, min(idx-1, trace.nsamples-1))]) * w2) * weight;
-                }
-            }
-        }
-    #if defined(_OPENMP)
+    p = shm->pins + (uint64_t)shm->iowner * SHM_NPINS + (pin - 1);
+    if (0 != *p) {
+        e = shm_entry(shm, *p - 1);
+        if (e->refcount > 0) {
+            e->refcount--;
         }
-    #endif
-    if (err != SUCCESS)
-        return BAD_REQUEST;
-    return SUCCESS;
+        *p = 0;
+    }
 }
 
-static store_error_t store_init(int f_index, int f_data, store_t *store) {
-    void *p;
-    struct stat st;
-    size_t mmap_index_size;
+static gf_dtype *shm_pin_data(shm_cache_t *shm, uint64_t pin) {
+    uint64_t pos;
+    pos = shm->pins[(uint64_t)shm->iowner * SHM_NPINS + (pin - 1)];
+    return (gf_dtype*)(shm->data + pos - 1 + SHM_ENTRY_HEADER_SIZE);
+}
+
+static uint64_t shm_acquire_locked(shm_cache_t *shm, uint64_t irecord,
+                                   uint64_t nbytes) {
+
+    /* Look up and pin a record, return the pin handle, or 0 if it is not in
+     * the cache or cannot be pinned. */
+
+    shm_header_t *h;
+    shm_entry_t *e;
+    uint64_t pos, pos_new;
+
+    h = shm->header;
+    if (!(irecord < h->nrecords && 0 != shm->slots[irecord] &&
+            shm_entry(shm, shm->slots[irecord] - 1)->nbytes == nbytes)) {
+        h->misses++;
+        return 0;
+    }
+
+    pos = shm->slots[irecord];
+    h->hits++;
+
+    /* keep frequently used records away from the tail, the old copy is
+     * pinned meanwhile, so that it is not overwritten by the new one */
+    if ((pos - 1 + h->data_size - h->head) % h->data_size < h->data_size / 4) {
+        e = shm_entry(shm, pos - 1);
+        e->refcount++;
+        pos_new = shm_put_locked(
+            shm, irecord, shm->data + pos - 1 + SHM_ENTRY_HEADER_SIZE, nbytes);
+        e->refcount--;
+        if (0 != pos_new) {
+            pos = pos_new;
+        }
+    }
+
+    return shm_pin_locked(shm, pos);
+}
+
+static uint64_t shm_put_pinned_locked(shm_cache_t *shm, uint64_t irecord,
+                                      const void *buf, uint64_t nbytes) {
+
+    /* Insert and pin a record, return the pin handle, or 0 if it cannot be
+     * inserted. If another process has inserted the record meanwhile, that
+     * entry is used. */
+
+    uint64_t pos;
+
+    if (shm->iowner < 0) {
+        return 0;
+    }
+
+    if (irecord < shm->header->nrecords && 0 != shm->slots[irecord] &&
+            shm_entry(shm, shm->slots[irecord] - 1)->nbytes == nbytes) {
+        pos = shm->slots[irecord];
+    } else {
+        pos = shm_put_locked(shm, irecord, buf, nbytes);
+    }
+
+    if (0 == pos) {
+        return 0;
+    }
+
+    return shm_pin_locked(shm, pos);
+}
+
+static int shm_has_room(shm_cache_t *shm, uint64_t irecord, uint64_t nbytes) {
+    /* Check if the record is cached or fits into the unused space. */
+
+    shm_header_t *h;
+    int room;
+
+    if (0 != shm_lock(shm)) {
+        return 0;
+    }
+
+    h = shm->header;
+    room = (irecord < h->nrecords && 0 != shm->slots[irecord]) ||
+        h->nbytes_used + (h->nentries + 1) * SHM_ENTRY_HEADER_SIZE +
+        pad32(nbytes) <= h->data_size;
+
+    shm_unlock(shm);
+    return room;
+}
+
+static uint64_t shm_npins_locked(shm_cache_t *shm) {
+    uint64_t i, npins;
+
+    npins = 0;
+    for (i=0; i<SHM_NOWNERS * SHM_NPINS; i++) {
+        npins += 0 != shm->pins[i];
+    }
+    return npins;
+}
+
+static void shm_clear_locked(shm_cache_t *shm, uint64_t nrecords) {
+    /* Remove all unpinned entries. */
+
+    shm_header_t *h;
+    shm_entry_t *e;
+    uint64_t pos, size;
+    int pinned;
+
+    shm_reclaim_locked(shm);
+
+    h = shm->header;
+    pinned = 0;
+    for (pos=0; pos<h->hwm; pos+=size) {
+        e = shm_entry(shm, pos);
+        size = shm_entry_size(e);
+        if (SHM_FREE_ENTRY != e->irecord && e->refcount > 0) {
+            pinned = 1;
+        } else {
+            shm_evict(shm, pos);
+            shm_put_free_entry(shm, pos, pos + size);
+        }
+    }
+
+    if (!pinned) {
+        shm_reset(shm, nrecords, 1);
+    }
+}
+
+static void shm_detach(shm_cache_t *shm) {
+    if (NULL != shm->base && -1 != shm->fd && 0 == shm_lock(shm)) {
+        if (shm->iowner >= 0) {
+            shm_release_owner_locked(shm, shm->iowner);
+        }
+        shm_unlock(shm);
+    }
+    if (NULL != shm->base) {
+        munmap(shm->base, shm->nbytes);
+    }
+    if (-1 != shm->fd) {
+        close(shm->fd);
+    }
+    pthread_mutex_destroy(&shm->mutex);
+    free(shm->path);
+    free(shm);
+}
+
+static store_error_t shm_attach(
+        store_t *store, const char *path, uint64_t nbytes) {
+
+    shm_cache_t *shm;
+    struct stat st;
+    void *p;
+    uint64_t data_offset;
+    store_error_t err;
+
+    if (NULL != store->shm) {
+        shm_detach(store->shm);
+        store->shm = NULL;
+    }
+
+    shm = (shm_cache_t*)calloc(1, sizeof(shm_cache_t));
+    if (NULL == shm) {
+        return ALLOC_FAILED;
+    }
+
+    shm->fd = -1;
+    shm->pid = getpid();
+    shm->iowner = -1;
+    pthread_mutex_init(&shm->mutex, NULL);
+    shm->path = strdup(path);
+    if (NULL == shm->path) {
+        shm_detach(shm);
+        return ALLOC_FAILED;
+    }
+
+    data_offset = shm_data_offset(store->nrecords);
+
+    shm->fd = open(path, O_RDWR | O_CREAT, 0600);
+    if (-1 == shm->fd || 0 != shm_lock(shm)) {
+        shm_detach(shm);
+        return SHM_FAILED;
+    }
+
+    err = SUCCESS;
+    if (-1 == fstat(shm->fd, &st)) {
+        err = SHM_FAILED;
+    } else if (0 == st.st_size) {
+        if (nbytes < data_offset + SHM_DATA_SIZE_MIN ||
+                0 != ftruncate(shm->fd, nbytes)) {
+            err = SHM_FAILED;
+        }
+    } else {
+        /* segment exists, its size is set by whoever created it */
+        nbytes = st.st_size;
+        if (nbytes < data_offset + SHM_DATA_SIZE_MIN) {
+            err = SHM_FAILED;
+        }
+    }
+
+    if (SUCCESS == err) {
+        p = mmap(NULL, nbytes, PROT_READ | PROT_WRITE, MAP_SHARED, shm->fd, 0);
+        if (MAP_FAILED == p) {
+            err = SHM_FAILED;
+        } else {
+            shm->nbytes = nbytes;
+            shm->base = (char*)p;
+            shm->header = (shm_header_t*)p;
+            shm->owners = (int64_t*)(shm->base + SHM_HEADER_SIZE);
+            shm->pins = (uint64_t*)(shm->owners + SHM_NOWNERS);
+            shm->slots = shm->pins + SHM_NOWNERS * SHM_NPINS;
+            shm->data = shm->base + data_offset;
+
+            if (0 != memcmp(shm->header->magic, SHM_MAGIC, 8) ||
+                    shm->header->nrecords != store->nrecords ||
+                    shm->header->nbytes_total != nbytes ||
+                    shm->header->data_offset != data_offset) {
+                shm_reset(shm, store->nrecords, 0);
+            }
+
+            shm_claim_owner_locked(shm);
+            if (shm->iowner < 0) {
+                err = SHM_FAILED;
+            }
+        }
+    }
+
+    shm_unlock(shm);
+
+    if (SUCCESS != err) {
+        shm_detach(shm);
+        return err;
+    }
+
+    store->shm = shm;
+    return SUCCESS;
+}
+
+/* Process private cache of decoded records
+ *
+ * Records which cannot be served from the memory mapped traces file or from
+ * the shared memory cache are decoded into private buffers, which are kept
+ * in a cache limited to max_bytes. Records in use are pinned with a
+ * reference count and are not evicted until released; the remaining
+ * entries are evicted in LRU order. Lookups and updates are serialized by a
+ * mutex, decoding happens outside of it. With max_bytes set to zero,
+ * records are decoded on each access and freed after use. */
+
+static record_cache_t *cache_new(uint64_t nrecords, uint64_t max_bytes) {
+    record_cache_t *cache;
+
+    if (nrecords > SIZE_MAX / sizeof(cache_entry_t*)) {
+        return NULL;
+    }
+
+    cache = (record_cache_t*)calloc(1, sizeof(record_cache_t));
+    if (NULL == cache) {
+        return NULL;
+    }
+
+    cache->entries = (cache_entry_t**)calloc(
+        max(nrecords, (uint64_t)1), sizeof(cache_entry_t*));
+    if (NULL == cache->entries) {
+        free(cache);
+        return NULL;
+    }
+
+    cache->max_bytes = max_bytes;
+    pthread_mutex_init(&cache->mutex, NULL);
+    return cache;
+}
+
+static void cache_unlink(record_cache_t *cache, cache_entry_t *e) {
+    if (NULL != e->prev) {
+        e->prev->next = e->next;
+    } else {
+        cache->head = e->next;
+    }
+    if (NULL != e->next) {
+        e->next->prev = e->prev;
+    } else {
+        cache->tail = e->prev;
+    }
+    e->prev = NULL;
+    e->next = NULL;
+}
+
+static void cache_link_head(record_cache_t *cache, cache_entry_t *e) {
+    e->prev = NULL;
+    e->next = cache->head;
+    if (NULL != cache->head) {
+        cache->head->prev = e;
+    } else {
+        cache->tail = e;
+    }
+    cache->head = e;
+}
+
+static void cache_drop(record_cache_t *cache, cache_entry_t *e) {
+    cache_unlink(cache, e);
+    cache->entries[e->irecord] = NULL;
+    cache->nentries--;
+    cache->nbytes -= e->nbytes;
+    free(e->data);
+    free(e);
+}
+
+static void cache_evict_locked(record_cache_t *cache) {
+    /* Evict unpinned entries, oldest first, until within size limit. */
+
+    cache_entry_t *e, *prev;
+
+    e = cache->tail;
+    while (NULL != e && cache->nbytes > cache->max_bytes) {
+        prev = e->prev;
+        if (0 == e->refcount) {
+            cache_drop(cache, e);
+            cache->evictions++;
+        }
+        e = prev;
+    }
+}
+
+static gf_dtype *cache_acquire_locked(record_cache_t *cache,
+                                      uint64_t irecord) {
+
+    /* Get and pin a cached record, NULL if it is not in the cache. */
+
+    cache_entry_t *e;
+
+    e = cache->entries[irecord];
+    if (NULL == e) {
+        cache->misses++;
+        return NULL;
+    }
+
+    e->refcount++;
+    cache_unlink(cache, e);
+    cache_link_head(cache, e);
+    cache->hits++;
+    return e->data;
+}
+
+static gf_dtype *cache_insert_locked(
+        record_cache_t *cache, uint64_t irecord, gf_dtype *data,
+        uint64_t nbytes) {
+
+    /* Hand a freshly decoded record over to the cache and pin it. If another
+     * thread has inserted the record in the meantime, that copy is used and
+     * the new one is freed. Returns NULL if allocation fails, the record is
+     * freed in that case too. */
+
+    cache_entry_t *e;
+
+    e = cache->entries[irecord];
+    if (NULL != e) {
+        free(data);
+        cache_unlink(cache, e);
+    } else {
+        e = (cache_entry_t*)calloc(1, sizeof(cache_entry_t));
+        if (NULL == e) {
+            free(data);
+            return NULL;
+        }
+        e->data = data;
+        e->irecord = irecord;
+        e->nbytes = nbytes;
+        cache->entries[irecord] = e;
+        cache->nentries++;
+        cache->nbytes += nbytes;
+    }
+    e->refcount++;
+    cache_link_head(cache, e);
+    return e->data;
+}
+
+static void cache_release_locked(record_cache_t *cache, uint64_t irecord) {
+    cache_entry_t *e;
+
+    e = cache->entries[irecord];
+    if (NULL != e && e->refcount > 0) {
+        e->refcount--;
+    }
+}
+
+static int cache_has_room(
+        record_cache_t *cache, uint64_t irecord, uint64_t nbytes) {
+
+    /* Check if the record is cached or can be cached without evictions. */
+
+    int room;
+
+    pthread_mutex_lock(&cache->mutex);
+    room = NULL != cache->entries[irecord] ||
+        cache->nbytes + nbytes <= cache->max_bytes;
+    pthread_mutex_unlock(&cache->mutex);
+
+    return room;
+}
+
+static void cache_set_max_bytes(record_cache_t *cache, uint64_t max_bytes) {
+    pthread_mutex_lock(&cache->mutex);
+    cache->max_bytes = max_bytes;
+    cache_evict_locked(cache);
+    pthread_mutex_unlock(&cache->mutex);
+}
+
+static void cache_free(record_cache_t *cache) {
+    while (NULL != cache->head) {
+        cache_drop(cache, cache->head);
+    }
+    pthread_mutex_destroy(&cache->mutex);
+    free(cache->entries);
+    free(cache);
+}
+
+static store_error_t store_load_record(
+        const store_t *store,
+        uint64_t data_offset,
+        int32_t nsamples,
+        gf_dtype **data) {
+
+    /* Read (and decompress) a record into a freshly allocated buffer. */
+
+    size_t nbytes;
+    uint32_t nbytes_payload;
+    uint8_t *block;
+    store_error_t err;
+
+    *data = (gf_dtype*)malloc(nsamples * sizeof(gf_dtype));
+    if (NULL == *data) {
+        return ALLOC_FAILED;
+    }
+
+    if (!store->compressed) {
+        err = store_read(store, data_offset, nsamples * sizeof(gf_dtype),
+                         *data);
+
+    } else if (data_offset + GF_BLOCK_HEADER_SIZE > store->data_size) {
+        err = BAD_DATA_OFFSET;
+
+    } else if (NULL != store->data) {
+        err = store_decode(
+            (uint8_t*)store->data + data_offset,
+            store->data_size - data_offset, nsamples, *data);
+
+    } else {
+        err = store_read(store, data_offset, 4, &nbytes_payload);
+        nbytes = GF_BLOCK_HEADER_SIZE + xe32toh(nbytes_payload);
+        if (SUCCESS == err && data_offset + nbytes > store->data_size) {
+            err = BAD_DATA_OFFSET;
+        }
+        if (SUCCESS == err) {
+            block = (uint8_t*)malloc(nbytes);
+            if (NULL == block) {
+                err = ALLOC_FAILED;
+            } else {
+                err = store_read(store, data_offset, nbytes, block);
+                if (SUCCESS == err) {
+                    err = store_decode(block, nbytes, nsamples, *data);
+                }
+                free(block);
+            }
+        }
+    }
+
+    if (SUCCESS != err) {
+        free(*data);
+        *data = NULL;
+    }
+
+    return err;
+}
+
+static store_error_t store_get_direct(
+        const store_t *store,
+        uint64_t irecord,
+        trace_t *trace,
+        uint64_t *pin) {
+
+    /* Fill in a trace, as far as possible without the record caches. Sets
+     * pin to PIN_NEED if the samples must be taken from a cache. */
+
+    record_t *record;
+    uint64_t data_offset;
+
+    *pin = PIN_NONE;
+
+    if (irecord >= store->nrecords) {
+        *trace = ZERO_TRACE;
+        return INVALID_RECORD;
+    }
+
+    record = &store->records[irecord];
+    data_offset = xe64toh(record->data_offset);
+    trace->itmin = xe32toh(record->itmin);
+    trace->nsamples = xe32toh(record->nsamples);
+    trace->begin_value = fe32toh(record->begin_value);
+    trace->end_value = fe32toh(record->end_value);
+
+    if (!inlimits(trace->itmin) || !inposlimits(trace->nsamples) ||
+            data_offset >= UINT64_MAX - SLIMIT * sizeof(gf_dtype)) {
+        return BAD_RECORD;
+    }
+
+    if (REC_EMPTY == data_offset) {
+        *trace = ZERO_TRACE;
+        return EMPTY_RECORD;
+    }
+
+    if (REC_ZERO == data_offset) {
+        *trace = ZERO_TRACE;
+        trace->itmin = xe32toh(record->itmin);
+        return SUCCESS;
+    }
+
+    trace->is_zero = 0;
+
+    if (REC_SHORT == data_offset) {
+        trace->data = &record->begin_value;
+        return SUCCESS;
+    }
+
+    if (!store->compressed &&
+            data_offset + trace->nsamples*sizeof(gf_dtype) > store->data_size) {
+        *trace = ZERO_TRACE;
+        return BAD_DATA_OFFSET;
+    }
+
+    if (NULL != store->data && !store->compressed) {
+        trace->data = &store->data[data_offset/sizeof(gf_dtype)];
+        return SUCCESS;
+    }
+
+    trace->data = NULL;
+    *pin = PIN_NEED;
+    return SUCCESS;
+}
+
+static void store_release(
+        const store_t *store,
+        const uint64_t *irecords,
+        size_t n,
+        uint64_t *pins) {
+
+    /* Release records acquired with store_acquire(), taking each lock only
+     * once. */
+
+    size_t j;
+    int have_shm, have_private;
+
+    have_shm = have_private = 0;
+    for (j=0; j<n; j++) {
+        if (PIN_PRIVATE == pins[j]) {
+            have_private = 1;
+        } else if (PIN_NONE != pins[j]) {
+            have_shm = 1;
+        }
+    }
+
+    if (have_shm && NULL != store->shm && 0 == shm_lock(store->shm)) {
+        for (j=0; j<n; j++) {
+            if (PIN_PRIVATE != pins[j] && PIN_NONE != pins[j]) {
+                shm_unpin_locked(store->shm, pins[j]);
+                pins[j] = PIN_NONE;
+            }
+        }
+        shm_unlock(store->shm);
+    }
+
+    if (have_private) {
+        pthread_mutex_lock(&store->cache->mutex);
+        for (j=0; j<n; j++) {
+            if (PIN_PRIVATE == pins[j]) {
+                cache_release_locked(store->cache, irecords[j]);
+                pins[j] = PIN_NONE;
+            }
+        }
+        cache_evict_locked(store->cache);
+        pthread_mutex_unlock(&store->cache->mutex);
+    }
+}
+
+static store_error_t store_acquire(
+        const store_t *store,
+        const uint64_t *irecords,
+        const float32_t *weights,
+        size_t n,
+        trace_t *traces,
+        uint64_t *pins) {
+
+    /* Get several records at once, each lock is taken at most twice per
+     * call. Records with zero weight are skipped, weights may be NULL.
+     * Records served from a cache are pinned until given to
+     * store_release() with the pins set here. */
+
+    size_t j, nneed;
+    uint64_t pin, nbytes;
+    gf_dtype *data;
+    shm_cache_t *shm;
+    store_error_t err;
+
+    nneed = 0;
+    for (j=0; j<n; j++) {
+        pins[j] = PIN_NONE;
+    }
+
+    for (j=0; j<n; j++) {
+        if (NULL != weights && 0.0 == weights[j]) {
+            traces[j] = ZERO_TRACE;
+            continue;
+        }
+        err = store_get_direct(store, irecords[j], &traces[j], &pins[j]);
+        if (SUCCESS != err) {
+            for (j=0; j<n; j++) {
+                pins[j] = PIN_NONE;
+            }
+            return err;
+        }
+        nneed += PIN_NEED == pins[j];
+    }
+
+    if (0 == nneed) {
+        return SUCCESS;
+    }
+
+    /* shared copies are used in place */
+
+    shm = store->shm;
+    if (NULL != shm && 0 == shm_lock(shm)) {
+        for (j=0; j<n; j++) {
+            if (PIN_NEED == pins[j]) {
+                pin = shm_acquire_locked(
+                    shm, irecords[j], traces[j].nsamples * sizeof(gf_dtype));
+                if (0 != pin) {
+                    pins[j] = pin;
+                    traces[j].data = shm_pin_data(shm, pin);
+                    nneed--;
+                }
+            }
+        }
+        shm_unlock(shm);
+    }
+
+    if (0 == nneed) {
+        return SUCCESS;
+    }
+
+    pthread_mutex_lock(&store->cache->mutex);
+    for (j=0; j<n; j++) {
+        if (PIN_NEED == pins[j]) {
+            data = cache_acquire_locked(store->cache, irecords[j]);
+            if (NULL != data) {
+                pins[j] = PIN_PRIVATE;
+                traces[j].data = data;
+                nneed--;
+            }
+        }
+    }
+    pthread_mutex_unlock(&store->cache->mutex);
+
+    if (0 == nneed) {
+        return SUCCESS;
+    }
+
+    /* decode the rest, outside of any lock */
+
+    err = SUCCESS;
+    for (j=0; j<n; j++) {
+        if (PIN_NEED == pins[j]) {
+            err = store_load_record(
+                store, xe64toh(store->records[irecords[j]].data_offset),
+                traces[j].nsamples, &traces[j].data);
+            if (SUCCESS != err) {
+                break;
+            }
+            pins[j] = PIN_DECODED;
+        }
+    }
+
+    if (SUCCESS != err) {
+        for (j=0; j<n; j++) {
+            if (PIN_DECODED == pins[j]) {
+                free(traces[j].data);
+                pins[j] = PIN_NONE;
+            } else if (PIN_NEED == pins[j]) {
+                pins[j] = PIN_NONE;
+            }
+        }
+        store_release(store, irecords, n, pins);
+        return err;
+    }
+
+    if (NULL != shm && 0 == shm_lock(shm)) {
+        for (j=0; j<n; j++) {
+            if (PIN_DECODED == pins[j]) {
+                nbytes = traces[j].nsamples * sizeof(gf_dtype);
+                pin = shm_put_pinned_locked(
+                    shm, irecords[j], traces[j].data, nbytes);
+                if (0 != pin) {
+                    free(traces[j].data);
+                    pins[j] = pin;
+                    traces[j].data = shm_pin_data(shm, pin);
+                }
+            }
+        }
+        shm_unlock(shm);
+    }
+
+    pthread_mutex_lock(&store->cache->mutex);
+    for (j=0; j<n; j++) {
+        if (PIN_DECODED == pins[j]) {
+            traces[j].data = cache_insert_locked(
+                store->cache, irecords[j], traces[j].data,
+                traces[j].nsamples * sizeof(gf_dtype));
+            if (NULL == traces[j].data) {
+                err = ALLOC_FAILED;
+                pins[j] = PIN_NONE;
+            } else {
+                pins[j] = PIN_PRIVATE;
+            }
+        }
+    }
+    cache_evict_locked(store->cache);
+    pthread_mutex_unlock(&store->cache->mutex);
+
+    if (SUCCESS != err) {
+        store_release(store, irecords, n, pins);
+    }
+
+    return err;
+}
+
+static store_error_t store_get(
+        const store_t *store,
+        uint64_t irecord,
+        trace_t *trace,
+        uint64_t *pin) {
+
+    /* Get a single record, release it with store_release(). */
+
+    return store_acquire(store, &irecord, NULL, 1, trace, pin);
+}
+
+static store_error_t store_warm_up(const store_t *store, uint64_t *nbytes) {
+
+    /* Make records resident: touch all pages of memory mapped traces and
+     * decode compressed records until the record cache (or the shared
+     * memory cache, if attached) is full. */
+
+    uint64_t irecord, data_offset, pin;
+    int32_t isample, nsamples;
+    trace_t trace;
+    store_error_t err;
+    volatile gf_dtype sink;
+
+    *nbytes = 0;
+    sink = 0.0;
+    for (irecord=0; irecord<store->nrecords; irecord++) {
+        if (NULL != store->cache) {
+            data_offset = xe64toh(store->records[irecord].data_offset);
+            nsamples = xe32toh(store->records[irecord].nsamples);
+            if (data_offset > REC_SHORT && inposlimits(nsamples) &&
+                    !(NULL != store->shm ?
+                      shm_has_room(store->shm, irecord,
+                                   nsamples * sizeof(gf_dtype)) :
+                      cache_has_room(store->cache, irecord,
+                                     nsamples * sizeof(gf_dtype)))) {
+                break;
+            }
+        }
+
+        err = store_get(store, irecord, &trace, &pin);
+        if (EMPTY_RECORD == err) {
+            continue;
+        }
+        if (SUCCESS != err) {
+            return err;
+        }
+        if (!trace.is_zero) {
+            for (isample=0; isample<trace.nsamples;
+                    isample+=4096/sizeof(gf_dtype)) {
+                sink += trace.data[isample];
+            }
+            *nbytes += trace.nsamples * sizeof(gf_dtype);
+        }
+        store_release(store, &irecord, 1, &pin);
+    }
+    (void)sink;
+
+    return SUCCESS;
+}
+
+static int clipint32(int32_t lo, int32_t hi, int32_t n) {
+    return n <= lo ? lo : n >= hi ? hi : n;
+}
+
+static void trace_trim(trace_t *trace, int32_t itmin, int32_t nsamples) {
+    int32_t ilo, ihi;
+    ilo = max(itmin, trace->itmin);
+    ihi = min(itmin + nsamples, trace->itmin + trace->nsamples);
+    trace->data = (trace->nsamples == 0) ? NULL : (trace->data + (ilo - trace->itmin));
+    trace->itmin = ilo;
+    trace->nsamples = max(0, ihi - ilo);
+}
+
+static void trace_trim_sticky(trace_t *trace, int32_t itmin, int32_t nsamples) {
+    int32_t ilo, ihi;
+    ilo = clipint32(0, trace->nsamples-1, itmin-trace->itmin);
+    ihi = clipint32(1, trace->nsamples, itmin+nsamples-trace->itmin);
+    trace->itmin = trace->itmin + ilo;
+    trace->nsamples = max(0, (ihi - ilo));
+    trace->data += ilo;
+}
+
+
+static store_error_t store_sum_extent(
+            const store_t *store,
+            const uint64_t *irecords,
+            const float32_t *delays,
+            int n,
+            int32_t *nsamples_,
+            int32_t *itmin_) {
+
+    float itmin_d, itmax_d, idelay;
+    int32_t itmax, itmin, ns;
+    int ihave, is_zero, j;
+    store_error_t err;
+    itmin_d = itmax_d = 0.0;
+    itmin = 0;
+    ihave = 0;
+
+    if (n == 0) {
+        *itmin_ = 0;
+        *nsamples_ = 0;
+        return SUCCESS;
+    }
+
+    for (j=0; j<n; j++) {
+        err = store_get_span(store, irecords[j], &itmin, &ns, &is_zero);
+        if (SUCCESS != err) {
+            return err;
+        }
+
+        itmax = itmin + ns - 1;
+        idelay = delays[j]/store->deltat;
+
+        if (ihave) {
+            itmin_d = min(itmin_d, itmin + idelay);
+            itmax_d = max(itmax_d, itmax + idelay);
+        }
+        else {
+            itmin_d = itmin + idelay;
+            itmax_d = itmax + idelay;
+            ihave = 1;
+        }
+    }
+
+    *itmin_ = (int32_t) floor(itmin_d);
+    *nsamples_ = (int32_t) ceil(itmax_d) - *itmin_ + 1;
+    return SUCCESS;
+}
+
+static store_error_t store_sum(
+        const store_t *store,
+        const uint64_t *irecords,
+        const float32_t *delays,
+        const float32_t *weights,
+        int n,
+        trace_t *result) {
+
+    float32_t weight, delay;
+    trace_t trace;
+    trace_t traces[ACQUIRE_CHUNK];
+    uint64_t pins[ACQUIRE_CHUNK];
+    float32_t deltat = store->deltat;
+    gf_dtype begin_value, end_value;
+    int ilo;
+    int i, j, j0, nchunk;
+    int idelay_floor, idelay_ceil;
+    float w1, w2;
+    store_error_t err;
+    int32_t itmin;
+    int32_t nsamples;
+    gf_dtype *out;
+
+    out = result->data;
+    itmin = result->itmin;
+    nsamples = result->nsamples;
+
+    result->is_zero = 1;
+    result->begin_value = 0.0;
+    result->end_value = 0.0;
+
+    if (!inlimits(itmin) || !inposlimits(nsamples)) {
+        return BAD_REQUEST;
+    }
+
+    if (0 == n) {
+        return SUCCESS;
+    }
+
+    begin_value = 0.0;
+    end_value = 0.0;
+
+    for (j=0; j<n; j++) {
+        idelay_floor = (int)floor(delays[j]/deltat);
+        idelay_ceil = (int)ceil(delays[j]/deltat);
+        if (!inlimits(idelay_floor) || !inlimits(idelay_ceil))
+            return BAD_REQUEST;
+    }
+
+    /* records are acquired in chunks, to take the cache locks only once
+     * per chunk */
+
+    for (j0=0; j0<n; j0+=ACQUIRE_CHUNK) {
+        nchunk = min(n - j0, ACQUIRE_CHUNK);
+        err = store_acquire(store, &irecords[j0], &weights[j0], nchunk,
+                            traces, pins);
+        if (SUCCESS != err)
+            return err;
+
+        for (j=j0; j<j0+nchunk; j++) {
+
+            delay = delays[j];
+            weight = weights[j];
+            idelay_floor = (int)floor(delay/deltat);
+            idelay_ceil = (int)ceil(delay/deltat);
+
+            if (0.0 == weight) {
+                continue;
+            }
+
+            trace = traces[j-j0];
+
+            if (trace.is_zero)
+                continue;
+
+            trace_trim_sticky(&trace, itmin - idelay_ceil, nsamples + idelay_ceil - idelay_floor);
+
+            if (idelay_floor == idelay_ceil) {
+                ilo = itmin - idelay_floor - trace.itmin;
+                /*for (i=0; i<nsamples; i++) {
+                    ifloor = i + ilo;
+                    ifloor = max(0, min(ifloor, trace.nsamples-1));
+                    out[i] += fe32toh(trace.data[ifloor]) * weight;
+                } // version below is a bit faster */
+                for (i=0; i<min(-ilo,nsamples); i++) {
+                    out[i] += fe32toh(trace.data[0]) * weight;
+                }
+                for (i=max(0,-ilo); i<min(nsamples, trace.nsamples-ilo); i++) {
+                    out[i] += fe32toh(trace.data[i+ilo]) * weight;
+                }
+                for (i=max(0,trace.nsamples-ilo); i<nsamples; i++) {
+                    out[i] += fe32toh(trace.data[trace.nsamples-1]) * weight;
+                }
+            } else {
+                ilo = itmin - idelay_floor - trace.itmin;
+                /*ihi = ilo - 1;*/
+                w1 = (idelay_ceil - delay/deltat);
+                w2 = 1.0 - w1;
+                w1 *= weight;
+                w2 *= weight;
+                /* printf("- w1 %f, w2 %f\n", w1, w2); */
+                /*for (i=0; i<nsamples; i++) {
+                    ifloor = i + ilo;
+                    iceil = i + ihi;
+                    ifloor = max(0, min(ifloor, trace.nsamples-1));
+                    iceil = max(0, min(iceil, trace.nsamples-1));
+                    out[i] += fe32toh(trace.data[ifloor]) * w1;
+                    out[i] += fe32toh(trace.data[iceil]) * w2;
+                } // version below is a bit faster */
+                for (i=0; i<min(-ilo,nsamples); i++) {
+                    out[i] += fe32toh(trace.data[0]) * weight;
+                }
+                for (i=max(0,-ilo); i<min(nsamples, -ilo+1); i++) {
+                    out[i] += fe32toh(trace.data[i+ilo])*w1
+                              + fe32toh(trace.data[0])*w2;
+                }
+                for (i=max(0,-ilo+1); i<min(nsamples, trace.nsamples-ilo); i++) {
+                    out[i] += fe32toh(trace.data[i+ilo])*w1
+                              + fe32toh(trace.data[i+ilo-1])*w2;
+                }
+                for (i=max(0,trace.nsamples-ilo);
+                     i<min(nsamples, trace.nsamples-ilo+1); i++) {
+                    out[i] += fe32toh(trace.data[trace.nsamples-1]) * w1
+                              + fe32toh(trace.data[i+ilo-1])*w2;
+                }
+                for (i=max(0,trace.nsamples-ilo+1); i<nsamples; i++) {
+                    out[i] += fe32toh(trace.data[trace.nsamples-1]) * weight;
+                }
+            }
+
+            begin_value += trace.begin_value * weight;
+            end_value += trace.end_value * weight;
+        }
+
+        store_release(store, &irecords[j0], nchunk, pins);
+    }
+
+    result->is_zero = 0;
+    result->begin_value = begin_value;
+    result->end_value = end_value;
+
+    return SUCCESS;
+}
+
+static store_error_t store_sum_static(
+        const store_t *store,
+        const uint64_t *irecords,
+        const float32_t *delays,
+        const float32_t *weights,
+        int32_t it,
+        int32_t ntargets,
+        size_t nsummands,
+        size_t nsources,
+        int32_t nthreads,
+        gf_dtype *result) {
+
+    float32_t weight, delay;
+    trace_t trace;
+    trace_t traces[ACQUIRE_CHUNK];
+    uint64_t pins[ACQUIRE_CHUNK];
+    float32_t deltat = store->deltat;
+    int idelay_floor, idelay_ceil;
+    int itarget, idx, ichunk, nchunks, ntargets_chunk;
+    size_t j, j0, jbegin, jend, nacquire;
+    uint isummand, nsummands_src;
+    float w1, w2;
+    store_error_t err=SUCCESS, err_get;
+    (void) nthreads;
+
+    if (0 == nsummands || 0 == ntargets)
+        return SUCCESS;
+
+    if (!inlimits(it))
+        return BAD_REQUEST;
+
+    if (result == NULL)
+        return ALLOC_FAILED;
+
+    nsummands_src = nsummands / nsources;
+
+    /* targets are processed in chunks, the records of a chunk are acquired
+     * together, to take the cache locks only once per ACQUIRE_CHUNK
+     * records */
+    ntargets_chunk = max((size_t)1, (size_t)ACQUIRE_CHUNK / nsummands);
+    nchunks = (ntargets + ntargets_chunk - 1) / ntargets_chunk;
+
+    #if defined(_OPENMP)
+        if (nthreads == 0)
+            nthreads = omp_get_num_procs();
+
+        #pragma omp parallel \
+            shared (store, irecords, delays, weights, ntargets, nsummands, \
+                    result, it, deltat) \
+            private (j, j0, jbegin, jend, nacquire, itarget, isummand, delay, weight, \
+                     idelay_floor, idelay_ceil, idx, trace, traces, pins, w1, w2, err_get) \
+            reduction (+: err) \
+            num_threads (nthreads)
+        {
+        #pragma omp for schedule (static)
+    #endif
+        for (ichunk=0; ichunk<nchunks; ichunk++) {
+            jbegin = (size_t)ichunk * ntargets_chunk * nsummands;
+            jend = min((size_t)(ichunk + 1) * ntargets_chunk, (size_t)ntargets)
+                * nsummands;
+            for (j0=jbegin; j0<jend; j0+=ACQUIRE_CHUNK) {
+                nacquire = min(jend - j0, (size_t)ACQUIRE_CHUNK);
+                err_get = store_acquire(store, &irecords[j0], &weights[j0],
+                                        nacquire, traces, pins);
+                err += err_get;
+                if (SUCCESS != err_get)
+                    continue;
+
+                for (j=j0; j<j0+nacquire; j++) {
+                    itarget = j / nsummands;
+                    isummand = j % nsummands;
+
+                    delay = delays[isummand / nsummands_src];
+                    weight = weights[j];
+                    idelay_floor = (int) floor(delay/deltat);
+                    idelay_ceil = (int) ceil(delay/deltat);
+
+                    if (weight == 0.)
+                        continue;
+
+                    if (!inlimits(idelay_floor) || !inlimits(idelay_ceil))
+                        err += BAD_REQUEST;
+
+                    trace = traces[j-j0];
+
+                    if (trace.is_zero)
+                        continue;
+
+                    idx = it - idelay_floor - trace.itmin;
+
+                    if (idelay_floor == idelay_ceil) {
+                        result[itarget] += fe32toh(trace.data[max(0, min(idx, trace.nsamples-1))]) * weight;
+                    } else {
+                        w1 = (idelay_ceil - delay/deltat);
+                        w2 = (1.0-w1);
+                        result[itarget] += (
+                            fe32toh(trace.data[max(0, min(idx, trace.nsamples-1))]) * w1
+                            + fe32toh(trace.data[max(0, min(idx-1, trace.nsamples-1))]) * w2) * weight;
+                    }
+                }
+
+                store_release(store, &irecords[j0], nacquire, pins);
+            }
+        }
+    #if defined(_OPENMP)
+        }
+    #endif
+    if (err != SUCCESS)
+        return BAD_REQUEST;
+    return SUCCESS;
+}
+
+static void *preload_file(int fd, size_t nbytes, int *flags) {
+
+    /* Read a whole file into anonymous memory, so that it is never paged
+     * in from the filesystem later. Huge pages and locking are used if
+     * requested and possible, the respective bits in flags are cleared
+     * otherwise. */
+
+    char *p;
+    size_t nhave;
+    ssize_t nread;
+
+    p = mmap(NULL, nbytes, PROT_READ | PROT_WRITE,
+             MAP_PRIVATE | MAP_ANONYMOUS, -1, 0);
+
+    if (MAP_FAILED == p) {
+        return MAP_FAILED;
+    }
+
+#if defined(MADV_HUGEPAGE)
+    if ((*flags & PRELOAD_HUGEPAGES) && 0 != madvise(p, nbytes, MADV_HUGEPAGE)) {
+        *flags &= ~PRELOAD_HUGEPAGES;
+    }
+#else
+    *flags &= ~PRELOAD_HUGEPAGES;
+#endif
+
+    nhave = 0;
+    while (nhave < nbytes) {
+        nread = pread(fd, p+nhave, nbytes-nhave, nhave);
+        if (nread <= 0) {
+            if (-1 == nread && EINTR == errno) {
+                continue;
+            }
+            munmap(p, nbytes);
+            return MAP_FAILED;
+        }
+        nhave += nread;
+    }
+
+    mprotect(p, nbytes, PROT_READ);
+
+    if ((*flags & PRELOAD_MLOCK) && 0 != mlock(p, nbytes)) {
+        *flags &= ~PRELOAD_MLOCK;
+    }
+
+    return p;
+}
+
+static store_error_t store_init(
+        int f_index, int f_data, int preload, store_t *store) {
+
+    void *p;
+    struct stat st;
+    size_t mmap_index_size;
     int use_mmap;
+    char magic[4];
 
     use_mmap = 0;
 
@@ -780,6 +2112,15 @@ static store_error_t store_init(int f_index, int f_data, store_t *store) {
     }
 
     store->data_size = (uint64_t)st.st_size;
+
+    if (store->data_size >= GF_STORE_DATA_HEADER_SIZE) {
+        if (4 != pread(store->f_data, magic, 4, 0)) {
+            return READ_DATA_FAILED;
+        }
+        store->compressed = 0 == memcmp(
+            magic, GF_STORE_COMPRESSED_MAGIC, 4);
+    }
+
     if (store->nrecords >= (UINT64_MAX - GF_STORE_HEADER_SIZE) / sizeof(record_t)) {
         return BAD_STORE;
     }
@@ -789,9 +2130,17 @@ static store_error_t store_init(int f_index, int f_data, store_t *store) {
         return MMAP_INDEX_FAILED;
     }
 
-    p = mmap(NULL, mmap_index_size, PROT_READ, MAP_SHARED, store->f_index, 0);
-    if (MAP_FAILED == p) {
-        return MMAP_INDEX_FAILED;
+    if (preload & PRELOAD) {
+        store->preload = preload;
+        p = preload_file(store->f_index, mmap_index_size, &store->preload);
+        if (MAP_FAILED == p) {
+            return PRELOAD_FAILED;
+        }
+    } else {
+        p = mmap(NULL, mmap_index_size, PROT_READ, MAP_SHARED, store->f_index, 0);
+        if (MAP_FAILED == p) {
+            return MMAP_INDEX_FAILED;
+        }
     }
 
     store->records = (record_t*)((char*)p+GF_STORE_HEADER_SIZE);
@@ -799,24 +2148,33 @@ static store_error_t store_init(int f_index, int f_data, store_t *store) {
     /* on 32-bit systems, use mmap only if traces file is considerably smaller
      * than address space */
 
-    use_mmap = store->data_size < SIZE_MAX / 8;
+    use_mmap = store->data_size < SIZE_MAX / 8 || (preload & PRELOAD);
 
     if (use_mmap) {
         if (store->data_size >= SIZE_MAX) {
             return MMAP_TRACES_FAILED;
         }
-        p = mmap(NULL, store->data_size, PROT_READ, MAP_SHARED, store->f_data, 0);
-        if (MAP_FAILED == p) {
-            return MMAP_TRACES_FAILED;
+        if (preload & PRELOAD) {
+            p = preload_file(store->f_data, store->data_size, &store->preload);
+            if (MAP_FAILED == p) {
+                return PRELOAD_FAILED;
+            }
+        } else {
+            p = mmap(NULL, store->data_size, PROT_READ, MAP_SHARED, store->f_data, 0);
+            if (MAP_FAILED == p) {
+                return MMAP_TRACES_FAILED;
+            }
         }
 
         store->data = (gf_dtype*)p;
-    } else {
-        if (store->nrecords > SIZE_MAX) {
-            return ALLOC_FAILED;
-        }
-        store->memdata = (gf_dtype**)calloc(store->nrecords, sizeof(gf_dtype*));
-        if (NULL == store->memdata) {
+    }
+
+    /* decoded records of compressed stores are held in the record cache */
+
+    if (!use_mmap || store->compressed) {
+        store->cache = cache_new(
+            store->nrecords, RECORD_CACHE_MAX_BYTES_DEFAULT);
+        if (NULL == store->cache) {
             return ALLOC_FAILED;
         }
     }
@@ -862,7 +2220,6 @@ static void store_mapping_deinit(mapping_t *mapping) {
 
 void store_deinit(store_t *store) {
     size_t mmap_index_size;
-    uint64_t irecord;
 
     mmap_index_size = sizeof(record_t) * store->nrecords + GF_STORE_HEADER_SIZE;
     if (store->records != NULL) {
@@ -873,20 +2230,18 @@ void store_deinit(store_t *store) {
         munmap(store->data, store->data_size);
     }
 
-    if (store->memdata != NULL) {
-        for (irecord=0; irecord<store->nrecords; irecord++) {
-            if (NULL != store->memdata[irecord]) {
-                free(store->memdata[irecord]);
-                store->memdata[irecord] = NULL;
-            }
-        }
-        free(store->memdata);
+    if (store->cache != NULL) {
+        cache_free(store->cache);
     }
 
     if (store->mapping != NULL) {
         free(store->mapping);
     }
 
+    if (store->shm != NULL) {
+        shm_detach(store->shm);
+    }
+
     if (store->mapping_scheme != NULL) {
     }
 
@@ -908,14 +2263,16 @@ static void w_store_delete(void *store) {
 #endif
 
 static PyObject* w_store_init(PyObject *dummy, PyObject *args) {
-    int f_index, f_data;
+    int f_index, f_data, preload;
     store_t *store;
     store_error_t err;
 
     (void)dummy; /* silence warning */
 
-    if (!PyArg_ParseTuple(args, "ii", &f_index, &f_data)) {
-        PyErr_SetString(StoreExtError, "usage store_init(f_index, f_data)" );
+    preload = 0;
+    if (!PyArg_ParseTuple(args, "ii|i", &f_index, &f_data, &preload)) {
+        PyErr_SetString(
+            StoreExtError, "usage store_init(f_index, f_data[, preload])" );
         return NULL;
     }
 
@@ -925,7 +2282,7 @@ static PyObject* w_store_init(PyObject *dummy, PyObject *args) {
         return NULL;
     }
 
-    err = store_init(f_index, f_data, store);
+    err = store_init(f_index, f_data, preload, store);
     if (SUCCESS != err) {
         PyErr_SetString(StoreExtError, store_error_names[err]);
         store_deinit(store);
@@ -1050,7 +2407,7 @@ static PyObject* w_store_get(PyObject *dummy, PyObject *args) {
     npy_intp array_dims[1] = {0};
     unsigned long long int irecord_;
     int itmin_, nsamples_;
-    uint64_t irecord;
+    uint64_t irecord, pin;
     int32_t itmin, nsamples;
     int i;
     store_error_t err;
@@ -1080,7 +2437,7 @@ static PyObject* w_store_get(PyObject *dummy, PyObject *args) {
     }
     nsamples = nsamples_;
 
-    err = store_get(store, irecord, &trace);
+    err = store_get(store, irecord, &trace, &pin);
     if (SUCCESS != err) {
         PyErr_SetString(StoreExtError, store_error_names[err]);
         return NULL;
@@ -1096,6 +2453,7 @@ static PyObject* w_store_get(PyObject *dummy, PyObject *args) {
     for (i=0; i<trace.nsamples; i++) {
         adata[i] = fe32toh(trace.data[i]);
     }
+    store_release(store, &irecord, 1, &pin);
 
     return Py_BuildValue("Nififf", array, trace.itmin, store->deltat,
                          trace.is_zero, trace.begin_value, trace.end_value);
@@ -1548,6 +2906,71 @@ static store_error_t vicinity_function_type_b(
     return SUCCESS;
 }
 
+static store_error_t make_sum_params_single(
+        const float64_t *source_coords,
+        const float64_t *ms,
+        const float64_t *receiver_coords,
+        size_t isource,
+        size_t nsources,
+        size_t ireceiver,
+        const component_scheme_t *cscheme,
+        const mapping_scheme_t *mscheme,
+        const mapping_t *mapping,
+        interpolation_scheme_id interpolation,
+        float32_t **ws,
+        uint64_t **irecords) {
+
+    /* Fill weights and record numbers for a single source-receiver pair. */
+
+    size_t iip, nip, icomponent, isummand, nsummands, nsummands_max, iout;
+    float64_t ws_this[cscheme->ncomponents*cscheme->nsummands_max];
+    uint64_t irecord_bases[VICINITY_NIP_MAX];
+    float64_t weights_ip[VICINITY_NIP_MAX];
+    store_error_t err = SUCCESS;
+
+    nsummands_max = cscheme->nsummands_max;
+    nip = mscheme->vicinity_nip;
+
+    cscheme->make_weights(&source_coords[isource*5], &ms[isource*cscheme->nsource_terms], &receiver_coords[ireceiver*5], ws_this);
+    if (interpolation == MULTILINEAR)  {
+        err = mscheme->vicinity(
+            mapping,
+            &source_coords[isource*5],
+            &receiver_coords[ireceiver*5],
+            irecord_bases,
+            weights_ip);
+
+        for (iip=0; iip<nip; iip++) {
+            for (icomponent=0; icomponent<cscheme->ncomponents; icomponent++) {
+                iout = (ireceiver*nsources + isource)*cscheme->nsummands[icomponent]*nip;
+                nsummands = cscheme->nsummands[icomponent];
+                for (isummand=0; isummand<nsummands; isummand++) {
+                    ws[icomponent][iout+iip*nsummands+isummand] = weights_ip[iip] * ws_this[icomponent*nsummands_max + isummand];
+                    irecords[icomponent][iout+iip*nsummands+isummand] = irecord_bases[iip] + cscheme->igs[icomponent][isummand];
+                    /*printf("%d\n", iout+iip*nsummands+isummand);*/
+                }
+            }
+        }
+    } else if (interpolation == NEAREST_NEIGHBOR) {
+        err = mscheme->irecord(
+            mapping,
+            &source_coords[isource*5],
+            &receiver_coords[ireceiver*5],
+            irecord_bases);
+
+        for (icomponent=0; icomponent<cscheme->ncomponents; icomponent++) {
+            iout = (ireceiver*nsources + isource)*cscheme->nsummands[icomponent];
+            nsummands = cscheme->nsummands[icomponent];
+            for (isummand=0; isummand<nsummands; isummand++) {
+                ws[icomponent][iout+isummand] = ws_this[icomponent*nsummands_max + isummand];
+                irecords[icomponent][iout+isummand] = irecord_bases[0] + cscheme->igs[icomponent][isummand];
+            }
+        }
+    }
+
+    return err;
+}
+
 static store_error_t make_sum_params(
         const float64_t *source_coords,
         const float64_t *ms,
@@ -1562,81 +2985,209 @@ static store_error_t make_sum_params(
         float32_t **ws,
         uint64_t **irecords) {
 
-    size_t ireceiver, isource, iip, nip, icomponent, isummand, nsummands, nsummands_max, iout;
-    float64_t ws_this[cscheme->ncomponents*cscheme->nsummands_max];
-    uint64_t irecord_bases[VICINITY_NIP_MAX];
-    float64_t weights_ip[VICINITY_NIP_MAX];
+    size_t ireceiver, isource;
+    store_error_t err = SUCCESS;
+    (void) nthreads;
+
+    Py_BEGIN_ALLOW_THREADS
+    #if defined(_OPENMP)
+        if (nthreads == 0)
+            nthreads = omp_get_num_procs();
+        else if (nthreads > omp_get_num_procs()) {
+            nthreads = omp_get_num_procs();
+            printf("make_sum_params - Warning: Desired nthreads exceeds number of physical processors, falling to %d threads\n", nthreads);
+        }
+
+        #pragma omp parallel \
+            shared (source_coords, ms, receiver_coords, nsources, nreceivers, \
+                    cscheme, mscheme, mapping, interpolation, ws, irecords) \
+            private (isource) \
+            reduction (+: err) \
+            num_threads (nthreads)
+        {
+            #pragma omp for schedule (dynamic)
+    #endif
+        for (ireceiver=0; ireceiver<nreceivers; ireceiver++) {
+            for (isource=0; isource<nsources; isource++) {
+                err += make_sum_params_single(
+                    source_coords, ms, receiver_coords, isource, nsources,
+                    ireceiver, cscheme, mscheme, mapping, interpolation, ws,
+                    irecords);
+            }
+        }
+    #if defined(_OPENMP)
+        }
+    #endif
+    Py_END_ALLOW_THREADS
+    if (err != SUCCESS)
+        return INDEX_OUT_OF_BOUNDS;
+    return SUCCESS;
+}
+
+static store_error_t store_calc_timeseries_single(
+        const store_t *store,
+        const float64_t *source_coords,
+        const float64_t *ms,
+        const float32_t *delays,
+        const float64_t *receiver_coords,
+        size_t nsources,
+        const component_scheme_t *cscheme,
+        interpolation_scheme_id interpolation,
+        int32_t *itmin,
+        int32_t *nsamples,
+        int32_t nsamples_out,
+        gf_dtype *out) {
+
+    /* Stack all components for a single receiver. If *nsamples is -1, the
+     * common extent of the components is determined and written to *itmin
+     * and *nsamples. If out is not NULL, the components are stacked into
+     * consecutive rows of length nsamples_out. */
+
+    float32_t *ws[NCOMPONENTS_MAX];
+    uint64_t *irecords[NCOMPONENTS_MAX];
+    float32_t *ds[NCOMPONENTS_MAX];
+    size_t icomponent, isource, n[NCOMPONENTS_MAX], nper, i, nip;
+    int32_t itmin_c, nsamples_c, itmax, itmax_c;
+    int ihave;
+    trace_t result;
+    store_error_t err = SUCCESS;
+
+    nip = (interpolation == NEAREST_NEIGHBOR) ?
+        1 : store->mapping_scheme->vicinity_nip;
+
+    for (icomponent=0; icomponent<cscheme->ncomponents; icomponent++) {
+        n[icomponent] = nsources * cscheme->nsummands[icomponent] * nip;
+        ws[icomponent] = (float32_t*)malloc(n[icomponent]*sizeof(float32_t));
+        irecords[icomponent] = (uint64_t*)malloc(n[icomponent]*sizeof(uint64_t));
+        ds[icomponent] = (float32_t*)malloc(n[icomponent]*sizeof(float32_t));
+        if (NULL == ws[icomponent] || NULL == irecords[icomponent] ||
+                NULL == ds[icomponent]) {
+            err = ALLOC_FAILED;
+        }
+    }
+
+    for (isource=0; isource<nsources && SUCCESS == err; isource++) {
+        if (SUCCESS != make_sum_params_single(
+                source_coords, ms, receiver_coords, isource, nsources, 0,
+                cscheme, store->mapping_scheme, store->mapping,
+                interpolation, ws, irecords)) {
+            err = INDEX_OUT_OF_BOUNDS;
+        }
+
+        for (icomponent=0; icomponent<cscheme->ncomponents; icomponent++) {
+            nper = cscheme->nsummands[icomponent] * nip;
+            for (i=isource*nper; i<(isource+1)*nper; i++) {
+                ds[icomponent][i] = delays[isource];
+            }
+        }
+    }
+
+    if (SUCCESS == err && -1 == *nsamples) {
+        ihave = 0;
+        itmax = 0;
+        for (icomponent=0; icomponent<cscheme->ncomponents; icomponent++) {
+            if (0 == n[icomponent]) {
+                continue;
+            }
+            err = store_sum_extent(store, irecords[icomponent],
+                                   ds[icomponent], n[icomponent],
+                                   &nsamples_c, &itmin_c);
+            if (SUCCESS != err) {
+                break;
+            }
+
+            itmax_c = itmin_c + nsamples_c - 1;
+            if (ihave) {
+                *itmin = min(*itmin, itmin_c);
+                itmax = max(itmax, itmax_c);
+            } else {
+                *itmin = itmin_c;
+                itmax = itmax_c;
+                ihave = 1;
+            }
+        }
+        *nsamples = ihave ? itmax - *itmin + 1 : 0;
+    }
+
+    if (SUCCESS == err && NULL != out) {
+        if (*nsamples > nsamples_out) {
+            err = BAD_REQUEST;
+        }
+        for (icomponent=0; icomponent<cscheme->ncomponents && SUCCESS == err;
+                icomponent++) {
+
+            result.data = out + icomponent*nsamples_out;
+            result.itmin = *itmin;
+            result.nsamples = *nsamples;
+            memset(result.data, 0, nsamples_out*sizeof(gf_dtype));
+            err = store_sum(store, irecords[icomponent], ds[icomponent],
+                            ws[icomponent], n[icomponent], &result);
+        }
+    }
+
+    for (icomponent=0; icomponent<cscheme->ncomponents; icomponent++) {
+        free(ws[icomponent]);
+        free(irecords[icomponent]);
+        free(ds[icomponent]);
+    }
+
+    return err;
+}
+
+static store_error_t store_calc_timeseries(
+        const store_t *store,
+        const float64_t *source_coords,
+        const float64_t *ms,
+        const float32_t *delays,
+        const float64_t *receiver_coords,
+        size_t nsources,
+        size_t nreceivers,
+        const component_scheme_t *cscheme,
+        interpolation_scheme_id interpolation,
+        int32_t *itmins,
+        int32_t *nsamples,
+        int32_t nsamples_out,
+        gf_dtype *out,
+        int32_t nthreads) {
+
+    /* Batched stacking for many receivers, parallelized over receivers. */
+
+    size_t ireceiver;
+    store_error_t *errs;
     store_error_t err = SUCCESS;
     (void) nthreads;
 
-    nsummands_max = cscheme->nsummands_max;
+    errs = (store_error_t*)calloc(nreceivers + 1, sizeof(store_error_t));
+    if (NULL == errs) {
+        return ALLOC_FAILED;
+    }
 
     Py_BEGIN_ALLOW_THREADS
-    nip = mscheme->vicinity_nip;
     #if defined(_OPENMP)
         if (nthreads == 0)
             nthreads = omp_get_num_procs();
-        else if (nthreads > omp_get_num_procs()) {
-            nthreads = omp_get_num_procs();
-            printf("make_sum_params - Warning: Desired nthreads exceeds number of physical processors, falling to %d threads\n", nthreads);
-        }
 
-        #pragma omp parallel \
-            shared (source_coords, ms, receiver_coords, nsources, nreceivers, \
-                    cscheme, mscheme, mapping, interpolation, ws, irecords, nip) \
-            private (ws_this, iout, nsummands, isource, icomponent, isummand, irecord_bases, weights_ip, iip) \
-            reduction (+: err) \
-            num_threads (nthreads)
-        {
-            #pragma omp for schedule (dynamic)
-    #endif
-        for (ireceiver=0; ireceiver<nreceivers; ireceiver++) {
-            for (isource=0; isource<nsources; isource++) {
-                cscheme->make_weights(&source_coords[isource*5], &ms[isource*cscheme->nsource_terms], &receiver_coords[ireceiver*5], ws_this);
-                if (interpolation == MULTILINEAR)  {
-                    err += mscheme->vicinity(
-                        mapping,
-                        &source_coords[isource*5],
-                        &receiver_coords[ireceiver*5],
-                        irecord_bases,
-                        weights_ip);
-
-                    for (iip=0; iip<nip; iip++) {
-                        for (icomponent=0; icomponent<cscheme->ncomponents; icomponent++) {
-                            iout = (ireceiver*nsources + isource)*cscheme->nsummands[icomponent]*nip;
-                            nsummands = cscheme->nsummands[icomponent];
-                            for (isummand=0; isummand<nsummands; isummand++) {
-                                ws[icomponent][iout+iip*nsummands+isummand] = weights_ip[iip] * ws_this[icomponent*nsummands_max + isummand];
-                                irecords[icomponent][iout+iip*nsummands+isummand] = irecord_bases[iip] + cscheme->igs[icomponent][isummand];
-                                /*printf("%d\n", iout+iip*nsummands+isummand);*/
-                            }
-                        }
-                    }
-                } else if (interpolation == NEAREST_NEIGHBOR) {
-                    err += mscheme->irecord(
-                        mapping,
-                        &source_coords[isource*5],
-                        &receiver_coords[ireceiver*5],
-                        irecord_bases);
-
-                    for (icomponent=0; icomponent<cscheme->ncomponents; icomponent++) {
-                        iout = (ireceiver*nsources + isource)*cscheme->nsummands[icomponent];
-                        nsummands = cscheme->nsummands[icomponent];
-                        for (isummand=0; isummand<nsummands; isummand++) {
-                            ws[icomponent][iout+isummand] = ws_this[icomponent*nsummands_max + isummand];
-                            irecords[icomponent][iout+isummand] = irecord_bases[0] + cscheme->igs[icomponent][isummand];
-                        }
-                    }
-                }
-            }
-        }
-    #if defined(_OPENMP)
-        }
+        #pragma omp parallel for schedule (dynamic) num_threads (nthreads)
     #endif
+    for (ireceiver=0; ireceiver<nreceivers; ireceiver++) {
+        errs[ireceiver] = store_calc_timeseries_single(
+            store, source_coords, ms, delays, &receiver_coords[ireceiver*5],
+            nsources, cscheme, interpolation,
+            &itmins[ireceiver], &nsamples[ireceiver], nsamples_out,
+            (NULL == out) ?
+                NULL : out + ireceiver*cscheme->ncomponents*nsamples_out);
+    }
     Py_END_ALLOW_THREADS
-    if (err != SUCCESS)
-        return INDEX_OUT_OF_BOUNDS;
-    return SUCCESS;
+
+    for (ireceiver=0; ireceiver<nreceivers; ireceiver++) {
+        if (SUCCESS != errs[ireceiver]) {
+            err = errs[ireceiver];
+            break;
+        }
+    }
+
+    free(errs);
+    return err;
 }
 
 static PyObject* w_store_sum(PyObject *dummy, PyObject *args) {
@@ -1903,6 +3454,347 @@ static PyObject* w_make_sum_params(PyObject *dummy, PyObject *args) {
     return out_list;
 }
 
+static PyObject* w_store_calc_timeseries(PyObject *dummy, PyObject *args) {
+    PyObject *capsule, *source_coords_arr, *ms_arr, *delays_arr;
+    PyObject *receiver_coords_arr, *itmins_arr, *nsamples_arr, *out_arr;
+    npy_intp shape_want_coords[2] = {-1, 5};
+    npy_intp shape_want_ms[2] = {-1, 6};
+    npy_intp shape_want_out[3] = {-1, -1, -1};
+    char *component_scheme_name, *interpolation_scheme_name;
+    const component_scheme_t *cscheme;
+    interpolation_scheme_id interpolation;
+    size_t nsources, nreceivers;
+    int32_t nthreads, nsamples_out;
+    gf_dtype *out;
+    store_error_t err;
+    store_t *store;
+
+    (void)dummy; /* silence warning */
+
+    if (!PyArg_ParseTuple(
+            args, "OOOOOssOOOi", &capsule, &source_coords_arr, &ms_arr,
+            &delays_arr, &receiver_coords_arr, &component_scheme_name,
+            &interpolation_scheme_name, &itmins_arr, &nsamples_arr, &out_arr,
+            &nthreads)) {
+        PyErr_SetString(StoreExtError,
+            "usage: store_calc_timeseries(cstore, source_coords, moment_tensors, delays, receiver_coords, component_scheme, interpolation_name, itmins, nsamples, out, nthreads)");
+        return NULL;
+    }
+
+    store = get_store_from_capsule(capsule);
+    if (store == NULL) return NULL;
+
+    if (store->mapping_scheme == NULL) {
+        PyErr_SetString(StoreExtError, "store_calc_timeseries: no mapping scheme set on store");
+        return NULL;
+    }
+
+    cscheme = get_component_scheme(component_scheme_name);
+    if (cscheme == NULL) {
+        PyErr_SetString(StoreExtError, "store_calc_timeseries: invalid component scheme name");
+        return NULL;
+    }
+
+    interpolation = get_interpolation_scheme_id(interpolation_scheme_name);
+    if (interpolation == UNDEFINED_INTERPOLATION_SCHEME) {
+        PyErr_SetString(StoreExtError, "store_calc_timeseries: invalid interpolation scheme name");
+        return NULL;
+    }
+
+    if (!good_array(source_coords_arr, NPY_FLOAT64, -1, 2, shape_want_coords)) {
+        return NULL;
+    }
+    nsources = PyArray_DIMS((PyArrayObject*)source_coords_arr)[0];
+
+    shape_want_ms[0] = nsources;
+    shape_want_ms[1] = cscheme->nsource_terms;
+    if (!good_array(ms_arr, NPY_FLOAT64, -1, 2, shape_want_ms)) {
+        return NULL;
+    }
+
+    if (!good_array(delays_arr, NPY_FLOAT32, nsources, 1, NULL)) {
+        return NULL;
+    }
+
+    if (!good_array(receiver_coords_arr, NPY_FLOAT64, -1, 2, shape_want_coords)) {
+        return NULL;
+    }
+    nreceivers = PyArray_DIMS((PyArrayObject*)receiver_coords_arr)[0];
+
+    if (!good_array(itmins_arr, NPY_INT32, nreceivers, 1, NULL) ||
+        !good_array(nsamples_arr, NPY_INT32, nreceivers, 1, NULL)) {
+        return NULL;
+    }
+
+    if (out_arr == Py_None) {
+        out = NULL;
+        nsamples_out = 0;
+    } else {
+        shape_want_out[0] = nreceivers;
+        shape_want_out[1] = cscheme->ncomponents;
+        if (!good_array(out_arr, NPY_GFDTYPE, -1, 3, shape_want_out)) {
+            return NULL;
+        }
+        nsamples_out = PyArray_DIMS((PyArrayObject*)out_arr)[2];
+        out = PyArray_DATA((PyArrayObject*)out_arr);
+    }
+
+    err = store_calc_timeseries(
+        store,
+        PyArray_DATA((PyArrayObject*)source_coords_arr),
+        PyArray_DATA((PyArrayObject*)ms_arr),
+        PyArray_DATA((PyArrayObject*)delays_arr),
+        PyArray_DATA((PyArrayObject*)receiver_coords_arr),
+        nsources,
+        nreceivers,
+        cscheme,
+        interpolation,
+        PyArray_DATA((PyArrayObject*)itmins_arr),
+        PyArray_DATA((PyArrayObject*)nsamples_arr),
+        nsamples_out,
+        out,
+        nthreads);
+
+    if (SUCCESS != err) {
+        PyErr_SetString(StoreExtError, store_error_names[err]);
+        return NULL;
+    }
+
+    Py_RETURN_NONE;
+}
+
+static PyObject* w_store_shm_attach(PyObject *dummy, PyObject *args) {
+    PyObject *capsule;
+    store_t *store;
+    char *path;
+    unsigned long long int nbytes;
+    store_error_t err;
+
+    (void)dummy; /* silence warning */
+
+    if (!PyArg_ParseTuple(args, "OsK", &capsule, &path, &nbytes)) {
+        PyErr_SetString(StoreExtError,
+            "usage store_shm_attach(cstore, path, nbytes)");
+        return NULL;
+    }
+
+    store = get_store_from_capsule(capsule);
+    if (store == NULL)
+        return NULL;
+
+    err = shm_attach(store, path, nbytes);
+    if (SUCCESS != err) {
+        PyErr_SetString(StoreExtError, store_error_names[err]);
+        return NULL;
+    }
+
+    Py_RETURN_NONE;
+}
+
+static PyObject* w_store_shm_stats(PyObject *dummy, PyObject *args) {
+    PyObject *capsule;
+    store_t *store;
+    shm_cache_t *shm;
+    shm_header_t h;
+    uint64_t npins;
+
+    (void)dummy; /* silence warning */
+
+    if (!PyArg_ParseTuple(args, "O", &capsule)) {
+        PyErr_SetString(StoreExtError, "usage store_shm_stats(cstore)");
+        return NULL;
+    }
+
+    store = get_store_from_capsule(capsule);
+    if (store == NULL)
+        return NULL;
+
+    shm = store->shm;
+    if (NULL == shm) {
+        Py_RETURN_NONE;
+    }
+
+    if (0 != shm_lock(shm)) {
+        PyErr_SetString(StoreExtError, store_error_names[SHM_FAILED]);
+        return NULL;
+    }
+    h = *shm->header;
+    npins = shm_npins_locked(shm);
+    shm_unlock(shm);
+
+    return Py_BuildValue("KKKKKKK",
+        (unsigned long long int)h.nentries,
+        (unsigned long long int)h.nbytes_used,
+        (unsigned long long int)h.data_size,
+        (unsigned long long int)h.hits,
+        (unsigned long long int)h.misses,
+        (unsigned long long int)h.evictions,
+        (unsigned long long int)npins);
+}
+
+static PyObject* w_store_shm_clear(PyObject *dummy, PyObject *args) {
+    PyObject *capsule;
+    store_t *store;
+    shm_cache_t *shm;
+
+    (void)dummy; /* silence warning */
+
+    if (!PyArg_ParseTuple(args, "O", &capsule)) {
+        PyErr_SetString(StoreExtError, "usage store_shm_clear(cstore)");
+        return NULL;
+    }
+
+    store = get_store_from_capsule(capsule);
+    if (store == NULL)
+        return NULL;
+
+    shm = store->shm;
+    if (NULL != shm) {
+        if (0 != shm_lock(shm)) {
+            PyErr_SetString(StoreExtError, store_error_names[SHM_FAILED]);
+            return NULL;
+        }
+        shm_clear_locked(shm, store->nrecords);
+        shm_unlock(shm);
+    }
+
+    Py_RETURN_NONE;
+}
+
+static PyObject* w_store_shm_detach(PyObject *dummy, PyObject *args) {
+    PyObject *capsule;
+    store_t *store;
+
+    (void)dummy; /* silence warning */
+
+    if (!PyArg_ParseTuple(args, "O", &capsule)) {
+        PyErr_SetString(StoreExtError, "usage store_shm_detach(cstore)");
+        return NULL;
+    }
+
+    store = get_store_from_capsule(capsule);
+    if (store == NULL)
+        return NULL;
+
+    if (NULL != store->shm) {
+        shm_detach(store->shm);
+        store->shm = NULL;
+    }
+
+    Py_RETURN_NONE;
+}
+
+static PyObject* w_store_warm_up(PyObject *dummy, PyObject *args) {
+    PyObject *capsule;
+    store_t *store;
+    store_error_t err;
+    uint64_t nbytes;
+
+    (void)dummy; /* silence warning */
+
+    if (!PyArg_ParseTuple(args, "O", &capsule)) {
+        PyErr_SetString(StoreExtError, "usage store_warm_up(cstore)");
+        return NULL;
+    }
+
+    store = get_store_from_capsule(capsule);
+    if (store == NULL)
+        return NULL;
+
+    Py_BEGIN_ALLOW_THREADS
+    err = store_warm_up(store, &nbytes);
+    Py_END_ALLOW_THREADS
+
+    if (SUCCESS != err) {
+        PyErr_SetString(StoreExtError, store_error_names[err]);
+        return NULL;
+    }
+
+    return Py_BuildValue("K", (unsigned long long int)nbytes);
+}
+
+static PyObject* w_store_preload_flags(PyObject *dummy, PyObject *args) {
+    PyObject *capsule;
+    store_t *store;
+
+    (void)dummy; /* silence warning */
+
+    if (!PyArg_ParseTuple(args, "O", &capsule)) {
+        PyErr_SetString(StoreExtError, "usage store_preload_flags(cstore)");
+        return NULL;
+    }
+
+    store = get_store_from_capsule(capsule);
+    if (store == NULL)
+        return NULL;
+
+    return Py_BuildValue("i", store->preload);
+}
+
+static PyObject* w_store_set_cache_max_bytes(PyObject *dummy, PyObject *args) {
+    PyObject *capsule;
+    store_t *store;
+    unsigned long long int nbytes;
+
+    (void)dummy; /* silence warning */
+
+    if (!PyArg_ParseTuple(args, "OK", &capsule, &nbytes)) {
+        PyErr_SetString(StoreExtError,
+            "usage store_set_cache_max_bytes(cstore, nbytes)");
+        return NULL;
+    }
+
+    store = get_store_from_capsule(capsule);
+    if (store == NULL)
+        return NULL;
+
+    if (NULL != store->cache) {
+        cache_set_max_bytes(store->cache, nbytes);
+    }
+
+    Py_RETURN_NONE;
+}
+
+static PyObject* w_store_cache_stats(PyObject *dummy, PyObject *args) {
+    PyObject *capsule;
+    store_t *store;
+    record_cache_t *cache;
+    uint64_t vals[6];
+
+    (void)dummy; /* silence warning */
+
+    if (!PyArg_ParseTuple(args, "O", &capsule)) {
+        PyErr_SetString(StoreExtError, "usage store_cache_stats(cstore)");
+        return NULL;
+    }
+
+    store = get_store_from_capsule(capsule);
+    if (store == NULL)
+        return NULL;
+
+    cache = store->cache;
+    if (NULL == cache) {
+        Py_RETURN_NONE;
+    }
+
+    pthread_mutex_lock(&cache->mutex);
+    vals[0] = cache->nentries;
+    vals[1] = cache->nbytes;
+    vals[2] = cache->max_bytes;
+    vals[3] = cache->hits;
+    vals[4] = cache->misses;
+    vals[5] = cache->evictions;
+    pthread_mutex_unlock(&cache->mutex);
+
+    return Py_BuildValue("KKKKKK",
+        (unsigned long long int)vals[0],
+        (unsigned long long int)vals[1],
+        (unsigned long long int)vals[2],
+        (unsigned long long int)vals[3],
+        (unsigned long long int)vals[4],
+        (unsigned long long int)vals[5]);
+}
+
 static PyMethodDef StoreExtMethods[] = {
     {"store_init",  w_store_init, METH_VARARGS,
         "Initialize store struct." },
@@ -1922,6 +3814,33 @@ static PyMethodDef StoreExtMethods[] = {
     {"make_sum_params", w_make_sum_params, METH_VARARGS,
         "Prepare parameters for weight-and-delay-sum." },
 
+    {"store_calc_timeseries", w_store_calc_timeseries, METH_VARARGS,
+        "Stack GF traces for many receivers into a preallocated array." },
+
+    {"store_shm_attach", w_store_shm_attach, METH_VARARGS,
+        "Attach shared memory record cache." },
+
+    {"store_shm_stats", w_store_shm_stats, METH_VARARGS,
+        "Get statistics of shared memory record cache." },
+
+    {"store_shm_clear", w_store_shm_clear, METH_VARARGS,
+        "Remove all entries not in use from shared memory record cache." },
+
+    {"store_shm_detach", w_store_shm_detach, METH_VARARGS,
+        "Detach shared memory record cache." },
+
+    {"store_warm_up", w_store_warm_up, METH_VARARGS,
+        "Make all records of the store resident in memory." },
+
+    {"store_preload_flags", w_store_preload_flags, METH_VARARGS,
+        "Get effective preload flags of the store." },
+
+    {"store_set_cache_max_bytes", w_store_set_cache_max_bytes, METH_VARARGS,
+        "Set size limit of the cache of decoded records." },
+
+    {"store_cache_stats", w_store_cache_stats, METH_VARARGS,
+        "Get statistics of the cache of decoded records." },
+
     {NULL, NULL, 0, NULL}        /* Sentinel */
 };
 
@@ -490,6 +490,44 @@ class Timing(SObject):
         except spit.OutOfBounds:
             raise OutOfBounds(args)
 
+    def evaluate_many(self, get_phase_many, args):
+        '''
+        Evaluate timing for many geometries at once.
+
+        :param get_phase_many: callable returning a phase function which
+            accepts a tuple of arrays of index args and returns an array of
+            arrival times (NaN where the phase is undefined)
+        :param args: tuple of 1D arrays of index args
+        :returns: NumPy array of times, NaN where undefined
+        '''
+
+        n = args[0].size
+        if self.offset_is_slowness and self.offset != 0.0:
+            phase_offset = get_phase_many(
+                'vel_surface:%g' % (1.0/self.offset))
+            offset = phase_offset(args)
+        else:
+            offset = self.offset
+
+        if self.phase_defs:
+            times = [
+                get_phase_many(phase_def)(args) + offset
+                for phase_def in self.phase_defs]
+
+            if self.select == 'first':
+                return reduce(num.fmin, times)
+            elif self.select == 'last':
+                return reduce(num.fmax, times)
+            else:
+                result = times[0].copy()
+                for t in times[1:]:
+                    undefined = num.isnan(result)
+                    result[undefined] = t[undefined]
+
+                return result
+        else:
+            return num.zeros(n) + offset
+
     phase_defs = List.T(String.T())
     offset = Float.T(default=0.0)
     offset_is_slowness = Bool.T(default=False)
@@ -1782,7 +1820,7 @@ class ConfigTypeA(Config):
         return args[1]
 
     def get_distance(self, args):
-        return math.sqrt(args[0]**2 + args[1]**2)
+        return num.sqrt(args[0]**2 + args[1]**2)
 
     def get_source_depth(self, args):
         return args[0]
@@ -1954,7 +1992,7 @@ class ConfigTypeB(Config):
         'elastic2', 'elastic5', 'elastic8', 'elastic10', 'poroelastic10']
 
     def get_distance(self, args):
-        return math.sqrt((args[1] - args[0])**2 + args[2]**2)
+        return num.sqrt((args[1] - args[0])**2 + args[2]**2)
 
     def get_surface_distance(self, args):
         return args[2]
@@ -1,10 +1,14 @@
-from collections import defaultdict
+from collections import defaultdict, OrderedDict
 import time
 import math
 import os
 import re
 import logging
 import resource
+import hashlib
+import shutil
+import copy
+import cPickle as pickle
 
 import numpy as num
 
@@ -15,6 +19,7 @@ from pyrocko.guts_array import Array
 
 from pyrocko import moment_tensor as mt
 from pyrocko import trace, model, util
+from pyrocko.parimap import parimap
 from pyrocko.gf import meta, store, ws
 from pyrocko.orthodrome import ne_to_latlon
 from .targets import Target, StaticTarget, SatelliteTarget
@@ -1201,7 +1206,8 @@ class RectangularExplosionSource(ExplosionSource):
     def base_key(self):
         return Source.base_key(self) + (self.strike, self.dip, self.length,
                                         self.width, self.nucleation_x,
-                                        self.nucleation_y, self.velocity)
+                                        self.nucleation_y, self.velocity,
+                                        self.anchor)
 
     def discretize_basesource(self, store, target=None):
 
@@ -1517,7 +1523,17 @@ class RectangularSource(DCSource):
             self.nucleation_x,
             self.nucleation_y,
             self.velocity,
-            self.slip)
+            self.slip,
+            self.anchor,
+            self.decimation_factor,
+            self.interpolation)
+
+    def get_factor(self):
+        if self.slip is not None:
+            # amplitudes are set from slip during discretization
+            return 1.0
+
+        return DCSource.get_factor(self)
 
     def discretize_basesource(self, store, target=None):
 
@@ -1829,7 +1845,8 @@ class RingfaultSource(SourceWithMagnitude):
     discretized_source_class = meta.DiscretizedMTSource
 
     def base_key(self):
-        return Source.base_key(self) + (self.strike, self.dip, self.diameter)
+        return Source.base_key(self) + (self.strike, self.dip, self.diameter,
+                                        self.npointsources)
 
     def get_factor(self):
         return self.sign * self.moment
@@ -2287,10 +2304,16 @@ class StaticDisplacement(Rule):
     def apply_(self, target, base_statics):
         if isinstance(target, SatelliteTarget):
             los_fac = target.get_los_factors()
-            base_statics['displacement.los'] =\
-                (los_fac[:, 0] * -base_statics['displacement.d'] +
-                 los_fac[:, 1] * base_statics['displacement.e'] +
-                 los_fac[:, 2] * base_statics['displacement.n'])
+            los = (los_fac[:, 0] * -base_statics['displacement.d'] +
+                   los_fac[:, 1] * base_statics['displacement.e'] +
+                   los_fac[:, 2] * base_statics['displacement.n'])
+
+            if 'displacement.los' in base_statics:
+                # preallocated output
+                base_statics['displacement.los'][:] = los
+            else:
+                base_statics['displacement.los'] = los
+
         return base_statics
 
 
@@ -2314,112 +2337,174 @@ class OutOfBoundsContext(Object):
     components = List.T(String.T())
 
 
-def process_subrequest_dynamic(work, pshared=None):
-    engine = pshared['engine']
-    _, _, isources, itargets = work
-
-    sources = [pshared['sources'][isource] for isource in isources]
-    targets = [pshared['targets'][itarget] for itarget in itargets]
-
-    components = set()
-    for target in targets:
-        rule = engine.get_rule(sources[0], target)
-        components.update(rule.required_components(target))
-
-    try:
-        base_seismogram, tcounters = engine.base_seismogram(
-            sources[0],
-            targets[0],
-            components,
-            pshared['dsource_cache'])
-
-    except meta.OutOfBounds, e:
-        e.context = OutOfBoundsContext(
-            source=sources[0],
-            target=targets[0],
-            distance=sources[0].distance_to(targets[0]),
-            components=components)
-        raise
-
-    n_records_stacked = 0
-    t_optimize = 0.0
-    t_stack = 0.0
-    for _, tr in base_seismogram.iteritems():
-        n_records_stacked += tr.n_records_stacked
-        t_optimize += tr.t_optimize
-        t_stack += tr.t_stack
-
-    results = []
-    for isource, source in zip(isources, sources):
-        for itarget, target in zip(itargets, targets):
-            try:
-                result = engine._post_process_dynamic(
-                    base_seismogram, source, target)
-                result.n_records_stacked = n_records_stacked
-                result.n_shared_stacking = len(sources) * len(targets)
-                result.t_optimize = t_optimize
-                result.t_stack = t_stack
+def process_subrequest(work, pshared=None):
+    '''
+    Process a chunk of work in a worker process of
+    :py:meth:`LocalEngine.process`.
+
+    The engine with its open (memory-mapped) stores, the sources, the targets
+    and the discretized source cache are inherited from the parent process
+    through ``pshared``, so that only the small work descriptors and the
+    results have to be transferred between the processes.
+
+    :returns: tuple ``(kind, results)``
+    '''
+
+    kind, batch = work
+    if kind == 'dynamic':
+        results = process_dynamic(
+            batch, pshared['sources'], pshared['targets'], pshared['engine'],
+            nthreads=pshared['nthreads'],
+            dsource_cache=pshared['dsource_cache'])
+    else:
+        results = process_static(
+            batch, pshared['sources'], pshared['targets'], pshared['engine'],
+            nthreads=pshared['nthreads'])
 
-            except SeismosizerError, e:
-                result = e
+    return kind, list(results)
 
-            results.append((isource, itarget, result))
 
-    tcounters.append(xtime())
+def split_work(work, nprocs):
+    '''
+    Split work into chunks for parallel processing.
+
+    Each chunk handles a single source, so that sources are discretized only
+    once per chunk. The targets of a source are split if there are not
+    enough source-target pairs to keep ``nprocs`` processes busy.
+    '''
+
+    npairs = sum(len(isources) * len(itargets)
+                 for (_, _, isources, itargets) in work)
+
+    nchunk = max(1, npairs // (4 * nprocs))
+
+    chunks = []
+    for (i, nsub, isources, itargets) in work:
+        for isource in isources:
+            for j in xrange(0, len(itargets), nchunk):
+                chunks.append((i, nsub, [isource], itargets[j:j+nchunk]))
+
+    return chunks
 
-    return results, tcounters
 
+def batch_key(target):
+    '''
+    Get key of settings which targets must share to be stacked in one batch.
+
+    The target's ``optimization`` setting is not part of the key: batched
+    stacking in :py:meth:`pyrocko.gf.store.Store.seismograms` always sums
+    the GF records without optimization.
+    '''
+
+    return (target.store_id, target.sample_rate, target.interpolation,
+            target.tmin, target.tmax)
 
-def process_dynamic(work, psources, ptargets, engine, nthreads=0):
-    dsource_cache = {}
 
+def batch_work(work, ptargets, nbatch=None):
+    '''
+    Group work items which can be computed with batched stacking.
+
+    Work items with the same sources and with targets sharing the
+    :py:func:`batch_key` are grouped together, so that
+    :py:func:`process_dynamic` can stack them in a single call to
+    :py:meth:`LocalEngine.base_seismograms`. Groups are split into batches of
+    at most ``nbatch`` items.
+    '''
+
+    groups = OrderedDict()
     for w in work:
         _, _, isources, itargets = w
+        if itargets:
+            k = (tuple(isources), batch_key(ptargets[itargets[0]]))
+        else:
+            k = None
 
-        sources = [psources[isource] for isource in isources]
-        targets = [ptargets[itarget] for itarget in itargets]
+        groups.setdefault(k, []).append(w)
 
-        components = set()
-        for target in targets:
-            rule = engine.get_rule(sources[0], target)
-            components.update(rule.required_components(target))
+    batches = []
+    for group in groups.itervalues():
+        n = nbatch or len(group)
+        for i in xrange(0, len(group), n):
+            batches.append(group[i:i+n])
 
-        for isource, source in zip(isources, sources):
-            for itarget, target in zip(itargets, targets):
+    return batches
 
-                try:
-                    base_seismogram, tcounters = engine.base_seismogram(
-                        source, target, components, dsource_cache, nthreads)
-                except meta.OutOfBounds, e:
-                    e.context = OutOfBoundsContext(
-                        source=sources[0],
-                        target=targets[0],
-                        distance=sources[0].distance_to(targets[0]),
-                        components=components)
-                    raise
 
-                n_records_stacked = 0
-                t_optimize = 0.0
-                t_stack = 0.0
+def process_dynamic(work, psources, ptargets, engine, nthreads=0,
+                    dsource_cache=None):
 
-                for _, tr in base_seismogram.iteritems():
-                    n_records_stacked += tr.n_records_stacked
-                    t_optimize += tr.t_optimize
-                    t_stack += tr.t_stack
+    if dsource_cache is None:
+        dsource_cache = {}
 
-                try:
-                    result = engine._post_process_dynamic(
-                        base_seismogram, source, target)
-                    result.n_records_stacked = n_records_stacked
-                    result.n_shared_stacking = len(sources) *\
-                        len(targets)
-                    result.t_optimize = t_optimize
-                    result.t_stack = t_stack
-                except SeismosizerError, e:
-                    result = e
+    groups = OrderedDict()
+    for w in work:
+        _, _, isources, itargets = w
+        if not itargets:
+            continue
 
-                tcounters.append(xtime())
-                yield (isource, itarget, result), tcounters
+        k = (tuple(isources), batch_key(ptargets[itargets[0]]))
+        groups.setdefault(k, []).append(w)
+
+    for (isources, _), group in groups.iteritems():
+        sources = [psources[isource] for isource in isources]
+        targetss = [[ptargets[itarget] for itarget in w[3]] for w in group]
+
+        components = set()
+        for targets in targetss:
+            for target in targets:
+                rule = engine.get_rule(sources[0], target)
+                components.update(rule.required_components(target))
+
+        for isource, source in zip(isources, sources):
+            try:
+                if len(group) == 1:
+                    base_seismograms = [engine.base_seismogram(
+                        source, targetss[0][0], components, dsource_cache,
+                        nthreads)]
+                else:
+                    base_seismograms = engine.base_seismograms(
+                        source, [targets[0] for targets in targetss],
+                        components, dsource_cache, nthreads)
+
+            except meta.OutOfBounds, e:
+                e.context = OutOfBoundsContext(
+                    source=sources[0],
+                    target=targetss[0][0],
+                    distance=sources[0].distance_to(targetss[0][0]),
+                    components=components)
+                raise
+
+            for w, targets, (base_seismogram, tcounters_base) in zip(
+                    group, targetss, base_seismograms):
+
+                for itarget, target in zip(w[3], targets):
+                    tcounters = list(tcounters_base)
+
+                    # the base seismogram is shared, only count it once
+                    tcounters_base = [xtime()] * len(tcounters_base)
+
+                    n_records_stacked = 0
+                    t_optimize = 0.0
+                    t_stack = 0.0
+
+                    for _, tr in base_seismogram.iteritems():
+                        n_records_stacked += tr.n_records_stacked
+                        t_optimize += tr.t_optimize
+                        t_stack += tr.t_stack
+
+                    try:
+                        result = engine._post_process_dynamic(
+                            base_seismogram, source, target)
+                        result.n_records_stacked = n_records_stacked
+                        result.n_shared_stacking = len(sources) *\
+                            len(targets)
+                        result.t_optimize = t_optimize
+                        result.t_stack = t_stack
+                    except SeismosizerError, e:
+                        result = e
+
+                    tcounters.append(xtime())
+                    yield (isource, itarget, result), tcounters
 
 
 def process_static(work, psources, ptargets, engine, nthreads=0):
@@ -2451,6 +2536,219 @@ def process_static(work, psources, ptargets, engine, nthreads=0):
                 yield (isource, itarget, result), tcounters
 
 
+def unstacked_copy(base_seismogram):
+    '''
+    Copy cached base seismogram, resetting the stacking statistics.
+
+    The data arrays are shared with the cached traces.
+    '''
+
+    copied = {}
+    for k, tr in base_seismogram.iteritems():
+        tr = copy.copy(tr)
+        tr.n_records_stacked = 0
+        tr.t_optimize = 0.
+        tr.t_stack = 0.
+        copied[k] = tr
+
+    return copied
+
+
+def copy_statics(base_statics):
+    return dict((k, v.copy()) for (k, v) in base_statics.iteritems())
+
+
+class SizeBoundedCache(object):
+    '''
+    Base class for LRU caches limited by the size of the cached arrays.
+
+    Derived classes implement :py:meth:`nbytes` to estimate the size of an
+    entry. When the total size exceeds ``max_bytes``, least recently used
+    entries are evicted.
+    '''
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._nbytes = 0
+        self.clear_stats()
+
+    def nbytes(self, value):
+        raise NotImplementedError
+
+    def get(self, key):
+        try:
+            value, nbytes = self._entries.pop(key)
+        except KeyError:
+            self.misses += 1
+            return None
+
+        self._entries[key] = value, nbytes
+        self.hits += 1
+        return value
+
+    def put(self, key, value):
+        if key in self._entries:
+            _, nbytes = self._entries.pop(key)
+            self._nbytes -= nbytes
+
+        nbytes = self.nbytes(value)
+        self._entries[key] = value, nbytes
+        self._nbytes += nbytes
+        self._evict()
+
+    def set_max_bytes(self, max_bytes):
+        self.max_bytes = max_bytes
+        self._evict()
+
+    def clear(self):
+        self._entries.clear()
+        self._nbytes = 0
+
+    def clear_stats(self):
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def stats(self):
+        return dict(
+            nentries=len(self._entries),
+            nbytes=self._nbytes,
+            max_bytes=self.max_bytes,
+            hits=self.hits,
+            misses=self.misses,
+            evictions=self.evictions)
+
+    def _evict(self):
+        while self._entries and self._nbytes > self.max_bytes:
+            _, (_, nbytes) = self._entries.popitem(last=False)
+            self._nbytes -= nbytes
+            self.evictions += 1
+
+
+class DiscretizedSourceCache(SizeBoundedCache):
+    '''
+    Size-bounded cache of discretized sources.
+
+    Entries are keyed by ``(source.base_key(), store_id, store_dir)``, so
+    that sources differing only in parameters handled in post-processing
+    (origin time, amplitude) share their discretization, while the levels of
+    a store pyramid, which share the store ID, do not.
+    '''
+
+    def __init__(self, max_bytes=100*1024**2):
+        SizeBoundedCache.__init__(self, max_bytes)
+
+    def key(self, source, store_):
+        return (source.base_key(), store_.config.id, store_.store_dir)
+
+    def nbytes(self, dsource):
+        return sum(
+            v.nbytes for v in vars(dsource).itervalues()
+            if isinstance(v, num.ndarray))
+
+
+class BaseResultCache(SizeBoundedCache):
+    '''
+    Cache of base seismograms and base statics.
+
+    Entries are keyed by the base keys of source and target, the required
+    components and the identity of the GF store. Base seismograms and base
+    statics are the results of the GF stacking before post-processing, so
+    that sources differing only in parameters handled in post-processing
+    (origin time, amplitude, post-STF) and targets differing only in their
+    orientation share the cached stacks.
+
+    Besides the in-memory LRU tier, bounded by ``max_bytes``, entries are
+    optionally written to ``cachedir``, which may be shared between processes
+    and sessions. The disk tier is not size-bounded, use :py:meth:`clear`
+    with ``disk=True`` to empty it.
+    '''
+
+    def __init__(self, max_bytes=0, cachedir=None):
+        SizeBoundedCache.__init__(self, max_bytes)
+        self.cachedir = cachedir
+        self._store_fingerprints = {}
+
+    @property
+    def enabled(self):
+        return self.max_bytes > 0 or self.cachedir is not None
+
+    def _store_fingerprint(self, store_):
+        if store_.store_dir not in self._store_fingerprints:
+            st = os.stat(store_.data_fn())
+            self._store_fingerprints[store_.store_dir] = (
+                store_.config.id, st.st_size, st.st_mtime)
+
+        return self._store_fingerprints[store_.store_dir]
+
+    def key(self, store_, source, target, components):
+        k = (self._store_fingerprint(store_), source.base_key(),
+             target.base_key(), tuple(sorted(components)))
+
+        if isinstance(target, StaticTarget):
+            k += (hashlib.sha1(target.coords5.tobytes()).hexdigest(),)
+
+        return k
+
+    def nbytes(self, value):
+        return sum(
+            (v.data.nbytes if isinstance(v, store.GFTrace) else v.nbytes)
+            for v in value.itervalues())
+
+    def _path(self, key):
+        digest = hashlib.sha1(repr(key)).hexdigest()
+        return pjoin(self.cachedir, digest[:2], digest)
+
+    def get(self, key):
+        value = SizeBoundedCache.get(self, key)
+        if value is not None or self.cachedir is None:
+            return value
+
+        try:
+            with open(self._path(key), 'rb') as f:
+                key_disk, value = pickle.load(f)
+
+        except (IOError, OSError, EOFError, pickle.UnpicklingError):
+            return None
+
+        if key_disk != key:
+            return None
+
+        self.misses -= 1
+        self.disk_hits += 1
+        SizeBoundedCache.put(self, key, value)
+        return value
+
+    def put(self, key, value):
+        SizeBoundedCache.put(self, key, value)
+        if self.cachedir is None:
+            return
+
+        fn = self._path(key)
+        util.ensuredirs(fn)
+        fn_temp = '%s.%i.temp' % (fn, os.getpid())
+        with open(fn_temp, 'wb') as f:
+            pickle.dump((key, value), f, protocol=2)
+
+        os.rename(fn_temp, fn)
+
+    def clear(self, disk=False):
+        SizeBoundedCache.clear(self)
+        if disk and self.cachedir is not None \
+                and os.path.exists(self.cachedir):
+            shutil.rmtree(self.cachedir)
+
+    def clear_stats(self):
+        SizeBoundedCache.clear_stats(self)
+        self.disk_hits = 0
+
+    def stats(self):
+        d = SizeBoundedCache.stats(self)
+        d['disk_hits'] = self.disk_hits
+        return d
+
+
 class LocalEngine(Engine):
     '''
     Offline synthetic seismogram calculator.
@@ -2460,6 +2758,28 @@ class LocalEngine(Engine):
         GF_STORE_SUPERDIRS AND GF_STORE_DIRS
     :param use_config: if ``True``, fill :py:attr:`store_superdirs` and
         :py:attr:`store_dirs` with paths set in the user's config file.
+    :param dsource_cache_max_bytes: size limit of the cache of discretized
+        sources, which is kept across calls to :py:meth:`process` (``0``
+        disables the cache)
+    :param base_cache_max_bytes: size limit of the in-memory cache of base
+        seismograms and base statics (default: ``0``, disabled), see
+        :py:class:`BaseResultCache`
+    :param base_cache_dir: directory for the on-disk tier of the cache of
+        base seismograms and base statics (default: ``None``, disabled)
+    :param shm_cache_max_bytes: size of the shared memory record cache
+        attached to each opened compressed store (default: ``0``,
+        disabled), see :py:meth:`pyrocko.gf.store.BaseStore.shm_cache_stats`
+    :param preload: if ``True``, read opened stores entirely into memory
+        (default: ``False``), see :py:meth:`pyrocko.gf.store.BaseStore.warm_up`
+    :param preload_hugepages: back preloaded stores with huge pages, if
+        available
+    :param preload_mlock: lock preloaded stores in memory
+    :param record_cache_max_bytes: size limit of the cache of decoded records
+        of each opened compressed store, see
+        :py:meth:`pyrocko.gf.store.BaseStore.record_cache_stats`
+    :param resolution: default level of the GF store pyramids to use
+        (default: ``0``, full resolution), see :py:meth:`get_store` and
+        :py:meth:`pyrocko.gf.store.Store.make_pyramid`
     '''
 
     store_superdirs = List.T(
@@ -2478,6 +2798,17 @@ class LocalEngine(Engine):
     def __init__(self, **kwargs):
         use_env = kwargs.pop('use_env', False)
         use_config = kwargs.pop('use_config', False)
+        dsource_cache_max_bytes = kwargs.pop(
+            'dsource_cache_max_bytes', 100*1024**2)
+        base_cache_max_bytes = kwargs.pop('base_cache_max_bytes', 0)
+        base_cache_dir = kwargs.pop('base_cache_dir', None)
+        self._shm_cache_max_bytes = kwargs.pop('shm_cache_max_bytes', 0)
+        self._store_kwargs = dict(
+            (k, kwargs.pop(k, False)) for k in (
+                'preload', 'preload_hugepages', 'preload_mlock'))
+        self._store_kwargs['record_cache_max_bytes'] = kwargs.pop(
+            'record_cache_max_bytes', store.record_cache_max_bytes_default)
+        self._resolution = kwargs.pop('resolution', 0)
         Engine.__init__(self, **kwargs)
         if use_env:
             env_store_superdirs = os.environ.get('GF_STORE_SUPERDIRS', '')
@@ -2497,6 +2828,10 @@ class LocalEngine(Engine):
         self._id_to_store_dir = {}
         self._open_stores = {}
         self._effective_default_store_id = None
+        self._dsource_cache = DiscretizedSourceCache(
+            max_bytes=dsource_cache_max_bytes)
+        self._base_cache = BaseResultCache(
+            max_bytes=base_cache_max_bytes, cachedir=base_cache_dir)
 
     def _check_store_dirs_type(self):
         for sdir in ['store_dirs', 'store_superdirs']:
@@ -2575,27 +2910,53 @@ class LocalEngine(Engine):
 
         return self._effective_default_store_id
 
-    def get_store(self, store_id=None):
+    def get_store(self, store_id=None, resolution=None):
         '''
         Get a store from the engine.
 
         :param store_id: identifier of the store (optional)
+        :param resolution: level of the store pyramid (optional, by default
+            the engine's current resolution level, see :py:meth:`process`)
         :returns: :py:class:`pyrocko.gf.store.Store` object
 
         If no ``store_id`` is provided the store
         associated with the :py:gattr:`default_store_id` is returned.
         Raises :py:exc:`NoDefaultStoreSet` if :py:gattr:`default_store_id` is
         undefined.
+
+        With a ``resolution`` level greater than zero, the corresponding
+        coarsened sub-store of the store is returned, or the coarsest
+        available one below that level (see
+        :py:meth:`pyrocko.gf.store.Store.get_pyramid_store`).
         '''
 
         if store_id is None:
             store_id = self.effective_default_store_id()
 
+        if resolution is None:
+            resolution = self._resolution
+
         if store_id not in self._open_stores:
             store_dir = self.get_store_dir(store_id)
-            self._open_stores[store_id] = store.Store(store_dir)
+            self._open_stores[store_id] = store.Store(
+                store_dir, shm_cache_max_bytes=self._shm_cache_max_bytes,
+                **self._store_kwargs)
 
-        return self._open_stores[store_id]
+        store_ = self._open_stores[store_id]
+        if resolution:
+            return store_.get_pyramid_store(resolution)
+
+        return store_
+
+    def get_resolution_levels(self, store_id=None):
+        '''
+        Get available levels of a store pyramid.
+
+        :param store_id: identifier of the store (optional)
+        :returns: sorted list of levels, ``0`` is the full resolution store
+        '''
+
+        return self.get_store(store_id, resolution=0).get_pyramid_levels()
 
     def get_store_config(self, store_id):
         store = self.get_store(store_id)
@@ -2644,11 +3005,53 @@ class LocalEngine(Engine):
                 target.store_id,
                 source.__class__.__name__))
 
+    def get_dsource_cache_stats(self):
+        '''
+        Get statistics of the cache of discretized sources.
+
+        :returns: dict with entries ``nentries``, ``nbytes``, ``max_bytes``,
+            ``hits``, ``misses`` and ``evictions``
+        '''
+
+        return self._dsource_cache.stats()
+
+    def clear_dsource_cache(self):
+        '''
+        Remove all entries from the cache of discretized sources.
+        '''
+
+        self._dsource_cache.clear()
+
+    def get_base_cache_stats(self):
+        '''
+        Get statistics of the cache of base seismograms and base statics.
+
+        :returns: dict with entries ``nentries``, ``nbytes``, ``max_bytes``,
+            ``hits``, ``disk_hits``, ``misses`` and ``evictions``
+        '''
+
+        return self._base_cache.stats()
+
+    def clear_base_cache(self, disk=False):
+        '''
+        Remove all entries from the cache of base seismograms and statics.
+
+        :param disk: whether to also remove the on-disk tier
+        '''
+
+        self._base_cache.clear(disk=disk)
+
     def _cached_discretize_basesource(self, source, store, cache, target):
-        if (source, store) not in cache:
-            cache[source, store] = source.discretize_basesource(store, target)
+        k = self._dsource_cache.key(source, store)
+        if k not in cache:
+            dsource = self._dsource_cache.get(k)
+            if dsource is None:
+                dsource = source.discretize_basesource(store, target)
+                self._dsource_cache.put(k, dsource)
+
+            cache[k] = dsource
 
-        return cache[source, store]
+        return cache[k]
 
     def base_seismogram(self, source, target, components, dsource_cache,
                         nthreads):
@@ -2656,6 +3059,17 @@ class LocalEngine(Engine):
         tcounters = [xtime()]
 
         store_ = self.get_store(target.store_id)
+
+        base_cache_key = None
+        if self._base_cache.enabled:
+            base_cache_key = self._base_cache.key(
+                store_, source, target, components)
+
+            base_seismogram = self._base_cache.get(base_cache_key)
+            if base_seismogram is not None:
+                tcounters.extend(xtime() for _ in xrange(4))
+                return unstacked_copy(base_seismogram), tcounters
+
         receiver = target.receiver(store_)
 
         if target.tmin and target.tmax is not None:
@@ -2689,10 +3103,97 @@ class LocalEngine(Engine):
 
         base_seismogram = store.make_same_span(base_seismogram)
 
+        if base_cache_key is not None:
+            self._base_cache.put(base_cache_key, base_seismogram)
+
         tcounters.append(xtime())
 
         return base_seismogram, tcounters
 
+    def base_seismograms(self, source, targets, components, dsource_cache,
+                         nthreads):
+        '''
+        Compute base seismograms for many targets in one go.
+
+        Like :py:meth:`base_seismogram` but the GF traces for all targets are
+        stacked by a single call to
+        :py:meth:`~pyrocko.gf.store.Store.seismograms`. The targets must
+        agree in the settings given by :py:func:`batch_key`. The targets'
+        ``optimization`` setting is ignored, the GF records are always
+        stacked without optimization.
+
+        :returns: list of ``(base_seismogram, tcounters)`` tuples, one for
+            each target
+        '''
+
+        tcounters = [xtime()]
+
+        target = targets[0]
+        store_ = self.get_store(target.store_id)
+
+        results = [None] * len(targets)
+        base_cache_keys = [None] * len(targets)
+        if self._base_cache.enabled:
+            for itarget, target_ in enumerate(targets):
+                base_cache_keys[itarget] = self._base_cache.key(
+                    store_, source, target_, components)
+
+                base_seismogram = self._base_cache.get(
+                    base_cache_keys[itarget])
+
+                if base_seismogram is not None:
+                    results[itarget] = unstacked_copy(base_seismogram)
+
+        itargets = [i for (i, r) in enumerate(results) if r is None]
+        receivers = [targets[i].receiver(store_) for i in itargets]
+
+        if target.tmin and target.tmax is not None:
+            n_f = store_.config.sample_rate
+            itmin = int(num.floor(target.tmin * n_f))
+            nsamples = int(num.ceil((target.tmax - target.tmin) * n_f))
+        else:
+            itmin = None
+            nsamples = None
+
+        tcounters.append(xtime())
+
+        if itargets:
+            base_source = self._cached_discretize_basesource(
+                source, store_, dsource_cache, target)
+
+        tcounters.append(xtime())
+
+        if target.sample_rate is not None:
+            deltat = 1./target.sample_rate
+        else:
+            deltat = None
+
+        if itargets:
+            base_seismograms = store_.seismograms(
+                base_source, receivers, components,
+                deltat=deltat,
+                itmin=itmin, nsamples=nsamples,
+                interpolation=target.interpolation,
+                nthreads=nthreads)
+
+            for itarget, base_seismogram in zip(itargets, base_seismograms):
+                results[itarget] = base_seismogram
+                if base_cache_keys[itarget] is not None:
+                    # detach from the common array of the batch
+                    cached = {}
+                    for k, tr in base_seismogram.iteritems():
+                        cached[k] = copy.copy(tr)
+                        cached[k].data = tr.data.copy()
+
+                    self._base_cache.put(base_cache_keys[itarget], cached)
+
+        tcounters.append(xtime())
+        tcounters.append(xtime())
+
+        tcounters_empty = [tcounters[-1]] * len(tcounters)
+        return [(base_seismogram, tcounters if i == 0 else tcounters_empty)
+                for (i, base_seismogram) in enumerate(results)]
+
     def base_statics(self, source, target, components, nthreads):
 
         class OkadaSource(object):
@@ -2704,6 +3205,16 @@ class LocalEngine(Engine):
             tcounters = [xtime()]
             store_ = self.get_store(target.store_id)
 
+            base_cache_key = None
+            if self._base_cache.enabled:
+                base_cache_key = self._base_cache.key(
+                    store_, source, target, components)
+
+                base_statics = self._base_cache.get(base_cache_key)
+                if base_statics is not None:
+                    tcounters.extend(xtime() for _ in xrange(3))
+                    return copy_statics(base_statics), tcounters
+
             if target.tsnapshot is not None:
                 n_f = store_.config.sample_rate
                 itsnapshot = int(num.floor(target.tsnapshot * n_f))
@@ -2712,7 +3223,8 @@ class LocalEngine(Engine):
                 itsnapshot = 1
             tcounters.append(xtime())
 
-            base_source = source.discretize_basesource(store_)
+            base_source = self._cached_discretize_basesource(
+                source, store_, {}, target)
 
             tcounters.append(xtime())
 
@@ -2724,6 +3236,11 @@ class LocalEngine(Engine):
                 target.interpolation,
                 nthreads)
 
+            if base_cache_key is not None:
+                # post-processing modifies the statics in place
+                self._base_cache.put(
+                    base_cache_key, copy_statics(base_statics))
+
             tcounters.append(xtime())
 
             return base_statics, tcounters
@@ -2772,6 +3289,74 @@ class LocalEngine(Engine):
 
         return starget.post_process(self, source, base_statics)
 
+    def static_displacements(self, sources, starget, out=None, nthreads=0,
+                             max_bytes=None):
+        '''
+        Compute summed static displacements of many sources at many targets.
+
+        The discretized point sources of all ``sources`` (e.g. the patches of
+        a fault model) are scaled by their amplitude factors and combined, so
+        that the displacements at all locations of ``starget`` are computed
+        in a single batched summation, processed in chunks of targets to
+        bound the memory used by temporary arrays (see
+        :py:meth:`pyrocko.gf.store.Store.statics`). This is much faster than
+        processing the source-target pairs one by one with
+        :py:meth:`process` for large target sets, like InSAR scenes.
+
+        :param sources: list of :py:class:`Source` objects
+        :param starget: :py:class:`StaticTarget` or
+            :py:class:`SatelliteTarget` object
+        :param out: optional dict of preallocated arrays, keyed by component
+            name, to be filled with the results
+        :param nthreads: number of threads to use (``0``: all cores)
+        :param max_bytes: memory limit for temporary arrays
+        :returns: dict with arrays of the displacement components
+            ``'displacement.n'``, ``'displacement.e'``, ``'displacement.d'``
+            and, for satellite targets, ``'displacement.los'``
+        '''
+
+        if starget.quantity != 'displacement':
+            raise BadRequest(
+                'static_displacements: unsupported quantity "%s"' %
+                starget.quantity)
+
+        if not sources:
+            raise BadRequest('static_displacements: no sources given')
+
+        store_ = self.get_store(starget.store_id)
+        scheme = store_.config.component_scheme
+
+        rule = StaticDisplacement()
+        components = rule.required_components(starget)
+        for source in sources:
+            self.get_rule(source, starget)
+
+        if starget.tsnapshot is not None:
+            itsnapshot = int(num.floor(
+                starget.tsnapshot * store_.config.sample_rate))
+        else:
+            itsnapshot = 1
+
+        coords = []
+        terms = []
+        times = []
+        for source in sources:
+            dsource = self._cached_discretize_basesource(
+                source, store_, {}, starget)
+
+            coords.append(dsource.coords5())
+            terms.append(
+                dsource.get_source_terms(scheme) * source.get_factor())
+            times.append(dsource.times)
+
+        base_statics = store_.statics_raw(
+            num.vstack(coords), num.vstack(terms), num.concatenate(times),
+            starget.coords5, itsnapshot, components,
+            interpolation=starget.interpolation, nthreads=nthreads, out=out,
+            max_bytes=max_bytes)
+
+        return rule.apply_(starget, base_statics)
+
     def process(self, *args, **kwargs):
         '''
         Process a request.
@@ -2785,6 +3370,29 @@ class LocalEngine(Engine):
         The request can be given a a :py:class:`Request` object, or such an
         object is created using ``Request(**kwargs)`` for convenience.
 
+        The following keyword arguments control parallel processing:
+
+        ``nprocs``
+            Number of worker processes (default: 1). The source-target pairs
+            are distributed in chunks among the processes, which share the
+            open stores and the discretized sources with the calling
+            process. Results are returned in request order.
+
+        ``nthreads``
+            Number of threads used in the stacking routines of each process.
+            By default, 1 if multiple processes are used, otherwise
+            ``nprocs``, so that requests which cannot be split (e.g. a single
+            source and target) still make use of the requested cores.
+
+        The following keyword argument selects the GF stores to use:
+
+        ``resolution``
+            Level of the GF store pyramids (default: the engine's
+            ``resolution``, usually ``0``, full resolution). Coarse levels
+            can be used in early iterations of coarse-to-fine optimizations.
+            If a store has no pyramid level as coarse as requested, its
+            coarsest available level is used.
+
         :returns: :py:class:`Response` object
         '''
 
@@ -2800,14 +3408,25 @@ class LocalEngine(Engine):
         request = kwargs.pop('request', None)
         status_callback = kwargs.pop('status_callback', None)
 
-        nprocs = kwargs.pop('nprocs', None)
-        nthreads = kwargs.pop('nthreads', 1)
-        if nprocs:
-            nthreads = nprocs
+        nprocs = kwargs.pop('nprocs', None) or 1
+        nthreads = kwargs.pop('nthreads', None)
+        resolution = kwargs.pop('resolution', None)
 
         if request is None:
             request = Request(**kwargs)
 
+        if resolution is None:
+            return self._process(request, status_callback, nprocs, nthreads)
+
+        resolution_saved = self._resolution
+        try:
+            self._resolution = resolution
+            return self._process(request, status_callback, nprocs, nthreads)
+        finally:
+            self._resolution = resolution_saved
+
+    def _process(self, request, status_callback, nprocs, nthreads):
+
         rs0 = resource.getrusage(resource.RUSAGE_SELF)
         rc0 = resource.getrusage(resource.RUSAGE_CHILDREN)
         tt0 = xtime()
@@ -2834,43 +3453,78 @@ class LocalEngine(Engine):
         nsub = len(skeys)
         isub = 0
 
-        # Processing dynamic targets through
-        # parimap(process_subrequest_dynamic)
+        work = []
         if request.has_dynamic:
-            work_dynamic = [
+            work.append(('dynamic', [
                 (i, nsub,
                  [source_index[source] for source in m[k][0]],
                  [target_index[target] for target in m[k][1]
                   if not isinstance(target, StaticTarget)])
-                for (i, k) in enumerate(skeys)]
-
-            for ii_results, tcounters_dyn in process_dynamic(
-              work_dynamic, request.sources, request.targets, self,
-              nthreads=nthreads):
-
-                tcounters_dyn_list.append(num.diff(tcounters_dyn))
-                isource, itarget, result = ii_results
-                results_list[isource][itarget] = result
+                for (i, k) in enumerate(skeys)]))
 
-                if status_callback:
-                    status_callback(isub, nsub)
-
-                isub += 1
-
-        # Processing static targets through process_static
         if request.has_statics:
-            work_static = [
+            work.append(('static', [
                 (i, nsub,
                  [source_index[source] for source in m[k][0]],
                  [target_index[target] for target in m[k][1]
                   if isinstance(target, StaticTarget)])
-                for (i, k) in enumerate(skeys)]
+                for (i, k) in enumerate(skeys)]))
+
+        tasks = []
+        for kind, work_kind in work:
+            if nprocs > 1:
+                work_kind = split_work(work_kind, nprocs)
+                nbatch = max(1, len(work_kind) // (4 * nprocs))
+            else:
+                nbatch = None
 
-            for ii_results, tcounters_static in process_static(
-              work_static, request.sources, request.targets, self,
-              nthreads=nthreads):
+            if kind == 'dynamic':
+                tasks.extend(
+                    (kind, batch) for batch in batch_work(
+                        work_kind, request.targets, nbatch))
+            else:
+                tasks.extend((kind, [w]) for w in work_kind)
+
+        # if the request cannot be split, use threads in the stacking
+        # routines instead of processes
+        nprocs_eff = min(nprocs, len(tasks))
+        if nthreads is None:
+            nthreads = nprocs if nprocs_eff <= 1 else 1
+
+        pshared = dict(
+            engine=self,
+            sources=request.sources,
+            targets=request.targets,
+            dsource_cache={},
+            nthreads=nthreads)
+
+        if nprocs_eff > 1:
+            # discretize in this process, so that the discretized sources end
+            # up in the engine's cache and are shared with all workers
+            for sources, targets in m.itervalues():
+                for store_id in set(target.store_id for target in targets):
+                    store_ = self.get_store(store_id)
+                    for source in sources:
+                        self._cached_discretize_basesource(
+                            source, store_, pshared['dsource_cache'],
+                            targets[0])
+
+            task_results = parimap(
+                process_subrequest, tasks,
+                nprocs=nprocs_eff,
+                pshared=pshared,
+                eprintignore=(meta.OutOfBounds, SeismosizerError))
+        else:
+            task_results = (
+                process_subrequest(task, pshared=pshared) for task in tasks)
+
+        for kind, results in task_results:
+            for ii_results, tcounters in results:
+                if kind == 'dynamic':
+                    tcounters_dyn_list.append(num.diff(tcounters))
+                else:
+                    tcounters_static_list.append(num.diff(tcounters))
 
-                tcounters_static_list.append(num.diff(tcounters_static))
                 isource, itarget, result = ii_results
                 results_list[isource][itarget] = result
 
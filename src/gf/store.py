@@ -9,6 +9,9 @@ import fcntl
 import copy
 import logging
 import re
+import zlib
+import hashlib
+import tempfile
 
 import numpy as num
 from scipy import signal
@@ -43,6 +46,30 @@ gf_record_dtype = num.dtype([
     ('end_value', E + 'f4'),
 ])
 
+# header at the start of the traces file, zero-filled for uncompressed stores
+gf_store_data_header_fmt = E + '4sIf20x'
+gf_store_data_header_fmt_size = struct.calcsize(gf_store_data_header_fmt)
+gf_store_compressed_magic = 'GFZC'
+
+gf_store_compressions = {
+    'deflate': 1,
+}
+
+# header preceding each record in the traces file of compressed stores
+gf_block_header_fmt = E + 'IIf'
+gf_block_header_fmt_size = struct.calcsize(gf_block_header_fmt)
+
+gf_codec_deflate = 1
+gf_codec_deflate_quantized = 2
+
+# flags for store_ext.store_init, see BaseStore.__init__
+store_preload = 1
+store_preload_hugepages = 2
+store_preload_mlock = 4
+
+# default size limit of the cache of decoded records of compressed stores
+record_cache_max_bytes_default = 512*1024**2
+
 
 def valid_string_id(s):
     return re.match(meta.StringID.pattern, s)
@@ -253,6 +280,150 @@ class NoSuchPhase(StoreError):
                'Running "fomosto ttt" may be needed.' % self.value
 
 
+def _shuffle(raw, n):
+    return num.fromstring(raw, dtype=num.uint8).reshape((n, 4)).T.tostring()
+
+
+def _unshuffle(raw, n):
+    return num.fromstring(raw, dtype=num.uint8).reshape((4, n)).T.tostring()
+
+
+def _encode_record(data, tolerance):
+    '''
+    Compress GF trace samples for storage in a compressed store.
+
+    Returns the block to be written to the traces file and the samples as
+    they will be seen when reading them back. If ``tolerance`` is zero,
+    compression is lossless: differences of the samples' bit patterns are
+    deflated. Otherwise samples are quantized with a step size such that
+    the error is at most ``tolerance`` times the peak amplitude of the trace
+    and the differences of the quantized values are deflated.
+    '''
+
+    data = num.asarray(data, dtype=gf_dtype)
+    n = data.size
+    peak = num.max(num.abs(data))
+
+    codec = gf_codec_deflate
+    step = num.float32(0.0)
+    bits = data.astype(gf_dtype_store).view(E + 'u4')
+    values = bits.copy()
+    values[1:] -= bits[:-1]
+    if tolerance > 0.0 and peak > 0.0:
+        step = num.float32(2.0 * tolerance * peak)
+        iq = num.round(data / num.float64(step)).astype(num.int64)
+        diq = num.diff(iq)
+        if iq.size > 0 and \
+                max(abs(iq[0]), num.max(num.abs(diq))) < 2**31:
+
+            codec = gf_codec_deflate_quantized
+            values = num.empty(n, dtype=E + 'i4')
+            values[0] = iq[0]
+            values[1:] = diq
+            data = (iq.astype(num.float64) * num.float64(step)).astype(
+                gf_dtype)
+
+    payload = zlib.compress(_shuffle(values.tostring(), n), 6)
+    block = struct.pack(gf_block_header_fmt, len(payload), codec, step) \
+        + payload
+
+    return block, data
+
+
+def _decode_record(block):
+    '''
+    Decompress GF trace samples from a compressed store record block.
+    '''
+
+    nbytes, codec, step = struct.unpack(
+        gf_block_header_fmt, block[:gf_block_header_fmt_size])
+
+    payload = block[gf_block_header_fmt_size:gf_block_header_fmt_size+nbytes]
+    if len(payload) != nbytes:
+        raise ShortRead()
+
+    raw = zlib.decompress(payload)
+    raw = _unshuffle(raw, len(raw) // 4)
+
+    if codec == gf_codec_deflate:
+        bits = num.cumsum(num.fromstring(raw, dtype=E + 'u4'),
+                          dtype=num.uint32)
+        return bits.view(gf_dtype).copy()
+
+    elif codec == gf_codec_deflate_quantized:
+        iq = num.cumsum(num.fromstring(raw, dtype=E + 'i4'), dtype=num.int64)
+        return (iq.astype(num.float64) * num.float64(step)).astype(gf_dtype)
+
+    else:
+        raise StoreError('unknown record codec: %i' % codec)
+
+
+def _interleave_bits(x, nbits):
+    key = num.zeros(x.shape[0], dtype=num.uint64)
+    for ibit in xrange(nbits-1, -1, -1):
+        for idim in xrange(x.shape[1]):
+            key = (key << num.uint64(1)) | \
+                ((x[:, idim] >> num.uint64(ibit)) & num.uint64(1))
+
+    return key
+
+
+def space_filling_curve_keys(indices, curve='hilbert'):
+    '''
+    Get positions of grid nodes along a space-filling curve.
+
+    :param indices: integer grid indices, shape ``(npoints, ndims)``
+    :param curve: ``'hilbert'`` or ``'morton'`` (Z-order)
+    :returns: keys which, when sorted, give the nodes in curve order
+
+    The Hilbert keys are computed with Skilling's transpose algorithm
+    (J. Skilling, Programming the Hilbert curve, AIP Conf. Proc. 707, 2004).
+    '''
+
+    x = num.array(indices, dtype=num.uint64, ndmin=2)
+    npoints, ndims = x.shape
+    nbits = max(1, int(num.max(x)).bit_length()) if x.size else 1
+    if nbits * ndims > 64:
+        raise StoreError('grid too large for space-filling curve keys')
+
+    if curve == 'morton':
+        return _interleave_bits(x, nbits)
+
+    elif curve != 'hilbert':
+        raise StoreError('unknown space-filling curve: %s' % curve)
+
+    one = num.uint64(1)
+    m = one << num.uint64(nbits - 1)
+
+    q = m
+    while q > one:
+        p = q - one
+        for idim in xrange(ndims):
+            mask = (x[:, idim] & q) != 0
+            x[mask, 0] ^= p
+            nmask = ~mask
+            t = (x[nmask, 0] ^ x[nmask, idim]) & p
+            x[nmask, 0] ^= t
+            x[nmask, idim] ^= t
+
+        q >>= one
+
+    for idim in xrange(1, ndims):
+        x[:, idim] ^= x[:, idim-1]
+
+    t = num.zeros(npoints, dtype=num.uint64)
+    q = m
+    while q > one:
+        mask = (x[:, ndims-1] & q) != 0
+        t[mask] ^= q - one
+        q >>= one
+
+    for idim in xrange(ndims):
+        x[:, idim] ^= t
+
+    return _interleave_bits(x, nbits)
+
+
 def remove_if_exists(fn, force=False):
     if os.path.exists(fn):
         if force:
@@ -272,7 +443,15 @@ class BaseStore(object):
         return os.path.join(store_dir, 'traces')
 
     @staticmethod
-    def create(store_dir, deltat, nrecords, force=False):
+    def create(store_dir, deltat, nrecords, force=False, compression=None,
+               tolerance=0.0):
+
+        if compression is not None and \
+                compression not in gf_store_compressions:
+            raise CannotCreate('unknown compression: %s' % compression)
+
+        if not (0.0 <= tolerance < 1.0):
+            raise CannotCreate('tolerance must be in the range [0, 1)')
 
         try:
             util.ensuredir(store_dir)
@@ -291,18 +470,34 @@ class BaseStore(object):
             records.tofile(f)
 
         with open(data_fn, 'wb') as f:
-            f.write('\0' * 32)
-
-    def __init__(self, store_dir, mode='r', use_memmap=True):
+            if compression is None:
+                f.write('\0' * gf_store_data_header_fmt_size)
+            else:
+                f.write(struct.pack(
+                    gf_store_data_header_fmt, gf_store_compressed_magic,
+                    gf_store_compressions[compression], tolerance))
+
+    def __init__(self, store_dir, mode='r', use_memmap=True,
+                 shm_cache_max_bytes=0, preload=False, preload_hugepages=False,
+                 preload_mlock=False,
+                 record_cache_max_bytes=record_cache_max_bytes_default):
         assert mode in 'rw'
         self.store_dir = store_dir
         self.mode = mode
         self._use_memmap = use_memmap
+        self._shm_cache_max_bytes = shm_cache_max_bytes
+        self._record_cache_max_bytes = record_cache_max_bytes
+        self._preload = preload
+        self._preload_hugepages = preload_hugepages
+        self._preload_mlock = preload_mlock
+        self._preload_flags = 0
         self._nrecords = None
         self._deltat = None
         self._f_index = None
         self._f_data = None
         self._end_values = None
+        self._compression = None
+        self._tolerance = 0.0
         self.cstore = None
 
     def open(self):
@@ -323,12 +518,28 @@ class BaseStore(object):
             self.mode = ''
             raise CannotOpen('cannot open gf store: %s' % self.store_dir)
 
+        flags = 0
+        if self.mode == 'r' and self._preload:
+            flags = store_preload | \
+                (0, store_preload_hugepages)[bool(self._preload_hugepages)] | \
+                (0, store_preload_mlock)[bool(self._preload_mlock)]
+
         try:
             self.cstore = store_ext.store_init(
-                self._f_index.fileno(), self._f_data.fileno())
+                self._f_index.fileno(), self._f_data.fileno(), flags)
         except store_ext.StoreExtError, e:
             raise StoreError(str(e))
 
+        store_ext.store_set_cache_max_bytes(
+            self.cstore, int(self._record_cache_max_bytes))
+
+        self._preload_flags = store_ext.store_preload_flags(self.cstore)
+        if flags & store_preload_mlock and \
+                not self._preload_flags & store_preload_mlock:
+            logger.warn(
+                'cannot lock preloaded gf store %s in memory (check '
+                'RLIMIT_MEMLOCK)' % self.store_dir)
+
         while True:
             try:
                 dataheader = self._f_index.read(gf_store_header_fmt_size)
@@ -345,8 +556,147 @@ class BaseStore(object):
         self._nrecords = nrecords
         self._deltat = deltat
 
+        self._read_data_header()
         self._load_index()
 
+        # records of uncompressed stores are used in place from the memory
+        # mapped traces file, which the page cache already shares between
+        # processes
+        if self.mode == 'r' and self._shm_cache_max_bytes and \
+                self._compression:
+            try:
+                store_ext.store_shm_attach(
+                    self.cstore, self._shm_cache_path(),
+                    int(self._shm_cache_max_bytes))
+            except store_ext.StoreExtError, e:
+                logger.warn(
+                    'cannot attach shared memory cache to gf store %s: %s' % (
+                        self.store_dir, e))
+
+    @property
+    def preloaded(self):
+        '''
+        ``True`` if the store is held in memory, see :py:meth:`warm_up`.
+        '''
+
+        if not self._f_index:
+            self.open()
+
+        return bool(self._preload_flags & store_preload)
+
+    def warm_up(self):
+        '''
+        Make the records of the store resident in memory.
+
+        Touches all pages of the traces file, so that subsequent calls to
+        :py:meth:`sum` do not pay for first access. Records of compressed
+        stores are decoded only until the cache of decoded records is full
+        (see ``record_cache_max_bytes``, :py:meth:`record_cache_stats`).
+        With ``preload=True`` given to the constructor, the
+        index and traces files are read into (optionally locked, huge page
+        backed) anonymous memory when the store is opened, and the store does
+        not touch the filesystem after that. Use the ``size_preload`` entry of
+        :py:meth:`stats` to estimate the memory needed.
+
+        :returns: number of bytes of sample data made resident
+        '''
+
+        if not self._f_index:
+            self.open()
+
+        try:
+            return store_ext.store_warm_up(self.cstore)
+        except store_ext.StoreExtError, e:
+            raise StoreError(str(e))
+
+    def _shm_cache_name(self):
+        h = hashlib.sha1()
+        h.update(os.path.abspath(self.store_dir))
+        for fn in (self.index_fn(), self.data_fn()):
+            st = os.stat(fn)
+            h.update('%i %r' % (st.st_size, st.st_mtime))
+
+        h.update('%i' % self._nrecords)
+        return 'pyrocko-gf-' + h.hexdigest()
+
+    def _shm_cache_path(self):
+        if os.path.isdir('/dev/shm'):
+            dpath = '/dev/shm'
+        else:
+            dpath = tempfile.gettempdir()
+
+        return os.path.join(dpath, self._shm_cache_name())
+
+    def record_cache_stats(self):
+        '''
+        Get statistics of the cache of decoded records.
+
+        Decoded records of compressed stores are kept in a process private
+        cache of at most ``record_cache_max_bytes``, given to the
+        constructor. Records in use are never evicted, so the limit may be
+        exceeded by these for the duration of a call.
+
+        :returns: dict with keys ``nentries``, ``nbytes``, ``max_bytes``,
+            ``hits``, ``misses`` and ``evictions``, or ``None`` if the store
+            does not need the cache
+        '''
+
+        if not self._f_index:
+            self.open()
+
+        vals = store_ext.store_cache_stats(self.cstore)
+        if vals is None:
+            return None
+
+        return dict(zip(
+            'nentries nbytes max_bytes hits misses evictions'.split(), vals))
+
+    def shm_cache_stats(self):
+        '''
+        Get statistics of the shared memory record cache.
+
+        With ``shm_cache_max_bytes`` given to the constructor, decoded
+        records of compressed stores are kept in a shared memory segment and
+        used in place by all processes opening the same store. Records in
+        use are pinned and not evicted until released at the end of the
+        call using them. Uncompressed stores do not use the cache.
+
+        :returns: dict with keys ``nentries``, ``nbytes``, ``max_bytes``,
+            ``hits``, ``misses``, ``evictions`` and ``npins``, or ``None``
+            if no cache is attached. The counters are shared by all
+            processes using the cache.
+        '''
+
+        if not self._f_index:
+            self.open()
+
+        vals = store_ext.store_shm_stats(self.cstore)
+        if vals is None:
+            return None
+
+        return dict(zip(
+            'nentries nbytes max_bytes hits misses evictions npins'.split(),
+            vals))
+
+    def clear_shm_cache(self, unlink=False):
+        '''
+        Remove all records not in use from the shared memory record cache.
+
+        Pins held by processes which do not exist anymore, e.g. killed
+        workers, are released first.
+
+        :param unlink: also detach from the cache and remove its backing file
+        '''
+
+        if not self._f_index:
+            self.open()
+
+        store_ext.store_shm_clear(self.cstore)
+        if unlink:
+            store_ext.store_shm_detach(self.cstore)
+            self._shm_cache_max_bytes = 0
+            remove_if_exists(self._shm_cache_path(), force=True)
+
     def __del__(self):
         if self.mode != '':
             self.close()
@@ -567,16 +917,21 @@ class BaseStore(object):
             return
 
         ndata = trace.data.size
+        data = trace.data
 
         if ndata > 2:
             self._f_data.seek(0, 2)
             ipos = self._f_data.tell()
-            trace.data.astype(gf_dtype_store).tofile(self._f_data)
+            if self._compression:
+                block, data = _encode_record(data, self._tolerance)
+                self._f_data.write(block)
+            else:
+                data.astype(gf_dtype_store).tofile(self._f_data)
         else:
             ipos = 2
 
         self._records[irecord] = (ipos, trace.itmin, ndata,
-                                  trace.data[0], trace.data[-1])
+                                  data[0], data[-1])
 
     def _sum_impl_alternative(self, irecords, delays, weights, itmin, nsamples,
                               decimate):
@@ -894,7 +1249,7 @@ class BaseStore(object):
             self.cstore, irecords, delays, weights, it, ntargets, nthreads)
 
     def _load_index(self):
-        if self._use_memmap:
+        if self._use_memmap and not self._preload_flags & store_preload:
             records = num.memmap(
                 self._f_index, dtype=gf_record_dtype,
                 offset=gf_store_header_fmt_size,
@@ -929,6 +1284,18 @@ class BaseStore(object):
                 data_orig[0] = begin_value
                 data_orig[1] = end_value
                 return data_orig[ilo:ihi]
+            elif self._compression:
+                self._f_data.seek(int(ipos))
+                header = self._f_data.read(gf_block_header_fmt_size)
+                if len(header) != gf_block_header_fmt_size:
+                    raise ShortRead()
+
+                nbytes = struct.unpack(gf_block_header_fmt, header)[0]
+                arr = _decode_record(header + self._f_data.read(nbytes))
+                if arr.size < ihi:
+                    raise ShortRead()
+
+                return arr[ilo:ihi]
             else:
                 self._f_data.seek(
                     int(ipos + ilo*gf_dtype_nbytes_per_sample))
@@ -941,6 +1308,153 @@ class BaseStore(object):
         else:
             return num.empty((0,), dtype=gf_dtype)
 
+    def _read_data_header(self):
+        self._f_data.seek(0)
+        header = self._f_data.read(gf_store_data_header_fmt_size)
+        self._compression = None
+        self._tolerance = 0.0
+        if len(header) == gf_store_data_header_fmt_size:
+            magic, compression_id, tolerance = struct.unpack(
+                gf_store_data_header_fmt, header)
+
+            if magic == gf_store_compressed_magic:
+                for k, v in gf_store_compressions.iteritems():
+                    if v == compression_id:
+                        self._compression = k
+                        self._tolerance = float(tolerance)
+                        break
+                else:
+                    raise StoreError(
+                        'unknown compression in gf store: %s' %
+                        self.store_dir)
+
+    @property
+    def compression(self):
+        '''
+        Compression of the store's traces file (``None`` or ``'deflate'``).
+        '''
+
+        if not self._f_index:
+            self.open()
+
+        return self._compression
+
+    @property
+    def tolerance(self):
+        '''
+        Relative error bound of lossy compressed stores (zero if lossless).
+        '''
+
+        if not self._f_index:
+            self.open()
+
+        return self._tolerance
+
+    def _record_nbytes(self, irecord):
+        ipos, _, nsamples, _, _ = self._records[irecord]
+        if ipos <= 2:
+            return 0
+
+        elif self._compression:
+            self._f_data.seek(int(ipos))
+            header = self._f_data.read(gf_block_header_fmt_size)
+            if len(header) != gf_block_header_fmt_size:
+                raise ShortRead()
+
+            return gf_block_header_fmt_size + struct.unpack(
+                gf_block_header_fmt, header)[0]
+
+        else:
+            return int(nsamples) * gf_dtype_nbytes_per_sample
+
+    def rewrite_data(self, order, show_progress=False):
+        '''
+        Rewrite the traces file with the records laid out in given order.
+
+        The record data is copied unchanged (also for compressed stores), only
+        the data offsets in the index are updated. Unreferenced data in the
+        traces file is dropped on the way. New index and traces files are
+        written next to the old ones and then renamed into place, so that
+        processes still having the store open continue to see the old
+        files.
+
+        :param order: permutation of the record numbers
+        :param show_progress: Show progress, defaults to False
+        '''
+
+        if not self._f_index:
+            self.open()
+
+        if self.mode != 'r':
+            raise StoreError('store must be open in read mode for rewrite')
+
+        order = num.asarray(order, dtype=num.int64)
+        if not num.all(num.sort(order) == num.arange(self._nrecords)):
+            raise StoreError('order is not a permutation of the records')
+
+        records = num.array(self._records)
+        index_fn_tmp = self.index_fn() + '-rewrite'
+        data_fn_tmp = self.data_fn() + '-rewrite'
+
+        if show_progress:
+            pbar = util.progressbar('rewriting traces', self._nrecords)
+
+        with open(data_fn_tmp, 'wb') as f:
+            self._f_data.seek(0)
+            f.write(self._f_data.read(gf_store_data_header_fmt_size))
+            for i, irecord in enumerate(order):
+                nbytes = self._record_nbytes(irecord)
+                if nbytes > 0:
+                    ipos = records[irecord]['data_offset']
+                    self._f_data.seek(int(ipos))
+                    buf = self._f_data.read(nbytes)
+                    if len(buf) != nbytes:
+                        raise ShortRead()
+
+                    records['data_offset'][irecord] = f.tell()
+                    f.write(buf)
+
+                if show_progress:
+                    pbar.update(i+1)
+
+        if show_progress:
+            pbar.finish()
+
+        with open(index_fn_tmp, 'wb') as f:
+            f.write(struct.pack(gf_store_header_fmt, self._nrecords,
+                                self._deltat))
+            records.tofile(f)
+
+        mode = self.mode
+        self.close()
+        os.rename(data_fn_tmp, self.data_fn())
+        os.rename(index_fn_tmp, self.index_fn())
+        self.mode = mode
+        self.open()
+
+    def _transcode(self, store_dir, compression, tolerance, force,
+                   show_progress):
+
+        BaseStore.create(store_dir, self._deltat, self._nrecords, force=force,
+                         compression=compression, tolerance=tolerance)
+
+        dest = BaseStore(store_dir, 'w')
+        if show_progress:
+            pbar = util.progressbar('converting store', self._nrecords)
+
+        for irecord in xrange(self._nrecords):
+            if self._records[irecord]['data_offset'] != 0:
+                tr = BaseStore._get(self, irecord, None, None, 1, 'c')
+                dest.put(irecord, tr)
+
+            if show_progress:
+                pbar.update(irecord+1)
+
+        if show_progress:
+            pbar.finish()
+
+        dest.close()
+
     def index_fn(self):
         return BaseStore.index_fn_(self.store_dir)
 
@@ -970,6 +1484,28 @@ class BaseStore(object):
     def size_index_and_data_human(self):
         return util.human_bytesize(self.size_index_and_data)
 
+    def size_preload(self):
+        '''
+        Estimate memory needed by a preloaded and warmed up store.
+
+        Includes index and traces file and, for compressed stores, the
+        decoded records, as far as they fit into the record cache.
+        '''
+
+        if not self._f_index:
+            self.open()
+
+        nbytes = self.size_index_and_data
+        if self._compression:
+            records = self._records
+            nsamples = records['nsamples'][records['data_offset'] > 2]
+            nbytes += min(
+                int(num.sum(nsamples, dtype=num.int64)) *
+                gf_dtype_nbytes_per_sample,
+                int(self._record_cache_max_bytes))
+
+        return nbytes
+
     def stats(self):
         counter = self.count_special_records()
 
@@ -981,11 +1517,17 @@ class BaseStore(object):
             zero=counter[1],
             size_data=self.size_data,
             size_index=self.size_index,
+            size_preload=self.size_preload(),
+            compression=self._compression or 'none',
         )
 
+        if self._compression and self._tolerance:
+            stats['compression'] += ' (tolerance %g)' % self._tolerance
+
         return stats
 
-    stats_keys = 'total inserted empty short zero size_data size_index'.split()
+    stats_keys = '''total inserted empty short zero size_data size_index
+        size_preload compression'''.split()
 
 
 def remake_dir(dpath, force):
@@ -1116,12 +1658,20 @@ class Store(BaseStore):
         BaseStore.create(store_dir, config.deltat, config.nrecords,
                          force=force)
 
-        for sub_dir in ['decimated']:
+        for sub_dir in ['decimated', 'pyramid']:
             dpath = os.path.join(store_dir, sub_dir)
             remake_dir(dpath, force)
 
-    def __init__(self, store_dir, mode='r', use_memmap=True):
-        BaseStore.__init__(self, store_dir, mode=mode, use_memmap=use_memmap)
+    def __init__(self, store_dir, mode='r', use_memmap=True,
+                 shm_cache_max_bytes=0, preload=False, preload_hugepages=False,
+                 preload_mlock=False,
+                 record_cache_max_bytes=record_cache_max_bytes_default):
+        BaseStore.__init__(self, store_dir, mode=mode, use_memmap=use_memmap,
+                           shm_cache_max_bytes=shm_cache_max_bytes,
+                           preload=preload,
+                           preload_hugepages=preload_hugepages,
+                           preload_mlock=preload_mlock,
+                           record_cache_max_bytes=record_cache_max_bytes)
         config_fn = os.path.join(store_dir, 'config')
         if not os.path.isfile(config_fn):
             raise StoreError(
@@ -1130,12 +1680,20 @@ class Store(BaseStore):
 
         self.config = meta.load(filename=config_fn)
         self._decimated = {}
+        self._pyramid = {}
         self._extra = {}
         self._phases = {}
         for decimate in range(2, 9):
             if os.path.isdir(self._decimated_store_dir(decimate)):
                 self._decimated[decimate] = None
 
+        pyramid_dir = os.path.join(store_dir, 'pyramid')
+        if os.path.isdir(pyramid_dir):
+            for entry in os.listdir(pyramid_dir):
+                if entry.isdigit() and int(entry) > 0 and os.path.isfile(
+                        os.path.join(pyramid_dir, entry, 'config')):
+                    self._pyramid[int(entry)] = None
+
     def open(self):
         if not self._f_index:
             BaseStore.open(self)
@@ -1147,6 +1705,10 @@ class Store(BaseStore):
                 c.mins, c.maxs, c.deltas, c.ns.astype(num.uint64),
                 c.ncomponents)
 
+    def _shm_cache_name(self):
+        return BaseStore._shm_cache_name(self).replace(
+            'pyrocko-gf-', 'pyrocko-gf-%s-' % self.config.id, 1)
+
     def save_config(self, make_backup=False):
         config_fn = os.path.join(self.store_dir, 'config')
         if make_backup:
@@ -1409,12 +1971,316 @@ class Store(BaseStore):
 
         self._decimated[decimate] = None
 
+    pyramid_dims = [
+        'source_depth', 'distance', 'source_east_shift', 'source_north_shift']
+
+    def pyramid_config(self, level, factor=2, decimate=1):
+        '''
+        Get GF store configuration of a level of the store pyramid.
+
+        Source depth and distance (or horizontal source shift) spacings are
+        multiplied by ``factor**level``, the sampling interval by
+        ``decimate**level``. Receiver depths are not changed. The nodes of the
+        coarse grid are a subset of the nodes of the original grid and the
+        extent of the grid is kept. If the number of intervals along a
+        dimension is not divisible by ``factor**level``, the largest smaller
+        divisor is used for that dimension.
+
+        :param level: Pyramid level, 0 is the original store
+        :type level: int
+        :param factor: Spatial coarsening factor per level, defaults to 2
+        :type factor: int, optional
+        :param decimate: Temporal decimation factor per level, defaults to 1
+        :type decimate: int, optional
+        :returns: :py:class:`pyrocko.gf.meta.Config` object
+        '''
+
+        config = copy.deepcopy(self.config)
+        for dim in self.pyramid_dims:
+            if not hasattr(config, dim + '_delta'):
+                continue
+
+            vmin = getattr(config, dim + '_min')
+            vmax = getattr(config, dim + '_max')
+            delta = getattr(config, dim + '_delta')
+            nintervals = int(round((vmax - vmin) / delta))
+            f = factor**level
+            while nintervals % f != 0:
+                f -= 1
+
+            setattr(config, dim + '_delta', delta * f)
+
+        config.sample_rate = self.config.sample_rate / decimate**level
+        return config
+
+    def make_pyramid(self, nlevels, factor=2, decimate=1, force=False,
+                     show_progress=False):
+        '''
+        Create spatially (and optionally temporally) coarsened sub-stores.
+
+        Create the levels ``1, ..., nlevels`` of a GF store pyramid, e.g. for
+        coarse-to-fine optimizations, where early iterations can be computed
+        on a coarser grid, reading fewer and possibly shorter records. The
+        sampling of each level is given by :py:meth:`pyramid_config`. The
+        records of the coarse levels are taken from the nearest nodes of
+        this store, decimated in time if requested. Pyramid sub-stores are
+        created under the ``pyramid`` subdirectory within the GF store
+        directory, stored phases and extra files are copied.
+
+        :param nlevels: Number of levels to create
+        :type nlevels: int
+        :param factor: Spatial coarsening factor per level, defaults to 2
+        :type factor: int, optional
+        :param decimate: Temporal decimation factor per level, defaults to 1
+        :type decimate: int, optional
+        :param force: Force overwrite, defaults to False
+        :type force: bool, optional
+        :param show_progress: Show progress, defaults to False
+        :type show_progress: bool, optional
+        '''
+
+        if not self._f_index:
+            self.open()
+
+        assert self.mode == 'r'
+
+        if nlevels < 1 or factor < 1 or decimate < 1:
+            raise StoreError(
+                'nlevels, factor and decimate arguments must be positive')
+
+        if decimate**nlevels > 8:
+            raise StoreError(
+                'total decimation (decimate**nlevels) must not exceed 8')
+
+        for level in range(1, nlevels+1):
+            self._make_pyramid_level(
+                level, self.pyramid_config(level, factor, decimate),
+                decimate**level, force, show_progress)
+
+    def _make_pyramid_level(self, level, config, decimate, force,
+                            show_progress):
+
+        if level in self._pyramid:
+            if self._pyramid[level] is not None:
+                self._pyramid[level].close()
+
+            del self._pyramid[level]
+
+        store_dir = self._pyramid_store_dir(level)
+        if os.path.exists(store_dir):
+            if force:
+                shutil.rmtree(store_dir)
+            else:
+                raise CannotCreate('store already exists at %s' % store_dir)
+
+        store_dir_incomplete = store_dir + '-incomplete'
+        Store.create(store_dir_incomplete, config, force=force)
+
+        for sub_dir in ['extra', 'phases']:
+            dpath = os.path.join(self.store_dir, sub_dir)
+            if os.path.isdir(dpath):
+                dpath_level = os.path.join(store_dir_incomplete, sub_dir)
+                if os.path.exists(dpath_level):
+                    shutil.rmtree(dpath_level)
+
+                shutil.copytree(dpath, dpath_level)
+
+        coarse = Store(store_dir_incomplete, 'w')
+        if show_progress:
+            pbar = util.progressbar(
+                'making pyramid level %i' % level, coarse.config.nrecords)
+
+        for i, args in enumerate(coarse.config.iter_nodes()):
+            tr = self.get(args, decimate=decimate)
+            coarse.put(args, tr)
+
+            if show_progress:
+                pbar.update(i+1)
+
+        if show_progress:
+            pbar.finish()
+
+        coarse.close()
+
+        shutil.move(store_dir_incomplete, store_dir)
+
+        self._pyramid[level] = None
+
+    def get_pyramid_levels(self):
+        '''
+        Get available levels of the GF store pyramid.
+
+        :returns: Sorted list of levels, including level 0 (this store)
+        '''
+
+        return [0] + sorted(self._pyramid.keys())
+
+    def get_pyramid_store(self, level):
+        '''
+        Get GF store of a given pyramid level.
+
+        If the requested level is not available, the coarsest available level
+        below it is returned.
+
+        :param level: Pyramid level, 0 is this store
+        :type level: int
+        :returns: :py:class:`Store` object
+        '''
+
+        levels = [x for x in self.get_pyramid_levels() if x <= level]
+        level = levels[-1]
+        if level == 0:
+            return self
+
+        store = self._pyramid[level]
+        if store is None:
+            store = Store(
+                self._pyramid_store_dir(level), 'r',
+                **self._substore_kwargs())
+            self._pyramid[level] = store
+
+        return store
+
+    def record_order(self, curve='hilbert'):
+        '''
+        Get record numbers ordered along a space-filling curve.
+
+        The curve runs over the grid indices of the store's continuous
+        dimensions (e.g. source depth and distance). Records of the different
+        components at a grid node are kept together, as are all records of a
+        receiver in stores of type C.
+
+        :param curve: ``'hilbert'``, ``'morton'``, or ``'index'`` (no
+            reordering)
+        :returns: array of record numbers
+        '''
+
+        c = self.config
+        ns = [int(n) for n in c.ns]
+        ng = int(c.ncomponents)
+        nnodes = int(num.product(ns))
+        nouter = int(c.nrecords) // (nnodes * ng)
+
+        if curve == 'index':
+            return num.arange(c.nrecords, dtype=num.int64)
+
+        indices = num.array(num.unravel_index(num.arange(nnodes), ns)).T
+        inodes = num.argsort(
+            space_filling_curve_keys(indices, curve), kind='mergesort')
+
+        return (num.arange(nouter)[:, num.newaxis, num.newaxis] * nnodes * ng
+                + inodes[num.newaxis, :, num.newaxis] * ng
+                + num.arange(ng)[num.newaxis, num.newaxis, :]).ravel()
+
+    def reorder(self, curve='hilbert', show_progress=False):
+        '''
+        Rewrite the traces file in space-filling curve order.
+
+        GF traces which are stacked together when interpolating between
+        neighbouring grid nodes are placed close to each other in the
+        traces file, so that reading them touches fewer, contiguous pages
+        and profits from read-ahead. The index format is unchanged.
+        Decimated and pyramid sub-stores are reordered as well.
+
+        :param curve: ``'hilbert'``, ``'morton'``, or ``'index'``, see
+            :py:meth:`record_order`
+        :param show_progress: Show progress, defaults to False
+        '''
+
+        self.rewrite_data(self.record_order(curve),
+                          show_progress=show_progress)
+
+        for decimate in sorted(self._decimated.keys()):
+            decimated, _ = self._decimated_store(decimate)
+            decimated.reorder(curve=curve, show_progress=show_progress)
+
+        for level in sorted(self._pyramid.keys()):
+            self.get_pyramid_store(level).reorder(
+                curve=curve, show_progress=show_progress)
+
+    def make_compressed(self, store_dir, compression='deflate',
+                        tolerance=0.0, force=False, show_progress=False):
+        '''
+        Create a copy of the GF store with compressed traces file.
+
+        Each GF trace is compressed block-wise and decompressed on the fly
+        when accessed. With ``tolerance=0.0``, compression is lossless.
+        Otherwise, samples are quantized such that their error does not
+        exceed ``tolerance`` times the peak amplitude of the respective GF
+        trace. With ``compression=None``, an uncompressed copy is made, e.g.
+        to convert a compressed store back. Decimated and pyramid sub-stores
+        are converted as well. Config, extra and phase files are copied
+        unchanged.
+
+        :param store_dir: Directory of the new GF store
+        :type store_dir: str
+        :param compression: ``'deflate'`` or ``None``
+        :type compression: str, optional
+        :param tolerance: Relative error bound for lossy compression,
+            defaults to 0.0
+        :type tolerance: float, optional
+        :param force: Force overwrite, defaults to False
+        :type force: bool, optional
+        :param show_progress: Show progress, defaults to False
+        :type show_progress: bool, optional
+        '''
+
+        if not self._f_index:
+            self.open()
+
+        assert self.mode == 'r'
+
+        if os.path.exists(store_dir):
+            if force:
+                shutil.rmtree(store_dir)
+            else:
+                raise CannotCreate('store already exists at %s' % store_dir)
+
+        def ignore(dpath, names):
+            if dpath == self.store_dir:
+                return [n for n in names
+                        if n in ('index', 'traces', 'decimated', 'pyramid')]
+            else:
+                return []
+
+        store_dir_incomplete = store_dir + '-incomplete'
+        if os.path.exists(store_dir_incomplete):
+            shutil.rmtree(store_dir_incomplete)
+
+        shutil.copytree(self.store_dir, store_dir_incomplete, ignore=ignore)
+        os.mkdir(os.path.join(store_dir_incomplete, 'decimated'))
+        os.mkdir(os.path.join(store_dir_incomplete, 'pyramid'))
+
+        self._transcode(store_dir_incomplete, compression, tolerance, force,
+                        show_progress)
+
+        for decimate in sorted(self._decimated.keys()):
+            decimated, _ = self._decimated_store(decimate)
+            decimated.make_compressed(
+                os.path.join(
+                    store_dir_incomplete, 'decimated', str(decimate)),
+                compression=compression,
+                tolerance=tolerance,
+                force=force,
+                show_progress=show_progress)
+
+        for level in sorted(self._pyramid.keys()):
+            self.get_pyramid_store(level).make_compressed(
+                os.path.join(store_dir_incomplete, 'pyramid', str(level)),
+                compression=compression,
+                tolerance=tolerance,
+                force=force,
+                show_progress=show_progress)
+
+        shutil.move(store_dir_incomplete, store_dir)
+
     def stats(self):
         stats = BaseStore.stats(self)
         stats['decimated'] = sorted(self._decimated.keys())
+        stats['pyramid'] = sorted(self._pyramid.keys())
         return stats
 
-    stats_keys = BaseStore.stats_keys + ['decimated']
+    stats_keys = BaseStore.stats_keys + ['decimated', 'pyramid']
 
     def check(self, show_progress=False):
         if show_progress:
@@ -1450,16 +2316,29 @@ class Store(BaseStore):
             logger.warn('deepest layer of earthmodel_receiver_1d not '
                         'found in earthmodel_1d')
 
+    def _substore_kwargs(self):
+        return dict(
+            shm_cache_max_bytes=self._shm_cache_max_bytes,
+            preload=self._preload,
+            preload_hugepages=self._preload_hugepages,
+            preload_mlock=self._preload_mlock,
+            record_cache_max_bytes=self._record_cache_max_bytes)
+
     def _decimated_store_dir(self, decimate):
         return os.path.join(self.store_dir, 'decimated', str(decimate))
 
+    def _pyramid_store_dir(self, level):
+        return os.path.join(self.store_dir, 'pyramid', str(level))
+
     def _decimated_store(self, decimate):
         if decimate == 1 or decimate not in self._decimated:
             return self, decimate
         else:
             store = self._decimated[decimate]
             if store is None:
-                store = Store(self._decimated_store_dir(decimate), 'r')
+                store = Store(
+                    self._decimated_store_dir(decimate), 'r',
+                    **self._substore_kwargs())
                 self._decimated[decimate] = store
 
             return store, 1
@@ -1548,6 +2427,48 @@ class Store(BaseStore):
 
         raise StoreError('unsupported phase provider: %s' % provider)
 
+    def _get_phase_many(self, phase_def):
+        toks = phase_def.split(':', 1)
+        if len(toks) == 2:
+            provider, phase_def_ = toks
+        else:
+            provider, phase_def_ = 'stored', toks[0]
+
+        if provider == 'stored':
+            spt = self.get_stored_phase(phase_def_)
+
+            def evaluate(args):
+                return spt.interpolate_many(num.column_stack(args))
+
+            return evaluate
+
+        elif provider in ('vel', 'vel_surface') \
+                and self.config.short_type in 'AB':
+
+            vel = float(phase_def_) * 1000.
+            if provider == 'vel':
+                get_distance = self.config.get_distance
+            else:
+                get_distance = self.config.get_surface_distance
+
+            def evaluate(args):
+                return num.asarray(get_distance(args), dtype=num.float) / vel
+
+            return evaluate
+
+        else:
+            phase = self.get_phase(phase_def)
+
+            def evaluate(args):
+                times = num.empty(args[0].size, dtype=num.float)
+                for i, args1 in enumerate(zip(*args)):
+                    t = phase(args1)
+                    times[i] = t if t is not None else num.nan
+
+                return times
+
+            return evaluate
+
     def t(self, timing, *args):
         '''
         Compute interpolated phase arrivals.
@@ -1577,6 +2498,13 @@ class Store(BaseStore):
         :type \*args: tuple
         :returns: Phase arrival according to ``timing``
         :rtype: float or None
+
+        The index tuple may also contain NumPy arrays (which are broadcast
+        against each other) to evaluate the timing for many geometries at
+        once, e.g. ``test_store.t('P', (depths, distances))``. In this case,
+        a NumPy array of the broadcast shape is returned, with NaN where the
+        timing is undefined or where the geometry is out of the bounds of a
+        stored travel time table.
         '''
 
         if len(args) == 1:
@@ -1587,6 +2515,15 @@ class Store(BaseStore):
         if not isinstance(timing, meta.Timing):
             timing = meta.Timing(timing)
 
+        if any(isinstance(arg, num.ndarray) and arg.ndim > 0
+               for arg in args):
+
+            args = num.broadcast_arrays(*args)
+            shape = args[0].shape
+            return timing.evaluate_many(
+                self._get_phase_many,
+                tuple(arg.ravel() for arg in args)).reshape(shape)
+
         return timing.evaluate(self.get_phase, args)
 
     def make_timing_params(self, begin, end, snap_vred=True):
@@ -1607,14 +2544,14 @@ class Store(BaseStore):
           as start
         '''
 
-        data = []
-        for args in self.config.iter_nodes(level=-1):
-            tmin = self.t(begin, args)
-            tmax = self.t(end, args)
-            x = self.config.get_surface_distance(args)
-            data.append((x, tmin, tmax))
+        args = tuple(
+            arg.ravel() for arg in num.meshgrid(
+                *self.config.coords[:-1], indexing='ij'))
 
-        xs, tmins, tmaxs = num.array(data, dtype=num.float).T
+        tmins = self.t(begin, args)
+        tmaxs = self.t(end, args)
+        xs = num.asarray(
+            self.config.get_surface_distance(args), dtype=num.float)
 
         tlens = tmaxs - tmins
 
@@ -1643,7 +2580,7 @@ class Store(BaseStore):
                 self.config.deltat *
                 math.floor(tmin_vred / self.config.deltat) - xe * sred)
 
-        tlenmax_vred = num.nanmax(tmax - (tmin_vred + sred*x))
+        tlenmax_vred = num.nanmax(tmaxs - (tmin_vred + sred*xs))
         if sred != 0.0:
             vred = 1.0/sred
         else:
@@ -1657,13 +2594,15 @@ class Store(BaseStore):
             tlenmax_vred=tlenmax_vred,
             vred=vred)
 
-    def make_ttt(self, force=False):
+    def make_ttt(self, force=False, nworkers=1):
         '''Compute travel time tables.
 
         Travel time tables are computed using the 1D earth model defined in
         :py:attr:`pyrocko.gf.meta.Config.earthmodel_1d` for each defined phase
         in :py:attr:`pyrocko.gf.meta.Config.tabulated_phases`. The accuracy of
         the tablulated times is adjusted to the sampling rate of the store.
+        Rays are traced in ``nworkers`` parallel processes (``None``: number
+        of processors).
         '''
 
         from pyrocko import cake
@@ -1727,47 +2666,111 @@ class Store(BaseStore):
                 f=evaluate,
                 ftol=config.deltat*0.5,
                 xbounds=num.transpose((config.mins, config.maxs)),
-                xtols=config.deltas)
+                xtols=config.deltas,
+                nworkers=nworkers)
 
             util.ensuredirs(fn)
             ip.dump(fn)
 
     def statics(self, source, multi_location, itsnapshot, components,
-                interpolation='nearest_neighbor', nthreads=0):
+                interpolation='nearest_neighbor', nthreads=0, out=None,
+                max_bytes=None):
+        '''
+        Compute static displacements at many locations.
+
+        The targets are processed in chunks, such that the temporary
+        summation parameters take up at most ``max_bytes`` (default: 16 MB).
+
+        :param source: discretized source model
+        :type source: :py:class:`pyrocko.gf.meta.DiscretizedSource`
+        :param multi_location: target locations
+        :type multi_location: :py:class:`pyrocko.gf.meta.MultiLocation`
+        :param itsnapshot: index of the time sample to compute
+        :param components: names of the components to compute
+        :param interpolation: ``'nearest_neighbor'`` or ``'multilinear'``
+        :param nthreads: number of threads to use (``0``: all cores)
+        :param out: optional dict of preallocated arrays of length
+            ``multi_location.ntargets`` per component, which are filled with
+            the results
+        :param max_bytes: memory limit for temporary arrays
+        :returns: dict of arrays with the results per component
+        '''
+
+        return self.statics_raw(
+            source.coords5(),
+            source.get_source_terms(self.config.component_scheme),
+            source.times,
+            multi_location.coords5,
+            itsnapshot, components, interpolation, nthreads, out, max_bytes)
+
+    def statics_raw(self, source_coords, source_terms, times,
+                    receiver_coords, itsnapshot, components,
+                    interpolation='nearest_neighbor', nthreads=0, out=None,
+                    max_bytes=None):
+
+        '''
+        Compute static displacements from arrays of source and target data.
+
+        Like :py:meth:`statics` but with the point sources given as arrays of
+        coordinates (``(nsources, 5)``, see
+        :py:meth:`pyrocko.gf.meta.DiscretizedSource.coords5`), source terms
+        and times, and the targets as array of coordinates (``(ntargets,
+        5)``). This allows to combine several (scaled) discretized sources
+        into a single computation.
+        '''
+
         if not self._f_index:
             self.open()
 
-        out = {}
-        ntargets = multi_location.ntargets
-        source_terms = source.get_source_terms(self.config.component_scheme)
-        delays = source.times.astype(num.float32)
+        ntargets = receiver_coords.shape[0]
+        delays = num.asarray(times, dtype=num.float32)
         scheme_desc = meta.component_scheme_to_description[
             self.config.component_scheme]
 
         if ntargets == 0:
             raise StoreError('MultiLocation.coords5 is empty')
 
-        sum_params = store_ext.make_sum_params(
-            self.cstore,
-            source.coords5(),
-            source_terms,
-            multi_location.coords5,
-            self.config.component_scheme,
-            interpolation,
-            nthreads or 0)
-
-        for icomp, comp in enumerate(scheme_desc.provided_components):
-            if comp not in components:
-                continue
-            weights, irecords = sum_params[icomp]
-            out[comp] = self.sum_statics(
-                irecords,
-                delays,
-                weights,
-                itsnapshot,
-                ntargets,
+        if max_bytes is None:
+            max_bytes = 16*1024**2
+
+        # irecords (8 bytes) and weights (4 bytes) per summand, per point
+        # source, per interpolation node and per provided component
+        nip = 1 if interpolation == 'nearest_neighbor' else 8
+        nbytes_per_target = 12 * source_coords.shape[0] * \
+            source_terms.shape[1] * nip * len(scheme_desc.provided_components)
+
+        nchunk = int(max(1, min(ntargets, max_bytes // nbytes_per_target)))
+
+        if out is None:
+            out = {}
+
+        for comp in scheme_desc.provided_components:
+            if comp in components and comp not in out:
+                out[comp] = num.empty(ntargets, dtype=gf_dtype)
+
+        for ilo in xrange(0, ntargets, nchunk):
+            ihi = min(ilo + nchunk, ntargets)
+            sum_params = store_ext.make_sum_params(
+                self.cstore,
+                source_coords,
+                source_terms,
+                num.ascontiguousarray(receiver_coords[ilo:ihi]),
+                self.config.component_scheme,
+                interpolation,
                 nthreads or 0)
 
+            for icomp, comp in enumerate(scheme_desc.provided_components):
+                if comp not in components:
+                    continue
+                weights, irecords = sum_params[icomp]
+                out[comp][ilo:ihi] = self.sum_statics(
+                    irecords,
+                    delays,
+                    weights,
+                    itsnapshot,
+                    ihi - ilo,
+                    nthreads or 0)
+
         return out
 
     def seismogram_old(
@@ -1860,6 +2863,124 @@ class Store(BaseStore):
 
         return out
 
+    def seismograms(self, source, receivers, components, deltat=None,
+                    itmin=None, nsamples=None,
+                    interpolation='nearest_neighbor', nthreads=0):
+        '''
+        Compute GF seismograms for many receivers at once.
+
+        Interpolation weights and record numbers for all receivers are
+        computed and the GF traces are stacked in a single call to the C
+        extension, parallelized over receivers. The result for each receiver
+        is equivalent to ``make_same_span(self.seismogram(...))``, except that
+        the ``optimization`` step of :py:meth:`seismogram` is skipped.
+
+        :param source: discretized source
+        :param receivers: list of :py:class:`pyrocko.gf.meta.Receiver`
+            objects
+        :param components: names of components to return
+        :param deltat: sampling interval, a decimated sub-store is used if
+            it differs from the store's sampling interval
+        :param itmin: index of first sample (``None`` for automatic extent)
+        :param nsamples: number of samples (``None`` for automatic extent)
+        :param interpolation: ``'nearest_neighbor'`` or ``'multilinear'``
+        :param nthreads: number of threads (``0``: number of processors)
+        :returns: list of dicts with :py:class:`GFTrace` objects, one for
+            each receiver; the traces are views into a common array of shape
+            ``(nreceivers, ncomponents, nsamples_max)``
+        '''
+
+        config = self.config
+
+        if deltat is None:
+            decimate = 1
+        else:
+            decimate = int(round(deltat/config.deltat))
+
+        store, decimate_ = self._decimated_store(decimate)
+        if decimate_ != 1:
+            return [
+                make_same_span(self.seismogram(
+                    source, receiver, components, deltat=deltat,
+                    itmin=itmin, nsamples=nsamples,
+                    interpolation=interpolation))
+                for receiver in receivers]
+
+        if not store._f_index:
+            store.open()
+
+        scheme = config.component_scheme
+        scheme_desc = meta.component_scheme_to_description[scheme]
+        provided_components = scheme_desc.provided_components
+
+        nreceivers = len(receivers)
+        if source.times.size == 0:
+            return [dict((k, Zero) for k in components)
+                    for _ in xrange(nreceivers)]
+
+        receiver_coords = num.zeros((nreceivers, 5), dtype=num.float)
+        for ireceiver, receiver in enumerate(receivers):
+            receiver_coords[ireceiver, :] = receiver.coords5
+
+        # shift delays to keep them small for float32 precision
+        itoffset = int(num.floor(num.min(source.times) / store._deltat))
+        delays = (source.times - itoffset*store._deltat).astype(num.float32)
+
+        if nsamples is None:
+            itmins = num.zeros(nreceivers, dtype=num.int32)
+            nsampless = num.zeros(nreceivers, dtype=num.int32) - 1
+        else:
+            itmins = num.zeros(nreceivers, dtype=num.int32) + \
+                ((itmin or 0) - itoffset)
+            nsampless = num.zeros(nreceivers, dtype=num.int32) + nsamples
+
+        args = (store.cstore, source.coords5(),
+                source.get_source_terms(scheme), delays, receiver_coords,
+                scheme, interpolation, itmins, nsampless)
+
+        t0 = time.time()
+        try:
+            if nsamples is None:
+                store_ext.store_calc_timeseries(*(args + (None, nthreads)))
+
+            out = num.empty(
+                (nreceivers, len(provided_components),
+                 max(1, int(num.max(nsampless)))),
+                dtype=gf_dtype)
+
+            store_ext.store_calc_timeseries(*(args + (out, nthreads)))
+
+        except store_ext.StoreExtError, e:
+            if str(e) == 'INDEX_OUT_OF_BOUNDS':
+                raise meta.OutOfBounds()
+
+            raise StoreError(str(e) + ' in store %s' % store.store_dir)
+
+        t_stack = (time.time() - t0) / nreceivers
+
+        nip = 1 if interpolation == 'nearest_neighbor' else \
+            {'A': 4, 'B': 8}.get(config.short_type, 1)
+
+        n_records_stacked = source.times.size * nip
+
+        results = []
+        for ireceiver in xrange(nreceivers):
+            res = {}
+            for icomp, comp in enumerate(provided_components):
+                if comp in components:
+                    tr = GFTrace(
+                        out[ireceiver, icomp, :nsampless[ireceiver]],
+                        itmin=int(itmins[ireceiver]) + itoffset,
+                        deltat=config.deltat * decimate)
+
+                    tr.n_records_stacked = n_records_stacked
+                    tr.t_stack = t_stack
+                    res[comp] = tr
+
+            results.append(res)
+
+        return results
+
 
 __all__ = '''
 gf_dtype
@@ -2,6 +2,9 @@ from struct import unpack
 import os
 import re
 import logging
+from collections import OrderedDict
+
+import numpy as num
 
 from pyrocko import trace
 from pyrocko.util import reuse, ensuredirs
@@ -14,39 +17,141 @@ class CodeTooLong(FileSaveError):
     pass
 
 
-def iload(filename, load_data=True):
+def as_traces(trtups, filename):
     from pyrocko import mseed_ext
 
     have_zero_rate_traces = False
-    try:
-        traces = []
-        for tr in mseed_ext.get_traces(filename, load_data):
-            network, station, location, channel = tr[1:5]
-            tmin = float(tr[5])/float(mseed_ext.HPTMODULUS)
-            tmax = float(tr[6])/float(mseed_ext.HPTMODULUS)
-            try:
-                deltat = reuse(float(1.0)/float(tr[7]))
-            except ZeroDivisionError, e:
-                have_zero_rate_traces = True
-                continue
-
-            ydata = tr[8]
-
-            traces.append(trace.Trace(
-                network, station, location, channel, tmin, tmax,
-                deltat, ydata))
+    traces = []
+    for tr in trtups:
+        network, station, location, channel = tr[1:5]
+        tmin = float(tr[5])/float(mseed_ext.HPTMODULUS)
+        tmax = float(tr[6])/float(mseed_ext.HPTMODULUS)
+        try:
+            deltat = reuse(float(1.0)/float(tr[7]))
+        except ZeroDivisionError:
+            have_zero_rate_traces = True
+            continue
 
-        for tr in traces:
-            yield tr
+        ydata = tr[8]
 
-    except (OSError, mseed_ext.MSeedError), e:
-        raise FileLoadError(str(e)+' (file: %s)' % filename)
+        traces.append(trace.Trace(
+            network, station, location, channel, tmin, tmax,
+            deltat, ydata))
 
     if have_zero_rate_traces:
         logger.warn(
             'Ignoring traces with sampling rate of zero in file %s '
             '(maybe LOG traces)' % filename)
 
+    return traces
+
+
+def iload(filename, load_data=True):
+    from pyrocko import mseed_ext
+
+    try:
+        trtups = mseed_ext.get_traces(filename, load_data)
+    except (OSError, mseed_ext.MSeedError), e:
+        raise FileLoadError(str(e)+' (file: %s)' % filename)
+
+    for tr in as_traces(trtups, filename):
+        yield tr
+
+
+class RecordIndex(object):
+    '''Index of the data records in a Mini-SEED file.
+
+    Holds byte offsets, lengths and time spans of the data records of a
+    file. It is used to unpack only those records which are needed for a
+    given time window, see :py:func:`load_window`. Use
+    :py:func:`get_record_index` to create it.
+    '''
+
+    def __init__(self, offsets, reclens, tmins, tmaxs, deltats):
+        self.offsets = offsets
+        self.reclens = reclens
+        self.tmins = tmins
+        self.tmaxs = tmaxs
+        self.deltats = deltats
+
+    def select(self, tmin, tmax):
+        '''Get offsets and lengths of records overlapping with time span.
+
+        The time span is extended by one sample interval on either side, so
+        that the result is sufficient to chop the span with any rounding.
+        '''
+
+        mask = num.logical_and(
+            self.tmins <= tmax + self.deltats,
+            self.tmaxs >= tmin - self.deltats)
+
+        return self.offsets[mask], self.reclens[mask]
+
+    def __len__(self):
+        return self.offsets.size
+
+
+def get_record_index(filename):
+    '''Scan Mini-SEED file and create :py:class:`RecordIndex`.
+
+    Only the record headers are read, no data is unpacked.
+    '''
+
+    from pyrocko import mseed_ext
+
+    try:
+        records = mseed_ext.get_record_index(filename)
+    except (OSError, mseed_ext.MSeedError), e:
+        raise FileLoadError(str(e)+' (file: %s)' % filename)
+
+    n = len(records)
+    offsets = num.array([r[0] for r in records], dtype=num.int64)
+    reclens = num.array([r[1] for r in records], dtype=num.int32)
+    hptmodulus = float(mseed_ext.HPTMODULUS)
+    tmins = num.array([r[6] for r in records], dtype=num.float) / hptmodulus
+    tmaxs = num.array([r[7] for r in records], dtype=num.float) / hptmodulus
+    srates = num.array([r[8] for r in records], dtype=num.float)
+    deltats = num.zeros(n)
+    deltats[srates > 0.] = 1.0 / srates[srates > 0.]
+
+    return RecordIndex(offsets, reclens, tmins, tmaxs, deltats)
+
+
+def load_window(filename, tmin, tmax, record_index=None, load_data=True):
+    '''Load traces overlapping with a time span from Mini-SEED file.
+
+    Only the records overlapping with the given time span are unpacked from
+    the memory-mapped file, so that the cost of extracting a short window
+    from a long file is proportional to the length of the window. The
+    returned traces are not chopped to the time span.
+
+    :param filename: path to the Mini-SEED file
+    :param tmin: start time
+    :param tmax: end time
+    :param record_index: :py:class:`RecordIndex` of the file; it is created
+        if not given
+    :param load_data: whether to unpack the data samples
+    :returns: list of :py:class:`pyrocko.trace.Trace` objects
+    '''
+
+    from pyrocko import mseed_ext
+
+    if record_index is None:
+        record_index = get_record_index(filename)
+
+    offsets, reclens = record_index.select(tmin, tmax)
+    if offsets.size == 0:
+        return []
+
+    try:
+        trtups = mseed_ext.get_traces_records(
+            filename, offsets.tolist(), reclens.tolist(), load_data)
+
+    except (OSError, mseed_ext.MSeedError), e:
+        raise FileLoadError(str(e)+' (file: %s)' % filename)
+
+    return as_traces(trtups, filename)
+
 
 def as_tuple(tr):
     from pyrocko import mseed_ext
@@ -57,21 +162,26 @@ def as_tuple(tr):
             itmin, itmax, srate, tr.get_ydata())
 
 
-def save(traces, filename_template, additional={}, overwrite=True):
+def check_codes(tr):
+    for code, maxlen, val in zip(
+            ['network', 'station', 'location', 'channel'],
+            [2, 5, 2, 3],
+            tr.nslc_id):
+
+        if len(val) > maxlen:
+            raise CodeTooLong(
+                '%s code too long to be stored in MSeed file: %s' %
+                (code, val))
+
+
+def save(traces, filename_template, additional={}, overwrite=True,
+         record_length=4096, steim=1):
+
     from pyrocko import mseed_ext
 
     fn_tr = {}
     for tr in traces:
-        for code, maxlen, val in zip(
-                ['network', 'station', 'location', 'channel'],
-                [2, 5, 2, 3],
-                tr.nslc_id):
-
-            if len(val) > maxlen:
-                raise CodeTooLong(
-                    '%s code too long to be stored in MSeed file: %s' %
-                    (code, val))
-
+        check_codes(tr)
         fn = tr.fill_template(filename_template, **additional)
         if not overwrite and os.path.exists(fn):
             raise FileSaveError('file exists: %s' % fn)
@@ -89,7 +199,7 @@ def save(traces, filename_template, additional={}, overwrite=True):
 
         ensuredirs(fn)
         try:
-            mseed_ext.store_traces(trtups, fn)
+            mseed_ext.store_traces(trtups, fn, record_length, steim)
         except mseed_ext.MSeedError, e:
             raise FileSaveError(
                 str(e) + ' (while storing traces to file \'%s\')' % fn)
@@ -97,6 +207,194 @@ def save(traces, filename_template, additional={}, overwrite=True):
     return fn_tr.keys()
 
 
+class MSeedWriter(object):
+    '''Incremental writer for Mini-SEED files.
+
+    Successive chunks of continuous traces can be passed to :py:meth:`append`.
+    Only completely filled records are packed and written to the output
+    files, samples which do not fill a record are kept until the next chunk
+    of the same channel arrives, or until the writer is closed. Compared to
+    :py:func:`save`, contiguous chunks end up in continuous records and
+    output files can be filled with data from many successive chunks, with
+    memory use bounded by the chunk size.
+
+    :param filename_template: filename template, as for :py:func:`save`
+    :param additional: dict with custom template placeholder fillins
+    :param overwrite: if ``False``, raise an exception if an output file
+        already exists when it is opened for the first time
+    :param record_length: length of the Mini-SEED records in bytes (power of
+        two, between 256 and 8192)
+    :param steim: Steim compression level (1 or 2), used for integer data
+    :param max_open_files: maximum number of simultaneously open output
+        files; least recently used files are closed and re-opened for
+        appending when needed
+
+    Usage::
+
+        writer = MSeedWriter('data/%(network)s.%(station)s.mseed')
+        for traces in p.chopper(tinc=3600.):
+            writer.append(traces)
+
+        writer.close()
+    '''
+
+    def __init__(self, filename_template, additional={}, overwrite=True,
+                 record_length=4096, steim=1, max_open_files=64):
+
+        if steim not in (1, 2):
+            raise ValueError('steim must be 1 or 2')
+
+        if record_length not in [2**i for i in xrange(8, 14)]:
+            raise ValueError(
+                'record_length must be a power of 2 between 256 and 8192')
+
+        self._filename_template = filename_template
+        self._additional = additional
+        self._overwrite = overwrite
+        self._record_length = record_length
+        self._steim = steim
+        self._max_open_files = max_open_files
+        self._files = OrderedDict()
+        self._created = []
+        self._opened = set()
+        self._seqnums = {}
+        self._pending = {}
+
+    def append(self, traces, additional={}):
+        '''Add trace chunks to the output.
+
+        :param traces: trace or list of traces
+        :param additional: dict with custom template placeholder fillins,
+            updating those given at construction
+        '''
+
+        if isinstance(traces, trace.Trace):
+            traces = [traces]
+
+        fillins = dict(self._additional)
+        fillins.update(additional)
+
+        for tr in traces:
+            check_codes(tr)
+            fn = tr.fill_template(self._filename_template, **fillins)
+            k = (fn, tr.nslc_id)
+            pending = self._pending.pop(k, None)
+            if pending is not None:
+                if self._is_continuation(pending, tr):
+                    ydata = num.concatenate((pending.ydata, tr.get_ydata()))
+                    tr = tr.copy(data=False)
+                    tr.tmin = pending.tmin
+                    tr.set_ydata(ydata)
+                else:
+                    self._pack(fn, pending, flush=True)
+
+            rest = self._pack(fn, tr, flush=False)
+            if rest is not None:
+                self._pending[k] = rest
+
+    def flush(self):
+        '''Pack and write all pending samples.
+
+        Subsequent chunks start new records.
+        '''
+
+        for (fn, _), pending in sorted(self._pending.iteritems()):
+            self._pack(fn, pending, flush=True)
+
+        self._pending = {}
+        for f in self._files.itervalues():
+            f.flush()
+
+    def close(self):
+        '''Flush pending samples and close all output files.
+
+        :returns: list of the files written
+        '''
+
+        try:
+            self.flush()
+        finally:
+            while self._files:
+                _, f = self._files.popitem(last=False)
+                f.close()
+
+        return list(self._created)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def _is_continuation(self, pending, tr):
+        deltat = pending.deltat
+        return (
+            abs(tr.deltat - deltat) < deltat * 1e-6 and
+            tr.ydata is not None and
+            tr.ydata.dtype == pending.ydata.dtype and
+            abs(tr.tmin - (pending.tmin + pending.ydata.size * deltat))
+            < deltat * 0.01)
+
+    def _pack(self, fn, tr, flush):
+        from pyrocko import mseed_ext
+
+        if tr.ydata is None or tr.ydata.size == 0:
+            return None
+
+        try:
+            records, npacked, seqnum = mseed_ext.pack_records(
+                as_tuple(tr), self._record_length, self._steim, int(flush),
+                self._seqnums.get(fn, 1))
+
+        except mseed_ext.MSeedError, e:
+            raise FileSaveError(
+                str(e) + ' (while storing traces to file \'%s\')' % fn)
+
+        if records:
+            self._seqnums[fn] = seqnum
+            self._get_file(fn).write(records)
+
+        if npacked == tr.ydata.size:
+            return None
+
+        rest = tr.copy(data=False)
+        rest.tmin = tr.tmin + npacked * tr.deltat
+        rest.set_ydata(tr.ydata[npacked:].copy())
+        return rest
+
+    def _get_file(self, fn):
+        if fn in self._files:
+            f = self._files.pop(fn)
+            self._files[fn] = f
+            return f
+
+        while len(self._files) >= max(1, self._max_open_files):
+            _, f_old = self._files.popitem(last=False)
+            f_old.close()
+
+        if fn in self._opened:
+            mode = 'ab'
+        else:
+            if not self._overwrite and os.path.exists(fn):
+                raise FileSaveError('file exists: %s' % fn)
+
+            ensuredirs(fn)
+            mode = 'wb'
+
+        try:
+            f = open(fn, mode)
+        except (OSError, IOError), e:
+            raise FileSaveError(
+                str(e) + ' (while storing traces to file \'%s\')' % fn)
+
+        if fn not in self._opened:
+            self._opened.add(fn)
+            self._created.append(fn)
+
+        self._files[fn] = f
+        return f
+
+
 tcs = {}
 
 
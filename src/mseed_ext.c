@@ -11,6 +11,10 @@
 
 #include <libmseed.h>
 #include <assert.h>
+#include <fcntl.h>
+#include <unistd.h>
+#include <sys/mman.h>
+#include <sys/stat.h>
 
 static PyObject *MSeedError;
 
@@ -18,58 +22,15 @@ static PyObject *MSeedError;
 
 
 static PyObject*
-mseed_get_traces (PyObject *dummy, PyObject *args)
+mstg_to_list (MSTraceGroup *mstg, int unpackdata)
 {
-    char          *filename;
-    MSTraceGroup  *mstg = NULL;
     MSTrace       *mst = NULL;
-    int           retcode;
     npy_intp      array_dims[1] = {0};
     PyObject      *array = NULL;
     PyObject      *out_traces = NULL;
     PyObject      *out_trace = NULL;
     int           numpytype;
     char          strbuf[BUFSIZE];
-    PyObject      *unpackdata = NULL;
-
-    (void) dummy; /* silence warning */
-
-    if (!PyArg_ParseTuple(args, "sO", &filename, &unpackdata)) {
-        PyErr_SetString(MSeedError, "usage get_traces(filename, dataflag)" );
-        return NULL;
-    }
-
-    if (!PyBool_Check(unpackdata)) {
-        PyErr_SetString(MSeedError, "Second argument must be a boolean" );
-        return NULL;
-    }
-  
-    /* get data from mseed file */
-    retcode = ms_readtraces (&mstg, filename, 0, -1.0, -1.0, 0, 1, (unpackdata == Py_True), 0);
-    if ( retcode < 0 ) {
-        snprintf (strbuf, BUFSIZE, "Cannot read file '%s': %s", filename, ms_errorstr(retcode));
-        PyErr_SetString(MSeedError, strbuf);
-        return NULL;
-    }
-
-    if ( ! mstg ) {
-        snprintf (strbuf, BUFSIZE, "Error reading file");
-        PyErr_SetString(MSeedError, strbuf);
-        return NULL;
-    }
-
-    /* check that there is data in the traces */
-    if (unpackdata == Py_True) {
-        mst = mstg->traces;
-        while (mst) {
-            if (mst->datasamples == NULL) {
-                snprintf (strbuf, BUFSIZE, "Error reading file - datasamples is NULL");
-                PyErr_SetString(MSeedError, strbuf);
-                return NULL;
-            }
-            mst = mst->next;
-        }
-    }
 
     out_traces = Py_BuildValue("[]");
 
@@ -79,7 +40,7 @@ mseed_get_traces (PyObject *dummy, PyObject *args)
 
     while (mst) {
         
-        if (unpackdata == Py_True) {
+        if (unpackdata) {
             array_dims[0] = mst->numsamples;
             switch (mst->sampletype) {
                 case 'i':
@@ -128,45 +89,426 @@ mseed_get_traces (PyObject *dummy, PyObject *args)
         mst = mst->next;
     }
 
+    return out_traces;
+}
+
+
+static PyObject*
+mseed_get_traces (PyObject *dummy, PyObject *args)
+{
+    char          *filename;
+    MSTraceGroup  *mstg = NULL;
+    MSTrace       *mst = NULL;
+    int           retcode;
+    PyObject      *out_traces = NULL;
+    char          strbuf[BUFSIZE];
+    PyObject      *unpackdata = NULL;
+
+    (void) dummy; /* silence warning */
+
+    if (!PyArg_ParseTuple(args, "sO", &filename, &unpackdata)) {
+        PyErr_SetString(MSeedError, "usage get_traces(filename, dataflag)" );
+        return NULL;
+    }
+
+    if (!PyBool_Check(unpackdata)) {
+        PyErr_SetString(MSeedError, "Second argument must be a boolean" );
+        return NULL;
+    }
+  
+    /* get data from mseed file (ms_readtraces is thread safe) */
+    Py_BEGIN_ALLOW_THREADS
+    retcode = ms_readtraces (&mstg, filename, 0, -1.0, -1.0, 0, 1, (unpackdata == Py_True), 0);
+    Py_END_ALLOW_THREADS
+    if ( retcode < 0 ) {
+        snprintf (strbuf, BUFSIZE, "Cannot read file '%s': %s", filename, ms_errorstr(retcode));
+        PyErr_SetString(MSeedError, strbuf);
+        return NULL;
+    }
+
+    if ( ! mstg ) {
+        snprintf (strbuf, BUFSIZE, "Error reading file");
+        PyErr_SetString(MSeedError, strbuf);
+        return NULL;
+    }
+
+    /* check that there is data in the traces */
+    if (unpackdata == Py_True) {
+        mst = mstg->traces;
+        while (mst) {
+            if (mst->datasamples == NULL) {
+                snprintf (strbuf, BUFSIZE, "Error reading file - datasamples is NULL");
+                PyErr_SetString(MSeedError, strbuf);
+                return NULL;
+            }
+            mst = mst->next;
+        }
+    }
+
+    out_traces = mstg_to_list(mstg, unpackdata == Py_True);
+
     mst_freegroup (&mstg);
 
     return out_traces;
 }
 
+static PyObject*
+mseed_get_record_index (PyObject *dummy, PyObject *args)
+{
+    char          *filename;
+    MSFileParam   *msfp = NULL;
+    MSRecord      *msr = NULL;
+    off_t         fpos = 0;
+    int           retcode;
+    PyObject      *out_records = NULL;
+    PyObject      *out_record = NULL;
+    char          strbuf[BUFSIZE];
+
+    (void) dummy; /* silence warning */
+
+    if (!PyArg_ParseTuple(args, "s", &filename)) {
+        PyErr_SetString(MSeedError, "usage get_record_index(filename)" );
+        return NULL;
+    }
+
+    out_records = Py_BuildValue("[]");
+
+    while ((retcode = ms_readmsr_r(&msfp, &msr, filename, 0, &fpos, NULL, 1, 0, 0)) == MS_NOERROR) {
+        out_record = Py_BuildValue( "(L,i,s,s,s,s,L,L,d,L)",
+                                    (long long)fpos,
+                                    msr->reclen,
+                                    msr->network,
+                                    msr->station,
+                                    msr->location,
+                                    msr->channel,
+                                    msr->starttime,
+                                    msr_endtime(msr),
+                                    msr->samprate,
+                                    (long long)msr->samplecnt );
+
+        PyList_Append(out_records, out_record);
+        Py_DECREF(out_record);
+    }
+
+    ms_readmsr_r(&msfp, &msr, NULL, 0, NULL, NULL, 0, 0, 0);
+
+    if ( retcode != MS_ENDOFFILE ) {
+        snprintf (strbuf, BUFSIZE, "Cannot read file '%s': %s", filename, ms_errorstr(retcode));
+        PyErr_SetString(MSeedError, strbuf);
+        Py_DECREF(out_records);
+        return NULL;
+    }
+
+    return out_records;
+}
+
+
+static PyObject*
+mseed_get_traces_records (PyObject *dummy, PyObject *args)
+{
+    char          *filename;
+    PyObject      *in_offsets = NULL;
+    PyObject      *in_reclens = NULL;
+    PyObject      *unpackdata = NULL;
+    PyObject      *out_traces = NULL;
+    MSTraceGroup  *mstg = NULL;
+    MSRecord      *msr = NULL;
+    long long     *offsets = NULL;
+    int           *reclens = NULL;
+    Py_ssize_t    i, nrecords;
+    int           fd;
+    struct stat   st;
+    char          *base = NULL;
+    int           retcode = MS_NOERROR;
+    int           bad_range = 0;
+    char          strbuf[BUFSIZE];
+
+    (void) dummy; /* silence warning */
+
+    if (!PyArg_ParseTuple(args, "sOOO", &filename, &in_offsets, &in_reclens, &unpackdata)) {
+        PyErr_SetString(MSeedError, "usage get_traces_records(filename, offsets, reclens, dataflag)" );
+        return NULL;
+    }
+
+    if (!PyBool_Check(unpackdata)) {
+        PyErr_SetString(MSeedError, "Fourth argument must be a boolean" );
+        return NULL;
+    }
+
+    if (!PySequence_Check(in_offsets) || !PySequence_Check(in_reclens) ||
+            PySequence_Length(in_offsets) != PySequence_Length(in_reclens)) {
+        PyErr_SetString(MSeedError, "Offsets and reclens must be sequences of equal length." );
+        return NULL;
+    }
+
+    nrecords = PySequence_Length(in_offsets);
+    offsets = (long long*)calloc(nrecords+1, sizeof(long long));
+    reclens = (int*)calloc(nrecords+1, sizeof(int));
+    if (offsets == NULL || reclens == NULL) {
+        free(offsets);
+        free(reclens);
+        return PyErr_NoMemory();
+    }
+
+    for (i=0; i<nrecords; i++) {
+        PyObject *o = PySequence_GetItem(in_offsets, i);
+        PyObject *r = PySequence_GetItem(in_reclens, i);
+        offsets[i] = PyLong_AsLongLong(o);
+        reclens[i] = (int)PyInt_AsLong(r);
+        Py_XDECREF(o);
+        Py_XDECREF(r);
+    }
+
+    if (PyErr_Occurred()) {
+        free(offsets);
+        free(reclens);
+        return NULL;
+    }
+
+    fd = open(filename, O_RDONLY);
+    if (fd == -1 || fstat(fd, &st) == -1) {
+        snprintf (strbuf, BUFSIZE, "Cannot open file '%s'", filename);
+        PyErr_SetString(MSeedError, strbuf);
+        if (fd != -1) close(fd);
+        free(offsets);
+        free(reclens);
+        return NULL;
+    }
+
+    if (st.st_size > 0) {
+        /* private mapping: libmseed may byte-swap in place */
+        base = mmap(NULL, st.st_size, PROT_READ | PROT_WRITE, MAP_PRIVATE, fd, 0);
+    }
+    close(fd);
+
+    if (base == MAP_FAILED) {
+        snprintf (strbuf, BUFSIZE, "Cannot map file '%s'", filename);
+        PyErr_SetString(MSeedError, strbuf);
+        free(offsets);
+        free(reclens);
+        return NULL;
+    }
+
+    mstg = mst_initgroup(NULL);
+
+    Py_BEGIN_ALLOW_THREADS
+    for (i=0; i<nrecords; i++) {
+        if (offsets[i] < 0 || reclens[i] <= 0 ||
+                offsets[i] + reclens[i] > (long long)st.st_size) {
+            bad_range = 1;
+            break;
+        }
+
+        retcode = msr_unpack(base + offsets[i], reclens[i], &msr, (unpackdata == Py_True), 0);
+        if (retcode != MS_NOERROR) {
+            break;
+        }
+
+        mst_addmsrtogroup(mstg, msr, 0, -1.0, -1.0);
+    }
+    Py_END_ALLOW_THREADS
+
+    msr_free(&msr);
+    if (base != NULL) {
+        munmap(base, st.st_size);
+    }
+    free(offsets);
+    free(reclens);
+
+    if (bad_range) {
+        snprintf (strbuf, BUFSIZE, "Record out of range in file '%s' (file may have changed)", filename);
+        PyErr_SetString(MSeedError, strbuf);
+        mst_freegroup(&mstg);
+        return NULL;
+    }
+
+    if (retcode != MS_NOERROR) {
+        snprintf (strbuf, BUFSIZE, "Cannot read file '%s': %s", filename, ms_errorstr(retcode));
+        PyErr_SetString(MSeedError, strbuf);
+        mst_freegroup(&mstg);
+        return NULL;
+    }
+
+    out_traces = mstg_to_list(mstg, unpackdata == Py_True);
+    mst_freegroup(&mstg);
+
+    return out_traces;
+}
+
+
 static void record_handler (char *record, int reclen, void *outfile) {    
     if ( fwrite(record, reclen, 1, outfile) != 1 ) {
       fprintf(stderr, "Error writing mseed record to output file\n");
     }
 }
 
+typedef struct {
+    char    *data;
+    size_t  size;
+    size_t  capacity;
+    int     failed;
+} RecordBuffer;
+
+static void record_buffer_handler (char *record, int reclen, void *buffer) {
+    RecordBuffer *buf = (RecordBuffer*)buffer;
+    char *newdata;
+    size_t newcapacity;
+
+    if (buf->failed) return;
+
+    if (buf->size + reclen > buf->capacity) {
+        newcapacity = buf->capacity * 2;
+        if (newcapacity < buf->size + reclen) {
+            newcapacity = buf->size + reclen;
+        }
+        newdata = realloc(buf->data, newcapacity);
+        if (newdata == NULL) {
+            buf->failed = 1;
+            return;
+        }
+        buf->data = newdata;
+        buf->capacity = newcapacity;
+    }
+    memcpy(buf->data + buf->size, record, reclen);
+    buf->size += reclen;
+}
+
+static int
+steim_encoding (int steim) {
+    switch (steim) {
+        case 1:
+            return DE_STEIM1;
+        case 2:
+            return DE_STEIM2;
+        default:
+            return -1;
+    }
+}
+
+/* Convert trace tuple to MSTrace. Returns NULL and sets a Python exception
+   on error. */
+static MSTrace*
+tuple_to_mst (PyObject *in_trace, int steim, int *msdetype)
+{
+    MSTrace       *mst = NULL;
+    PyObject      *array = NULL;
+    PyArrayObject *contiguous_array = NULL;
+    char          *network, *station, *location, *channel;
+    char          mstype;
+    int           numpytype;
+    int           length;
+
+    if (!PyTuple_Check(in_trace)) {
+        PyErr_SetString(MSeedError, "Trace record must be a tuple of (network, station, location, channel, starttime, endtime, samprate, data)." );
+        return NULL;
+    }
+    mst = mst_init (NULL);
+    
+    if (!PyArg_ParseTuple(in_trace, "ssssLLdO",
+                                &network,
+                                &station,
+                                &location,
+                                &channel,
+                                &(mst->starttime),
+                                &(mst->endtime),
+                                &(mst->samprate),
+                                &array )) {
+        PyErr_SetString(MSeedError, "Trace record must be a tuple of (network, station, location, channel, starttime, endtime, samprate, data)." );
+        mst_free( &mst );  
+        return NULL;
+    }
+
+    strncpy( mst->network, network, 10);
+    strncpy( mst->station, station, 10);
+    strncpy( mst->location, location, 10);
+    strncpy( mst->channel, channel, 10);
+    mst->network[10] = '\0';
+    mst->station[10] = '\0';
+    mst->location[10] ='\0';
+    mst->channel[10] = '\0';
+
+    if (!PyArray_Check(array)) {
+        PyErr_SetString(MSeedError, "Data must be given as NumPy array." );
+        mst_free( &mst );
+        return NULL;
+    }
+    if (PyArray_ISBYTESWAPPED((PyArrayObject*)array)) {
+        PyErr_SetString(MSeedError, "Data must be given in machine byte-order" );
+        mst_free( &mst );
+        return NULL;
+    }
+
+    numpytype = PyArray_TYPE((PyArrayObject*)array);
+    switch (numpytype) {
+            case NPY_INT32:
+                assert( ms_samplesize('i') == 4 );
+                mstype = 'i';
+                *msdetype = steim_encoding(steim);
+                break;
+            case NPY_INT8:
+                assert( ms_samplesize('a') == 1 );
+                mstype = 'a';
+                *msdetype = DE_ASCII;
+                break;
+            case NPY_FLOAT32:
+                assert( ms_samplesize('f') == 4 );
+                mstype = 'f';
+                *msdetype = DE_FLOAT32;
+                break;
+            case NPY_FLOAT64:
+                assert( ms_samplesize('d') == 8 );
+                mstype = 'd';
+                *msdetype = DE_FLOAT64;
+                break;
+            default:
+                PyErr_SetString(MSeedError, "Data must be of type float64, float32, int32 or int8.");
+                mst_free( &mst );  
+                return NULL;
+        }
+    mst->sampletype = mstype;
+
+    contiguous_array = PyArray_GETCONTIGUOUS((PyArrayObject*)array);
+
+    length = PyArray_SIZE(contiguous_array);
+    mst->numsamples = length;
+    mst->samplecnt = length;
+
+    mst->datasamples = calloc(length,ms_samplesize(mstype));
+    memcpy(mst->datasamples, PyArray_DATA(contiguous_array), length*ms_samplesize(mstype));
+    Py_DECREF(contiguous_array);
+
+    return mst;
+}
+
 static PyObject*
 mseed_store_traces (PyObject *dummy, PyObject *args)
 {
     char          *filename;
     MSTrace       *mst = NULL;
-    PyObject      *array = NULL;
     PyObject      *in_traces = NULL;
     PyObject      *in_trace = NULL;
-    PyArrayObject *contiguous_array = NULL;
     int           i;
-    char          *network, *station, *location, *channel;
-    char          mstype;
     int           msdetype;
     int64_t       psamples;
-    int           numpytype;
-    int           length;
+    int           reclen = 4096;
+    int           steim = 1;
     FILE          *outfile;
 
     (void) dummy; /* silence warning */
 
-    if (!PyArg_ParseTuple(args, "Os", &in_traces, &filename)) {
-        PyErr_SetString(MSeedError, "usage store_traces(traces, filename)" );
+    if (!PyArg_ParseTuple(args, "Os|ii", &in_traces, &filename,
+                          &reclen, &steim)) {
+        PyErr_SetString(MSeedError, "usage store_traces(traces, filename[, reclen, steim])" );
         return NULL;
     }
     if (!PySequence_Check( in_traces )) {
         PyErr_SetString(MSeedError, "Traces is not of sequence type." );
         return NULL;
     }
+    if (steim_encoding(steim) == -1) {
+        PyErr_SetString(MSeedError, "Steim compression level must be 1 or 2." );
+        return NULL;
+    }
 
     outfile = fopen(filename, "w" );
     if (outfile == NULL) {
@@ -177,99 +519,94 @@ mseed_store_traces (PyObject *dummy, PyObject *args)
     for (i=0; i<PySequence_Length(in_traces); i++) {
         
         in_trace = PySequence_GetItem(in_traces, i);
-        if (!PyTuple_Check(in_trace)) {
-            PyErr_SetString(MSeedError, "Trace record must be a tuple of (network, station, location, channel, starttime, endtime, samprate, data)." );
-            Py_DECREF(in_trace);
-            return NULL;
-        }
-        mst = mst_init (NULL);
-        
-        if (!PyArg_ParseTuple(in_trace, "ssssLLdO",
-                                    &network,
-                                    &station,
-                                    &location,
-                                    &channel,
-                                    &(mst->starttime),
-                                    &(mst->endtime),
-                                    &(mst->samprate),
-                                    &array )) {
-            PyErr_SetString(MSeedError, "Trace record must be a tuple of (network, station, location, channel, starttime, endtime, samprate, data)." );
-            mst_free( &mst );  
-            Py_DECREF(in_trace);
+        mst = tuple_to_mst(in_trace, steim, &msdetype);
+        Py_DECREF(in_trace);
+        if (mst == NULL) {
+            fclose( outfile );
             return NULL;
         }
 
-        strncpy( mst->network, network, 10);
-        strncpy( mst->station, station, 10);
-        strncpy( mst->location, location, 10);
-        strncpy( mst->channel, channel, 10);
-        mst->network[10] = '\0';
-        mst->station[10] = '\0';
-        mst->location[10] ='\0';
-        mst->channel[10] = '\0';
-
-        if (!PyArray_Check(array)) {
-            PyErr_SetString(MSeedError, "Data must be given as NumPy array." );
-            mst_free( &mst );
-            Py_DECREF(in_trace);
-            return NULL;
-        }
-        if (PyArray_ISBYTESWAPPED((PyArrayObject*)array)) {
-            PyErr_SetString(MSeedError, "Data must be given in machine byte-order" );
-            mst_free( &mst );
-            Py_DECREF(in_trace);
-            return NULL;
-        }
+        mst_pack (mst, &record_handler, outfile, reclen, msdetype,
+                                     1, &psamples, 1, 0, NULL);
+        mst_free( &mst );
+    }
+    fclose( outfile );
 
-        numpytype = PyArray_TYPE((PyArrayObject*)array);
-        switch (numpytype) {
-                case NPY_INT32:
-                    assert( ms_samplesize('i') == 4 );
-                    mstype = 'i';
-                    msdetype = DE_STEIM1;
-                    break;
-                case NPY_INT8:
-                    assert( ms_samplesize('a') == 1 );
-                    mstype = 'a';
-                    msdetype = DE_ASCII;
-                    break;
-                case NPY_FLOAT32:
-                    assert( ms_samplesize('f') == 4 );
-                    mstype = 'f';
-                    msdetype = DE_FLOAT32;
-                    break;
-                case NPY_FLOAT64:
-                    assert( ms_samplesize('d') == 8 );
-                    mstype = 'd';
-                    msdetype = DE_FLOAT64;
-                    break;
-                default:
-                    PyErr_SetString(MSeedError, "Data must be of type float64, float32, int32 or int8.");
-                    mst_free( &mst );  
-                    Py_DECREF(in_trace);
-                    return NULL;
-            }
-        mst->sampletype = mstype;
+    Py_INCREF(Py_None);
+    return Py_None;
+}
+
+static PyObject*
+mseed_pack_records (PyObject *dummy, PyObject *args)
+{
+    MSTrace       *mst = NULL;
+    MSRecord      *msr = NULL;
+    PyObject      *in_trace = NULL;
+    PyObject      *out = NULL;
+    RecordBuffer  buf;
+    int           msdetype;
+    int64_t       psamples = 0;
+    int           reclen = 4096;
+    int           steim = 1;
+    int           flush = 1;
+    int           seqnum = 1;
+    int           nrecords;
 
-        contiguous_array = PyArray_GETCONTIGUOUS((PyArrayObject*)array);
+    (void) dummy; /* silence warning */
 
-        length = PyArray_SIZE(contiguous_array);
-        mst->numsamples = length;
-        mst->samplecnt = length;
+    if (!PyArg_ParseTuple(args, "Oiiii", &in_trace, &reclen, &steim, &flush,
+                          &seqnum)) {
+        PyErr_SetString(MSeedError, "usage pack_records(trace, reclen, steim, flush, seqnum)" );
+        return NULL;
+    }
+    if (steim_encoding(steim) == -1) {
+        PyErr_SetString(MSeedError, "Steim compression level must be 1 or 2." );
+        return NULL;
+    }
 
-        mst->datasamples = calloc(length,ms_samplesize(mstype));
-        memcpy(mst->datasamples, PyArray_DATA(contiguous_array), length*ms_samplesize(mstype));
-        Py_DECREF(contiguous_array);
+    mst = tuple_to_mst(in_trace, steim, &msdetype);
+    if (mst == NULL) {
+        return NULL;
+    }
 
-        mst_pack (mst, &record_handler, outfile, 4096, msdetype,
-                                     1, &psamples, 1, 0, NULL);
+    /* template carrying the record sequence number */
+    msr = msr_init (NULL);
+    if (msr == NULL) {
         mst_free( &mst );
-        Py_DECREF(in_trace);
+        PyErr_SetString(MSeedError, "Error initializing record template.");
+        return NULL;
+    }
+    msr->dataquality = 'D';
+    strcpy (msr->network, mst->network);
+    strcpy (msr->station, mst->station);
+    strcpy (msr->location, mst->location);
+    strcpy (msr->channel, mst->channel);
+    msr->sequence_number = seqnum;
+
+    buf.data = NULL;
+    buf.size = 0;
+    buf.capacity = 0;
+    buf.failed = 0;
+
+    Py_BEGIN_ALLOW_THREADS
+    nrecords = mst_pack (mst, &record_buffer_handler, &buf, reclen, msdetype,
+                         1, &psamples, flush, 0, msr);
+    Py_END_ALLOW_THREADS
+
+    seqnum = msr->sequence_number;
+    msr_free( &msr );
+    mst_free( &mst );
+
+    if (nrecords < 0 || buf.failed) {
+        free(buf.data);
+        PyErr_SetString(MSeedError, "Error packing records.");
+        return NULL;
     }
-    fclose( outfile );
 
-    Py_INCREF(Py_None);
-    return Py_None;
+    out = Py_BuildValue("(s#Li)", buf.data ? buf.data : "", (int)buf.size,
+                        (long long)psamples, seqnum);
+    free(buf.data);
+    return out;
 }
 
 
@@ -286,7 +623,32 @@ static PyMethodDef MSEEDMethods[] = {
     "data. If dataflag is False, the data is not unpacked and `data` is None.\n" },
 
     {"store_traces",  mseed_store_traces, METH_VARARGS, 
-    "store_traces(traces, filename)\n" },
+    "store_traces(traces, filename[, reclen, steim])\n" },
+
+    {"pack_records",  mseed_pack_records, METH_VARARGS,
+    "pack_records(trace, reclen, steim, flush, seqnum)\n"
+    "Pack trace data into mseed records in memory.\n\n"
+    "The trace is given as a tuple as for store_traces. If flush is zero,\n"
+    "only completely filled records are produced. Returns a tuple\n\n"
+    "  (records, npacked, seqnum)\n\n"
+    "with the packed records as a string, the number of samples packed\n"
+    "and the sequence number to be used for the next record.\n" },
+
+    {"get_record_index",  mseed_get_record_index, METH_VARARGS,
+    "get_record_index(filename)\n"
+    "Get index of the data records in an mseed file.\n\n"
+    "Returns a list of tuples, one tuple for each data record in the file.\n"
+    "Each tuple has 10 elements:\n\n"
+    "  (offset, reclen, network, station, location, channel,\n"
+    "    starttime, endtime, samprate, samplecnt)\n\n"
+    "The data samples are not unpacked.\n" },
+
+    {"get_traces_records",  mseed_get_traces_records, METH_VARARGS,
+    "get_traces_records(filename, offsets, reclens, dataflag)\n"
+    "Get traces from selected records of an mseed file.\n\n"
+    "Only the records at the given byte offsets, with the given record\n"
+    "lengths, are unpacked from the memory-mapped file (e.g. as obtained with\n"
+    "get_record_index). Returns a list of tuples as get_traces does.\n" },
 
     {NULL, NULL, 0, NULL}        /* Sentinel */
 };
@@ -1,7 +1,9 @@
 import Queue
 import multiprocessing
+import time
 import traceback
 import errno
+import cPickle as pickle
 
 
 def worker(q_in, q_out, function, eprintignore, pshared):
@@ -21,17 +23,70 @@ def worker(q_in, q_out, function, eprintignore, pshared):
             if eprintignore is not None and not isinstance(e, eprintignore):
                 traceback.print_exc()
 
+            try:
+                pickle.dumps(e)
+            except Exception:
+                # exception could not be sent to the parent process
+                e = Exception('%s: %s' % (e.__class__.__name__, str(e)))
+
         q_out.put((i, r, e))
 
 
+def drain(q):
+    while True:
+        try:
+            q.get_nowait()
+        except (Queue.Empty, IOError):
+            break
+
+
+def shutdown(procs, q_in, q_out, sentinels_sent, timeout):
+    # Let the workers finish their current task and exit on a sentinel. Only
+    # those still running after the timeout are terminated. Results are
+    # drained meanwhile, because a worker does not exit before its results
+    # are flushed to the pipe.
+
+    deadline = time.time() + timeout
+    if not sentinels_sent:
+        for p in procs:
+            while time.time() < deadline:
+                try:
+                    q_in.put((None, None), timeout=0.05)
+                    break
+                except Queue.Full:
+                    drain(q_out)
+
+        q_in.close()
+
+    for p in procs:
+        while p.is_alive() and time.time() < deadline:
+            drain(q_out)
+            p.join(0.05)
+
+    for p in procs:
+        if p.is_alive():
+            p.terminate()
+
+        p.join()
+
+
 def parimap(function, *iterables, **kwargs):
     assert all(
-        k in ('nprocs', 'eprintignore', 'pshared') for k in kwargs.keys())
+        k in ('nprocs', 'eprintignore', 'pshared', 'ordered',
+              'shutdown_timeout')
+        for k in kwargs.keys())
 
     nprocs = kwargs.get('nprocs', None)
     eprintignore = kwargs.get('eprintignore', 'all')
     pshared = kwargs.get('pshared', None)
 
+    # with ordered=False, results are yielded as soon as they arrive
+    ordered = kwargs.get('ordered', True)
+
+    # when the consumer stops early, workers get this many seconds to finish
+    # their current task before they are terminated
+    shutdown_timeout = kwargs.get('shutdown_timeout', 10.)
+
     if eprintignore == 'all':
         eprintignore = None
 
@@ -62,54 +117,49 @@ def parimap(function, *iterables, **kwargs):
     all_written = False
     error_ahead = False
     iterables = map(iter, iterables)
-    while True:
-        if nrun < nprocs and not all_written and not error_ahead:
-            args = tuple(it.next() for it in iterables)
-            if len(args) == len(iterables):
-                if len(procs) < nrun + 1:
-                    p = multiprocessing.Process(
-                        target=worker,
-                        args=(q_in, q_out, function, eprintignore, pshared))
-                    p.daemon = True
-                    p.start()
-                    procs.append(p)
-
-                q_in.put((nwritten, args))
-                nwritten += 1
-                nrun += 1
-            else:
-                all_written = True
-                [q_in.put((None, None)) for p in procs]
-                q_in.close()
-
-        try:
-            while nrun > 0:
-                if nrun < nprocs and not all_written and not error_ahead:
-                    results.append(q_out.get_nowait())
+    try:
+        while True:
+            if nrun < nprocs and not all_written and not error_ahead:
+                args = tuple(it.next() for it in iterables)
+                if len(args) == len(iterables):
+                    if len(procs) < nrun + 1:
+                        p = multiprocessing.Process(
+                            target=worker,
+                            args=(q_in, q_out, function, eprintignore,
+                                  pshared))
+                        p.daemon = True
+                        p.start()
+                        procs.append(p)
+
+                    q_in.put((nwritten, args))
+                    nwritten += 1
+                    nrun += 1
                 else:
-                    while True:
-                        try:
-                            results.append(q_out.get())
-                            break
-                        except IOError, e:
-                            if e.errno != errno.EINTR:
-                                raise
-
-                nrun -= 1
-
-        except Queue.Empty:
-            pass
-
-        if results:
-            results.sort()
-            # check for error ahead to prevent further enqueuing
-            if any(e for (_, _, e) in results):
-                error_ahead = True
-
-            while results:
-                (i, r, e) = results[0]
-                if i == iout:
-                    results.pop(0)
+                    all_written = True
+                    [q_in.put((None, None)) for p in procs]
+                    q_in.close()
+
+            try:
+                while nrun > 0:
+                    if nrun < nprocs and not all_written and not error_ahead:
+                        results.append(q_out.get_nowait())
+                    else:
+                        while True:
+                            try:
+                                results.append(q_out.get())
+                                break
+                            except IOError, e:
+                                if e.errno != errno.EINTR:
+                                    raise
+
+                    nrun -= 1
+
+            except Queue.Empty:
+                pass
+
+            if results and not ordered:
+                while results:
+                    (i, r, e) = results.pop(0)
                     if e:
                         if not all_written:
                             [q_in.put((None, None)) for p in procs]
@@ -118,11 +168,34 @@ def parimap(function, *iterables, **kwargs):
                     else:
                         yield r
 
-                    iout += 1
-                else:
-                    break
+            if results:
+                results.sort()
+                # check for error ahead to prevent further enqueuing
+                if any(e for (_, _, e) in results):
+                    error_ahead = True
+
+                while results:
+                    (i, r, e) = results[0]
+                    if i == iout:
+                        results.pop(0)
+                        if e:
+                            if not all_written:
+                                [q_in.put((None, None)) for p in procs]
+                                q_in.close()
+                            raise e
+                        else:
+                            yield r
+
+                        iout += 1
+                    else:
+                        break
 
-        if all_written and nrun == 0:
-            break
+            if all_written and nrun == 0:
+                break
+
+    except GeneratorExit:
+        # consumer stopped early, e.g. on user abort
+        shutdown(procs, q_in, q_out, all_written, shutdown_timeout)
+        raise
 
     [p.join() for p in procs]
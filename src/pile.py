@@ -9,12 +9,18 @@ import sys
 import operator
 import math
 import cPickle as pickle
+import sqlite3
+import threading
+from collections import OrderedDict
+from multiprocessing.pool import ThreadPool
 
+import numpy as num
 import avl
 
-from pyrocko import trace, io, util
+from pyrocko import trace, io, util, mseed
 from pyrocko import config
 from pyrocko.trace import degapper
+from pyrocko.parimap import parimap
 
 
 def sl(s):
@@ -130,26 +136,289 @@ class Sorted(object):
         return len(self._avl)
 
 
+class TimeIndex(object):
+    '''Sorted-array index for time span overlap queries.
+
+    The index is built in bulk from a sequence of objects with ``tmin`` and
+    ``tmax`` attributes, which must be sorted by ``tmin``. Besides the start
+    and end times, the running maximum of the end times is kept, so that
+    the range of candidate objects can be found by bisection also when a few
+    very long objects are present. The remaining candidates are checked in a
+    single vectorized operation.
+
+    Objects added with :py:meth:`insert` are collected in an unsorted tail,
+    which is scanned in a vectorized operation on each query, and objects
+    given to :py:meth:`remove` are only marked as removed. The sorted arrays
+    are rebuilt when the tail or the number of removed objects exceeds a
+    fraction of the index size, so that interleaved modifications and
+    queries stay cheap. The time attributes of indexed objects must not be
+    modified.
+    '''
+
+    nmerge_min = 64
+    merge_fraction = 0.1
+
+    def __init__(self, values):
+        self._set_sorted(list(values))
+
+    def _set_sorted(self, values):
+        self._values = values
+        n = len(values)
+        self._tmins = num.fromiter(
+            (float(v.tmin) for v in values), dtype=num.float, count=n)
+        self._tmaxs = num.fromiter(
+            (float(v.tmax) for v in values), dtype=num.float, count=n)
+        self._tmaxs_cummax = num.maximum.accumulate(self._tmaxs)
+        self._tail = []
+        self._tail_tmins = num.zeros(self.nmerge_min, dtype=num.float)
+        self._tail_tmaxs = num.zeros(self.nmerge_min, dtype=num.float)
+        self._removed = set()
+
+    def _nmerge(self):
+        return max(self.nmerge_min, int(len(self._values)*self.merge_fraction))
+
+    def _merge(self):
+        removed = self._removed
+        values = [v for v in self._values + self._tail
+                  if id(v) not in removed]
+
+        tmins = num.fromiter(
+            (float(v.tmin) for v in values), dtype=num.float,
+            count=len(values))
+
+        order = num.argsort(tmins, kind='mergesort')
+        self._set_sorted([values[i] for i in order])
+
+    def insert(self, values):
+        '''Add objects to the index.'''
+
+        removed = self._removed
+        for v in values:
+            if id(v) in removed:
+                # the object is still in the index, it must not be doubled
+                self._merge()
+                removed = self._removed
+
+            n = len(self._tail)
+            if n == self._tail_tmins.size:
+                self._tail_tmins = num.resize(self._tail_tmins, 2*n)
+                self._tail_tmaxs = num.resize(self._tail_tmaxs, 2*n)
+
+            self._tail.append(v)
+            self._tail_tmins[n] = float(v.tmin)
+            self._tail_tmaxs[n] = float(v.tmax)
+
+        if len(self._tail) > self._nmerge():
+            self._merge()
+
+    def remove(self, values):
+        '''Remove objects from the index.'''
+
+        self._removed.update(id(v) for v in values)
+        if len(self._removed) > self._nmerge():
+            self._merge()
+
+    def overlapping(self, tmin, tmax):
+        '''Get objects which may overlap with the given time span.
+
+        The returned candidates are sorted by ``tmin``. The span is slightly
+        widened to account for rounding of high-precision times, so callers
+        should do an exact check on the results.
+        '''
+
+        tmin = float(tmin)
+        tmax = float(tmax)
+        eps = 1e-15 * max(abs(tmin), abs(tmax))
+        tmin -= eps
+        tmax += eps
+
+        ilo = num.searchsorted(self._tmaxs_cummax, tmin, 'left')
+        ihi = num.searchsorted(self._tmins, tmax, 'right')
+        if ihi > ilo:
+            ii = ilo + num.nonzero(self._tmaxs[ilo:ihi] >= tmin)[0]
+            values = self._values
+            candidates = [values[i] for i in ii]
+        else:
+            candidates = []
+
+        ntail = len(self._tail)
+        if ntail:
+            ii = num.nonzero(num.logical_and(
+                self._tail_tmins[:ntail] <= tmax,
+                self._tail_tmaxs[:ntail] >= tmin))[0]
+
+            if ii.size:
+                tail = self._tail
+                candidates.extend(tail[i] for i in ii)
+                candidates.sort(key=lambda v: v.tmin)
+
+        if self._removed:
+            removed = self._removed
+            candidates = [v for v in candidates if id(v) not in removed]
+
+        return candidates
+
+    def __len__(self):
+        return len(self._values) + len(self._tail) - len(self._removed)
+
+
+class DataCache(object):
+    '''Memory-bounded LRU cache for waveform data of loaded files.
+
+    When the data of a :py:class:`TracesFile` is no longer in use by any
+    accessor (see :py:meth:`TracesFile.drop_data`), it is not forgotten
+    immediately but kept as long as the total size of all loaded data does
+    not exceed :py:attr:`max_bytes`. If the budget is exceeded, idle files
+    are evicted in least recently used order. Data which is in use is never
+    evicted.
+
+    A single global instance is shared by all piles, see
+    :py:func:`get_data_cache`. With the default budget of zero, data is
+    dropped as soon as it is no longer in use.
+    '''
+
+    def __init__(self, max_bytes=0):
+        self.max_bytes = max_bytes
+        self._nbytes = {}
+        self._idle = OrderedDict()
+        self.nbytes_resident = 0
+        self.nbytes_idle = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def set_max_bytes(self, max_bytes):
+        '''Set memory budget [bytes] and evict idle data as needed.'''
+
+        self.max_bytes = max_bytes
+        self._evict()
+
+    def loaded(self, file):
+        '''Register data which has just been read from a file.'''
+
+        self.misses += 1
+        idle = file in self._idle
+        self.forget(file)
+        nbytes = sum(
+            tr.ydata.nbytes for tr in file.traces if tr.ydata is not None)
+
+        self._nbytes[file] = nbytes
+        self.nbytes_resident += nbytes
+        if idle:
+            self._idle[file] = True
+            self.nbytes_idle += nbytes
+
+        self._evict()
+
+    def reused(self, file):
+        '''Register a request for data which is already loaded.'''
+
+        self.hits += 1
+        if file in self._idle:
+            del self._idle[file]
+            self.nbytes_idle -= self._nbytes[file]
+
+    def release(self, file):
+        '''Mark data of a file as no longer being in use.'''
+
+        if file not in self._nbytes:
+            file.forget_data()
+            return
+
+        if file in self._idle:
+            del self._idle[file]
+        else:
+            self.nbytes_idle += self._nbytes[file]
+
+        self._idle[file] = True
+        self._evict()
+
+    def forget(self, file):
+        '''Remove file from cache bookkeeping without touching its data.'''
+
+        if file in self._idle:
+            del self._idle[file]
+            self.nbytes_idle -= self._nbytes[file]
+
+        if file in self._nbytes:
+            self.nbytes_resident -= self._nbytes.pop(file)
+
+    def clear(self):
+        '''Evict all idle data.'''
+
+        while self._idle:
+            self._evict_one()
+
+    def stats(self):
+        '''Get cache statistics as a dict.'''
+
+        return dict(
+            max_bytes=self.max_bytes,
+            nbytes_resident=self.nbytes_resident,
+            nbytes_idle=self.nbytes_idle,
+            nfiles_resident=len(self._nbytes),
+            nfiles_idle=len(self._idle),
+            hits=self.hits,
+            misses=self.misses,
+            evictions=self.evictions)
+
+    def _evict(self):
+        while self._idle and (
+                self.max_bytes <= 0 or self.nbytes_resident > self.max_bytes):
+
+            self._evict_one()
+
+    def _evict_one(self):
+        file, _ = self._idle.popitem(last=False)
+        nbytes = self._nbytes.pop(file)
+        self.nbytes_idle -= nbytes
+        self.nbytes_resident -= nbytes
+        self.evictions += 1
+        file.forget_data()
+
+
+g_data_cache = DataCache()
+
+
+def get_data_cache():
+    '''Get global :py:class:`DataCache` object.'''
+    return g_data_cache
+
+
 class TracesFileCache(object):
     '''Manages trace metainformation cache.
 
-    For each directory with files containing traces, one cache file is
-    maintained to hold the trace metainformation of all files which are
-    contained in the directory.
+    The trace metainformation of all files is kept in a single SQLite
+    database in the cache directory. For each file, one row is maintained in
+    the ``files`` table, holding the file's modification time and its pickled
+    header-only :py:class:`TracesFile` object. The individual trace headers
+    are additionally entered into the ``traces`` table, which is indexed by
+    network, station, location and channel codes and by time span, so that
+    the contents of an archive can be queried without unpickling every file
+    entry (see :py:meth:`relevant_abspaths`).
+
+    Entries are looked up and written per file. When a pile is opened over
+    an archive, files which are unchanged since they have been cached are
+    only checked with a cheap index lookup (see :py:meth:`get_info`). They
+    are entered into the pile in deferred form, and their cache entries are
+    unpickled only when they are needed (see :py:meth:`Pile.add_deferred`).
     '''
 
     caches = {}
 
+    database_filename = 'traces.sqlite'
+    schema_version = 2
+
     def __init__(self, cachedir):
         '''Create new cache.
 
-        :param cachedir: directory to hold the cache files.
+        :param cachedir: directory to hold the cache database.
 
         '''
 
         self.cachedir = cachedir
-        self.dircaches = {}
-        self.modified = set()
+        self.modified = {}
+        self._local = threading.local()
         util.ensuredir(self.cachedir)
 
     def get(self, abspath):
@@ -162,10 +431,39 @@ class TracesFileCache(object):
 
         '''
 
-        dircache = self._get_dircache_for(abspath)
-        if abspath in dircache:
-            return dircache[abspath]
-        return None
+        if abspath in self.modified:
+            return self.modified[abspath]
+
+        row = self._get_conn().execute(
+            'SELECT content FROM files WHERE path = ?',
+            (abspath,)).fetchone()
+
+        if row is None:
+            return None
+
+        return self._unpack(row[0])
+
+    def get_info(self, abspath):
+        '''Get basic information about a file entry stored on disk.
+
+        Pending modifications, which have not been written with
+        :py:meth:`dump_modified` are not considered.
+
+        :param abspath: absolute path of the file
+
+        :returns: tuple ``(format, mtime, has_record_index)`` or ``None`` if
+            the file is not in the cache.
+        '''
+
+        row = self._get_conn().execute(
+            'SELECT format, mtime, has_record_index FROM files '
+            'WHERE path = ?', (abspath,)).fetchone()
+
+        if row is None:
+            return None
+
+        format, mtime, has_record_index = row
+        return format, mtime, bool(has_record_index)
 
     def put(self, abspath, tfile):
         '''Put an item into the cache.
@@ -174,107 +472,259 @@ class TracesFileCache(object):
         :param tfile: object to be stored
         '''
 
-        cachepath = self._dircachepath(abspath)
-        # get lock on cachepath here
-        dircache = self._get_dircache(cachepath)
-        dircache[abspath] = tfile
-        self.modified.add(cachepath)
+        self.modified[abspath] = tfile
 
     def dump_modified(self):
         '''Save any modifications to disk.'''
 
-        for cachepath in self.modified:
-            self._dump_dircache(self.dircaches[cachepath], cachepath)
-            # unlock
+        if not self.modified:
+            return
 
-        self.modified = set()
+        conn = self._get_conn()
+        with conn:
+            for abspath, tfile in self.modified.iteritems():
+                conn.execute(
+                    'DELETE FROM traces WHERE path = ?', (abspath,))
+
+                conn.execute(
+                    'INSERT OR REPLACE INTO files '
+                    '(path, format, mtime, tmin, tmax, has_record_index, '
+                    'content) '
+                    'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                    (abspath, tfile.format, tfile.mtime,
+                     _sqlfloat(tfile.tmin), _sqlfloat(tfile.tmax),
+                     getattr(tfile, 'record_index', None) is not None,
+                     self._pack(tfile)))
+
+                conn.executemany(
+                    'INSERT INTO traces '
+                    '(path, network, station, location, channel, '
+                    'tmin, tmax, deltat) '
+                    'VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                    [(abspath, tr.network, tr.station, tr.location,
+                      tr.channel, _sqlfloat(tr.tmin), _sqlfloat(tr.tmax),
+                      tr.deltat) for tr in tfile.traces])
+
+        self.modified = {}
 
     def clean(self):
-        '''Weed out missing files from the disk caches.'''
+        '''Weed out missing files from the disk cache.'''
 
         self.dump_modified()
 
-        for fn in os.listdir(self.cachedir):
-            try:
-                int(fn)  # valid filenames are integers
-                cache = self._load_dircache(pjoin(self.cachedir, fn))
-                self._dump_dircache(cache, pjoin(self.cachedir, fn))
+        conn = self._get_conn()
+        missing = [
+            (path,) for (path,) in conn.execute('SELECT path FROM files')
+            if not os.path.isfile(path)]
 
-            except ValueError:
-                pass
+        with conn:
+            conn.executemany('DELETE FROM traces WHERE path = ?', missing)
+            conn.executemany('DELETE FROM files WHERE path = ?', missing)
 
-    def _get_dircache_for(self, abspath):
-        return self._get_dircache(self._dircachepath(abspath))
+    def relevant_abspaths(self, tmin=None, tmax=None, codes=None):
+        '''Query the cache for files containing matching traces.
 
-    def _get_dircache(self, cachepath):
-        if cachepath not in self.dircaches:
-            if os.path.isfile(cachepath):
-                self.dircaches[cachepath] = self._load_dircache(cachepath)
-            else:
-                self.dircaches[cachepath] = {}
+        :param tmin: start time or ``None``
+        :param tmax: end time or ``None``
+        :param codes: tuple with network, station, location and channel
+            patterns (``'*'`` and ``'?'`` wildcards are allowed) or ``None``
 
-        return self.dircaches[cachepath]
+        :returns: sorted list of absolute paths of all cached files which
+            contain traces overlapping with the given time span and matching
+            the given codes.
 
-    def _dircachepath(self, abspath):
-        cachefn = "%i" % abs(hash(os.path.dirname(abspath)))
-        return pjoin(self.cachedir, cachefn)
+        Only entries which have been written to disk are considered.
+        '''
 
-    def _load_dircache(self, cachefilename):
+        conds = []
+        args = []
+        if tmin is not None:
+            conds.append('tmax >= ?')
+            args.append(float(tmin))
 
-        f = open(cachefilename, 'r')
-        cache = pickle.load(f)
-        f.close()
+        if tmax is not None:
+            conds.append('tmin <= ?')
+            args.append(float(tmax))
 
-        # weed out files which no longer exist
-        for fn in cache.keys():
-            if not os.path.isfile(fn):
-                del cache[fn]
+        if codes is not None:
+            for k, pattern in zip(
+                    ('network', 'station', 'location', 'channel'), codes):
 
-        for v in cache.values():
-            v.trees_from_content(v.traces)
-            for tr in v.traces:
-                tr.file = v
+                if pattern != '*':
+                    conds.append('%s GLOB ?' % k)
+                    args.append(pattern)
 
-            v.data_use_count = 0
-            v.data_loaded = False
-        return cache
+        sql = 'SELECT DISTINCT path FROM traces'
+        if conds:
+            sql += ' WHERE ' + ' AND '.join(conds)
 
-    def _dump_dircache(self, cache, cachefilename):
+        sql += ' ORDER BY path'
 
-        if not cache:
-            if os.path.exists(cachefilename):
-                os.remove(cachefilename)
-            return
+        return [path for (path,) in self._get_conn().execute(sql, args)]
 
-        # make a copy without the parents and the binsearch trees
-        cache_copy = {}
-        for fn in cache.keys():
-            trf = copy.copy(cache[fn])
-            trf.parent = None
-            trf.by_tmin = None
-            trf.by_tmax = None
-            trf.by_tlen = None
-            trf.by_mtime = None
-            trf.data_use_count = 0
-            trf.data_loaded = False
-            traces = []
-            for tr in trf.traces:
-                tr = tr.copy(data=False)
-                tr.ydata = None
-                tr.meta = None
-                tr.file = trf
-                traces.append(tr)
+    def iter_relevant(self, tmin, tmax):
+        '''Query the cache for channels with traces in a given time span.
 
-            trf.traces = traces
+        :param tmin: start time
+        :param tmax: end time
 
-            cache_copy[fn] = trf
+        :returns: iterator over tuples ``(abspath, (network, station,
+            location, channel, deltat))``, one for each combination of file
+            and channel with traces overlapping with the given time span
+
+        Only entries which have been written to disk are considered.
+        '''
 
-        tmpfn = cachefilename+'.%i.tmp' % os.getpid()
-        f = open(tmpfn, 'w')
+        rows = self._get_conn().execute(
+            'SELECT DISTINCT path, network, station, location, channel, '
+            'deltat FROM traces WHERE tmax >= ? AND tmin <= ?',
+            (float(tmin), float(tmax))).fetchall()
 
-        pickle.dump(cache_copy, f)
-        f.close()
-        os.rename(tmpfn, cachefilename)
+        return ((row[0], row[1:]) for row in rows)
+
+    def summary(self, abspaths):
+        '''Summarize the trace headers of a selection of cached files.
+
+        :param abspaths: absolute paths of the files to be summarized
+
+        :returns: tuple ``(channels, mtime)``, where ``channels`` is a list of
+            tuples ``(network, station, location, channel, deltat, ntraces,
+            tmin, tmax, tlenmax)``, one for each distinct channel and
+            sampling interval of the traces in the selected files, and
+            ``mtime`` is the latest modification time of the files.
+
+        Only entries which have been written to disk are considered.
+        '''
+
+        conn = self._get_conn()
+        with conn:
+            conn.execute(
+                'CREATE TEMP TABLE IF NOT EXISTS selection '
+                '(path TEXT PRIMARY KEY)')
+
+            conn.execute('DELETE FROM selection')
+            conn.executemany(
+                'INSERT OR IGNORE INTO selection VALUES (?)',
+                ((abspath,) for abspath in abspaths))
+
+            channels = conn.execute(
+                'SELECT network, station, location, channel, deltat, '
+                'COUNT(*), MIN(tmin), MAX(tmax), MAX(tmax - tmin) '
+                'FROM traces JOIN selection USING (path) '
+                'GROUP BY network, station, location, channel, '
+                'deltat').fetchall()
+
+            (mtime,) = conn.execute(
+                'SELECT MAX(mtime) FROM files '
+                'JOIN selection USING (path)').fetchone()
+
+            conn.execute('DELETE FROM selection')
+
+        return channels, mtime
+
+    def _get_conn(self):
+        # connections must not be shared with forked children or between
+        # threads
+        local = self._local
+        if getattr(local, 'pid', None) != os.getpid():
+            local.conn = self._open_database(
+                pjoin(self.cachedir, self.database_filename))
+            local.pid = os.getpid()
+
+        return local.conn
+
+    def _open_database(self, database_path):
+        conn = sqlite3.connect(database_path, timeout=60.)
+        conn.text_factory = str
+        with conn:
+            (version,) = conn.execute('PRAGMA user_version').fetchone()
+            if version != self.schema_version:
+                # the database only holds cached information, so it is
+                # simply rebuilt when its layout has changed
+                conn.execute('DROP TABLE IF EXISTS traces')
+                conn.execute('DROP TABLE IF EXISTS files')
+                conn.execute(
+                    'PRAGMA user_version = %i' % self.schema_version)
+
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS files ('
+                'path TEXT PRIMARY KEY, '
+                'format TEXT, '
+                'mtime REAL, '
+                'tmin REAL, '
+                'tmax REAL, '
+                'has_record_index INTEGER, '
+                'content BLOB)')
+
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS traces ('
+                'path TEXT, '
+                'network TEXT, '
+                'station TEXT, '
+                'location TEXT, '
+                'channel TEXT, '
+                'tmin REAL, '
+                'tmax REAL, '
+                'deltat REAL)')
+
+            conn.execute(
+                'CREATE INDEX IF NOT EXISTS traces_path '
+                'ON traces (path)')
+            conn.execute(
+                'CREATE INDEX IF NOT EXISTS traces_nslc '
+                'ON traces (network, station, location, channel)')
+            conn.execute(
+                'CREATE INDEX IF NOT EXISTS traces_tmin ON traces (tmin)')
+            conn.execute(
+                'CREATE INDEX IF NOT EXISTS traces_tmax ON traces (tmax)')
+            conn.execute(
+                'CREATE INDEX IF NOT EXISTS files_mtime ON files (mtime)')
+
+        return conn
+
+    def _pack(self, tfile):
+
+        # make a copy without the parents and the binsearch trees
+        trf = copy.copy(tfile)
+        trf.parent = None
+        trf.by_tmin = None
+        trf.by_tmax = None
+        trf.by_tlen = None
+        trf.by_mtime = None
+        trf._time_index = None
+        trf.data_use_count = 0
+        trf.data_loaded = False
+        traces = []
+        for tr in trf.traces:
+            tr = tr.copy(data=False)
+            tr.ydata = None
+            tr.meta = None
+            tr.file = trf
+            traces.append(tr)
+
+        trf.traces = traces
+
+        return sqlite3.Binary(pickle.dumps(trf, pickle.HIGHEST_PROTOCOL))
+
+    def _unpack(self, content):
+        v = pickle.loads(str(content))
+        v.trees_from_content(v.traces)
+        for tr in v.traces:
+            tr.file = v
+
+        v.data_use_count = 0
+        v.data_loaded = False
+        if not hasattr(v, 'record_index'):
+            v.record_index = None
+
+        return v
+
+
+def _sqlfloat(t):
+    if t is None:
+        return None
+
+    return float(t)
 
 
 def get_cache(cachedir):
@@ -285,9 +735,80 @@ def get_cache(cachedir):
     return TracesFileCache.caches[cachedir]
 
 
+def make_record_index(abspath, fileformat):
+    '''Create record index for file.
+
+    :returns: :py:class:`pyrocko.mseed.RecordIndex` object. For files which
+        are not in Mini-SEED format, the index is empty.
+    '''
+
+    if fileformat == 'detect':
+        fileformat = io.detect_format(abspath)
+
+    if fileformat == 'mseed':
+        return mseed.get_record_index(abspath)
+    else:
+        return mseed.RecordIndex(*([num.zeros(0)] * 5))
+
+
+def load_header_traces(abspath, fileformat, substitutions, index_records):
+    '''Read trace headers and optionally create record index for file.
+
+    Helper for the parallel header scan in :py:func:`loader`. File problems
+    are returned rather than raised, so that they can be reported by the
+    calling process.
+
+    :returns: tuple ``(traces, record_index, error)``
+    '''
+
+    try:
+        traces = io.load(
+            abspath, format=fileformat, getdata=False,
+            substitutions=substitutions)
+
+        record_index = None
+        if index_records:
+            record_index = make_record_index(abspath, fileformat)
+
+        return traces, record_index, None
+
+    except (io.FileLoadError, OSError), e:
+        return None, None, e
+
+
+def unchanged_in_cache(cache, abspath, fileformat, mtime, index_records):
+    '''Check if the cache holds an up-to-date entry for a file on disk.'''
+
+    if not cache or abspath in cache.modified:
+        return False
+
+    info = cache.get_info(abspath)
+    if info is None:
+        return False
+
+    format, mtime_cached, has_record_index = info
+    return (
+        (format == fileformat or fileformat == 'detect') and
+        mtime_cached == mtime and
+        (has_record_index or not index_records))
+
+
 def loader(
         filenames, fileformat, cache, filename_attributes,
-        show_progress=True, update_progress=None):
+        show_progress=True, update_progress=None, nworkers=1,
+        index_records=False, deferred=None):
+
+    '''Get :py:class:`TracesFile` objects for the given files.
+
+    Trace headers are taken from the cache where possible, otherwise they
+    are read from the files and the cache is updated.
+
+    If a list is given as ``deferred``, the absolute paths of files which
+    are unchanged since they have been written to the cache are appended to
+    it instead of yielding their :py:class:`TracesFile` objects, see
+    :py:meth:`Pile.add_deferred`. The list is complete when the returned
+    iterator has been exhausted.
+    '''
 
     class Progress:
         def __init__(self, label, n):
@@ -344,17 +865,27 @@ def loader(
                         substitutions[k] = m.groupdict()[k]
 
             mtime = os.stat(filename)[8]
-            tfile = None
-            if cache:
-                tfile = cache.get(abspath)
+            if deferred is not None and not substitutions and \
+                    unchanged_in_cache(
+                        cache, abspath, fileformat, mtime, index_records):
 
-            mustload = (
-                not tfile or
-                (tfile.format != fileformat and fileformat != 'detect') or
-                tfile.mtime != mtime or
-                substitutions)
+                deferred.append(abspath)
 
-            to_load.append((mustload, mtime, abspath, substitutions, tfile))
+            else:
+                tfile = None
+                if cache:
+                    tfile = cache.get(abspath)
+
+                mustload = (
+                    not tfile or
+                    (tfile.format != fileformat and
+                     fileformat != 'detect') or
+                    tfile.mtime != mtime or
+                    substitutions or
+                    (index_records and tfile.record_index is None))
+
+                to_load.append(
+                    (mustload, mtime, abspath, substitutions, tfile))
 
         except (OSError, FilenameAttributeError), xerror:
             failures.append(abspath)
@@ -380,12 +911,36 @@ def loader(
     if to_load:
         progress = Progress('Scanning files', nload)
 
+        scanned = None
+        if nworkers is None or nworkers > 1:
+            to_scan = [x for x in to_load if x[0]]
+            scanned = parimap(
+                load_header_traces,
+                [x[2] for x in to_scan],
+                [fileformat] * len(to_scan),
+                [x[3] for x in to_scan],
+                [index_records] * len(to_scan),
+                nprocs=nworkers)
+
         for (mustload, mtime, abspath, substitutions, tfile) in to_load:
             try:
                 if mustload:
+                    traces = None
+                    record_index = None
+                    if scanned is not None:
+                        traces, record_index, error = scanned.next()
+                        if error is not None:
+                            raise error
+
                     tfile = TracesFile(
                         None, abspath, fileformat,
-                        substitutions=substitutions, mtime=mtime)
+                        substitutions=substitutions, mtime=mtime,
+                        traces=traces)
+
+                    if record_index is not None:
+                        tfile.record_index = record_index
+                    elif index_records:
+                        tfile.make_record_index()
 
                     if cache and not substitutions:
                         cache.put(abspath, tfile)
@@ -406,6 +961,9 @@ def loader(
             if abort:
                 break
 
+        if scanned is not None:
+            scanned.close()
+
         progress.update(nload)
 
     if failures:
@@ -421,6 +979,22 @@ def tlen(x):
     return x.tmax-x.tmin
 
 
+def _min_none(a, b):
+    if a is None:
+        return b
+    if b is None:
+        return a
+    return min(a, b)
+
+
+def _max_none(a, b):
+    if a is None:
+        return b
+    if b is None:
+        return a
+    return max(a, b)
+
+
 class TracesGroup(object):
 
     '''Trace container base class.
@@ -450,6 +1024,7 @@ class TracesGroup(object):
         self.by_tmax = Sorted([], 'tmax')
         self.by_tlen = Sorted([], tlen)
         self.by_mtime = Sorted([], 'mtime')
+        self._time_index = None
         self.tmin, self.tmax = None, None
         self.deltatmin, self.deltatmax = None, None
 
@@ -458,6 +1033,7 @@ class TracesGroup(object):
         self.by_tmax = Sorted(content, 'tmax')
         self.by_tlen = Sorted(content, tlen)
         self.by_mtime = Sorted(content, 'mtime')
+        self._time_index = None
         self.adjust_minmax()
 
     def add(self, content):
@@ -486,6 +1062,9 @@ class TracesGroup(object):
                 self.by_tlen.insert_many(c.by_tlen)
                 self.by_mtime.insert_many(c.by_mtime)
 
+                if self._time_index is not None:
+                    self._time_index.insert(c.by_tmin)
+
             elif isinstance(c, trace.Trace):
                 self.networks[c.network] += 1
                 self.stations[c.station] += 1
@@ -499,6 +1078,9 @@ class TracesGroup(object):
                 self.by_tlen.insert(c)
                 self.by_mtime.insert(c)
 
+                if self._time_index is not None:
+                    self._time_index.insert([c])
+
         self.adjust_minmax()
 
         self.nupdates += 1
@@ -529,6 +1111,9 @@ class TracesGroup(object):
                 self.by_tlen.remove_many(c.by_tlen)
                 self.by_mtime.remove_many(c.by_mtime)
 
+                if self._time_index is not None:
+                    self._time_index.remove(c.by_tmin)
+
             elif isinstance(c, trace.Trace):
                 self.networks.subtract1(c.network)
                 self.stations.subtract1(c.station)
@@ -542,6 +1127,9 @@ class TracesGroup(object):
                 self.by_tlen.remove(c)
                 self.by_mtime.remove(c)
 
+                if self._time_index is not None:
+                    self._time_index.remove([c])
+
         self.adjust_minmax()
 
         self.nupdates += 1
@@ -569,7 +1157,10 @@ class TracesGroup(object):
 
             return []
 
-        return [tr for tr in self.by_tmin.with_key_in(tmin-self.tlenmax, tmax)
+        if self._time_index is None:
+            self._time_index = TimeIndex(self.by_tmin)
+
+        return [tr for tr in self._time_index.overlapping(tmin, tmax)
                 if tr.is_relevant(tmin, tmax, trace_selector)]
 
     def adjust_minmax(self):
@@ -629,6 +1220,9 @@ class MemTracesFile(TracesGroup):
     def load_data(self):
         pass
 
+    def read_data_window(self, tmin, tmax):
+        return None
+
     def use_data(self):
         pass
 
@@ -668,10 +1262,27 @@ class MemTracesFile(TracesGroup):
         return s
 
 
+def _snippet_key(tr):
+    return (tr.mtime, tr.tmin, tr.tmax) + tr.nslc_id
+
+
+def _remove_duplicate_snippets(traces):
+    # prevent adding duplicate snippets from corrupt mseed files
+    k_seen = set()
+    traces_ = []
+    for tr in traces:
+        k = _snippet_key(tr)
+        if k not in k_seen:
+            k_seen.add(k)
+            traces_.append(tr)
+
+    return traces_
+
+
 class TracesFile(TracesGroup):
     def __init__(
             self, parent, abspath, format,
-            substitutions=None, mtime=None):
+            substitutions=None, mtime=None, traces=None):
 
         TracesGroup.__init__(self, parent)
         self.abspath = abspath
@@ -680,23 +1291,37 @@ class TracesFile(TracesGroup):
         self.data_loaded = False
         self.data_use_count = 0
         self.substitutions = substitutions
-        self.load_headers(mtime=mtime)
+        self.record_index = None
+        self.load_headers(mtime=mtime, traces=traces)
         self.mtime = mtime
 
-    def load_headers(self, mtime=None):
-        logger.debug('loading headers from file: %s' % self.abspath)
+    def load_headers(self, mtime=None, traces=None):
+        '''Load trace headers from file.
+
+        If ``traces`` is given, these header-only traces (e.g. as obtained
+        from :py:func:`load_header_traces`) are used instead of reading the
+        file.
+        '''
+
         if mtime is None:
             self.mtime = os.stat(self.abspath)[8]
 
         def kgen(tr):
             return (tr.mtime, tr.tmin, tr.tmax) + tr.nslc_id
 
+        traces_from_file = traces is None
+        if traces_from_file:
+            logger.debug('loading headers from file: %s' % self.abspath)
+            traces = io.load(self.abspath,
+                             format=self.format,
+                             getdata=False,
+                             substitutions=self.substitutions)
+
+        get_data_cache().forget(self)
         self.remove(self.traces)
+        self.traces = []
         ks = set()
-        for tr in io.load(self.abspath,
-                          format=self.format,
-                          getdata=False,
-                          substitutions=self.substitutions):
+        for tr in traces:
 
             k = kgen(tr)
             if k not in ks:
@@ -709,25 +1334,80 @@ class TracesFile(TracesGroup):
         self.data_loaded = False
         self.data_use_count = 0
 
-    def load_data(self, force=False):
+        if self.record_index is not None and traces_from_file:
+            self.make_record_index()
+
+    def make_record_index(self):
+        '''Create index of the data records in the file.
+
+        The index is kept in the attribute :py:attr:`record_index` and it is
+        stored along with the file's entry in the trace metainformation
+        cache. When present, it allows :py:meth:`read_data_window` to unpack
+        only the parts of the file needed for a given time window.
+        '''
+
+        self.record_index = make_record_index(self.abspath, self.format)
+
+    def read_data_window(self, tmin, tmax):
+        '''Read traces with data overlapping with given time span.
+
+        Only possible if the data of the file is not loaded and a non-empty
+        record index is available, see :py:meth:`make_record_index`. The
+        returned traces are not attached to the file.
+
+        :returns: list of traces or ``None`` if partial reading is not
+            possible
+        '''
+
+        if self.data_loaded or not self.record_index:
+            return None
+
+        if os.stat(self.abspath)[8] != self.mtime:
+            return None
+
+        logger.debug('reading data window from file: %s' % self.abspath)
+        traces = mseed.load_window(
+            self.abspath, tmin, tmax, record_index=self.record_index)
+
+        for tr in traces:
+            io.make_substitutions(tr, self.substitutions)
+            tr.set_mtime(self.mtime)
+
+        return _remove_duplicate_snippets(traces)
+
+    def read_data(self):
+        '''Read traces with data from file.
+
+        The state of the object is not modified, so this method may be
+        called from a background thread. Use :py:meth:`load_data` with the
+        ``traces`` argument to attach the returned traces.
+        '''
+
+        logger.debug('reading data from file: %s' % self.abspath)
+        return io.load(self.abspath, format=self.format, getdata=True,
+                       substitutions=self.substitutions)
+
+    def get_data_size_estimate(self):
+        '''Get upper estimate of the memory needed to hold the file's data.
+
+        Assumes 8 bytes per sample.
+        '''
+
+        return sum(tr.data_len() for tr in self.traces) * 8
+
+    def load_data(self, force=False, traces=None):
         file_changed = False
         if not self.data_loaded or force:
-            logger.debug('loading data from file: %s' % self.abspath)
 
-            def kgen(tr):
-                return (tr.mtime, tr.tmin, tr.tmax) + tr.nslc_id
+            kgen = _snippet_key
 
-            traces_ = io.load(self.abspath, format=self.format, getdata=True,
-                              substitutions=self.substitutions)
+            if traces is None:
+                traces_ = self.read_data()
+            else:
+                traces_ = traces
 
-            # prevent adding duplicate snippets from corrupt mseed files
-            k_loaded = set()
-            traces = []
-            for tr in traces_:
-                k = kgen(tr)
-                if k not in k_loaded:
-                    k_loaded.add(k)
-                    traces.append(tr)
+            traces = _remove_duplicate_snippets(traces_)
+            k_loaded = set(kgen(tr) for tr in traces)
 
             k_current_d = dict((kgen(tr), tr) for tr in self.traces)
             k_current = set(k_current_d)
@@ -755,6 +1435,10 @@ class TracesFile(TracesGroup):
                     ctr.ydata = tr.ydata
 
             self.data_loaded = True
+            get_data_cache().loaded(self)
+
+        else:
+            get_data_cache().reused(self)
 
         if file_changed:
             logger.debug('reloaded (file may have changed): %s' % self.abspath)
@@ -769,16 +1453,24 @@ class TracesFile(TracesGroup):
     def drop_data(self):
         if self.data_loaded:
             if self.data_use_count == 1:
-                logger.debug('forgetting data of file: %s' % self.abspath)
-                for tr in self.traces:
-                    tr.drop_data()
-
-                self.data_loaded = False
+                get_data_cache().release(self)
 
             self.data_use_count -= 1
         else:
             self.data_use_count = 0
 
+    def forget_data(self):
+        '''Drop the data of all traces in the file.
+
+        This is called by the :py:class:`DataCache` when the data is evicted.
+        '''
+
+        logger.debug('forgetting data of file: %s' % self.abspath)
+        for tr in self.traces:
+            tr.drop_data()
+
+        self.data_loaded = False
+
     def reload_if_modified(self):
         mtime = os.stat(self.abspath)[8]
         if mtime != self.mtime:
@@ -826,6 +1518,70 @@ class FilenameAttributeError(Exception):
     pass
 
 
+class Prefetcher(object):
+    '''Background data reader for :py:meth:`Pile.chopper`.
+
+    Reads the data of files which are needed for upcoming time windows in a
+    pool of threads. Only the reading happens in the background. The loaded
+    traces are attached to their :py:class:`TracesFile` objects in the
+    calling thread, when they are needed, so that the pile's indices and the
+    data use counters are only ever modified from there.
+
+    :param nthreads: number of reader threads
+    :param max_bytes: limit for the estimated size of the data which has
+        been read ahead but which is not yet in use (``None``: no limit)
+    '''
+
+    def __init__(self, nthreads=2, max_bytes=None):
+        self._pool = ThreadPool(nthreads)
+        self._max_bytes = max_bytes
+        self._pending = {}
+        self._pending_bytes = 0
+
+    def request(self, files):
+        '''Start reading data of given files, in the given order.'''
+
+        for file in files:
+            if file in self._pending or not isinstance(file, TracesFile) \
+                    or file.data_loaded or file.record_index:
+                continue
+
+            nbytes = file.get_data_size_estimate()
+            if self._max_bytes is not None \
+                    and self._pending_bytes + nbytes > self._max_bytes:
+                break
+
+            self._pending[file] = (
+                self._pool.apply_async(file.read_data), nbytes)
+
+            self._pending_bytes += nbytes
+
+    def apply(self, files):
+        '''Attach prefetched data to given files, waiting as necessary.'''
+
+        for file in files:
+            if file not in self._pending:
+                continue
+
+            result, nbytes = self._pending.pop(file)
+            self._pending_bytes -= nbytes
+            try:
+                traces = result.get()
+            except (io.FileLoadError, OSError):
+                # leave it to the regular loading to report the problem
+                continue
+
+            if not file.data_loaded:
+                file.load_data(traces=traces)
+
+    def close(self):
+        '''Discard outstanding reads and shut down the reader threads.'''
+
+        self._pool.terminate()
+        self._pending = {}
+        self._pending_bytes = 0
+
+
 class SubPile(TracesGroup):
     def __init__(self, parent):
         TracesGroup.__init__(self, parent)
@@ -913,6 +1669,10 @@ class Pile(TracesGroup):
     '''Waveform archive lookup, data loading and caching infrastructure.'''
 
     def __init__(self):
+        self._deferred = set()
+        self._deferred_cache = None
+        self._deferred_headers = {}
+        self._deferred_span = None
         TracesGroup.__init__(self, None)
         self.subpiles = {}
         self.open_files = {}
@@ -934,15 +1694,146 @@ class Pile(TracesGroup):
             fileformat='mseed',
             cache=None,
             show_progress=True,
-            update_progress=None):
+            update_progress=None,
+            nworkers=1,
+            index_records=False,
+            defer_unchanged=False):
+
+        deferred = None
+        if defer_unchanged and cache:
+            deferred = []
 
         l = loader(
             filenames, fileformat, cache, filename_attributes,
             show_progress=show_progress,
-            update_progress=update_progress)
+            update_progress=update_progress,
+            nworkers=nworkers,
+            index_records=index_records,
+            deferred=deferred)
 
         self.add_files(l)
 
+        if deferred:
+            self.add_deferred(cache, deferred)
+
+    def add_deferred(self, cache, abspaths):
+        '''Add cached files to the pile without loading their cache entries.
+
+        The trace headers of the files are only summarized from the cache
+        database, so that the pile's time span, codes and sampling rates are
+        available. The files are loaded from the cache when they are needed
+        by a :py:meth:`relevant` query (and thus by :py:meth:`chop` and
+        :py:meth:`chopper`), or when the whole content of the pile is
+        accessed, e.g. with :py:meth:`iter_files`.
+
+        For deferred files, a ``trace_selector`` given to :py:meth:`relevant`
+        is evaluated on one header-only trace per channel and sampling
+        interval, spanning all traces of the channel in the deferred files.
+        Selectors should therefore only depend on the codes and sampling
+        intervals of the traces.
+
+        :param cache: :py:class:`TracesFileCache` holding up-to-date entries
+            for the files
+        :param abspaths: absolute paths of the files
+        '''
+
+        abspaths = [
+            abspath for abspath in abspaths if abspath not in self.abspaths]
+
+        if not abspaths:
+            return
+
+        if self._deferred_cache not in (None, cache):
+            self._load_deferred()
+
+        channels, mtime = cache.summary(abspaths)
+        span = self._deferred_span or (None, None, None, None)
+        for (network, station, location, channel, deltat, ntraces, tmin,
+                tmax, tlenmax) in channels:
+
+            nslc = (network, station, location, channel)
+            self.networks[network] += ntraces
+            self.stations[station] += ntraces
+            self.locations[location] += ntraces
+            self.channels[channel] += ntraces
+            self.nslc_ids[nslc] += ntraces
+            self.deltats[deltat] += ntraces
+
+            k = nslc + (deltat,)
+            header = self._deferred_headers.get(k, None)
+            if header is None:
+                self._deferred_headers[k] = trace.Trace(
+                    network, station, location, channel,
+                    tmin=tmin, tmax=tmax, deltat=deltat)
+            else:
+                header.tmin = min(header.tmin, tmin)
+                header.tmax = max(header.tmax, tmax)
+
+            span = (
+                _min_none(span[0], tmin),
+                _max_none(span[1], tmax),
+                _max_none(span[2], tlenmax),
+                _max_none(span[3], mtime))
+
+        self._deferred_span = span
+        self._deferred_cache = cache
+        self._deferred.update(abspaths)
+        self.abspaths.update(abspaths)
+
+        self.adjust_minmax()
+        self.nupdates += 1
+        self.notify_listeners('add')
+
+    def _load_deferred(self, tmin=None, tmax=None, trace_selector=None,
+                       abspaths=None):
+        if not self._deferred:
+            return
+
+        cache = self._deferred_cache
+        if abspaths is not None:
+            abspaths = sorted(
+                abspath for abspath in abspaths if abspath in self._deferred)
+        elif tmin is None or tmax is None:
+            abspaths = sorted(self._deferred)
+        else:
+            keys = None
+            if trace_selector is not None:
+                keys = set(
+                    k for (k, header) in self._deferred_headers.iteritems()
+                    if trace_selector(header))
+
+            eps = 1e-15 * max(abs(tmin), abs(tmax))
+            abspaths = sorted(set(
+                abspath for (abspath, k) in cache.iter_relevant(
+                    tmin - eps, tmax + eps)
+                if abspath in self._deferred and (keys is None or k in keys)))
+
+        files = []
+        for abspath in abspaths:
+            self._deferred.remove(abspath)
+            self.abspaths.remove(abspath)
+            tfile = cache.get(abspath)
+            if tfile is None:
+                logger.warn('Deferred file not found in cache: %s' % abspath)
+                continue
+
+            # the traces of the file have been counted by add_deferred
+            self.networks.subtract(tfile.networks)
+            self.stations.subtract(tfile.stations)
+            self.locations.subtract(tfile.locations)
+            self.channels.subtract(tfile.channels)
+            self.nslc_ids.subtract(tfile.nslc_ids)
+            self.deltats.subtract(tfile.deltats)
+            files.append(tfile)
+
+        if not self._deferred:
+            self._deferred_cache = None
+            self._deferred_headers = {}
+            self._deferred_span = None
+
+        self.add_files(files)
+        self.adjust_minmax()
+
     def add_files(self, files):
         for file in files:
             self.add_file(file)
@@ -997,6 +1888,24 @@ class Pile(TracesGroup):
     def get_deltats(self):
         return self.deltats.keys()
 
+    def relevant(self, tmin, tmax, group_selector=None, trace_selector=None):
+        self._load_deferred(tmin, tmax, trace_selector)
+        return TracesGroup.relevant(
+            self, tmin, tmax, group_selector, trace_selector)
+
+    def adjust_minmax(self):
+        TracesGroup.adjust_minmax(self)
+        if self._deferred_span is not None:
+            tmin, tmax, tlenmax, mtime = self._deferred_span
+            self.tmin = _min_none(self.tmin, tmin)
+            self.tmax = _max_none(self.tmax, tmax)
+            self.tlenmax = _max_none(self.tlenmax, tlenmax)
+            self.mtime = _max_none(self.mtime, mtime)
+            deltats = self.deltats.keys()
+            if deltats:
+                self.deltatmin = min(deltats)
+                self.deltatmax = max(deltats)
+
     def chop(
             self, tmin, tmax,
             group_selector=None,
@@ -1011,8 +1920,17 @@ class Pile(TracesGroup):
         traces = self.relevant(tmin, tmax, group_selector, trace_selector)
         if load_data:
             files_changed = False
+            window_traces = {}
             for tr in traces:
-                if tr.file and tr.file not in used_files:
+                if tr.file and tr.file not in used_files \
+                        and tr.file not in window_traces:
+
+                    # only decode the needed part of files with record index
+                    wtraces = tr.file.read_data_window(tmin, tmax)
+                    if wtraces is not None:
+                        window_traces[tr.file] = wtraces
+                        continue
+
                     if tr.file.load_data():
                         files_changed = True
 
@@ -1023,6 +1941,13 @@ class Pile(TracesGroup):
                 traces = self.relevant(
                     tmin, tmax, group_selector, trace_selector)
 
+            if window_traces:
+                traces = [tr for tr in traces if tr.file not in window_traces]
+                for wtraces in window_traces.itervalues():
+                    traces.extend(
+                        tr for tr in wtraces
+                        if tr.is_relevant(tmin, tmax, trace_selector))
+
         for tr in traces:
             if not load_data and tr.ydata is not None:
                 tr = tr.copy(data=False)
@@ -1081,7 +2006,8 @@ class Pile(TracesGroup):
             group_selector=None, trace_selector=None,
             want_incomplete=True, degap=True, maxgap=5, maxlap=None,
             keep_current_files_open=False, accessor_id=None,
-            snap=(round, round), include_last=False, load_data=True):
+            snap=(round, round), include_last=False, load_data=True,
+            prefetch=0, prefetch_nthreads=2, prefetch_max_bytes=None):
 
         '''
         Get iterator for shifting window wise data extraction from waveform
@@ -1117,6 +2043,14 @@ class Pile(TracesGroup):
         :param load_data: whether to load the waveform data. If set to
             ``False``, traces with no data samples, but with correct
             meta-information are returned
+        :param prefetch: number of time windows for which data is read ahead
+            in background threads, so that reading can overlap with the
+            processing of the current window (default: ``0``, no read-ahead)
+        :param prefetch_nthreads: number of reader threads used when
+            ``prefetch`` is enabled
+        :param prefetch_max_bytes: limit for the estimated amount of memory
+            held by data which has been read ahead but is not yet in use
+            (default: ``None``, no limit)
         :returns: itererator yielding a list of :py:class:`pyrocko.trace.Trace`
             objects for every extracted time window
         '''
@@ -1137,44 +2071,91 @@ class Pile(TracesGroup):
 
         open_files = self.open_files[accessor_id]
 
-        iwin = 0
-        while True:
-            chopped = []
-            wmin, wmax = tmin+iwin*tinc, min(tmin+(iwin+1)*tinc, tmax)
+        def windows(iwin_begin, iwin_end):
+            wins = []
             eps = tinc*1e-6
-            if wmin >= tmax-eps:
-                break
+            for iwin_ in xrange(iwin_begin, iwin_end):
+                wmin_ = tmin+iwin_*tinc
+                wmax_ = min(tmin+(iwin_+1)*tinc, tmax)
+                if wmin_ >= tmax-eps:
+                    break
 
-            chopped, used_files = self.chop(
-                wmin-tpad, wmax+tpad, group_selector, trace_selector, snap,
-                include_last, load_data)
+                wins.append((wmin_, wmax_))
 
-            for file in used_files - open_files:
-                # increment datause counter on newly opened files
-                file.use_data()
+            return wins
 
-            open_files.update(used_files)
+        prefetcher = None
+        if prefetch and load_data:
+            prefetcher = Prefetcher(
+                nthreads=prefetch_nthreads, max_bytes=prefetch_max_bytes)
 
-            processed = self._process_chopped(
-                chopped, degap, maxgap, maxlap, want_incomplete, wmax, wmin,
-                tpad)
+        iwin = 0
+        try:
+            while True:
+                chopped = []
+                wins = windows(iwin, iwin+1)
+                if not wins:
+                    break
 
-            yield processed
+                wmin, wmax = wins[0]
 
-            unused_files = open_files - used_files
+                if prefetcher:
+                    prefetcher.request(self._files_for_windows(
+                        [(wmin_-tpad, wmax_+tpad) for (wmin_, wmax_) in
+                         windows(iwin, iwin+1+prefetch)],
+                        group_selector, trace_selector))
 
-            while unused_files:
-                file = unused_files.pop()
-                file.drop_data()
-                open_files.remove(file)
+                    prefetcher.apply(self._files_for_windows(
+                        [(wmin-tpad, wmax+tpad)],
+                        group_selector, trace_selector))
+
+                chopped, used_files = self.chop(
+                    wmin-tpad, wmax+tpad, group_selector, trace_selector, snap,
+                    include_last, load_data)
+
+                for file in used_files - open_files:
+                    # increment datause counter on newly opened files
+                    file.use_data()
+
+                open_files.update(used_files)
+
+                processed = self._process_chopped(
+                    chopped, degap, maxgap, maxlap, want_incomplete, wmax,
+                    wmin, tpad)
+
+                yield processed
+
+                unused_files = open_files - used_files
+
+                while unused_files:
+                    file = unused_files.pop()
+                    file.drop_data()
+                    open_files.remove(file)
+
+                iwin += 1
 
-            iwin += 1
+        finally:
+            if prefetcher:
+                prefetcher.close()
 
         if not keep_current_files_open:
             while open_files:
                 file = open_files.pop()
                 file.drop_data()
 
+    def _files_for_windows(self, spans, group_selector, trace_selector):
+        files = []
+        seen = set()
+        for (tmin, tmax) in spans:
+            for tr in self.relevant(
+                    tmin, tmax, group_selector, trace_selector):
+
+                if tr.file is not None and tr.file not in seen:
+                    seen.add(tr.file)
+                    files.append(tr.file)
+
+        return files
+
     def all(self, *args, **kwargs):
         '''
         Shortcut to aggregate :py:meth:`chopper` output into a single list.
@@ -1240,6 +2221,10 @@ class Pile(TracesGroup):
         for subpile in self.subpiles.values():
             keys |= subpile.gather_keys(gather, selector)
 
+        for header in self._deferred_headers.itervalues():
+            if selector is None or selector(header):
+                keys.add(gather(header))
+
         return sorted(keys)
 
     def iter_traces(
@@ -1269,6 +2254,7 @@ class Pile(TracesGroup):
                 print t
         '''
 
+        self._load_deferred()
         for subpile in self.subpiles.values():
             if not group_selector or group_selector(subpile):
                 for tr in subpile.iter_traces(load_data, return_abspath,
@@ -1276,11 +2262,34 @@ class Pile(TracesGroup):
                     yield tr
 
     def iter_files(self):
+        self._load_deferred()
         for subpile in self.subpiles.values():
             for file in subpile.iter_files():
                 yield file
 
+    def _modified_deferred(self):
+        cache = self._deferred_cache
+        modified = []
+        for abspath in sorted(self._deferred):
+            info = cache.get_info(abspath)
+            if info is None or os.stat(abspath)[8] != info[1]:
+                modified.append(abspath)
+
+        return modified
+
     def reload_modified(self):
+        '''Reload files which have been modified on disk.
+
+        Deferred files (see :py:meth:`add_deferred`) are checked against the
+        modification times in the cache. Modified ones are loaded and then
+        reloaded like any other file.
+
+        :returns: ``True`` if any file has been reloaded
+        '''
+
+        if self._deferred:
+            self._load_deferred(abspaths=self._modified_deferred())
+
         modified = False
         for subpile in self.subpiles.values():
             modified |= subpile.reload_modified()
@@ -1296,6 +2305,14 @@ class Pile(TracesGroup):
     def get_deltatmin(self):
         return self.deltatmin
 
+    def get_data_cache_stats(self):
+        '''Get statistics of the global waveform data cache.
+
+        See :py:class:`DataCache`.
+        '''
+
+        return get_data_cache().stats()
+
     def get_deltatmax(self):
         return self.deltatmax
 
@@ -1342,7 +2359,8 @@ class Pile(TracesGroup):
 def make_pile(
         paths=None, selector=None, regex=None,
         fileformat='mseed',
-        cachedirname=None, show_progress=True):
+        cachedirname=None, show_progress=True, nworkers=1,
+        index_records=False, defer_unchanged=True):
 
     '''Create pile from given file and directory names.
 
@@ -1357,6 +2375,15 @@ def make_pile(
     :param cachedirname: loader cache is stored under this directory. It is
         created as neccessary.
     :param show_progress: show progress bar and other progress information
+    :param nworkers: number of worker processes to use when scanning the
+        headers of files which are not in the cache (``None``: use all
+        available cores)
+    :param index_records: whether to create and cache record indices for
+        Mini-SEED files, so that extracting short time windows only decodes
+        the needed records (see :py:meth:`TracesFile.make_record_index`)
+    :param defer_unchanged: whether to load the cached trace headers of files
+        which are unchanged since they have been cached only when they are
+        needed (see :py:meth:`Pile.add_deferred`)
     '''
     if isinstance(paths, str):
         paths = [paths]
@@ -1376,7 +2403,10 @@ def make_pile(
         sorted(fns),
         cache=cache,
         fileformat=fileformat,
-        show_progress=show_progress)
+        show_progress=show_progress,
+        nworkers=nworkers,
+        index_records=index_records,
+        defer_unchanged=defer_unchanged)
 
     return p
 
@@ -1395,7 +1395,7 @@ def MakePileViewerMainClass(base):
             self.toggle_panel_menu.removeAction(item)
 
         def load(self, paths, regex=None, format='from_extension',
-                 cache_dir=None, force_cache=False):
+                 cache_dir=None, force_cache=False, nworkers=1):
 
             if cache_dir is None:
                 cache_dir = pyrocko.config.config().cache_dir
@@ -1447,7 +1447,8 @@ def MakePileViewerMainClass(base):
                 cache=cache,
                 fileformat=format,
                 show_progress=False,
-                update_progress=update_progress)
+                update_progress=update_progress,
+                nworkers=nworkers)
 
             self.automatic_updates = True
             self.update()
@@ -700,6 +700,8 @@ def snuffle(pile=None, **kwargs):
     :param cache_dir: cache directory with trace meta information
     :param force_cache: bool, whether to use the cache when attribute spoofing
         is active
+    :param nworkers: number of worker processes to use when scanning files
+        which are not in the cache
     :param store_path: filename template, where to store trace data from input
         streams
     :param store_interval: float, time interval (in seconds) between stream
@@ -719,7 +721,8 @@ def snuffle(pile=None, **kwargs):
         app = Snuffler()
 
     kwargs_load = {}
-    for k in ('paths', 'regex', 'format', 'cache_dir', 'force_cache'):
+    for k in ('paths', 'regex', 'format', 'cache_dir', 'force_cache',
+              'nworkers'):
         try:
             kwargs_load[k] = kwargs.pop(k)
         except KeyError:
@@ -865,6 +868,15 @@ def snuffler_from_commandline(args=sys.argv):
         help='use the cache even when trace attribute spoofing is active '
              '(may have silly consequences)')
 
+    parser.add_option(
+        '--nworkers',
+        type='int',
+        dest='nworkers',
+        default=1,
+        metavar='N',
+        help='scan headers of new or modified files with N worker '
+             'processes [default: %default]')
+
     parser.add_option(
         '--store-path',
         dest='store_path',
@@ -940,5 +952,6 @@ def snuffler_from_commandline(args=sys.argv):
         regex=options.regex,
         format=options.format,
         force_cache=options.force_cache,
+        nworkers=options.nworkers,
         store_path=options.store_path,
         store_interval=options.store_interval)
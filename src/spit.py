@@ -1,7 +1,11 @@
 import struct
 import logging
+import itertools
+import multiprocessing
 import numpy as num
 
+from pyrocko import spit_ext
+
 logger = logging.getLogger('pyrocko.spit')
 
 or_ = num.logical_or
@@ -22,13 +26,7 @@ class Cell:
         self.depths = num.log2(index).astype(num.int)
         self.bad = False
         self.children = []
-        n = 2**self.depths
-        i = self.index - n
-        delta = (self.tree.xbounds[:, 1] - self.tree.xbounds[:, 0])/n
-        xmin = self.tree.xbounds[:, 0]
-        self.xbounds = self.tree.xbounds.copy()
-        self.xbounds[:, 0] = xmin + i * delta
-        self.xbounds[:, 1] = xmin + (i+1) * delta
+        self.xbounds = self.tree.cell_xbounds(index)
         self.a = self.xbounds[:, ::-1].copy()
         self.b = self.a.copy()
         self.b[:, 1] = self.xbounds[:, 1] - self.xbounds[:, 0]
@@ -197,7 +195,7 @@ def bread(f, fmt):
 class SPTree:
 
     def __init__(self, f=None, ftol=None, xbounds=None, xtols=None,
-                 filename=None, addargs=()):
+                 filename=None, addargs=(), nworkers=1):
 
         '''Create n-dimensional space partitioning interpolator.
 
@@ -206,8 +204,13 @@ class SPTree:
         :param xbounds: bounds of x, shape (n, 2)
         :param xtols: target coarsenesses in x, vector of size n
         :param addargs: additional arguments to pass to f
+        :param nworkers: number of worker processes used to evaluate f
+            during construction (``None``: number of processors)
         '''
 
+        self._flat = None
+        self._pool = None
+
         if filename is None:
             assert all(v is not None for v in (f, ftol, xbounds, xtols))
 
@@ -246,24 +249,36 @@ class SPTree:
 
             self.nothing_found_yet = True
 
-            self.root = Cell(self, self.ones_int)
-            self.ncells += 1
-
-            self.fraction_bad = 0.0
-            self.nbad = 0
-            self.cells_to_continue = []
-            for clipdepth in range(0, num.max(self.maxdepths)+1):
-                self.clipdepth = clipdepth
-                self.tested = 0
-                if self.clipdepth == 0:
-                    self._fill(self.root)
-                else:
-                    self._continue_fill()
+            self._nworkers = nworkers or multiprocessing.cpu_count()
+            if self._nworkers > 1:
+                self._pool = _make_pool(f, addargs, self._nworkers)
 
-                self.status()
-
-                if not self.cells_to_continue:
-                    break
+            try:
+                self._prefetch([self.ones_int])
+                self.root = Cell(self, self.ones_int)
+                self.ncells += 1
+
+                self.fraction_bad = 0.0
+                self.nbad = 0
+                self.cells_to_continue = []
+                for clipdepth in range(0, num.max(self.maxdepths)+1):
+                    self.clipdepth = clipdepth
+                    self.tested = 0
+                    if self.clipdepth == 0:
+                        self._fill(self.root)
+                    else:
+                        self._continue_fill()
+
+                    self.status()
+
+                    if not self.cells_to_continue:
+                        break
+
+            finally:
+                if self._pool is not None:
+                    self._pool.terminate()
+                    self._pool.join()
+                    self._pool = None
 
         else:
             self._load(filename)
@@ -340,18 +355,104 @@ class SPTree:
     def __call__(self, x):
         return self.interpolate(x)
 
-    def interpolate_many(self, x):
-        return self.root.interpolate_many(x)
+    def cell_xbounds(self, index):
+        depths = num.log2(index).astype(num.int)
+        n = 2**depths
+        i = index - n
+        delta = (self.xbounds[:, 1] - self.xbounds[:, 0])/n
+        xmin = self.xbounds[:, 0]
+        xbounds = self.xbounds.copy()
+        xbounds[:, 0] = xmin + i * delta
+        xbounds[:, 1] = xmin + (i+1) * delta
+        return xbounds
+
+    def _test_points(self, xbounds):
+        return num.sum(xbounds * self.pointmaker_masked, axis=-1)
+
+    def _prefetch(self, cells_indices):
+        '''Evaluate f in parallel at all points needed by the given cells.'''
+
+        if self._pool is None:
+            return
+
+        missing = set()
+        for index in cells_indices:
+            xbounds = self.cell_xbounds(index)
+            for x in itertools.chain(
+                    itertools.product(*xbounds),
+                    self._test_points(xbounds)):
+
+                k = tuple(float(xx) for xx in x)
+                if k not in self.f_values:
+                    missing.add(k)
+
+        if not missing:
+            return
+
+        missing = sorted(missing)
+        chunksize = max(1, len(missing) // (self._nworkers * 4))
+        for k, v in zip(missing, self._pool.map(
+                _pool_evaluate, missing, chunksize)):
+            self.f_values[k] = v
+
+    def _children_indices(self, cell):
+        return [(cell.index << cell.deepen) + iadd
+                for iadd in num.ndindex(*(cell.deepen+1))]
+
+    def interpolate_many(self, x, nthreads=0):
+        '''Interpolate at many points.
+
+        :param x: points, shape (npoints, n)
+        :param nthreads: number of threads to use (``0``: use all available
+            processors)
+        :returns: interpolated values, NaN where the function is undefined or
+            where a point is out of bounds
+        '''
+
+        x = num.ascontiguousarray(x, dtype=num.float)
+        assert x.ndim == 2 and x.shape[1] == self.ndim
+        return spit_ext.interpolate_many(*(self._flatten() + (x, nthreads)))
+
+    def _flatten(self):
+        '''Get tree as flat arrays, with cells in breadth-first order.'''
+
+        if self._flat is None:
+            cells = [self.root]
+            first_child = []
+            nchildren = []
+            i = 0
+            while i < len(cells):
+                cell = cells[i]
+                first_child.append(len(cells))
+                nchildren.append(len(cell.children))
+                cells.extend(cell.children)
+                i += 1
+
+            ncells = len(cells)
+            self._flat = (
+                num.array(first_child, dtype=num.int64),
+                num.array(nchildren, dtype=num.int64),
+                num.array([c.xbounds for c in cells], dtype=num.float),
+                num.array([c.a for c in cells], dtype=num.float),
+                num.array([c.b for c in cells], dtype=num.float),
+                num.array([c.f for c in cells], dtype=num.float).reshape(
+                    ncells, 2**self.ndim))
+
+        return self._flat
 
     def _continue_fill(self):
         cells_to_continue, self.cells_to_continue = self.cells_to_continue, []
+        self._prefetch(
+            [index for cell in cells_to_continue
+             for index in self._children_indices(cell)])
+
         for cell in cells_to_continue:
             self._deepen_cell(cell)
 
     def _fill(self, cell):
 
         self.tested += 1
-        xtestpoints = num.sum(cell.xbounds * self.pointmaker_masked, axis=-1)
+        xtestpoints = self._test_points(cell.xbounds)
 
         fis = cell.interpolate_many(xtestpoints)
         fes = num.array(
@@ -407,8 +508,9 @@ class SPTree:
             self.nbad -= 1
             cell.bad = False
 
-        for iadd in num.ndindex(*(cell.deepen+1)):
-            index_child = (cell.index << cell.deepen) + iadd
+        indices_children = self._children_indices(cell)
+        self._prefetch(indices_children)
+        for index_child in indices_children:
             child = Cell(self, index_child)
             self.ncells += 1
             cell.children.append(child)
@@ -465,6 +567,25 @@ class SPTree:
             plt.show()
 
 
+_pool_f = None
+_pool_addargs = ()
+
+
+def _pool_evaluate(x):
+    return _pool_f(x, *_pool_addargs)
+
+
+def _make_pool(f, addargs, nworkers):
+    # f may be a closure, which cannot be pickled; worker processes get it
+    # through the module globals inherited when forking
+    global _pool_f, _pool_addargs
+    _pool_f, _pool_addargs = f, addargs
+    try:
+        return multiprocessing.Pool(nworkers)
+    finally:
+        _pool_f, _pool_addargs = None, ()
+
+
 def getset(d, k, f, addargs):
     try:
         return d[k]
@@ -0,0 +1,327 @@
+#define NPY_NO_DEPRECATED_API 7
+
+#include "Python.h"
+#include "numpy/arrayobject.h"
+
+#include <stdlib.h>
+#include <stdint.h>
+#include <math.h>
+#if defined(_OPENMP)
+    # include <omp.h>
+#endif
+
+#define SPIT_MAX_NDIM 16
+#define CHUNKSIZE 256
+
+static PyObject *SpitExtError;
+
+typedef enum {
+    SUCCESS = 0,
+    BAD_NDIM,
+    BAD_TREE,
+} spit_error_t;
+
+const char* spit_error_names[] = {
+    "SUCCESS",
+    "BAD_NDIM",
+    "BAD_TREE",
+};
+
+/* Flattened SPTree
+ *
+ * Cells are numbered in breadth-first order, so that the children of each
+ * cell are stored contiguously, starting at first_child[icell]. Per cell,
+ * xbounds, a and b hold ndim x 2 values (see pyrocko.spit.Cell) and f holds
+ * the 2**ndim corner values in C order. */
+
+typedef struct {
+    size_t ndim;
+    size_t ncells;
+    const int64_t *first_child;
+    const int64_t *nchildren;
+    const double *xbounds;
+    const double *a;
+    const double *b;
+    const double *f;
+} spit_tree_t;
+
+static int inside(const spit_tree_t *tree, size_t icell, const double *x) {
+    size_t idim;
+    const double *xb;
+
+    xb = tree->xbounds + icell*tree->ndim*2;
+    for (idim=0; idim<tree->ndim; idim++) {
+        if (!(xb[idim*2] <= x[idim] && x[idim] <= xb[idim*2+1])) {
+            return 0;
+        }
+    }
+    return 1;
+}
+
+static double interpolate_leaf(
+        const spit_tree_t *tree, size_t icell, const double *x) {
+
+    size_t ndim, nf, idim, icorner;
+    const double *a, *b, *f;
+    double ws[SPIT_MAX_NDIM*2];
+    double w, result;
+
+    ndim = tree->ndim;
+    nf = (size_t)1 << ndim;
+    a = tree->a + icell*ndim*2;
+    b = tree->b + icell*ndim*2;
+    f = tree->f + icell*nf;
+
+    for (icorner=0; icorner<nf; icorner++) {
+        if (!isfinite(f[icorner])) {
+            return NAN;
+        }
+    }
+
+    for (idim=0; idim<ndim; idim++) {
+        ws[idim*2] = (x[idim] - a[idim*2]) / b[idim*2];
+        ws[idim*2+1] = (x[idim] - a[idim*2+1]) / b[idim*2+1];
+    }
+
+    result = 0.0;
+    for (icorner=0; icorner<nf; icorner++) {
+        w = 1.0;
+        for (idim=0; idim<ndim; idim++) {
+            w *= ws[idim*2 + ((icorner >> (ndim-1-idim)) & 1)];
+        }
+        result += f[icorner] * w;
+    }
+
+    return result;
+}
+
+static double interpolate1(const spit_tree_t *tree, const double *x) {
+    size_t icell, ichild, ifirst, nchildren;
+    int found;
+
+    icell = 0;
+    if (!inside(tree, icell, x)) {
+        return NAN;
+    }
+
+    while (tree->nchildren[icell] > 0) {
+        ifirst = tree->first_child[icell];
+        nchildren = tree->nchildren[icell];
+        found = 0;
+        for (ichild=ifirst; ichild<ifirst+nchildren; ichild++) {
+            if (inside(tree, ichild, x)) {
+                icell = ichild;
+                found = 1;
+                break;
+            }
+        }
+        if (!found) {
+            return NAN;
+        }
+    }
+
+    return interpolate_leaf(tree, icell, x);
+}
+
+static spit_error_t spit_check(const spit_tree_t *tree) {
+    size_t icell;
+
+    if (tree->ndim < 1 || tree->ndim > SPIT_MAX_NDIM) {
+        return BAD_NDIM;
+    }
+
+    if (tree->ncells < 1) {
+        return BAD_TREE;
+    }
+
+    /* children must come after their parent, so that descending always
+     * terminates */
+    for (icell=0; icell<tree->ncells; icell++) {
+        if (tree->nchildren[icell] < 0 ||
+                (tree->nchildren[icell] > 0 && (
+                    tree->first_child[icell] <= (int64_t)icell ||
+                    tree->first_child[icell] + tree->nchildren[icell] >
+                        (int64_t)tree->ncells))) {
+            return BAD_TREE;
+        }
+    }
+
+    return SUCCESS;
+}
+
+static spit_error_t spit_interpolate_many(
+        const spit_tree_t *tree,
+        size_t npoints,
+        const double *x,
+        double *out,
+        int nthreads) {
+
+    size_t ipoint;
+    spit_error_t err;
+
+    err = spit_check(tree);
+    if (SUCCESS != err) {
+        return err;
+    }
+
+#if defined(_OPENMP)
+    if (nthreads <= 0) {
+        nthreads = omp_get_num_procs();
+    }
+    #pragma omp parallel for schedule(dynamic, CHUNKSIZE) \
+        num_threads(nthreads)
+#else
+    (void)nthreads;
+#endif
+    for (ipoint=0; ipoint<npoints; ipoint++) {
+        out[ipoint] = interpolate1(tree, x + ipoint*tree->ndim);
+    }
+
+    return SUCCESS;
+}
+
+static int good_array(PyObject* o, int typenum, npy_intp size_want,
+                      int ndim_want, npy_intp* shape_want) {
+    int i;
+
+    if (!PyArray_Check(o)) {
+        PyErr_SetString(SpitExtError, "not a NumPy array");
+        return 0;
+    }
+
+    if (PyArray_TYPE((PyArrayObject*)o) != typenum) {
+        PyErr_SetString(SpitExtError, "array of unexpected type");
+        return 0;
+    }
+
+    if (!PyArray_ISCARRAY((PyArrayObject*)o)) {
+        PyErr_SetString(SpitExtError,
+                        "array is not contiguous or not well behaved");
+        return 0;
+    }
+
+    if (size_want != -1 && size_want != PyArray_SIZE((PyArrayObject*)o)) {
+        PyErr_SetString(SpitExtError, "array is of unexpected size");
+        return 0;
+    }
+
+    if (ndim_want != -1 && ndim_want != PyArray_NDIM((PyArrayObject*)o)) {
+        PyErr_SetString(SpitExtError, "array is of unexpected ndim");
+        return 0;
+    }
+
+    if (ndim_want != -1 && shape_want != NULL) {
+        for (i=0; i<ndim_want; i++) {
+            if (shape_want[i] != -1 &&
+                    shape_want[i] != PyArray_DIMS((PyArrayObject*)o)[i]) {
+                PyErr_SetString(SpitExtError, "array is of unexpected shape");
+                return 0;
+            }
+        }
+    }
+
+    return 1;
+}
+
+static PyObject* w_interpolate_many(PyObject *dummy, PyObject *args) {
+    PyObject *first_child_arr, *nchildren_arr, *xbounds_arr, *a_arr, *b_arr;
+    PyObject *f_arr, *x_arr;
+    PyArrayObject *result_arr;
+    spit_tree_t tree;
+    npy_intp ncells, ndim, npoints;
+    npy_intp shape_want[3];
+    npy_intp array_dims[1];
+    int nthreads;
+    spit_error_t err;
+
+    (void)dummy; /* silence warning */
+
+    if (!PyArg_ParseTuple(args, "OOOOOOOi", &first_child_arr, &nchildren_arr,
+                          &xbounds_arr, &a_arr, &b_arr, &f_arr, &x_arr,
+                          &nthreads)) {
+        PyErr_SetString(
+            SpitExtError,
+            "usage: interpolate_many(first_child, nchildren, xbounds, a, b, "
+            "f, x, nthreads)");
+        return NULL;
+    }
+
+    if (!good_array(xbounds_arr, NPY_FLOAT64, -1, 3, NULL)) return NULL;
+
+    ncells = PyArray_DIMS((PyArrayObject*)xbounds_arr)[0];
+    ndim = PyArray_DIMS((PyArrayObject*)xbounds_arr)[1];
+    if (ndim < 1 || ndim > SPIT_MAX_NDIM) {
+        PyErr_SetString(SpitExtError, spit_error_names[BAD_NDIM]);
+        return NULL;
+    }
+
+    shape_want[0] = ncells;
+    shape_want[1] = ndim;
+    shape_want[2] = 2;
+    if (!good_array(xbounds_arr, NPY_FLOAT64, -1, 3, shape_want)) return NULL;
+    if (!good_array(a_arr, NPY_FLOAT64, -1, 3, shape_want)) return NULL;
+    if (!good_array(b_arr, NPY_FLOAT64, -1, 3, shape_want)) return NULL;
+    if (!good_array(first_child_arr, NPY_INT64, ncells, 1, NULL)) return NULL;
+    if (!good_array(nchildren_arr, NPY_INT64, ncells, 1, NULL)) return NULL;
+
+    shape_want[1] = (npy_intp)1 << ndim;
+    if (!good_array(f_arr, NPY_FLOAT64, -1, 2, shape_want)) return NULL;
+
+    shape_want[0] = -1;
+    shape_want[1] = ndim;
+    if (!good_array(x_arr, NPY_FLOAT64, -1, 2, shape_want)) return NULL;
+    npoints = PyArray_DIMS((PyArrayObject*)x_arr)[0];
+
+    tree.ndim = ndim;
+    tree.ncells = ncells;
+    tree.first_child = PyArray_DATA((PyArrayObject*)first_child_arr);
+    tree.nchildren = PyArray_DATA((PyArrayObject*)nchildren_arr);
+    tree.xbounds = PyArray_DATA((PyArrayObject*)xbounds_arr);
+    tree.a = PyArray_DATA((PyArrayObject*)a_arr);
+    tree.b = PyArray_DATA((PyArrayObject*)b_arr);
+    tree.f = PyArray_DATA((PyArrayObject*)f_arr);
+
+    array_dims[0] = npoints;
+    result_arr = (PyArrayObject*)PyArray_SimpleNew(1, array_dims, NPY_FLOAT64);
+    if (result_arr == NULL) {
+        PyErr_SetString(SpitExtError, "cannot allocate result array");
+        return NULL;
+    }
+
+    Py_BEGIN_ALLOW_THREADS
+    err = spit_interpolate_many(
+        &tree, npoints, PyArray_DATA((PyArrayObject*)x_arr),
+        PyArray_DATA(result_arr), nthreads);
+    Py_END_ALLOW_THREADS
+
+    if (SUCCESS != err) {
+        Py_DECREF(result_arr);
+        PyErr_SetString(SpitExtError, spit_error_names[err]);
+        return NULL;
+    }
+
+    return Py_BuildValue("N", result_arr);
+}
+
+static PyMethodDef SpitExtMethods[] = {
+    {"interpolate_many", w_interpolate_many, METH_VARARGS,
+        "Interpolate flattened SPTree at many points." },
+
+    {NULL, NULL, 0, NULL}        /* Sentinel */
+};
+
+PyMODINIT_FUNC
+initspit_ext(void)
+{
+    PyObject *m;
+
+    m = Py_InitModule("spit_ext", SpitExtMethods);
+    if (m == NULL) return;
+    import_array();
+
+    SpitExtError = PyErr_NewException("spit_ext.error", NULL, NULL);
+    Py_INCREF(SpitExtError);  /* required, because other code could remove
+                                 `error` from the module, what would create a
+                                 dangling pointer. */
+    PyModule_AddObject(m, "SpitExtError", SpitExtError);
+}
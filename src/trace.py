@@ -4,6 +4,8 @@ import time
 import math
 import copy
 import logging
+from collections import OrderedDict
+from multiprocessing.pool import ThreadPool
 
 import numpy as num
 from scipy import signal
@@ -1331,10 +1333,13 @@ class Trace(object):
         :param cut_off_fading: whether to cut off rise/fall interval in output
             trace.
         :param invert: set to True to do a deconvolution
+
+        The tapered response coefficients are cached, see
+        :py:func:`get_cached_tapered_coefs`.
         '''
 
         if transfer_function is None:
-            transfer_function = FrequencyResponse()
+            transfer_function = g_unit_response
 
         if self.tmax - self.tmin <= tfade*2.:
             raise TraceTooShort(
@@ -1349,11 +1354,11 @@ class Trace(object):
 
         data = self.ydata
         data_pad = num.zeros(ntrans, dtype=num.float)
-        data_pad[:ndata] = data - data.mean()
+        data_pad[:ndata] = data
+        data_pad[:ndata] -= data.mean()
         if tfade != 0.0:
-            data_pad[:ndata] *= costaper(
-                0., tfade, self.deltat*(ndata-1)-tfade, self.deltat*ndata,
-                ndata, self.deltat)
+            data_pad[:ndata] *= get_cached_fade_taper(
+                tfade, self.deltat, ndata)
 
         fdata = num.fft.rfft(data_pad)
         fdata *= coefs
@@ -1534,27 +1539,8 @@ class Trace(object):
     def _get_tapered_coefs(
             self, ntrans, freqlimits, transfer_function, invert=False):
 
-        deltaf = 1./(self.deltat*ntrans)
-        nfreqs = ntrans/2 + 1
-        transfer = num.ones(nfreqs, dtype=num.complex)
-        hi = snapper(nfreqs, deltaf)
-        if freqlimits is not None:
-            a, b, c, d = freqlimits
-            freqs = num.arange(hi(d)-hi(a), dtype=num.float)*deltaf \
-                + hi(a)*deltaf
-
-            if invert:
-                transfer[hi(a):hi(d)] = 1.0 / transfer_function.evaluate(freqs)
-            else:
-                transfer[hi(a):hi(d)] = transfer_function.evaluate(freqs)
-
-            tapered_transfer = costaper(a, b, c, d, nfreqs, deltaf)*transfer
-        else:
-            freqs = num.arange(nfreqs) * deltaf
-            tapered_transfer = transfer_function.evaluate(freqs)
-
-        tapered_transfer[0] = 0.0  # don't introduce static offsets
-        return tapered_transfer
+        return get_cached_tapered_coefs(
+            self.deltat, ntrans, freqlimits, transfer_function, invert=invert)
 
     def fill_template(self, template, **additional):
         '''
@@ -1654,6 +1640,401 @@ def snuffle(traces, **kwargs):
     return snuffler.snuffle(p, **kwargs)
 
 
+class TraceBatch(object):
+    '''
+    Aligned batch of evenly sampled traces for vectorised processing.
+
+    The samples of all traces are held in a single 2-D array of shape
+    ``(ntraces, ncols)``. Each row carries its own codes and start time and
+    may hold fewer than ``ncols`` valid samples; the remainder of the row is
+    zero padded. All traces share the same sampling interval.
+
+    A batch is typically built with :py:meth:`from_traces`, e.g. from the
+    trace groups yielded by :py:meth:`pyrocko.pile.Pile.chopper`, and
+    converted back with :py:meth:`to_traces`.
+
+    :param data: 2-D array with the samples, one trace per row
+    :param deltat: sampling interval [s]
+    :param tmins: start times of the rows [s], scalar or sequence
+    :param codes: list of ``(network, station, location, channel)`` tuples,
+        one per row
+    :param nsamples: number of valid samples per row (default: all)
+    '''
+
+    def __init__(self, data, deltat, tmins, codes=None, nsamples=None):
+        data = num.asarray(data)
+        if data.ndim != 2:
+            raise ValueError('TraceBatch: data must be a 2-D array')
+
+        ntraces, ncols = data.shape
+
+        if codes is None:
+            codes = [('', 'STA', '', '')] * ntraces
+
+        if nsamples is None:
+            nsamples = num.empty(ntraces, dtype=num.int)
+            nsamples.fill(ncols)
+
+        self.data = data
+        self.deltat = deltat
+        self.tmins = num.zeros(ntraces, dtype=num.float) + tmins
+        self.codes = list(codes)
+        self.nsamples = num.array(nsamples, dtype=num.int)
+
+        if len(self.codes) != ntraces or self.nsamples.size != ntraces:
+            raise ValueError(
+                'TraceBatch: number of codes or sample counts does not match '
+                'number of rows')
+
+        if num.any(self.nsamples > ncols) or num.any(self.nsamples < 0):
+            raise ValueError('TraceBatch: invalid number of samples')
+
+    @classmethod
+    def from_traces(cls, traces, dtype=num.float):
+        '''
+        Create batch from a list of traces.
+
+        The traces must share the same sampling rate. Shorter traces are zero
+        padded to the length of the longest one.
+
+        :param traces: list of :py:class:`Trace` objects
+        :param dtype: data type of the batch array
+        '''
+
+        if not traces:
+            raise NoData()
+
+        for tr in traces[1:]:
+            if not same_sampling_rate(tr, traces[0]):
+                raise MisalignedTraces(
+                    'TraceBatch: sampling rates of traces differ')
+
+        nsamples = num.array(
+            [tr.data_len() for tr in traces], dtype=num.int)
+
+        data = num.zeros((len(traces), nsamples.max()), dtype=dtype)
+        for i, tr in enumerate(traces):
+            data[i, :nsamples[i]] = tr.get_ydata()
+
+        return cls(
+            data, traces[0].deltat,
+            [tr.tmin for tr in traces],
+            codes=[tr.nslc_id for tr in traces],
+            nsamples=nsamples)
+
+    def to_traces(self, copy=False):
+        '''
+        Convert batch to a list of traces.
+
+        :param copy: if ``False``, the sample arrays of the returned traces
+            are views into the batch array, so that no data is copied.
+        '''
+
+        traces = []
+        for i in xrange(self.ntraces):
+            ydata = self.data[i, :self.nsamples[i]]
+            if copy:
+                ydata = ydata.copy()
+
+            network, station, location, channel = self.codes[i]
+            traces.append(Trace(
+                network, station, location, channel,
+                tmin=float(self.tmins[i]),
+                deltat=self.deltat,
+                ydata=ydata))
+
+        return traces
+
+    def copy(self):
+        '''
+        Get a deep copy of the batch.
+        '''
+
+        return TraceBatch(
+            self.data.copy(), self.deltat, self.tmins.copy(),
+            codes=list(self.codes), nsamples=self.nsamples.copy())
+
+    @property
+    def ntraces(self):
+        return self.data.shape[0]
+
+    @property
+    def tmaxs(self):
+        return self.tmins + (self.nsamples - 1) * self.deltat
+
+    def _padded(self):
+        return num.any(self.nsamples != self.data.shape[1])
+
+    def _zero_padding(self):
+        if self._padded():
+            icol = num.arange(self.data.shape[1])
+            self.data[icol[num.newaxis, :] >= self.nsamples[:, num.newaxis]] \
+                = 0.0
+
+    def _groups(self, key):
+        groups = {}
+        for i in xrange(self.ntraces):
+            groups.setdefault(key(i), []).append(i)
+
+        return groups.items()
+
+    def _float_data(self, demean):
+        data = self.data.astype(num.float64)
+        if demean:
+            data -= (num.sum(data, axis=1) / num.maximum(1, self.nsamples)
+                     )[:, num.newaxis]
+
+            if self._padded():
+                data[num.arange(data.shape[1])[num.newaxis, :]
+                     >= self.nsamples[:, num.newaxis]] = 0.0
+
+        return data
+
+    def _nyquist_check(self, frequency, intro, warn, raise_exception):
+        if frequency >= 0.5/self.deltat:
+            message = '%s (%g Hz) is equal to or higher than nyquist ' \
+                      'frequency (%g Hz). (TraceBatch)' \
+                % (intro, frequency, 0.5/self.deltat)
+            if warn:
+                logger.warn(message)
+            if raise_exception:
+                raise AboveNyquist(message)
+
+    def _filter(self, b, a, demean):
+        self.data = signal.lfilter(b, a, self._float_data(demean), axis=1)
+        self._zero_padding()
+
+    def lowpass(self, order, corner, nyquist_warn=True,
+                nyquist_exception=False, demean=True):
+
+        '''
+        Apply Butterworth lowpass to all traces of the batch.
+
+        See :py:meth:`Trace.lowpass`.
+        '''
+
+        self._nyquist_check(
+            corner, 'Corner frequency of lowpass', nyquist_warn,
+            nyquist_exception)
+
+        b, a = _get_cached_filter_coefs(
+            order, [corner*2.0*self.deltat], btype='low')
+
+        self._filter(b, a, demean)
+
+    def highpass(self, order, corner, nyquist_warn=True,
+                 nyquist_exception=False, demean=True):
+
+        '''
+        Apply Butterworth highpass to all traces of the batch.
+
+        See :py:meth:`Trace.highpass`.
+        '''
+
+        self._nyquist_check(
+            corner, 'Corner frequency of highpass', nyquist_warn,
+            nyquist_exception)
+
+        b, a = _get_cached_filter_coefs(
+            order, [corner*2.0*self.deltat], btype='high')
+
+        self._filter(b, a, demean)
+
+    def bandpass(self, order, corner_hp, corner_lp, demean=True):
+        '''
+        Apply Butterworth bandpass to all traces of the batch.
+
+        See :py:meth:`Trace.bandpass`.
+        '''
+
+        self._nyquist_check(
+            corner_hp, 'Lower corner frequency of bandpass', True, False)
+        self._nyquist_check(
+            corner_lp, 'Higher corner frequency of bandpass', True, False)
+
+        b, a = _get_cached_filter_coefs(
+            order,
+            [corner*2.0*self.deltat for corner in (corner_hp, corner_lp)],
+            btype='band')
+
+        self._filter(b, a, demean)
+
+    def taper(self, taperer):
+        '''
+        Apply a :py:class:`Taper` to all traces of the batch.
+
+        The taper weights are computed once for each distinct combination of
+        start time and number of samples.
+
+        :param taperer: instance of :py:class:`Taper` subclass
+        '''
+
+        data = self.data.astype(num.float64)
+        for (tmin, n), rows in self._groups(
+                lambda i: (self.tmins[i], self.nsamples[i])):
+
+            weights = num.ones(n)
+            taperer(weights, tmin, self.deltat)
+            data[rows, :n] *= weights
+
+        self.data = data
+
+    def spectrum(self, pad_to_pow2=False, tfade=None):
+        '''
+        Get FFT spectra of all traces of the batch.
+
+        All rows are transformed with the common length of the batch array.
+
+        :param pad_to_pow2: whether to zero-pad to the next power of two
+        :param tfade: rise/fall time in seconds of taper applied in
+            timedomain at both ends of each trace.
+
+        :returns: a tuple with (frequencies, 2-D array of values)
+        '''
+
+        ncols = self.data.shape[1]
+        if pad_to_pow2:
+            ntrans = nextpow2(ncols)
+        else:
+            ntrans = ncols
+
+        data = self.data
+        if tfade is not None:
+            data = self._faded(data.astype(num.float64), tfade)
+
+        fdata = num.fft.rfft(data, ntrans, axis=1)
+        df = 1./(ntrans*self.deltat)
+
+        return num.arange(fdata.shape[1])*df, fdata
+
+    def _faded(self, data, tfade):
+        for n, rows in self._groups(lambda i: self.nsamples[i]):
+            data[rows, :n] *= get_cached_fade_taper(tfade, self.deltat, n)
+
+        return data
+
+    def downsample(self, ndecimate, demean=False):
+        '''
+        Downsample all traces of the batch by a given integer factor.
+
+        See :py:meth:`Trace.downsample`. Snapping and carrying of filter
+        states are not supported.
+        '''
+
+        b, a, n = util.decimate_coeffs(ndecimate, None, 'fir')
+        data = self._float_data(demean)
+        y = signal.lfilter(b, a, data, axis=1)
+        self.data = y[:, n/2::ndecimate].copy()
+        self.nsamples = num.maximum(
+            0, (self.nsamples - n/2 + ndecimate - 1) // ndecimate)
+
+        self.deltat = reuse(self.deltat*ndecimate)
+        self._zero_padding()
+
+    def downsample_to(self, deltat, demean=False):
+        '''
+        Downsample all traces of the batch to given sampling rate.
+
+        See :py:meth:`Trace.downsample_to`. Upsampling is not supported.
+        '''
+
+        ratio = deltat/self.deltat
+        rratio = round(ratio)
+
+        if abs(ratio - rratio) / ratio > 0.0001 or \
+                not util.decitab(int(rratio)):
+            raise util.UnavailableDecimation('ratio = %g' % ratio)
+
+        for ndecimate in util.decitab(int(rratio)):
+            if ndecimate != 1:
+                self.downsample(ndecimate, demean=demean)
+
+    def transfer(self,
+                 tfade=0.,
+                 freqlimits=None,
+                 transfer_function=None,
+                 cut_off_fading=True,
+                 invert=False):
+
+        '''
+        Return new batch with transfer function applied to all traces.
+
+        Rows are grouped by their FFT length, which is chosen per row like in
+        :py:meth:`Trace.transfer`, so that the result for each row matches
+        the one of the single trace method. The transfer function is
+        evaluated once per group and the FFTs of all rows of a group are
+        computed in single calls. See :py:meth:`Trace.transfer` for the
+        meaning of the arguments.
+        '''
+
+        if transfer_function is None:
+            transfer_function = g_unit_response
+
+        if num.any((self.nsamples - 1) * self.deltat <= tfade*2.):
+            raise TraceTooShort(
+                'TraceBatch: traces too short for fading length setting. '
+                'fading length = %g' % tfade)
+
+        ncols = self.data.shape[1]
+        data = self._float_data(True)
+        if tfade != 0.0:
+            self._faded(data, tfade)
+
+        ddata = num.zeros((self.ntraces, ncols), dtype=num.float)
+        for ntrans, rows in self._groups(
+                lambda i: nextpow2(self.nsamples[i]*1.2)):
+
+            coefs = get_cached_tapered_coefs(
+                self.deltat, ntrans, freqlimits, transfer_function,
+                invert=invert)
+
+            n = min(ncols, ntrans)
+            fdata = num.fft.rfft(data[rows, :n], ntrans, axis=1)
+            fdata *= coefs
+            ddata[rows, :n] = num.fft.irfft(fdata, ntrans, axis=1)[:, :n]
+
+        output = TraceBatch(
+            ddata, self.deltat, self.tmins.copy(),
+            codes=list(self.codes), nsamples=self.nsamples.copy())
+
+        if cut_off_fading and tfade != 0.0:
+            output._cut_fading(tfade)
+        else:
+            output.data = output.data.copy()
+            output._zero_padding()
+
+        return output
+
+    def _cut_fading(self, tfade):
+        ibegs = num.zeros(self.ntraces, dtype=num.int)
+        iends = num.zeros(self.ntraces, dtype=num.int)
+        for i in xrange(self.ntraces):
+            tmin = self.tmins[i]
+            tmax = tmin + (self.nsamples[i] - 1) * self.deltat
+            ibegs[i] = max(0, t2ind(tmin+tfade - tmin, self.deltat))
+            iends[i] = min(
+                self.nsamples[i], t2ind(tmax-tfade - tmin, self.deltat))
+
+        nsamples = iends - ibegs
+        if num.any(nsamples <= 0):
+            raise TraceTooShort(
+                'TraceBatch: traces too short for fading length setting. '
+                'fading length = %g' % tfade)
+
+        ncols = nsamples.max()
+        if num.all(ibegs == ibegs[0]):
+            data = self.data[:, ibegs[0]:ibegs[0]+ncols].copy()
+        else:
+            data = num.zeros((self.ntraces, ncols), dtype=self.data.dtype)
+            for i in xrange(self.ntraces):
+                data[i, :nsamples[i]] = self.data[i, ibegs[i]:iends[i]]
+
+        self.data = data
+        self.tmins = self.tmins + ibegs * self.deltat
+        self.nsamples = nsamples
+        self._zero_padding()
+
+
 class MisalignedTraces(Exception):
     '''
     This exception is raised by some :py:class:`Trace` operations when tmin,
@@ -1798,17 +2179,24 @@ def degapper(
     :param maxlap:      maximum number of samples of overlap which are removed
 
     :returns:           list of traces
+
+    The merges are first planned using only the trace headers. The samples of
+    each output trace are then assembled in a single preallocated array, so
+    that the cost stays linear in the total number of samples, even for
+    thousands of small records.
     '''
 
     in_traces = traces
     out_traces = []
-    if not in_traces:
-        return out_traces
-    out_traces.append(in_traces.pop(0))
-    while in_traces:
+    plans = []
+    for b in in_traces:
+        if not out_traces:
+            out_traces.append(b)
+            plans.append([b.data_len(), []])
+            continue
 
         a = out_traces[-1]
-        b = in_traces.pop(0)
+        plan = plans[-1]
 
         avirt, bvirt = a.ydata is None, b.ydata is None
         assert avirt == bvirt, \
@@ -1817,11 +2205,18 @@ def degapper(
 
         virtual = avirt and bvirt
 
+        if virtual:
+            na = a.data_len()
+        else:
+            na = plan[0]
+
+        nb = b.data_len()
+
         if (a.nslc_id == b.nslc_id and a.deltat == b.deltat
-                and a.data_len() >= 1 and b.data_len() >= 1
+                and na >= 1 and nb >= 1
                 and (virtual or a.ydata.dtype == b.ydata.dtype)):
 
-            dist = (b.tmin-(a.tmin+(a.data_len()-1)*a.deltat))/a.deltat
+            dist = (b.tmin-(a.tmin+(na-1)*a.deltat))/a.deltat
             idist = int(round(dist))
             if abs(dist - idist) > 0.05 and idist <= maxgap:
                 # logger.warn('Cannot degap traces with displaced sampling '
@@ -1829,70 +2224,101 @@ def degapper(
                 pass
             else:
                 if 1 < idist <= maxgap:
-                    if not virtual:
-                        if fillmethod == 'interpolate':
-                            filler = a.ydata[-1] + (
-                                ((1.0 + num.arange(idist-1, dtype=num.float))
-                                 / idist) * (b.ydata[0]-a.ydata[-1])
-                            ).astype(a.ydata.dtype)
-                        elif fillmethod == 'zeros':
-                            filler = num.zeros(idist-1, dtype=a.ydist.dtype)
-                        a.ydata = num.concatenate((a.ydata, filler, b.ydata))
-                    a.tmax = b.tmax
-                    if a.mtime and b.mtime:
-                        a.mtime = max(a.mtime, b.mtime)
-                    continue
+                    plan[0] = na + idist-1 + nb
+                    plan[1].append(('gap', b, idist-1))
 
                 elif idist == 1:
-                    if not virtual:
-                        a.ydata = num.concatenate((a.ydata, b.ydata))
-                    a.tmax = b.tmax
-                    if a.mtime and b.mtime:
-                        a.mtime = max(a.mtime, b.mtime)
-                    continue
+                    plan[0] = na + nb
+                    plan[1].append(('gap', b, 0))
 
                 elif idist <= 0 and (maxlap is None or -maxlap < idist):
                     if b.tmax > a.tmax:
+                        n = -idist+1
                         if not virtual:
-                            na = a.ydata.size
-                            n = -idist+1
                             if deoverlap == 'use_second':
-                                a.ydata = num.concatenate(
-                                    (a.ydata[:-n], b.ydata))
-                            elif deoverlap in ('use_first', 'crossfade_cos'):
-                                a.ydata = num.concatenate(
-                                    (a.ydata, b.ydata[n:]))
-                            elif deoverlap == 'add':
-                                a.ydata[-n:] += b.ydata[:n]
-                                a.ydata = num.concatenate(
-                                    (a.ydata, b.ydata[n:]))
+                                plan[0] = max(0, na-n) + nb
+                            elif deoverlap in (
+                                    'use_first', 'crossfade_cos', 'add'):
+                                plan[0] = na + max(0, nb-n)
                             else:
                                 assert False, 'unknown deoverlap method'
 
-                            if deoverlap == 'crossfade_cos':
-                                n = -idist+1
-                                taper = 0.5-0.5*num.cos(
-                                    (1.+num.arange(n))/(1.+n)*num.pi)
-                                a.ydata[na-n:na] *= 1.-taper
-                                a.ydata[na-n:na] += b.ydata[:n] * taper
+                        plan[1].append(('overlap', b, n))
 
-                        a.tmax = b.tmax
-                        if a.mtime and b.mtime:
-                            a.mtime = max(a.mtime, b.mtime)
-                        continue
                     else:
                         # make short second trace vanish
                         continue
 
-        if b.data_len() >= 1:
+                else:
+                    if nb >= 1:
+                        out_traces.append(b)
+                        plans.append([nb, []])
+
+                    continue
+
+                a.tmax = b.tmax
+                if a.mtime and b.mtime:
+                    a.mtime = max(a.mtime, b.mtime)
+                continue
+
+        if nb >= 1:
             out_traces.append(b)
+            plans.append([nb, []])
+
+    del in_traces[:]
+
+    for tr, (ntotal, ops) in zip(out_traces, plans):
+        if ops and tr.ydata is not None:
+            tr.ydata = _degapper_assemble(
+                tr.ydata, ntotal, ops, fillmethod, deoverlap)
 
-    for tr in out_traces:
         tr._update_ids()
 
     return out_traces
 
 
+def _degapper_assemble(ydata, ntotal, ops, fillmethod, deoverlap):
+    out = num.empty(ntotal, dtype=ydata.dtype)
+    na = ydata.size
+    out[:na] = ydata
+    for kind, b, n in ops:
+        nb = b.ydata.size
+        if kind == 'gap':
+            if n != 0:
+                if fillmethod == 'interpolate':
+                    out[na:na+n] = out[na-1] + (
+                        ((1.0 + num.arange(n, dtype=num.float))
+                         / (n+1)) * (b.ydata[0]-out[na-1])
+                    ).astype(out.dtype)
+                elif fillmethod == 'zeros':
+                    out[na:na+n] = 0
+
+                na += n
+
+            out[na:na+nb] = b.ydata
+            na += nb
+
+        else:
+            if deoverlap == 'use_second':
+                na = max(0, na-n)
+                out[na:na+nb] = b.ydata
+                na += nb
+            else:
+                if deoverlap == 'add':
+                    out[max(0, na-n):na] += b.ydata[:n]
+                elif deoverlap == 'crossfade_cos':
+                    taper = 0.5-0.5*num.cos(
+                        (1.+num.arange(n))/(1.+n)*num.pi)
+                    out[na-n:na] *= 1.-taper
+                    out[na-n:na] += b.ydata[:n] * taper
+
+                out[na:na+max(0, nb-n)] = b.ydata[n:]
+                na += max(0, nb-n)
+
+    assert na == ntotal
+    return out
+
+
 def rotate(traces, azimuth, in_channels, out_channels):
     '''
     2D rotation of traces.
@@ -2309,6 +2735,215 @@ def correlate(a, b, mode='valid', normalization=None, use_fft=False):
     return c
 
 
+class MultiCorrelator(object):
+    '''
+    Batched FFT cross correlation of multi-channel templates with data.
+
+    Useful for template matching: each template is given as a list of
+    traces, one per channel, and is correlated with the data traces of the
+    same channels. Correlations are computed blockwise with the
+    overlap-save method, using an FFT length which depends only on the
+    template length. The template spectra are computed once, when the
+    correlator is created, and are small and independent of the length of
+    the data windows, e.g. as yielded by
+    :py:meth:`pyrocko.pile.Pile.chopper`. The data blocks of a channel are
+    transformed once for all templates of the same length. The
+    per-channel correlation traces of a template can be stacked over the
+    network with :py:meth:`stack`.
+
+    :param templates: list of templates, each a list of :py:class:`Trace`
+        objects with different (network, station, location, channel) codes
+    :param nthreads: number of threads used to process channels in parallel
+    '''
+
+    block_factor = 4
+    nfft_min = 1024
+
+    def __init__(self, templates, nthreads=1):
+        self.templates = [list(template) for template in templates]
+        all_traces = [tr for template in self.templates for tr in template]
+        if not all_traces:
+            raise NoData()
+
+        for tr in all_traces[1:]:
+            assert_same_sampling_rate(tr, all_traces[0])
+
+        self.deltat = all_traces[0].deltat
+        self.nthreads = nthreads
+
+        # the spectra are only read when correlating, so that they can be
+        # shared by the worker threads without locking
+        self._spectra = {}
+        for itemplate, template in enumerate(self.templates):
+            for itrace, a in enumerate(template):
+                nfft = self._nfft(a.data_len())
+                self._spectra[itemplate, itrace] = num.conj(
+                    num.fft.rfft(a.get_ydata(), nfft))
+
+    def _nfft(self, na):
+        return nextregular(max(self.block_factor * na, self.nfft_min))
+
+    def _blocks_spectra(self, yb, na):
+        nb = yb.size
+        nfft = self._nfft(na)
+        nstep = nfft - na + 1
+        nblocks = (nb - na) // nstep + 1
+
+        ypad = num.zeros((nblocks-1)*nstep + nfft, dtype=num.float)
+        ypad[:nb] = yb
+        blocks = num.lib.stride_tricks.as_strided(
+            ypad, shape=(nblocks, nfft),
+            strides=(ypad.strides[0]*nstep, ypad.strides[0]))
+
+        return num.fft.rfft(blocks, axis=1), nfft, nstep
+
+    def _correlate_channel(self, b, pairs, normalization):
+        yb = b.get_ydata().astype(num.float)
+        nb = yb.size
+
+        pairs_by_length = {}
+        for itemplate, itrace in pairs:
+            na = self.templates[itemplate][itrace].data_len()
+            pairs_by_length.setdefault(na, []).append((itemplate, itrace))
+
+        results = []
+        for na, pairs_na in pairs_by_length.iteritems():
+            fblocks, nfft, nstep = self._blocks_spectra(yb, na)
+
+            if normalization == 'normal':
+                normfac_b = num.sqrt(num.sum(yb**2))
+            elif normalization == 'gliding':
+                energies = num.sqrt(moving_sum(yb**2, na, mode='valid'))
+
+            for itemplate, itrace in pairs_na:
+                a = self.templates[itemplate][itrace]
+                ya = a.get_ydata()
+
+                yc = num.fft.irfft(
+                    fblocks * self._spectra[itemplate, itrace], nfft,
+                    axis=1)[:, :nstep].ravel()[:nb-na+1]
+
+                if normalization == 'normal':
+                    yc /= num.sqrt(num.sum(ya**2))*normfac_b
+
+                elif normalization == 'gliding':
+                    epsilon = 0.00001
+                    normfac_a = num.sqrt(num.sum(ya**2))
+                    yc /= normfac_a * energies + normfac_a*epsilon
+
+                c = a.copy(data=False)
+                c.set_ydata(yc)
+                c.set_codes(*merge_codes(a, b, '~'))
+                c.shift(-c.tmin + b.tmin-a.tmin)
+                results.append((itemplate, itrace, c))
+
+        return results
+
+    def correlate(self, traces, normalization='gliding'):
+        '''
+        Correlate all templates with the given data traces.
+
+        :param traces: list of data traces, at most one per channel, each at
+            least as long as the matching template traces
+        :param normalization: ``'normal'``, ``'gliding'``, or ``None``
+
+        :returns: list with one list of correlation traces per template,
+            holding results for the channels of the template for which data
+            is available
+
+        The correlation traces are the same as those returned by
+        :py:func:`correlate` with ``mode='valid'``, the template trace as
+        first and the data trace as second argument.
+        '''
+
+        data = {}
+        for tr in traces:
+            assert_same_sampling_rate(tr, self.templates[0][0])
+            if tr.nslc_id in data:
+                raise ValueError(
+                    'MultiCorrelator: multiple traces given for channel %s' %
+                    '.'.join(tr.nslc_id))
+
+            data[tr.nslc_id] = tr
+
+        jobs = {}
+        for itemplate, template in enumerate(self.templates):
+            for itrace, a in enumerate(template):
+                b = data.get(a.nslc_id, None)
+                if b is not None and a.data_len() <= b.data_len():
+                    jobs.setdefault(a.nslc_id, (b, []))[1].append(
+                        (itemplate, itrace))
+
+        def work(job):
+            b, pairs = job
+            return self._correlate_channel(b, pairs, normalization)
+
+        if self.nthreads > 1 and len(jobs) > 1:
+            pool = ThreadPool(self.nthreads)
+            try:
+                results = pool.map(work, jobs.values())
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            results = map(work, jobs.values())
+
+        ccs = [[] for template in self.templates]
+        for itemplate, itrace, c in sorted(
+                (x for result in results for x in result),
+                key=lambda x: x[:2]):
+
+            ccs[itemplate].append(c)
+
+        return ccs
+
+    def stack(self, ccs, weights=None):
+        '''
+        Stack correlation traces of a template with
+        :py:func:`pyrocko.parstack.parstack`.
+
+        :param ccs: list of correlation traces of one template, as returned
+            by :py:meth:`correlate`
+        :param weights: weight for each correlation trace (default: equal
+            weights, summing up to one, so that the network average is
+            returned)
+
+        :returns: :py:class:`Trace` with the stacked correlation, covering
+            the union of the time spans of the input traces
+        '''
+
+        from pyrocko.parstack import parstack
+
+        if not ccs:
+            raise NoData()
+
+        n = len(ccs)
+        if weights is None:
+            weights = num.ones((1, n), dtype=num.float) / n
+        else:
+            weights = num.array(weights, dtype=num.float).reshape((1, n))
+
+        tref = min(c.tmin for c in ccs)
+        offsets = num.array(
+            [int(round((c.tmin-tref)/self.deltat)) for c in ccs],
+            dtype=num.int32)
+
+        shifts = num.zeros((1, n), dtype=num.int32)
+        arrays = [
+            num.ascontiguousarray(c.get_ydata(), dtype=num.float)
+            for c in ccs]
+
+        result, ioffset = parstack(
+            arrays, offsets, shifts, weights, 0,
+            nparallel=max(1, self.nthreads))
+
+        return Trace(
+            '', 'STACK', '', '',
+            tmin=tref + ioffset*self.deltat,
+            deltat=self.deltat,
+            ydata=result[0])
+
+
 def deconvolve(
         a, b, waterlevel,
         tshift=0.,
@@ -3032,10 +3667,158 @@ def moving_sum(x, n, mode='valid'):
     return y
 
 
+def get_tapered_coefs(
+        deltat, ntrans, freqlimits, transfer_function, invert=False):
+
+    '''
+    Get tapered frequency response coefficients for FFT-based filtering.
+
+    :param deltat: sampling interval of the time series
+    :param ntrans: length of the real FFT
+    :param freqlimits: 4-tuple with corner frequencies in Hz or ``None``
+    :param transfer_function: :py:class:`FrequencyResponse` object
+    :param invert: whether to return coefficients of the inverse response
+
+    :returns: complex array with ``ntrans/2 + 1`` coefficients
+    '''
+
+    deltaf = 1./(deltat*ntrans)
+    nfreqs = ntrans/2 + 1
+    transfer = num.ones(nfreqs, dtype=num.complex)
+    hi = snapper(nfreqs, deltaf)
+    if freqlimits is not None:
+        a, b, c, d = freqlimits
+        freqs = num.arange(hi(d)-hi(a), dtype=num.float)*deltaf \
+            + hi(a)*deltaf
+
+        if invert:
+            transfer[hi(a):hi(d)] = 1.0 / transfer_function.evaluate(freqs)
+        else:
+            transfer[hi(a):hi(d)] = transfer_function.evaluate(freqs)
+
+        tapered_transfer = costaper(a, b, c, d, nfreqs, deltaf)*transfer
+    else:
+        freqs = num.arange(nfreqs) * deltaf
+        tapered_transfer = transfer_function.evaluate(freqs)
+
+    tapered_transfer[0] = 0.0  # don't introduce static offsets
+    return tapered_transfer
+
+
+g_unit_response = FrequencyResponse()
+# least recently used entries are dropped when the arrays held by the cache
+# would exceed g_transfer_cache_max_bytes
+g_transfer_cache = OrderedDict()
+g_transfer_cache_nbytes = 0
+g_transfer_cache_max_bytes = 64*1024**2
+
+
+def _get_cached(key, make):
+    global g_transfer_cache_nbytes
+
+    try:
+        value = g_transfer_cache.pop(key)
+    except KeyError:
+        value = make()
+        value[-1].flags.writeable = False
+        nbytes = value[-1].nbytes
+        if nbytes > g_transfer_cache_max_bytes:
+            return value
+
+        while g_transfer_cache and \
+                g_transfer_cache_nbytes + nbytes > g_transfer_cache_max_bytes:
+
+            _, old = g_transfer_cache.popitem(last=False)
+            g_transfer_cache_nbytes -= old[-1].nbytes
+
+        g_transfer_cache_nbytes += nbytes
+
+    g_transfer_cache[key] = value
+    return value
+
+
+def get_cached_tapered_coefs(
+        deltat, ntrans, freqlimits, transfer_function, invert=False):
+
+    '''
+    Cached variant of :py:func:`get_tapered_coefs`.
+
+    Coefficients are cached by identity of the response object, so that a
+    response is evaluated only once when it is applied to many traces of the
+    same length and sampling rate. Response objects must not be modified
+    after having been used with this function, or
+    :py:func:`clear_transfer_cache` must be called after modifying them.
+
+    The returned array is read-only.
+    '''
+
+    if freqlimits is not None:
+        freqlimits = tuple(freqlimits)
+
+    key = ('coefs', id(transfer_function), deltat, ntrans, freqlimits,
+           invert)
+
+    # the response object is kept in the cache entry to prevent its id from
+    # being reused while the entry exists
+    return _get_cached(key, lambda: (
+        transfer_function,
+        get_tapered_coefs(
+            deltat, ntrans, freqlimits, transfer_function, invert=invert)))[1]
+
+
+def get_cached_fade_taper(tfade, deltat, ndata):
+    '''
+    Get cached time domain fading taper as used by :py:meth:`Trace.transfer`.
+
+    The returned array is read-only.
+    '''
+
+    key = ('fade', tfade, deltat, ndata)
+    return _get_cached(key, lambda: (costaper(
+        0., tfade, deltat*(ndata-1)-tfade, deltat*ndata, ndata, deltat),))[0]
+
+
+def clear_transfer_cache():
+    '''
+    Clear cache used by :py:func:`get_cached_tapered_coefs` and
+    :py:func:`get_cached_fade_taper`.
+    '''
+
+    global g_transfer_cache_nbytes
+
+    g_transfer_cache.clear()
+    g_transfer_cache_nbytes = 0
+
+
 def nextpow2(i):
     return 2**int(math.ceil(math.log(i)/math.log(2.)))
 
 
+def nextregular(i):
+    '''
+    Get smallest number not less than ``i`` with no prime factors above 5.
+
+    Such transform lengths are handled efficiently by the FFT routines and
+    are usually much closer to ``i`` than :py:func:`nextpow2`.
+    '''
+
+    best = nextpow2(i)
+    p5 = 1
+    while p5 < best:
+        p35 = p5
+        while p35 < best:
+            p = p35
+            while p < i:
+                p *= 2
+
+            best = min(best, p)
+            p35 *= 3
+
+        p5 *= 5
+
+    return best
+
+
 def snapper_w_offset(nmax, offset, delta, snapfun=math.ceil):
     def snap(x):
         return max(0, min(int(snapfun((x-offset)/delta)), nmax))
@@ -3162,7 +3945,6 @@ def co_list_append(list):
         list.append((yield))
 
 
-@coroutine
 def co_lfilter(target, b, a):
     '''
     Successively filter broken continuous trace data (coroutine).
@@ -3194,12 +3976,18 @@ def co_lfilter(target, b, a):
 
     '''
 
+    return _co_lfilter(target, lambda tr: (b, a))
+
+
+@coroutine
+def _co_lfilter(target, get_coefs):
     try:
         states = States()
         output = None
         while True:
             input = (yield)
 
+            b, a = get_coefs(input)
             zi = states.get(input)
             if zi is None:
                 zi = num.zeros(max(len(a), len(b))-1, dtype=num.float)
@@ -3214,6 +4002,45 @@ def co_lfilter(target, b, a):
         target.close()
 
 
+def co_lowpass(target, order, corner):
+    '''
+    Successively apply Butterworth lowpass to broken continuous trace data
+    (coroutine).
+
+    Works like :py:func:`co_lfilter`, with filter coefficients as used by
+    :py:meth:`Trace.lowpass`, which are set up for the sampling rate of each
+    incoming trace. Unlike :py:meth:`Trace.lowpass`, the mean is not removed.
+    '''
+
+    return _co_lfilter(target, lambda tr: _get_cached_filter_coefs(
+        order, [corner*2.0*tr.deltat], btype='low'))
+
+
+def co_highpass(target, order, corner):
+    '''
+    Successively apply Butterworth highpass to broken continuous trace data
+    (coroutine).
+
+    See :py:func:`co_lowpass`.
+    '''
+
+    return _co_lfilter(target, lambda tr: _get_cached_filter_coefs(
+        order, [corner*2.0*tr.deltat], btype='high'))
+
+
+def co_bandpass(target, order, corner_hp, corner_lp):
+    '''
+    Successively apply Butterworth bandpass to broken continuous trace data
+    (coroutine).
+
+    See :py:func:`co_lowpass`.
+    '''
+
+    return _co_lfilter(target, lambda tr: _get_cached_filter_coefs(
+        order, [corner*2.0*tr.deltat for corner in (corner_hp, corner_lp)],
+        btype='band'))
+
+
 def co_antialias(target, q, n=None, ftype='fir'):
     b, a, n = util.decimate_coeffs(q, n, ftype)
     anti = co_lfilter(target, b, a)
@@ -3306,6 +4133,120 @@ def co_downsample_to(target, deltat):
             g.close()
 
 
+def get_cached_transfer_kernel(
+        deltat, nhalf, nfft, freqlimits, transfer_function, invert=False):
+
+    '''
+    Get spectrum of truncated impulse response for overlap-save convolution.
+
+    The impulse response belonging to the coefficients of
+    :py:func:`get_cached_tapered_coefs` is truncated to ``2*nhalf+1`` samples
+    centered at zero lag, tapered at its ends and zero padded to ``nfft``
+    samples. Convolution with it delays the signal by ``nhalf`` samples.
+
+    The returned array is read-only.
+    '''
+
+    if freqlimits is not None:
+        freqlimits = tuple(freqlimits)
+
+    def make():
+        ntrans = nextpow2(8*nhalf)
+        coefs = get_cached_tapered_coefs(
+            deltat, ntrans, freqlimits, transfer_function, invert=invert)
+
+        tkernel = 2*nhalf*deltat
+        kernel = num.zeros(nfft, dtype=num.float)
+        kernel[:2*nhalf+1] = num.roll(
+            num.fft.irfft(coefs, ntrans), nhalf)[:2*nhalf+1]
+        kernel[:2*nhalf+1] *= costaper(
+            0., 0.1*tkernel, 0.9*tkernel, tkernel, 2*nhalf+1, deltat)
+
+        return transfer_function, num.fft.rfft(kernel)
+
+    key = ('kernel', id(transfer_function), deltat, nhalf, nfft, freqlimits,
+           invert)
+
+    return _get_cached(key, make)[1]
+
+
+@coroutine
+def co_transfer(target, transfer_function, tkernel, freqlimits=None,
+                invert=False):
+
+    '''
+    Successively apply transfer function to broken continuous trace data
+    (coroutine).
+
+    Create coroutine which takes :py:class:`Trace` objects, convolves their
+    data with the transfer function and sends new :py:class:`Trace` objects
+    containing the result to target. Overlap-save FFT convolution with a
+    truncated impulse response is used, so that successive traces, e.g. as
+    yielded by :py:meth:`pyrocko.pile.Pile.chopper` without padding, give
+    seamless output.
+
+    The impulse response is truncated to the lag interval [-``tkernel``,
+    ``tkernel``]. ``tkernel`` should be a few times the longest period
+    passed by ``freqlimits``. Output lags input by ``tkernel``, i.e. each
+    output trace covers the time span of the respective input trace, shifted
+    back by ``tkernel``. After the first trace and after gaps, a transient of
+    length 2*``tkernel`` occurs, similar to the one produced by
+    :py:func:`co_lfilter`.
+
+    As with :py:func:`co_lfilter`, states are kept *per channel*.
+
+    :param transfer_function: :py:class:`FrequencyResponse` object
+    :param tkernel: half length of truncated impulse response [s]
+    :param freqlimits: 4-tuple with corner frequencies in Hz or ``None``
+    :param invert: set to ``True`` to do a deconvolution
+
+    Use it like this::
+
+      from pyrocko.trace import co_transfer, co_list_append
+
+      restituted = []
+      pipe = co_transfer(
+          co_list_append(restituted), response, 200.,
+          freqlimits=(0.01, 0.02, 20., 40.), invert=True)
+
+      for traces in pile.chopper(tinc=3600.):
+          for trace in traces:
+              pipe.send(trace)
+
+      pipe.close()
+    '''
+
+    try:
+        states = States()
+        while True:
+            input = (yield)
+
+            deltat = input.deltat
+            nhalf = max(1, int(round(tkernel/deltat)))
+            history = states.get(input)
+            if history is None:
+                history = num.zeros(2*nhalf, dtype=num.float)
+
+            ydata = input.get_ydata()
+            block = num.concatenate((history, ydata))
+            nfft = nextpow2(block.size)
+            fkernel = get_cached_transfer_kernel(
+                deltat, nhalf, nfft, freqlimits, transfer_function,
+                invert=invert)
+
+            output = input.copy(data=False)
+            output.shift(-nhalf*deltat)
+            output.set_ydata(num.fft.irfft(
+                num.fft.rfft(block, nfft) * fkernel,
+                nfft)[2*nhalf:2*nhalf+ydata.size])
+
+            states.set(input, block[-2*nhalf:].copy())
+            target.send(output)
+
+    except GeneratorExit:
+        target.close()
+
+
 class DomainChoice(StringChoice):
     choices = [
         'time_domain',
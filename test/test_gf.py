@@ -1,7 +1,9 @@
+import os
 import time
 import sys
 import random
 import math
+import signal
 from pyrocko import guts
 import unittest
 from tempfile import mkdtemp
@@ -487,6 +489,234 @@ class GFTestCase(unittest.TestCase):
 
             self.assertTrue(numeq(data, tr.ydata, 0.01))
 
+    def test_process_nprocs(self):
+        store_dir = self.get_pulse_store_dir()
+        engine = gf.LocalEngine(store_dirs=[store_dir])
+
+        sources = [
+            gf.ExplosionSource(
+                time=random.random(),
+                depth=depth,
+                moment=moment)
+
+            for moment in (1.0, 2.0) for depth in [100., 200., 300.]
+        ]
+
+        targets = [
+            gf.Target(
+                codes=('', 'STA%i' % i, '', component),
+                north_shift=random.uniform(100., 700.),
+                east_shift=random.uniform(100., 700.))
+
+            for i in xrange(5) for component in 'ZNE'
+        ]
+
+        def results(**kwargs):
+            response = engine.process(sources, targets, **kwargs)
+            return list(response.iter_results())
+
+        results1 = results()
+        for nprocs in [2, 4]:
+            status = []
+
+            def status_callback(i, n):
+                status.append((i, n))
+
+            results2 = results(nprocs=nprocs, status_callback=status_callback)
+            assert len(status) == len(results2) + 1
+            assert len(results1) == len(results2)
+            for (s1, t1, tr1), (s2, t2, tr2) in zip(results1, results2):
+                assert s1 == s2 and t1 == t2
+                assert tr1.tmin == tr2.tmin
+                num.testing.assert_array_equal(tr1.ydata, tr2.ydata)
+
+        for nprocs in [1, 2]:
+            with self.assertRaises(Exception):
+                engine.process(
+                    sources, [gf.Target(north_shift=5000.)] * 10,
+                    nprocs=nprocs)
+
+    def test_seismograms_batched(self):
+        store_dir = self.get_pulse_store_dir()
+        store = gf.Store(store_dir)
+        store.make_decimated(2, force=True)
+        engine = gf.LocalEngine(store_dirs=[store_dir])
+
+        source = gf.ExplosionSource(depth=150., moment=1.0, time=0.3)
+        dsource = source.discretize_basesource(store)
+        components = ['displacement.d', 'displacement.n']
+
+        receivers = [
+            gf.meta.Receiver(
+                north_shift=random.uniform(100., 700.),
+                east_shift=random.uniform(100., 700.))
+            for _ in xrange(20)]
+
+        for interpolation in ('nearest_neighbor', 'multilinear'):
+            for deltat, itmin, nsamples in [
+                    (None, None, None),
+                    (None, 5, 40),
+                    (store.config.deltat*2, None, None)]:
+
+                batched = store.seismograms(
+                    dsource, receivers, components, deltat=deltat,
+                    itmin=itmin, nsamples=nsamples,
+                    interpolation=interpolation)
+
+                for receiver, seis in zip(receivers, batched):
+                    seis_ref = gf.store.make_same_span(store.seismogram(
+                        dsource, receiver, components, deltat=deltat,
+                        itmin=itmin, nsamples=nsamples,
+                        interpolation=interpolation))
+
+                    self.assertEqual(sorted(seis.keys()), components)
+                    for comp in components:
+                        tr, tr_ref = seis[comp], seis_ref[comp]
+                        self.assertEqual(tr.itmin, tr_ref.itmin)
+                        self.assertEqual(tr.deltat, tr_ref.deltat)
+                        num.testing.assert_allclose(
+                            tr.data, tr_ref.data, rtol=1e-5, atol=1e-12)
+
+        with self.assertRaises(gf.meta.OutOfBounds):
+            store.seismograms(
+                dsource, [gf.meta.Receiver(north_shift=5000.)], components)
+
+        targets = [
+            gf.Target(
+                codes=('', 'STA%i' % i, '', component),
+                north_shift=random.uniform(100., 700.),
+                east_shift=random.uniform(100., 700.),
+                interpolation='multilinear')
+
+            for i in xrange(10) for component in 'ZNE'
+        ]
+
+        response = engine.process(source, targets)
+        for _, target, tr in response.iter_results():
+            tr_ref = engine.process(source, [target]).pyrocko_traces()[0]
+            self.assertEqual(tr.tmin, tr_ref.tmin)
+            num.testing.assert_allclose(
+                tr.ydata, tr_ref.ydata, rtol=1e-5,
+                atol=1e-5 * num.max(num.abs(tr_ref.ydata)))
+
+    def test_dsource_cache(self):
+        store_dir = self.get_pulse_store_dir()
+        engine = gf.LocalEngine(store_dirs=[store_dir])
+
+        sources = [
+            gf.RectangularExplosionSource(
+                time=time,
+                depth=depth,
+                moment=moment,
+                length=100.,
+                width=50.)
+
+            for time in (0.0, 0.5)
+            for moment in (1.0, 2.0)
+            for depth in [100., 200., 300.]
+        ]
+
+        targets = [
+            gf.Target(
+                codes=('', 'STA', '', component),
+                north_shift=500.,
+                east_shift=0.)
+
+            for component in 'ZNE'
+        ]
+
+        def results():
+            response = engine.process(sources, targets)
+            return [tr.ydata for (_, _, tr) in response.iter_results()]
+
+        results1 = results()
+        stats = engine.get_dsource_cache_stats()
+        assert stats['misses'] == 3
+        assert stats['hits'] == 0
+        assert stats['nentries'] == 3
+        assert 0 < stats['nbytes'] <= stats['max_bytes']
+
+        results2 = results()
+        stats = engine.get_dsource_cache_stats()
+        assert stats['misses'] == 3
+        assert stats['hits'] == 3
+        for ydata1, ydata2 in zip(results1, results2):
+            num.testing.assert_array_equal(ydata1, ydata2)
+
+        engine.clear_dsource_cache()
+        assert engine.get_dsource_cache_stats()['nentries'] == 0
+
+        engine = gf.LocalEngine(
+            store_dirs=[store_dir], dsource_cache_max_bytes=0)
+        results3 = results()
+        stats = engine.get_dsource_cache_stats()
+        assert stats['nentries'] == 0
+        assert stats['evictions'] == 3
+        for ydata1, ydata3 in zip(results1, results3):
+            num.testing.assert_array_equal(ydata1, ydata3)
+
+    def test_base_cache(self):
+        store_dir = self.get_pulse_store_dir()
+        cachedir = mkdtemp(prefix='gfcache')
+        self.tempdirs.append(cachedir)
+
+        sources = [
+            gf.ExplosionSource(
+                time=time,
+                depth=depth,
+                moment=moment)
+
+            for time in (0.0, 0.5)
+            for moment in (1.0, 2.0)
+            for depth in [100., 200.]
+        ]
+
+        targets = [
+            gf.Target(
+                codes=('', 'STA', '', component),
+                north_shift=500.,
+                east_shift=0.)
+
+            for component in 'ZNE'
+        ]
+
+        def results(engine):
+            response = engine.process(sources, targets)
+            return [tr.ydata for (_, _, tr) in response.iter_results()]
+
+        results_ref = results(gf.LocalEngine(store_dirs=[store_dir]))
+
+        engine = gf.LocalEngine(
+            store_dirs=[store_dir],
+            base_cache_max_bytes=10*1024**2,
+            base_cache_dir=cachedir)
+
+        for i in xrange(2):
+            for ydata1, ydata2 in zip(results_ref, results(engine)):
+                num.testing.assert_array_equal(ydata1, ydata2)
+
+        stats = engine.get_base_cache_stats()
+        assert stats['misses'] == 2
+        assert stats['hits'] == 2 * len(sources) - 2
+        assert stats['nentries'] == 2
+
+        engine2 = gf.LocalEngine(
+            store_dirs=[store_dir],
+            base_cache_max_bytes=10*1024**2,
+            base_cache_dir=cachedir)
+
+        for ydata1, ydata2 in zip(results_ref, results(engine2)):
+            num.testing.assert_array_equal(ydata1, ydata2)
+
+        stats = engine2.get_base_cache_stats()
+        assert stats['misses'] == 0
+        assert stats['disk_hits'] == 2
+
+        engine2.clear_base_cache(disk=True)
+        assert engine2.get_base_cache_stats()['nentries'] == 0
+        assert not os.path.exists(cachedir)
+        self.tempdirs.remove(cachedir)
+
     def test_pulse_decimate(self):
         store_dir = self.get_pulse_store_dir()
 
@@ -530,6 +760,432 @@ class GFTestCase(unittest.TestCase):
 
         self.assertTrue(numeq(trs[0].ydata, trs[1].ydata, 0.01))
 
+    def test_compressed_store(self):
+        store_dir = self.get_pulse_store_dir()
+        store = gf.Store(store_dir)
+        store.make_decimated(2, force=True)
+
+        comp_dir = mkdtemp(prefix='gfstore')
+        self.tempdirs.append(comp_dir)
+        lossless_dir = os.path.join(comp_dir, 'lossless')
+        lossy_dir = os.path.join(comp_dir, 'lossy')
+        plain_dir = os.path.join(comp_dir, 'plain')
+
+        tolerance = 1e-3
+        store.make_compressed(lossless_dir)
+        store.make_compressed(lossy_dir, tolerance=tolerance)
+        gf.Store(lossy_dir).make_compressed(plain_dir, compression=None)
+
+        lossless = gf.Store(lossless_dir)
+        lossy = gf.Store(lossy_dir)
+        plain = gf.Store(plain_dir)
+
+        self.assertEqual(lossless.compression, 'deflate')
+        self.assertEqual(plain.compression, None)
+        self.assertTrue(lossy.size_data < store.size_data)
+        self.assertEqual(lossless.stats()['decimated'], [2])
+        self.assertEqual(lossless.check(), 0)
+        self.assertEqual(lossy.check(), 0)
+
+        for irecord in xrange(store.config.nrecords):
+            tr = gf.BaseStore.get(store, irecord)
+            tr_lossless = gf.BaseStore.get(lossless, irecord)
+            tr_lossy = gf.BaseStore.get(lossy, irecord)
+            tr_lossy_py = gf.BaseStore.get(
+                lossy, irecord, implementation='python')
+            tr_plain = gf.BaseStore.get(plain, irecord)
+            for tr_other in (tr_lossless, tr_lossy, tr_lossy_py, tr_plain):
+                self.assertEqual(tr.itmin, tr_other.itmin)
+                self.assertEqual(tr.is_zero, tr_other.is_zero)
+
+            num.testing.assert_equal(tr.data, tr_lossless.data)
+            num.testing.assert_equal(tr_lossy.data, tr_lossy_py.data)
+            num.testing.assert_equal(tr_lossy.data, tr_plain.data)
+            if tr.data.size > 0:
+                peak = num.max(num.abs(tr.data))
+                self.assertTrue(num.all(
+                    num.abs(tr.data - tr_lossy.data) <=
+                    tolerance * peak * 1.001))
+
+        source = gf.ExplosionSource(depth=100., moment=1.0)
+        targets = [
+            gf.Target(north_shift=500.+i*100., sample_rate=sample_rate)
+            for i in range(5)
+            for sample_rate in [None, store.config.sample_rate / 2.0]]
+
+        trs = []
+        for d in (store_dir, lossless_dir):
+            engine = gf.LocalEngine(store_dirs=[d])
+            trs.append(engine.process(source, targets).pyrocko_traces())
+
+        for tr_a, tr_b in zip(*trs):
+            num.testing.assert_equal(tr_a.ydata, tr_b.ydata)
+
+    def test_reorder(self):
+        from pyrocko.gf.store import space_filling_curve_keys
+
+        indices = num.array(
+            num.unravel_index(num.arange(8*8*8), (8, 8, 8))).T
+        for curve in ('hilbert', 'morton'):
+            keys = space_filling_curve_keys(indices, curve)
+            self.assertEqual(len(set(keys)), indices.shape[0])
+
+        ordered = indices[num.argsort(
+            space_filling_curve_keys(indices, 'hilbert'))]
+        steps = num.sum(num.abs(num.diff(ordered, axis=0)), axis=1)
+        self.assertTrue(num.all(steps == 1))
+
+        store_dir = self.get_pulse_store_dir()
+        store = gf.Store(store_dir)
+        store.make_decimated(2, force=True)
+
+        tmp_dir = mkdtemp(prefix='gfstore')
+        self.tempdirs.append(tmp_dir)
+
+        for compression in (None, 'deflate'):
+            reordered_dir = os.path.join(tmp_dir, str(compression))
+            store.make_compressed(reordered_dir, compression=compression)
+            reordered = gf.Store(reordered_dir)
+            size_data = reordered.size_data
+            reordered.reorder()
+
+            self.assertEqual(reordered.size_data, size_data)
+            order = reordered.record_order()
+            offsets = reordered._records['data_offset'][order]
+            offsets = offsets[offsets > 2]
+            self.assertTrue(num.all(num.diff(offsets.astype(num.int64)) > 0))
+
+            for irecord in xrange(store.config.nrecords):
+                tr = gf.BaseStore.get(store, irecord)
+                tr2 = gf.BaseStore.get(reordered, irecord)
+                tr3 = gf.BaseStore.get(
+                    reordered, irecord, implementation='python')
+                for tr_other in (tr2, tr3):
+                    self.assertEqual(tr.itmin, tr_other.itmin)
+                    num.testing.assert_equal(tr.data, tr_other.data)
+
+            deci, _ = reordered._decimated_store(2)
+            self.assertTrue(reordered.check() == deci.check() == 0)
+
+    def test_shm_cache(self):
+        store_dir = self.get_pulse_store_dir()
+        store = gf.Store(store_dir)
+
+        tmp_dir = mkdtemp(prefix='gfstore')
+        self.tempdirs.append(tmp_dir)
+        comp_dir = os.path.join(tmp_dir, 'comp')
+        store.make_compressed(comp_dir)
+
+        irecords = range(0, store.config.nrecords, 7)
+        nrecords = store.config.nrecords
+        irecords_all = num.arange(nrecords, dtype=num.uint64)
+        delays = num.zeros(nrecords)
+        weights = num.ones(nrecords)
+
+        # uncompressed stores are shared through the page cache
+        self.assertEqual(
+            gf.Store(store_dir, shm_cache_max_bytes=1024**2).shm_cache_stats(),
+            None)
+
+        for max_bytes, evict in [(16*1024**2, False), (1024**2, True)]:
+            store_a = gf.Store(comp_dir, shm_cache_max_bytes=max_bytes)
+            store_b = gf.Store(comp_dir, shm_cache_max_bytes=max_bytes)
+            store_a.clear_shm_cache()
+
+            for irecord in irecords:
+                gf.BaseStore.get(store_a, irecord)
+
+            stats = store_a.shm_cache_stats()
+            # zero records are not cached
+            nmisses = stats['misses']
+            self.assertEqual(stats['hits'], 0)
+            self.assertTrue(0 < nmisses <= len(irecords))
+            self.assertEqual(stats['evictions'] > 0, evict)
+            self.assertTrue(stats['nbytes'] <= stats['max_bytes'])
+
+            for irecord in reversed(irecords):
+                tr = gf.BaseStore.get(store, irecord)
+                tr_b = gf.BaseStore.get(store_b, irecord)
+                self.assertEqual(tr.itmin, tr_b.itmin)
+                num.testing.assert_equal(tr.data, tr_b.data)
+
+            stats = store_b.shm_cache_stats()
+            if evict:
+                self.assertTrue(0 < stats['hits'] < nmisses)
+            else:
+                self.assertEqual(stats['hits'], nmisses)
+                self.assertEqual(stats['nentries'], nmisses)
+
+            # shared records are used in place, not copied
+            self.assertEqual(store_b.record_cache_stats()['nbytes'], 0)
+
+            tr = gf.BaseStore.sum(store, irecords_all, delays, weights)
+            tr_b = gf.BaseStore.sum(store_b, irecords_all, delays, weights)
+            self.assertEqual(tr.itmin, tr_b.itmin)
+            num.testing.assert_equal(tr.data, tr_b.data)
+
+            # pins are released at the end of each call
+            self.assertEqual(store_b.shm_cache_stats()['npins'], 0)
+
+            path = store_a._shm_cache_path()
+            self.assertTrue(os.path.exists(path))
+            store_a.clear_shm_cache(unlink=True)
+            self.assertEqual(store_a.shm_cache_stats(), None)
+            self.assertEqual(store_b.shm_cache_stats()['nentries'], 0)
+            self.assertFalse(os.path.exists(path))
+
+    def test_shm_cache_killed_worker(self):
+        store = gf.Store(self.get_pulse_store_dir())
+        tmp_dir = mkdtemp(prefix='gfstore')
+        self.tempdirs.append(tmp_dir)
+        comp_dir = os.path.join(tmp_dir, 'comp')
+        store.make_compressed(comp_dir)
+
+        nrecords = store.config.nrecords
+        irecords = num.arange(nrecords, dtype=num.uint64)
+        delays = num.zeros(nrecords)
+        weights = num.ones(nrecords)
+
+        def kill_worker_holding_pins(store):
+            for itry in xrange(20):
+                pid = os.fork()
+                if pid == 0:
+                    try:
+                        while True:
+                            gf.BaseStore.sum(store, irecords, delays, weights)
+                    finally:
+                        os._exit(1)
+
+                time.sleep(0.1 + 0.01 * itry)
+                os.kill(pid, signal.SIGKILL)
+                os.waitpid(pid, 0)
+                if store.shm_cache_stats()['npins'] > 0:
+                    return
+
+            self.fail('worker could not be killed while holding pins')
+
+        store = gf.Store(comp_dir, shm_cache_max_bytes=16*1024**2)
+        store.clear_shm_cache()
+
+        # pins of dead processes are released on clear
+        kill_worker_holding_pins(store)
+        store.clear_shm_cache()
+        stats = store.shm_cache_stats()
+        self.assertEqual(stats['npins'], 0)
+        self.assertEqual(stats['nentries'], 0)
+        self.assertEqual(stats['nbytes'], 0)
+
+        # ... and when attaching
+        kill_worker_holding_pins(store)
+        store_b = gf.Store(comp_dir, shm_cache_max_bytes=16*1024**2)
+        self.assertEqual(store_b.shm_cache_stats()['npins'], 0)
+        store_b.clear_shm_cache()
+        self.assertEqual(store_b.shm_cache_stats()['nentries'], 0)
+
+        store.clear_shm_cache(unlink=True)
+
+    def benchmark_shm_cache(self):
+        store = gf.Store(self.get_pulse_store_dir())
+        tmp_dir = mkdtemp(prefix='gfstore')
+        self.tempdirs.append(tmp_dir)
+        comp_dir = os.path.join(tmp_dir, 'comp')
+        store.make_compressed(comp_dir)
+
+        nrecords = store.config.nrecords
+        irecords = num.arange(nrecords, dtype=num.uint64)
+        delays = num.zeros(nrecords)
+        weights = num.ones(nrecords)
+
+        def sum_all(store):
+            return gf.BaseStore.sum(store, irecords, delays, weights)
+
+        max_bytes = 64*1024**2
+        store_warm = gf.Store(comp_dir, shm_cache_max_bytes=max_bytes)
+        store_warm.clear_shm_cache()
+        sum_all(store_warm)
+
+        store_cold = gf.Store(comp_dir)
+        store_shm = gf.Store(comp_dir, shm_cache_max_bytes=max_bytes)
+
+        benchmark.labeled('sum_cold_private')(sum_all)(store_cold)
+        benchmark.labeled('sum_warm_private')(sum_all)(store_cold)
+        benchmark.labeled('sum_warm_shm')(sum_all)(store_shm)
+        print benchmark
+        times = dict(benchmark.results)
+        benchmark.clear()
+
+        # all records were taken from the warm shared memory cache
+        self.assertEqual(store_shm.record_cache_stats()['nbytes'], 0)
+        self.assertTrue(times['sum_warm_shm'] < times['sum_cold_private'])
+
+        store_warm.clear_shm_cache(unlink=True)
+
+    def test_record_cache(self):
+        orig = gf.Store(self.get_pulse_store_dir())
+        nrecords = orig.config.nrecords
+        irecords = num.arange(nrecords, dtype=num.uint64)
+        delays = num.zeros(nrecords)
+        weights = num.ones(nrecords)
+        tr_sum = gf.BaseStore.sum(orig, irecords, delays, weights)
+
+        tmp_dir = mkdtemp(prefix='gfstore')
+        self.tempdirs.append(tmp_dir)
+        comp_dir = os.path.join(tmp_dir, 'comp')
+        orig.make_compressed(comp_dir)
+
+        self.assertEqual(orig.record_cache_stats(), None)
+
+        for max_bytes in (0, 64*1024, 1024**3):
+            store = gf.Store(comp_dir, record_cache_max_bytes=max_bytes)
+            for i in xrange(2):
+                tr = gf.BaseStore.sum(store, irecords, delays, weights)
+                self.assertEqual(tr.itmin, tr_sum.itmin)
+                num.testing.assert_equal(tr.data, tr_sum.data)
+
+            stats = store.record_cache_stats()
+            self.assertEqual(stats['max_bytes'], max_bytes)
+            self.assertTrue(stats['nbytes'] <= max_bytes)
+            self.assertTrue(stats['misses'] > 0)
+            if max_bytes == 0:
+                self.assertEqual(stats['nentries'], 0)
+                self.assertEqual(stats['hits'], 0)
+            elif max_bytes == 1024**3:
+                self.assertEqual(stats['evictions'], 0)
+                self.assertEqual(stats['hits'], stats['misses'])
+            else:
+                self.assertTrue(stats['evictions'] > 0)
+
+            store.warm_up()
+            stats = store.record_cache_stats()
+            self.assertTrue(stats['nbytes'] <= max_bytes)
+            self.assertTrue(
+                store.size_preload() <= store.size_index_and_data + max_bytes)
+
+    def test_preload(self):
+        orig = gf.Store(self.get_pulse_store_dir())
+        nrecords = orig.config.nrecords
+        irecords = num.arange(nrecords, dtype=num.uint64)
+        delays = num.zeros(nrecords)
+        weights = num.ones(nrecords)
+        tr_sum = gf.BaseStore.sum(orig, irecords, delays, weights)
+
+        tmp_dir = mkdtemp(prefix='gfstore')
+        self.tempdirs.append(tmp_dir)
+
+        for compression in (None, 'deflate'):
+            store_dir = os.path.join(tmp_dir, str(compression))
+            orig.make_compressed(store_dir, compression=compression)
+
+            label = '_%s' % compression
+
+            @benchmark.labeled('open_warm_up_mmap%s' % label)
+            def open_warm_up_mmap():
+                store = gf.Store(store_dir)
+                store.warm_up()
+                return store
+
+            @benchmark.labeled('open_warm_up_preload%s' % label)
+            def open_warm_up_preload():
+                store = gf.Store(store_dir, preload=True, preload_mlock=True,
+                                 preload_hugepages=True)
+                store.warm_up()
+                return store
+
+            def sum_repeat(store):
+                for i in xrange(10):
+                    tr = gf.BaseStore.sum(store, irecords, delays, weights)
+
+                return tr
+
+            store_mmap = open_warm_up_mmap()
+            store = open_warm_up_preload()
+            benchmark.labeled('sum_mmap%s' % label)(sum_repeat)(store_mmap)
+            benchmark.labeled('sum_preload%s' % label)(sum_repeat)(store)
+            logger.info(benchmark.__str__(header=False))
+            benchmark.clear()
+
+            self.assertFalse(store_mmap.preloaded)
+            self.assertTrue(store.preloaded)
+            stats = store.stats()
+            size_files = stats['size_index'] + stats['size_data']
+            if compression is None:
+                self.assertEqual(stats['size_preload'], size_files)
+            else:
+                self.assertTrue(stats['size_preload'] > size_files)
+
+            store_mmap.close()
+
+            # the preloaded store must not need its files anymore
+            open(store.data_fn(), 'wb').close()
+            open(store.index_fn(), 'wb').close()
+
+            tr = gf.BaseStore.sum(store, irecords, delays, weights)
+            self.assertEqual(tr.itmin, tr_sum.itmin)
+            num.testing.assert_equal(tr.data, tr_sum.data)
+            for irecord in xrange(0, nrecords, 13):
+                tr = gf.BaseStore.get(store, irecord)
+                tr_orig = gf.BaseStore.get(orig, irecord)
+                self.assertEqual(tr.itmin, tr_orig.itmin)
+                num.testing.assert_equal(tr.data, tr_orig.data)
+
+    def test_pyramid(self):
+        tmp_dir = mkdtemp(prefix='gfstore')
+        self.tempdirs.append(tmp_dir)
+        store_dir = os.path.join(tmp_dir, 'pulse')
+        gf.Store(self.get_pulse_store_dir()).make_compressed(
+            store_dir, compression=None)
+
+        store = gf.Store(store_dir)
+        with self.assertRaises(gf.StoreError):
+            store.make_pyramid(2, decimate=3)
+
+        # 99 distance intervals, 100 source depth intervals
+        store.make_pyramid(2, factor=3)
+        self.assertEqual(store.get_pyramid_levels(), [0, 1, 2])
+        self.assertEqual(store.stats()['pyramid'], [1, 2])
+
+        nrecords = [store.config.nrecords]
+        for level, ddist, ddepth in [(1, 30., 20.), (2, 90., 50.)]:
+            coarse = store.get_pyramid_store(level)
+            c = coarse.config
+            self.assertEqual(c.distance_delta, ddist)
+            self.assertEqual(c.source_depth_delta, ddepth)
+            self.assertEqual(c.distance_max, store.config.distance_max)
+            self.assertEqual(c.receiver_depth_delta,
+                             store.config.receiver_depth_delta)
+            self.assertEqual(coarse.check(), 0)
+            nrecords.append(c.nrecords)
+
+            for args in list(c.iter_nodes())[::37]:
+                tr = store.get(args)
+                tr_coarse = coarse.get(args)
+                self.assertEqual(tr.itmin, tr_coarse.itmin)
+                num.testing.assert_equal(tr.data, tr_coarse.data)
+
+        self.assertTrue(nrecords[0] > nrecords[1] > nrecords[2])
+        self.assertTrue(store.get_pyramid_store(5) is
+                        store.get_pyramid_store(2))
+
+        source = gf.ExplosionSource(depth=100., moment=1.0)
+        targets = [gf.Target(north_shift=550.)]
+
+        engine = gf.LocalEngine(store_dirs=[store_dir])
+        self.assertEqual(engine.get_resolution_levels(), [0, 1, 2])
+        self.assertTrue(
+            engine.get_store(resolution=1).store_dir.endswith('1'))
+
+        trs = [engine.process(source, targets, resolution=resolution)
+               .pyrocko_traces()[0] for resolution in (0, 1, 2, 3)]
+
+        self.assertEqual(engine._resolution, 0)
+        self.assertEqual(len(engine._dsource_cache._entries), 3)
+        for tr in trs[1:]:
+            num.testing.assert_allclose(tr.ydata, trs[0].ydata, atol=1e-12)
+
+        store.make_pyramid(1, decimate=2, force=True)
+        self.assertEqual(store.get_pyramid_store(1).config.sample_rate,
+                         store.config.sample_rate / 2.)
+
     def test_stf_pre_post(self):
         store_dir = self.get_pulse_store_dir()
         engine = gf.LocalEngine(store_dirs=[store_dir])
@@ -757,6 +1413,88 @@ class GFTestCase(unittest.TestCase):
             store.t('{cake:P}', args) + store.t('{vel_surface:10}', args),
             0.1)
 
+    def test_sptree_parallel(self):
+        from pyrocko import spit
+
+        def f(x):
+            x = num.asarray(x)
+            if num.sqrt(num.sum((x-0.5)**2)) < 0.5:
+                return x[2]**4 + x[1]
+
+            return None
+
+        trees = [
+            spit.SPTree(
+                f, 0.01, [[0., 1.], [0., 1.], [0., 1.]], [0.1, 0.1, 0.1],
+                nworkers=nworkers)
+            for nworkers in (1, 2)]
+
+        self.assertEqual(len(trees[0]), len(trees[1]))
+        for cell_a, cell_b in zip(*trees):
+            num.testing.assert_equal(cell_a.index, cell_b.index)
+            num.testing.assert_equal(cell_a.f, cell_b.f)
+
+        x = num.random.RandomState(1).uniform(-0.1, 1.1, size=(1000, 3))
+        values = trees[1].interpolate_many(x)
+        for i in xrange(x.shape[0]):
+            try:
+                v = trees[0].interpolate(x[i])
+            except spit.OutOfBounds:
+                v = None
+
+            if v is None:
+                self.assertTrue(num.isnan(values[i]))
+            else:
+                self.assertTrue(numeq(values[i], v, 1e-9))
+
+    def test_timing_many(self):
+        store_dir = self.get_regional_ttt_store_dir()
+        store = gf.Store(store_dir)
+
+        rstate = num.random.RandomState(123)
+        n = 200
+        depths = rstate.uniform(0., 20*km, n)
+        dists = rstate.uniform(1000*km, 2000*km, n)
+        depths[:2] = 0.0, 20*km
+        dists[:2] = 1000*km, 2000*km
+
+        spt = store.get_stored_phase('depthp')
+        x = num.column_stack((depths, dists))
+        values = spt.interpolate_many(x)
+        for i in xrange(n):
+            v = spt.interpolate(x[i])
+            if v is None:
+                self.assertTrue(num.isnan(values[i]))
+            else:
+                self.assertTrue(numeq(values[i], v, 1e-6))
+
+        for timing in ['P', 'first(S|P)', 'last(S|P)', '(depthp|P)',
+                       '{stored:P}+0.1S', 'vel:8', '-10']:
+            ts = store.t(timing, (depths, dists))
+            self.assertEqual(ts.shape, (n,))
+            for i in xrange(n):
+                t = store.t(timing, (depths[i], dists[i]))
+                if t is None:
+                    self.assertTrue(num.isnan(ts[i]))
+                else:
+                    self.assertTrue(numeq(ts[i], t, 1e-6))
+
+        ts = store.t('cake:P', (depths[:3], dists[:3]))
+        for i in xrange(3):
+            self.assertTrue(
+                numeq(ts[i], store.t('cake:P', (depths[i], dists[i])), 1e-6))
+
+        ts = store.t('P', (10*km, num.array([1500*km, 5000*km])))
+        self.assertTrue(num.isfinite(ts[0]))
+        self.assertTrue(num.isnan(ts[1]))
+
+        ts = store.t('P', (depths.reshape(20, 10), dists.reshape(20, 10)))
+        self.assertEqual(ts.shape, (20, 10))
+
+        params = store.make_timing_params('P', 'S')
+        self.assertTrue(params['tmin'] < params['tmax'])
+        self.assertTrue(params['tlenmax_vred'] > 0.)
+
     def dummy_store(self):
         if self._dummy_store is None:
 
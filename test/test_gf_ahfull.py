@@ -1,4 +1,5 @@
 import sys
+import os
 import random  # noqa
 import math
 import unittest
@@ -60,6 +61,69 @@ class GFAhfullTestCase(unittest.TestCase):
         store.make_ttt()
         ahfullgreen.build(d)
 
+    def test_build_parallel(self):
+        stores = []
+        for nworkers in (1, 3):
+            d = mkdtemp(prefix='gfstore')
+            self.tempdirs.append(d)
+            ahfullgreen.init(d, None)
+            ahfullgreen.build(d, nworkers=nworkers)
+            self.assertFalse(os.path.exists(os.path.join(d, '.status')))
+            stores.append(gf.Store(d))
+
+        config = stores[0].config
+        for irecord in xrange(config.nrecords):
+            tr_a, tr_b = [gf.BaseStore.get(st, irecord) for st in stores]
+            self.assertFalse(tr_a.is_zero)
+            self.assertEqual(tr_a.itmin, tr_b.itmin)
+            num.testing.assert_equal(tr_a.data, tr_b.data)
+
+    def test_build_continue(self):
+        d = mkdtemp(prefix='gfstore')
+        self.tempdirs.append(d)
+        ahfullgreen.init(d, None)
+        gf.Store.create_dependants(d)
+
+        # pretend first block and part of the second block are done
+        with open(os.path.join(d, '.status'), 'w') as f:
+            f.write('0 0\n')
+            f.write('0 1 0 5 1.0\n')
+            f.write('0 1 12 15 1.0\n')
+
+        ahfullgreen.build(d, continue_=True, nworkers=2)
+
+        store = gf.Store(d)
+        config = store.config
+        for isd, sd in enumerate(config.coords[0]):
+            for ix, x in enumerate(config.coords[1]):
+                empty = store.get_record((sd, x, 0))[0] == 0
+                if isd == 0 or (isd == 1 and (ix < 5 or 12 <= ix < 15)):
+                    self.assertTrue(empty)
+                else:
+                    self.assertFalse(empty)
+
+    def test_scheduler(self):
+        from pyrocko.gf.builder import Task, Scheduler
+
+        tasks = [Task(0, i, 0, n) for (i, n) in enumerate([20, 5, 40, 10])]
+        scheduler = Scheduler(tasks, nworkers=4)
+        got = []
+        for task in scheduler:
+            got.append(task)
+            scheduler.done(task, 0.1 * task.n * (task.iblock + 1))
+
+        self.assertTrue(len(got) > len(tasks))
+        for task in tasks:
+            covered = sorted(
+                (t.ilo, t.ihi) for t in got if t.iblock == task.iblock)
+            self.assertEqual(covered[0][0], task.ilo)
+            self.assertEqual(covered[-1][1], task.ihi)
+            for (_, ihi), (ilo, _) in zip(covered[:-1], covered[1:]):
+                self.assertEqual(ihi, ilo)
+
+        scheduler = Scheduler(tasks, nworkers=4, splittable=False)
+        self.assertEqual(len(list(scheduler)), len(tasks))
+
 
 if __name__ == '__main__':
     util.setup_logging('test_gf_ahfull', 'warning')
@@ -3,6 +3,7 @@ import numpy as num
 import cProfile
 import math
 import logging
+import multiprocessing
 
 from tempfile import mkdtemp
 from common import Benchmark
@@ -22,6 +23,7 @@ class GFBenchmarkTest(unittest.TestCase):
     def __init__(self, *args, **kwargs):
         self.tempdirs = []
         self._dummy_store = None
+        self._benchmark_store = None
         unittest.TestCase.__init__(self, *args, **kwargs)
 
     def __del__(self):
@@ -52,6 +54,38 @@ class GFBenchmarkTest(unittest.TestCase):
 
         return self._dummy_store
 
+    def benchmark_store(self):
+        if self._benchmark_store is None:
+
+            conf = gf.ConfigTypeA(
+                id='benchmark_regional',
+                source_depth_min=0.,
+                source_depth_max=20*km,
+                source_depth_delta=1*km,
+                distance_min=1*km,
+                distance_max=200*km,
+                distance_delta=1*km,
+                sample_rate=2.0,
+                ncomponents=2,
+                component_scheme='elastic2')
+
+            store_dir = mkdtemp(prefix='gfstore')
+            self.tempdirs.append(store_dir)
+
+            gf.Store.create(store_dir, config=conf)
+            store = gf.Store(store_dir, 'w')
+            for args in conf.iter_nodes():
+                _, distance, _ = args
+                itmin = int(round(distance / 5000. * conf.sample_rate))
+                data = random.random(100)
+                tr = gf.GFTrace(data=data, itmin=itmin, deltat=conf.deltat)
+                store.put(args, tr)
+
+            store.close()
+            self._benchmark_store = gf.Store(store_dir)
+
+        return self._benchmark_store
+
     def setUp(self):
         self.cprofile = cProfile.Profile()
         self.cprofile.enable()
@@ -184,6 +218,53 @@ class GFBenchmarkTest(unittest.TestCase):
                 for nt in ntargets:
                     test_weights_bench(store, d, nt, interpolation)
 
+    def test_process_benchmark(self):
+        benchmark.show_factor = True
+
+        store = self.benchmark_store()
+        engine = gf.LocalEngine(store_dirs=[store.store_dir])
+
+        sources = [
+            gf.RectangularExplosionSource(
+                lat=0., lon=0.,
+                depth=random.uniform(5*km, 15*km),
+                length=4*km, width=2*km,
+                strike=random.uniform(0., 360.),
+                dip=random.uniform(0., 90.))
+            for _ in xrange(10)]
+
+        distances = random.uniform(10*km, 150*km, size=200)
+        azimuths = random.uniform(0., 360., size=200)
+        targets = [
+            gf.Target(
+                codes=('', 'S%03i' % i, '', 'Z'),
+                lat=0., lon=0.,
+                north_shift=distance*math.cos(azimuth*d2r),
+                east_shift=distance*math.sin(azimuth*d2r))
+            for (i, (distance, azimuth)) in enumerate(
+                zip(distances, azimuths))]
+
+        nprocs_max = multiprocessing.cpu_count()
+        reference = None
+        for nprocs in [1, 2, 4, 8]:
+            if nprocs > 1 and nprocs > nprocs_max:
+                break
+
+            @benchmark.labeled('process_ns%04i_nt%04i_np%02i' % (
+                len(sources), len(targets), nprocs))
+            def process():
+                return engine.process(sources, targets, nprocs=nprocs)
+
+            results = list(process().iter_results())
+            if reference is None:
+                reference = results
+            else:
+                for (_, _, tr1), (_, _, tr2) in zip(reference, results):
+                    num.testing.assert_array_equal(tr1.ydata, tr2.ydata)
+
+        print benchmark.__str__(header=False)
+        benchmark.clear()
+
 
 if __name__ == '__main__':
     util.setup_logging('test_gf', 'warning')
@@ -237,6 +237,59 @@ mantle
         # self.plot_static_los_result(ml)
         # print benchmark
 
+    def test_static_displacements_batched(self):
+        ntargets = 10000
+        npatches = 4
+
+        patches = [
+            gf.RectangularSource(
+                lat=0., lon=0.,
+                north_shift=ipatch * 2*km, east_shift=0., depth=6.5*km,
+                width=2*km, length=2*km,
+                dip=60., rake=90., strike=0.,
+                slip=0.5 + ipatch * 0.1)
+            for ipatch in xrange(npatches)]
+
+        sattarget = gf.SatelliteTarget(
+            north_shifts=(random.rand(ntargets)-.5) * 25. * km,
+            east_shifts=(random.rand(ntargets)-.5) * 25. * km,
+            tsnapshot=20,
+            interpolation='nearest_neighbor',
+            phi=num.ones(ntargets) * num.deg2rad(192.),
+            theta=num.ones(ntargets) * num.deg2rad(90.-23.))
+
+        engine = gf.LocalEngine(store_dirs=[self.get_pscmp_store_dir()])
+
+        @benchmark.labeled('static-loop')
+        def process_loop():
+            los = num.zeros(ntargets)
+            for patch in patches:
+                result = engine.process(patch, sattarget).results_list[0][0]
+                los += result.result['displacement.los']
+
+            return los
+
+        @benchmark.labeled('static-batched')
+        def process_batched(max_bytes):
+            out = {'displacement.los': num.zeros(ntargets)}
+            result = engine.static_displacements(
+                patches, sattarget, out=out, max_bytes=max_bytes)
+
+            self.assertTrue(result['displacement.los'] is out[
+                'displacement.los'])
+            return out['displacement.los']
+
+        benchmark.clear()
+        los_loop = process_loop()
+        for max_bytes in (None, 1024**2):
+            los_batched = process_batched(max_bytes)
+            num.testing.assert_allclose(
+                los_batched, los_loop, rtol=1e-4,
+                atol=1e-4 * num.max(num.abs(los_loop)))
+
+        logger.info(benchmark.__str__(header=False))
+        benchmark.clear()
+
     @staticmethod
     def plot_static_los_result(result):
         import matplotlib.pyplot as plt
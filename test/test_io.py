@@ -91,6 +91,64 @@ class IOTestCase(unittest.TestCase):
 
         assert isinstance(e, mseed.CodeTooLong)
 
+    def testMSeedWriter(self):
+        tempdir = tempfile.mkdtemp()
+        rstate = num.random.RandomState(0)
+        deltat = 0.01
+        tmin = 1234567890.
+        nsamples = 100000
+        originals = []
+        for cha, dtype in [('BHZ', num.int32), ('BHN', num.float32)]:
+            ydata = num.cumsum(rstate.randint(-100, 100, size=nsamples))
+            originals.append(trace.Trace(
+                'XX', 'TEST', '', cha, tmin=tmin, deltat=deltat,
+                ydata=ydata.astype(dtype)))
+
+        fn_template = pjoin(tempdir, '%(network)s.%(station)s.%(channel)s')
+        for steim in (1, 2):
+            writer = mseed.MSeedWriter(
+                fn_template, record_length=512, steim=steim,
+                max_open_files=1)
+
+            ibegs = num.cumsum(rstate.randint(1, 5000, size=100))
+            ibegs = num.concatenate(([0], ibegs[ibegs < nsamples]))
+            iends = num.concatenate((ibegs[1:], [nsamples]))
+            for ibeg, iend in zip(ibegs, iends):
+                writer.append([
+                    tr.chop(tr.tmin + ibeg*deltat, tr.tmin + iend*deltat,
+                            inplace=False, include_last=False)
+                    for tr in originals])
+
+            fns = writer.close()
+            assert len(fns) == 2
+
+            for tr in originals:
+                fn = tr.fill_template(fn_template)
+                with open(fn, 'rb') as f:
+                    assert f.read(8)[6] == 'D'
+
+                assert os.path.getsize(fn) % 512 == 0
+                traces = io.load(fn)
+                assert len(traces) == 1
+                assert traces[0].tmin == tr.tmin
+                assert num.all(traces[0].ydata == tr.ydata)
+
+        writer = mseed.MSeedWriter(fn_template)
+        tr = originals[0]
+        writer.append(tr.chop(tmin, tmin+100., inplace=False))
+        writer.append(tr.chop(tmin+200., tmin+300., inplace=False))
+        fn = writer.close()[0]
+        assert len(io.load(fn)) == 2
+
+        writer = mseed.MSeedWriter(fn_template, overwrite=False)
+        try:
+            writer.append(tr)
+            assert False
+        except io.FileSaveError:
+            pass
+
+        shutil.rmtree(tempdir)
+
     def testMSeedDetect(self):
         fpath = common.test_data_file('test2.mseed')
         io.load(fpath, format='detect')
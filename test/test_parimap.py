@@ -4,6 +4,7 @@ import time
 import tempfile
 import os
 import fcntl
+import shutil
 import unittest
 import errno
 from pyrocko import util
@@ -79,6 +80,61 @@ class ParimapTestCase(unittest.TestCase):
                 if end1 or end2:
                     break
 
+    def test_parimap_unordered(self):
+
+        def work(x):
+            time.sleep(0.01 * (x % 3 == 0))
+            return x*2
+
+        for nprocs in (1, 2, 5):
+            results = list(parimap(
+                work, xrange(50), nprocs=nprocs, ordered=False))
+
+            assert sorted(results) == range(0, 100, 2)
+            if nprocs == 5:
+                assert results != sorted(results)
+
+        def crash(x):
+            if x == 20:
+                raise Crash(str(x))
+
+            return x
+
+        e = None
+        try:
+            for x in parimap(crash, xrange(50), nprocs=3, ordered=False,
+                             eprintignore=Crash):
+                pass
+
+        except Crash, e:
+            pass
+
+        assert isinstance(e, Crash)
+
+    def test_parimap_abort(self):
+        tmpdir = tempfile.mkdtemp(prefix='pyrocko-parimap')
+
+        def work(x):
+            open(os.path.join(tmpdir, '%i.start' % x), 'w').close()
+            time.sleep(0.2)
+            open(os.path.join(tmpdir, '%i.end' % x), 'w').close()
+            return x
+
+        results = parimap(work, xrange(100), nprocs=4, ordered=False)
+        results.next()
+        t0 = time.time()
+        results.close()
+        assert time.time() - t0 < 5.
+
+        # workers finish their current tasks instead of being killed
+        fns = os.listdir(tmpdir)
+        started = set(fn[:-6] for fn in fns if fn.endswith('.start'))
+        ended = set(fn[:-4] for fn in fns if fn.endswith('.end'))
+        assert 1 < len(started) < 100
+        assert started == ended
+
+        shutil.rmtree(tmpdir)
+
     def test_locks(self):
 
         def work(x):
@@ -115,6 +171,28 @@ class ParimapTestCase(unittest.TestCase):
         os.close(fos)
         os.remove(fn)
 
+    def test_unpicklable_exception(self):
+
+        class LocalCrash(Exception):
+            pass
+
+        def work(x):
+            if x == 5:
+                raise LocalCrash('crash at %i' % x)
+
+            return x
+
+        e = None
+        try:
+            for x in parimap(work, xrange(10), nprocs=2,
+                             eprintignore=LocalCrash):
+                pass
+
+        except Exception, e:
+            pass
+
+        assert str(e) == 'LocalCrash: crash at 5'
+
 
 if __name__ == '__main__':
     util.setup_logging('test_parimap', 'warning')
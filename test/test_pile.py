@@ -99,6 +99,355 @@ class PileTestCase(unittest.TestCase):
         pile.get_cache(cachedir).clean()
         shutil.rmtree(datadir)
 
+    def testCache(self):
+        import shutil
+        nfiles = 20
+        nsamples = 100
+        tmin = 1234567890
+        datadir = makeManyFiles(
+            nfiles, nsamples, ['xx'], ['aaa', 'bbb'], ['zzz'], tmin)
+        filenames = util.select_files([datadir], show_progress=False)
+        cachedir = pjoin(datadir, '_cache_')
+
+        cache = pile.TracesFileCache(cachedir)
+        p1 = pile.Pile()
+        p1.load_files(filenames=filenames, cache=cache, show_progress=False)
+
+        cache = pile.TracesFileCache(cachedir)
+        for fn in filenames:
+            tfile = cache.get(os.path.abspath(fn))
+            assert tfile is not None
+            assert tfile.mtime == os.stat(fn)[8]
+            assert len(tfile.traces) == 1
+            assert tfile.traces[0].file is tfile
+
+        p2 = pile.Pile()
+        p2.load_files(filenames=filenames, cache=cache, show_progress=False)
+        assert p1.tmin == p2.tmin and p1.tmax == p2.tmax
+        assert p1.nslc_ids == p2.nslc_ids
+
+        paths = cache.relevant_abspaths(tmin, tmin + nsamples*0.5)
+        assert len(paths) == 1
+
+        paths = cache.relevant_abspaths(codes=('xx', 'aaa', '*', '*'))
+        assert len(paths) == p1.stations['aaa']
+        assert all('-aaa-' in path for path in paths)
+
+        # unchanged files are only loaded from the cache when needed
+        p3 = pile.Pile()
+        p3.load_files(
+            filenames=filenames, cache=cache, show_progress=False,
+            defer_unchanged=True)
+
+        def nloaded(p):
+            return sum(len(subpile.files) for subpile in p.subpiles.values())
+
+        assert nloaded(p3) == 0
+        assert p1.tmin == p3.tmin and p1.tmax == p3.tmax
+        assert p1.nslc_ids == p3.nslc_ids
+        assert p1.deltats == p3.deltats
+        assert p1.gather_keys(lambda tr: tr.nslc_id) == \
+            p3.gather_keys(lambda tr: tr.nslc_id)
+
+        trs = p3.relevant(tmin, tmin + nsamples*0.5)
+        assert len(trs) == 1
+        assert nloaded(p3) == 1
+
+        def sel(tr):
+            return tr.station == 'bbb'
+
+        trs = p3.relevant(tmin, tmin + nsamples*nfiles, trace_selector=sel)
+        assert len(trs) == p1.stations['bbb']
+        assert nloaded(p3) == 1 + len(
+            [tr for tr in trs if tr.tmin > tmin + nsamples*0.5])
+
+        assert p1.nslc_ids == p3.nslc_ids
+
+        trs1 = p1.all(include_last=True)
+        trs3 = p3.all(include_last=True)
+        assert len(trs1) == len(trs3) and len(trs1) > 0
+        for tr1, tr3 in zip(trs1, trs3):
+            assert tr1.nslc_id == tr3.nslc_id
+            assert tr1.tmin == tr3.tmin
+            assert num.all(tr1.ydata == tr3.ydata)
+
+        assert nloaded(p3) == nfiles
+        assert p1.tmin == p3.tmin and p1.tmax == p3.tmax
+        assert p1.nslc_ids == p3.nslc_ids
+        assert p1.networks == p3.networks
+        assert p1.stations == p3.stations
+
+        # deferred files modified on disk are loaded and reloaded
+        p4 = pile.Pile()
+        p4.load_files(
+            filenames=filenames, cache=cache, show_progress=False,
+            defer_unchanged=True)
+
+        assert not p4.reload_modified()
+        assert nloaded(p4) == 0
+        mtime = os.stat(filenames[1])[8]
+        os.utime(filenames[1], (mtime + 10, mtime + 10))
+        assert p4.reload_modified()
+        assert nloaded(p4) == 1
+        tfile, = [f for sp in p4.subpiles.values() for f in sp.files]
+        assert tfile.abspath == os.path.abspath(filenames[1])
+        assert tfile.mtime == mtime + 10
+        assert p1.nslc_ids == p4.nslc_ids
+
+        os.unlink(filenames[0])
+        cache.clean()
+        assert cache.get(os.path.abspath(filenames[0])) is None
+        assert len(cache.relevant_abspaths()) == nfiles - 1
+
+        shutil.rmtree(datadir)
+
+    def testParallelScan(self):
+        import shutil
+        nfiles = 50
+        nsamples = 100
+        tmin = 1234567890
+        datadir = makeManyFiles(
+            nfiles, nsamples, ['xx'], ['aaa', 'bbb'], ['zzz'], tmin)
+
+        fn_bad = pjoin(datadir, 'bad.mseed')
+        with open(fn_bad, 'w') as f:
+            f.write('garbage' * 100)
+
+        filenames = util.select_files([datadir], show_progress=False)
+
+        p1 = pile.Pile()
+        p1.load_files(filenames=filenames, show_progress=False)
+
+        p2 = pile.Pile()
+        p2.load_files(filenames=filenames, show_progress=False, nworkers=4)
+
+        assert len(list(p2.iter_files())) == nfiles
+        assert sorted(f.abspath for f in p1.iter_files()) == \
+            sorted(f.abspath for f in p2.iter_files())
+        assert p1.nslc_ids == p2.nslc_ids
+        assert p1.tmin == p2.tmin and p1.tmax == p2.tmax
+
+        progress = []
+
+        def update_progress(label, i, n):
+            progress.append((label, i, n))
+            return False
+
+        cachedir = pjoin(datadir, '_cache_')
+        p3 = pile.Pile()
+        p3.load_files(filenames=filenames, cache=pile.get_cache(cachedir),
+                      show_progress=False, update_progress=update_progress,
+                      nworkers=2)
+
+        assert len(list(p3.iter_files())) == nfiles
+        assert ('Scanning files', nfiles+1, nfiles+1) in progress
+
+        shutil.rmtree(datadir)
+
+    def testChopperPrefetch(self):
+        import shutil
+        nfiles = 50
+        nsamples = 1000
+        tmin = 1234567890
+        datadir = makeManyFiles(
+            nfiles, nsamples, ['xx'], ['aaa', 'bbb'], ['zzz', 'yyy'], tmin)
+        filenames = util.select_files([datadir], show_progress=False)
+        p = pile.Pile()
+        p.load_files(filenames=filenames, show_progress=False)
+
+        def chop_all(**kwargs):
+            results = []
+            for traces in p.chopper(tinc=333., **kwargs):
+                results.append(sorted(
+                    (tr.nslc_id, tr.tmin, tr.tmax, num.sum(tr.ydata))
+                    for tr in traces))
+
+            for file in p.iter_files():
+                assert not file.data_loaded
+                assert file.data_use_count == 0
+
+            return results
+
+        results = chop_all()
+        assert results == chop_all(prefetch=3)
+        assert results == chop_all(prefetch=3, prefetch_nthreads=1,
+                                   prefetch_max_bytes=nsamples*8*2)
+        assert results == chop_all(prefetch=3, prefetch_max_bytes=0)
+
+        shutil.rmtree(datadir)
+
+    def testDataCache(self):
+        import shutil
+        nfiles = 20
+        nsamples = 1000
+        tmin = 1234567890
+        datadir = makeManyFiles(
+            nfiles, nsamples, ['xx'], ['aaa'], ['zzz'], tmin)
+        filenames = util.select_files([datadir], show_progress=False)
+        p = pile.Pile()
+        p.load_files(filenames=filenames, show_progress=False)
+
+        cache = pile.get_data_cache()
+        max_bytes_orig = cache.max_bytes
+        try:
+            nbytes_file = nsamples * 8
+            cache.set_max_bytes(5 * nbytes_file)
+            cache.clear()
+
+            def chop_all():
+                s = 0
+                for traces in p.chopper(tmax=p.tmax+1., tinc=250.):
+                    for tr in traces:
+                        s += num.sum(tr.ydata)
+
+                assert s == nfiles * nsamples
+
+            stats0 = p.get_data_cache_stats()
+            chop_all()
+            stats1 = p.get_data_cache_stats()
+            assert stats1['misses'] - stats0['misses'] == nfiles
+            assert stats1['nfiles_idle'] == 5
+            assert stats1['nbytes_resident'] <= 5 * nbytes_file
+            assert stats1['evictions'] - stats0['evictions'] == nfiles - 5
+
+            # most recently used files are still resident
+            for traces in p.chopper(
+                    tmin=p.tmax-4000., tmax=p.tmax+1., tinc=250.):
+                pass
+
+            stats2 = p.get_data_cache_stats()
+            assert stats2['misses'] == stats1['misses']
+
+            for file in p.iter_files():
+                assert file.data_use_count == 0
+
+            cache.set_max_bytes(0)
+            stats3 = p.get_data_cache_stats()
+            assert stats3['nfiles_idle'] == 0
+            assert stats3['nbytes_resident'] == 0
+            for file in p.iter_files():
+                assert not file.data_loaded
+
+        finally:
+            cache.set_max_bytes(max_bytes_orig)
+
+        shutil.rmtree(datadir)
+
+    def testRecordIndex(self):
+        import shutil
+        nfiles = 5
+        nsamples = 20000
+        tmin = 1234567890
+        datadir = makeManyFiles(
+            nfiles, nsamples, ['xx'], ['aaa', 'bbb'], ['zzz'], tmin)
+        filenames = util.select_files([datadir], show_progress=False)
+        cachedir = pjoin(datadir, '_cache_')
+
+        # file with repeated records, as found in corrupt archives
+        with open(filenames[0], 'rb') as f:
+            data = f.read()
+
+        with open(filenames[0], 'wb') as f:
+            f.write(data + data)
+
+        p1 = pile.Pile()
+        p1.load_files(filenames=filenames, show_progress=False)
+
+        p2 = pile.Pile()
+        p2.load_files(filenames=filenames, cache=pile.get_cache(cachedir),
+                      show_progress=False, index_records=True, nworkers=2)
+
+        for file in p2.iter_files():
+            assert len(file.record_index) > 1
+
+        cache = pile.TracesFileCache(cachedir)
+        for fn in filenames:
+            tfile = cache.get(os.path.abspath(fn))
+            assert len(tfile.record_index) > 1
+
+        def chop(p, tmin, tmax):
+            trs, used_files = p.chop(tmin, tmax)
+            result = sorted(
+                (tr.nslc_id, tr.tmin, tr.tmax, num.sum(tr.ydata))
+                for tr in trs)
+
+            for file in used_files:
+                file.drop_data()
+
+            return result, used_files
+
+        rstate = num.random.RandomState(0)
+        for i in xrange(50):
+            wmin = tmin + rstate.uniform(-100., nfiles*nsamples)
+            wmax = wmin + rstate.uniform(1., 3000.)
+            result1, _ = chop(p1, wmin, wmax)
+            result2, used_files = chop(p2, wmin, wmax)
+            assert result1 == result2
+            assert not used_files
+
+        for file in p2.iter_files():
+            assert not file.data_loaded
+
+        tr = pile.MemTracesFile(None, [])
+        assert tr.read_data_window(tmin, tmin+10.) is None
+
+        shutil.rmtree(datadir)
+
+    def testRelevant(self):
+        rstate = num.random.RandomState(0)
+        tmins = 1234567890. + rstate.uniform(0., 3600.*24., size=1000)
+        tlens = num.exp(rstate.normal(num.log(3600.), 2., size=1000))
+        traces = [
+            trace.Trace(tmin=tmin, tmax=tmin+tlen, deltat=1.0)
+            for (tmin, tlen) in zip(tmins, tlens)]
+
+        group = pile.TracesGroup(None)
+        group.add(traces)
+
+        def check(tmin, tmax):
+            a = group.relevant(tmin, tmax)
+            b = [tr for tr in traces if tr.is_relevant(tmin, tmax)]
+            assert set(map(id, a)) == set(map(id, b))
+            assert all(a[i].tmin <= a[i+1].tmin for i in xrange(len(a)-1))
+
+        for tr in traces[:100]:
+            check(tr.tmin, tr.tmax)
+            check(tr.tmax, tr.tmax + 10.)
+            check(tr.tmin - 10., tr.tmin)
+
+        check(group.tmin - 100., group.tmin)
+        check(group.tmax, group.tmax + 100.)
+        check(group.tmin, group.tmax)
+
+        removed = traces[:500]
+        group.remove(removed)
+        traces = traces[500:]
+        check(group.tmin, group.tmax)
+        for tr in traces[:100]:
+            check(tr.tmin, tr.tmax)
+
+        # interleaved modifications and queries update the index in place
+        time_index = group._time_index
+        for i, tr in enumerate(removed[:200]):
+            group.add(tr)
+            traces.append(tr)
+            if i % 3 == 0:
+                group.remove(traces[i])
+                del traces[i]
+
+            check(tr.tmin, tr.tmax)
+            check(group.tmin, group.tmax)
+
+        assert group._time_index is time_index
+        assert len(time_index) == len(traces)
+
+        # re-adding a removed trace
+        tr = traces[0]
+        group.remove(tr)
+        group.add(tr)
+        check(group.tmin, group.tmax)
+        assert len(group._time_index) == len(traces)
+
     def testMemTracesFile(self):
         tr = trace.Trace(ydata=num.arange(100, dtype=num.float))
 
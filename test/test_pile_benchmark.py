@@ -0,0 +1,92 @@
+import unittest
+import numpy as num
+
+from common import Benchmark
+from pyrocko import pile, trace, util
+
+benchmark = Benchmark()
+
+
+def make_traces(ntraces, distribution, tspan=365.*24.*3600.):
+    tmin0 = 1234567890.
+    deltat = 1.0
+    rstate = num.random.RandomState(123)
+    tmins = tmin0 + rstate.uniform(0., tspan, size=ntraces)
+
+    if distribution == 'uniform':
+        tlens = num.ones(ntraces) * 3600.
+
+    elif distribution == 'one_long':
+        tlens = num.ones(ntraces) * 3600.
+        tlens[0] = tspan
+        tmins[0] = tmin0
+
+    elif distribution == 'lognormal':
+        tlens = num.exp(rstate.normal(num.log(3600.), 2., size=ntraces))
+
+    else:
+        assert False
+
+    traces = []
+    for i in xrange(ntraces):
+        traces.append(trace.Trace(
+            'XX', 'S%04i' % (i % 1000), '', 'BHZ',
+            tmin=tmins[i], tmax=tmins[i]+tlens[i], deltat=deltat))
+
+    return traces
+
+
+def relevant_reference(group, tmin, tmax):
+    # time range scan as used before the introduction of pile.TimeIndex
+    return [tr for tr in group.by_tmin.with_key_in(tmin-group.tlenmax, tmax)
+            if tr.is_relevant(tmin, tmax)]
+
+
+class PileBenchmarkTestCase(unittest.TestCase):
+
+    def test_relevant_benchmark(self):
+        benchmark.show_factor = True
+        nqueries = 100
+
+        for distribution in ['uniform', 'one_long', 'lognormal']:
+            for ntraces in [1000, 10000, 50000]:
+                traces = make_traces(ntraces, distribution)
+                group = pile.TracesGroup(None)
+                group.add(traces)
+
+                rstate = num.random.RandomState(0)
+                qtmins = group.tmin + rstate.uniform(
+                    0., group.tmax - group.tmin, size=nqueries)
+                qtmaxs = qtmins + 600.
+
+                label = '_%s_n%06i' % (distribution, ntraces)
+
+                @benchmark.labeled('build' + label)
+                def build():
+                    group._time_index = None
+                    group.relevant(qtmins[0], qtmaxs[0])
+
+                @benchmark.labeled('relevant' + label)
+                def query():
+                    return [group.relevant(qtmin, qtmax)
+                            for (qtmin, qtmax) in zip(qtmins, qtmaxs)]
+
+                @benchmark.labeled('reference' + label)
+                def query_reference():
+                    return [relevant_reference(group, qtmin, qtmax)
+                            for (qtmin, qtmax) in zip(qtmins, qtmaxs)]
+
+                build()
+                results = query()
+                results_reference = query_reference()
+
+                for a, b in zip(results, results_reference):
+                    assert set(map(id, a)) == set(map(id, b))
+
+        print benchmark.__str__(header=False)
+        benchmark.clear()
+
+
+if __name__ == '__main__':
+    util.setup_logging('test_pile_benchmark', 'warning')
+    unittest.main()
@@ -2,6 +2,7 @@ from pyrocko import trace, util, model, pile
 import unittest
 import math
 import time
+import multiprocessing
 import os
 import numpy as num
 import cPickle as pickle
@@ -18,6 +19,172 @@ def floats(l):
     return num.array(l, dtype=num.float)
 
 
+def degapper_reference(
+        traces,
+        maxgap=5,
+        fillmethod='interpolate',
+        deoverlap='use_second',
+        maxlap=None):
+
+    # straightforward pairwise implementation, as reference for
+    # trace.degapper()
+
+    in_traces = list(traces)
+    out_traces = []
+    if not in_traces:
+        return out_traces
+    out_traces.append(in_traces.pop(0))
+    while in_traces:
+
+        a = out_traces[-1]
+        b = in_traces.pop(0)
+
+        avirt, bvirt = a.ydata is None, b.ydata is None
+        assert avirt == bvirt, \
+            'traces given to degapper() must either all have data or have ' \
+            'no data.'
+
+        virtual = avirt and bvirt
+
+        if (a.nslc_id == b.nslc_id and a.deltat == b.deltat
+                and a.data_len() >= 1 and b.data_len() >= 1
+                and (virtual or a.ydata.dtype == b.ydata.dtype)):
+
+            dist = (b.tmin-(a.tmin+(a.data_len()-1)*a.deltat))/a.deltat
+            idist = int(round(dist))
+            if abs(dist - idist) > 0.05 and idist <= maxgap:
+                # logger.warn('Cannot degap traces with displaced sampling '
+                #             '(%s, %s, %s, %s)' % a.nslc_id)
+                pass
+            else:
+                if 1 < idist <= maxgap:
+                    if not virtual:
+                        if fillmethod == 'interpolate':
+                            filler = a.ydata[-1] + (
+                                ((1.0 + num.arange(idist-1, dtype=num.float))
+                                 / idist) * (b.ydata[0]-a.ydata[-1])
+                            ).astype(a.ydata.dtype)
+                        elif fillmethod == 'zeros':
+                            filler = num.zeros(idist-1, dtype=a.ydata.dtype)
+                        a.ydata = num.concatenate((a.ydata, filler, b.ydata))
+                    a.tmax = b.tmax
+                    if a.mtime and b.mtime:
+                        a.mtime = max(a.mtime, b.mtime)
+                    continue
+
+                elif idist == 1:
+                    if not virtual:
+                        a.ydata = num.concatenate((a.ydata, b.ydata))
+                    a.tmax = b.tmax
+                    if a.mtime and b.mtime:
+                        a.mtime = max(a.mtime, b.mtime)
+                    continue
+
+                elif idist <= 0 and (maxlap is None or -maxlap < idist):
+                    if b.tmax > a.tmax:
+                        if not virtual:
+                            na = a.ydata.size
+                            n = -idist+1
+                            if deoverlap == 'use_second':
+                                a.ydata = num.concatenate(
+                                    (a.ydata[:-n], b.ydata))
+                            elif deoverlap in ('use_first', 'crossfade_cos'):
+                                a.ydata = num.concatenate(
+                                    (a.ydata, b.ydata[n:]))
+                            elif deoverlap == 'add':
+                                a.ydata[-n:] += b.ydata[:n]
+                                a.ydata = num.concatenate(
+                                    (a.ydata, b.ydata[n:]))
+                            else:
+                                assert False, 'unknown deoverlap method'
+
+                            if deoverlap == 'crossfade_cos':
+                                n = -idist+1
+                                taper = 0.5-0.5*num.cos(
+                                    (1.+num.arange(n))/(1.+n)*num.pi)
+                                a.ydata[na-n:na] *= 1.-taper
+                                a.ydata[na-n:na] += b.ydata[:n] * taper
+
+                        a.tmax = b.tmax
+                        if a.mtime and b.mtime:
+                            a.mtime = max(a.mtime, b.mtime)
+                        continue
+                    else:
+                        # make short second trace vanish
+                        continue
+
+        if b.data_len() >= 1:
+            out_traces.append(b)
+
+    for tr in out_traces:
+        tr._update_ids()
+
+    return out_traces
+
+
+def make_degapper_traces(dtype, nrecords=300, contiguous=False):
+    # records of two channels with gaps, overlaps and displaced sampling,
+    # or, if contiguous, without any of these
+
+    deltat = 0.01
+
+    def make_records(nslc, seed):
+        rstate = num.random.RandomState(seed)
+        records = []
+        tmin = sometime
+        for irecord in xrange(nrecords):
+            n = rstate.randint(20, 200)
+            if dtype == num.int32:
+                ydata = rstate.randint(-1000, 1000, n).astype(dtype)
+            else:
+                ydata = rstate.normal(size=n).astype(dtype)
+
+            records.append(trace.Trace(
+                *nslc, tmin=tmin, deltat=deltat, ydata=ydata,
+                mtime=float(irecord)))
+
+            if contiguous:
+                tmin += n*deltat
+                continue
+
+            x = rstate.random_sample()
+            if x < 0.6:
+                ishift = n
+            elif x < 0.75:
+                ishift = n + rstate.randint(1, 10)
+            elif x < 0.95:
+                ishift = n - rstate.randint(1, 30)
+            else:
+                ishift = rstate.randint(0, 10)
+
+            tmin += ishift*deltat
+            if rstate.random_sample() < 0.02:
+                tmin += 0.3*deltat
+
+        return records
+
+    traces = []
+    for i, nslc in enumerate([('N', 'A', '', 'Z'), ('N', 'B', '', 'Z')]):
+        traces.extend(make_records(nslc, i))
+
+    traces.sort(lambda a, b: cmp(a.full_id, b.full_id))
+    return traces
+
+
+def compare_degapped(xs, ys):
+    assert len(xs) == len(ys)
+    for x, y in zip(xs, ys):
+        assert x.nslc_id == y.nslc_id
+        assert x.tmin == y.tmin
+        assert x.tmax == y.tmax
+        assert x.mtime == y.mtime
+        if x.ydata is None:
+            assert y.ydata is None
+        else:
+            assert x.ydata.dtype == y.ydata.dtype
+            assert num.all(x.ydata == y.ydata)
+
+
 class TraceTestCase(unittest.TestCase):
 
     def testIntegrationDifferentiation(self):
@@ -101,6 +268,58 @@ class TraceTestCase(unittest.TestCase):
                 assert x.ydata.size == 18
                 assert numeq(x.ydata[8:10], res, 1e-6)
 
+    def testDegappingPlanned(self):
+        for dtype in (num.float32, num.float64, num.int32):
+            for deoverlap in (
+                    'use_second', 'use_first', 'crossfade_cos', 'add'):
+
+                if dtype == num.int32 and deoverlap == 'crossfade_cos':
+                    continue
+
+                for fillmethod in ('interpolate', 'zeros'):
+                    for maxlap in (None, 10):
+                        kwargs = dict(
+                            deoverlap=deoverlap, fillmethod=fillmethod,
+                            maxlap=maxlap)
+
+                        compare_degapped(
+                            trace.degapper(
+                                make_degapper_traces(dtype), **kwargs),
+                            degapper_reference(
+                                make_degapper_traces(dtype), **kwargs))
+
+        def dataless(traces):
+            for tr in traces:
+                tr.drop_data()
+
+            return traces
+
+        compare_degapped(
+            trace.degapper(dataless(make_degapper_traces(num.float64))),
+            degapper_reference(
+                dataless(make_degapper_traces(num.float64))))
+
+        traces = make_degapper_traces(
+            num.float64, nrecords=1000, contiguous=True)
+        xs = degapper_reference([tr.copy() for tr in traces])
+        ys = trace.degapper(traces)
+        assert len(ys) == 2
+        compare_degapped(xs, ys)
+
+    def benchmark_degapper(self):
+        # one long merge chain per channel, quadratic for pairwise merging
+        for nrecords in (2000, 20000):
+            traces = make_degapper_traces(
+                num.float64, nrecords=nrecords, contiguous=True)
+            t0 = time.time()
+            xs = degapper_reference([tr.copy() for tr in traces])
+            t1 = time.time()
+            ys = trace.degapper(traces)
+            t2 = time.time()
+            compare_degapped(xs, ys)
+            print 'degapper, %i records, reference: %g s, planned: %g s' % (
+                nrecords, t1-t0, t2-t1)
+
     def testRotation(self):
         s2 = math.sqrt(2.)
         ndata = num.array([s2, s2], dtype=num.float)
@@ -673,6 +892,268 @@ class TraceTestCase(unittest.TestCase):
         tr2.ydata += tr1.ydata.mean()
         assert numeq(tr1.ydata, tr2.ydata, 0.01)
 
+    def test_transfer_cache(self):
+
+        class CountingResponse(trace.PoleZeroResponse):
+            def evaluate(self, freqs):
+                self._n = getattr(self, '_n', 0) + 1
+                return trace.PoleZeroResponse.evaluate(self, freqs)
+
+        resp = CountingResponse(
+            zeros=[0j, 0j],
+            poles=[-0.037+0.037j, -0.037-0.037j, -200.+10.j, -200.-10.j],
+            constant=6e10)
+
+        deltat = 0.01
+        freqlimits = (0.01, 0.02, 20., 40.)
+        trace.clear_transfer_cache()
+
+        trs = []
+        for i in xrange(10):
+            tr = trace.Trace(
+                tmin=sometime + i*100., deltat=deltat,
+                ydata=num.random.random(10000))
+
+            trs.append(tr.transfer(
+                10., freqlimits, transfer_function=resp, invert=True))
+
+        assert resp._n == 1
+
+        ntrans = trace.nextpow2(10000*1.2)
+        coefs = trace.get_tapered_coefs(
+            deltat, ntrans, freqlimits, resp, invert=True)
+
+        assert resp._n == 2
+        assert num.all(coefs == trace.get_cached_tapered_coefs(
+            deltat, ntrans, freqlimits, resp, invert=True))
+
+        assert resp._n == 2
+
+        trace.clear_transfer_cache()
+        tr2 = tr.transfer(10., freqlimits, transfer_function=resp, invert=True)
+        assert resp._n == 3
+        assert numeq(trs[-1].ydata, tr2.ydata, 0.0)
+
+    def test_transfer_cache_bound(self):
+        resp = trace.PoleZeroResponse(
+            zeros=[0j], poles=[-0.1+0.1j, -0.1-0.1j], constant=1.0)
+
+        deltat = 0.01
+        max_bytes_orig = trace.g_transfer_cache_max_bytes
+        trace.clear_transfer_cache()
+        try:
+            nbytes = (8192//2 + 1) * 16
+            trace.g_transfer_cache_max_bytes = 3 * nbytes
+            for i in xrange(5):
+                trace.get_cached_tapered_coefs(
+                    deltat, 8192, (0.01+i*0.001, 0.02, 20., 40.), resp)
+
+            assert len(trace.g_transfer_cache) == 3
+            assert trace.g_transfer_cache_nbytes == 3 * nbytes
+
+            # arrays larger than the whole cache are not cached
+            trace.get_cached_tapered_coefs(deltat, 65536, None, resp)
+            assert len(trace.g_transfer_cache) == 3
+            assert trace.g_transfer_cache_nbytes == 3 * nbytes
+
+        finally:
+            trace.g_transfer_cache_max_bytes = max_bytes_orig
+            trace.clear_transfer_cache()
+
+        assert trace.g_transfer_cache_nbytes == 0
+
+    def test_co_filters(self):
+        deltat = 0.01
+        n = 20000
+        ydata = num.random.random(n) - 0.5
+        tr = trace.Trace(
+            'N', 'S', '', 'Z', tmin=sometime, deltat=deltat, ydata=ydata)
+
+        for co, method, args in [
+                (trace.co_lowpass, 'lowpass', (4, 5.)),
+                (trace.co_highpass, 'highpass', (4, 0.5)),
+                (trace.co_bandpass, 'bandpass', (4, 0.5, 5.))]:
+
+            outs = []
+            pipe = co(trace.co_list_append(outs), *args)
+            for i in xrange(0, n, 3000):
+                pipe.send(tr.chop(
+                    tr.tmin + i*deltat, tr.tmin + (i+3000)*deltat,
+                    inplace=False, include_last=False))
+
+            pipe.close()
+
+            tr_ref = tr.copy()
+            getattr(tr_ref, method)(*args, demean=False)
+
+            assert len(outs) == 7
+            assert outs[0].tmin == tr.tmin
+            assert numeq(
+                num.concatenate([out.ydata for out in outs]),
+                tr_ref.ydata, 1e-9)
+
+    def test_co_transfer(self):
+        deltat = 0.05
+        n = 40000
+        nwin = 4000
+        tkernel = 100.
+        tfade = 200.
+        freqlimits = (0.05, 0.1, 5., 8.)
+
+        ydata = num.cumsum(num.random.random(n) - 0.5)
+        tr = trace.Trace(
+            'N', 'S', '', 'Z', tmin=sometime, deltat=deltat, ydata=ydata)
+
+        resp = trace.PoleZeroResponse(
+            zeros=[0j, 0j],
+            poles=[-0.5+0.5j, -0.5-0.5j],
+            constant=1.0)
+
+        outs = []
+        pipe = trace.co_transfer(
+            trace.co_list_append(outs), resp, tkernel, freqlimits=freqlimits,
+            invert=True)
+
+        for i in xrange(0, n, nwin):
+            pipe.send(tr.chop(
+                tr.tmin + i*deltat, tr.tmin + (i+nwin)*deltat,
+                inplace=False, include_last=False))
+
+        pipe.close()
+
+        assert len(outs) == n / nwin
+        for a, b in zip(outs[:-1], outs[1:]):
+            assert abs(a.tmax + deltat - b.tmin) < deltat*1e-3
+
+        assert abs(outs[0].tmin - (tr.tmin - tkernel)) < deltat*1e-3
+
+        tr_co = trace.Trace(
+            tmin=outs[0].tmin, deltat=deltat,
+            ydata=num.concatenate([out.ydata for out in outs]))
+
+        tr_ref = tr.transfer(tfade, freqlimits, resp, invert=True)
+
+        tmin = tr.tmin + 2*tfade
+        tmax = tr.tmax - 2*tfade - tkernel
+        tr_co.chop(tmin, tmax)
+        tr_ref.chop(tmin, tmax)
+        assert numeq(
+            tr_co.ydata, tr_ref.ydata, 0.01 * num.abs(tr_ref.ydata).max())
+
+    def test_multi_correlator(self):
+        deltat = 0.01
+        nslcs = [('N', 'S%i' % i, '', 'Z') for i in xrange(4)]
+
+        data = [
+            trace.Trace(
+                *nslc, tmin=sometime + i*deltat, deltat=deltat,
+                ydata=num.random.normal(size=5000+i*10))
+            for (i, nslc) in enumerate(nslcs)]
+
+        templates = []
+        for itemplate in xrange(3):
+            template = []
+            for nslc, tr in zip(nslcs, data)[itemplate:]:
+                template.append(tr.chop(
+                    tr.tmin + (1000+itemplate*100)*deltat,
+                    tr.tmin + (1200+itemplate*150)*deltat,
+                    inplace=False))
+
+            templates.append(template)
+
+        mc = trace.MultiCorrelator(templates, nthreads=2)
+        for normalization in (None, 'normal', 'gliding'):
+            ccs = mc.correlate(data, normalization=normalization)
+            assert len(ccs) == len(templates)
+            for template, ccs_template in zip(templates, ccs):
+                assert len(ccs_template) == len(template)
+                for a, c in zip(template, ccs_template):
+                    b = data[nslcs.index(a.nslc_id)]
+                    c_ref = trace.correlate(
+                        a, b, mode='valid', normalization=normalization)
+
+                    assert c.nslc_id == c_ref.nslc_id
+                    assert abs(c.tmin - c_ref.tmin) < deltat*1e-3
+                    assert c.data_len() == c_ref.data_len()
+                    assert numeq(c.ydata, c_ref.ydata, 1e-6)
+
+        ccs = mc.correlate(data[1:])
+        assert [len(x) for x in ccs] == [3, 3, 2]
+
+        # data windows of many different lengths, some shorter than one
+        # overlap-save block
+        for n in (301, 400, 1100, 2592, 3000, 4321):
+            data_short = [tr.chop(
+                tr.tmin, tr.tmin + (n-1)*deltat, inplace=False,
+                include_last=True) for tr in data]
+
+            ccs = trace.MultiCorrelator(templates, nthreads=3).correlate(
+                data_short, normalization='normal')
+
+            for template, ccs_template in zip(templates, ccs):
+                for a, c in zip(template, ccs_template):
+                    b = data_short[nslcs.index(a.nslc_id)]
+                    c_ref = trace.correlate(
+                        a, b, mode='valid', normalization='normal')
+
+                    assert c.data_len() == c_ref.data_len()
+                    assert numeq(c.ydata, c_ref.ydata, 1e-6)
+
+        ccs = mc.correlate(data)
+        for ccs_template in ccs:
+            stack = mc.stack(ccs_template)
+
+            # each template matches its own data at its own time
+            tmax, vmax = stack.max()
+            assert abs(vmax - 1.0) < 1e-4
+            assert abs(tmax) < deltat*1e-3
+
+            stack_ref = ccs_template[0].copy()
+            for c in ccs_template[1:]:
+                stack_ref.add(c)
+
+            stack_ref.set_ydata(stack_ref.ydata / len(ccs_template))
+            stack.chop(stack_ref.tmin, stack_ref.tmax, include_last=True)
+            assert numeq(stack.ydata, stack_ref.ydata, 1e-6)
+
+    def benchmark_multi_correlator(self):
+        deltat = 0.01
+        nchannels = 20
+        ntemplates = 10
+        nsamples = 360000
+
+        data = [
+            trace.Trace(
+                '', 'S%i' % i, '', 'Z', tmin=sometime, deltat=deltat,
+                ydata=num.random.normal(size=nsamples))
+            for i in xrange(nchannels)]
+
+        templates = [
+            [tr.chop(tr.tmin + 100.*(i+1), tr.tmin + 100.*(i+1) + 20.,
+                     inplace=False) for tr in data]
+            for i in xrange(ntemplates)]
+
+        t0 = time.time()
+        for template in templates:
+            for a, b in zip(template, data):
+                trace.correlate(
+                    a, b, mode='valid', normalization='gliding', use_fft=True)
+
+        t1 = time.time()
+        print 'correlate, %i x %i: %g s' % (ntemplates, nchannels, t1-t0)
+
+        for nthreads in xrange(1, multiprocessing.cpu_count() + 1):
+            mc = trace.MultiCorrelator(templates, nthreads=nthreads)
+            for irun in xrange(2):
+                t0 = time.time()
+                ccs = mc.correlate(data, normalization='gliding')
+                for ccs_template in ccs:
+                    mc.stack(ccs_template)
+
+                t1 = time.time()
+                print 'MultiCorrelator, %i x %i, nthreads=%i, run %i: ' \
+                    '%g s' % (ntemplates, nchannels, nthreads, irun, t1-t0)
+
     def test_muliply_taper(self):
 
         taper = trace.CosTaper(0., 1., 2., 3.)
@@ -688,6 +1169,71 @@ class TraceTestCase(unittest.TestCase):
         assert numeq(y, z, 1e-6)
         assert taper.time_span() == taper2.time_span()
 
+    def test_trace_batch(self):
+        deltat = 0.01
+        traces = []
+        # rows of different lengths need different FFT lengths in transfer
+        for i, n in enumerate([1000, 1000, 873, 600, 400]):
+            traces.append(trace.Trace(
+                'N', 'S%i' % i, '', 'Z',
+                tmin=sometime + i*0.5,
+                deltat=deltat,
+                ydata=num.random.random(n) + 10.0))
+
+        batch = trace.TraceBatch.from_traces(traces)
+        assert batch.data.shape == (5, 1000)
+        assert numeq(batch.tmaxs, [tr.tmax for tr in traces], 1e-6)
+
+        for tr, tr_b in zip(traces, batch.to_traces()):
+            assert tr.nslc_id == tr_b.nslc_id
+            assert tr.tmin == tr_b.tmin
+            assert numeq(tr.ydata, tr_b.ydata, 0.0)
+            assert num.may_share_memory(tr_b.ydata, batch.data)
+
+        def check(batch, traces, eps):
+            for tr, tr_b in zip(traces, batch.to_traces()):
+                assert abs(tr.tmin - tr_b.tmin) < deltat*1e-3
+                assert abs(tr.deltat - tr_b.deltat) < deltat*1e-6
+                assert tr.data_len() == tr_b.data_len()
+                assert numeq(tr.ydata, tr_b.ydata, eps)
+
+        def apply(method, *args, **kwargs):
+            batch_ = batch.copy()
+            result = getattr(batch_, method)(*args, **kwargs)
+            traces_ = []
+            for tr in traces:
+                tr_ = tr.copy()
+                result_tr = getattr(tr_, method)(*args, **kwargs)
+                if result_tr is not None:
+                    tr_ = result_tr
+
+                traces_.append(tr_)
+
+            if result is not None:
+                batch_ = result
+
+            check(batch_, traces_, 1e-6)
+
+        apply('lowpass', 4, 5.)
+        apply('highpass', 4, 0.5)
+        apply('bandpass', 4, 0.5, 5.)
+        apply('taper', trace.CosTaper(
+            sometime, sometime+1., sometime+5., sometime+8.))
+        apply('downsample_to', 0.04)
+        apply('transfer', 1.0, (0.1, 0.2, 10., 20.),
+              trace.IntegrationResponse())
+        apply('transfer', 1.0, (0.1, 0.2, 10., 20.),
+              trace.IntegrationResponse(), cut_off_fading=False)
+
+        fx, fy = batch.spectrum()
+        fx_tr, fy_tr = traces[0].spectrum()
+        assert numeq(fx, fx_tr, 1e-9)
+        assert numeq(fy[0], fy_tr, 1e-6)
+
+        traces.append(trace.Trace(deltat=deltat*2., ydata=num.zeros(10)))
+        with self.assertRaises(trace.MisalignedTraces):
+            trace.TraceBatch.from_traces(traces)
+
     def test_pickle(self):
         y = num.random.random(10000)
         t1 = trace.Trace(tmin=0, ydata=y, deltat=0.01)